@@ -1,21 +1,20 @@
 import os
 import json
-import boto3
 import time
 import logging
 from typing import Dict, Any
 from urllib.parse import parse_qs
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
+from lib.storage import Storage, create_storage
+from lib.structured_log import configure_logging, log_invocation, LazyPayload
 
-# ロガーの設定
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# ロガーの設定（JSON形式・トークン伏せ字・サンプリング）
+logger = configure_logging()
 
-# DynamoDBクライアントの初期化
-dynamodb = boto3.resource('dynamodb')
-auth_table = dynamodb.Table(f"{os.environ['STACK_NAME']}-auth")
+storage: Storage = create_storage()
 
+@log_invocation
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     try:
         # クエリパラメータからcodeを取得
@@ -28,7 +27,7 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
 
         code = query_params['code']
-        logger.info("認証コードを受信: %s", code)
+        logger.info("認証コードを受信しました")
         
         # Slack OAuth APIを呼び出してアクセストークンを取得
         client = WebClient()
@@ -38,7 +37,7 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             client_secret=os.environ.get('SLACK_CLIENT_SECRET'),
             code=code
         )
-        logger.info("OAuth応答を受信: %s", oauth_response)
+        logger.debug("OAuth応答を受信: %s", LazyPayload(oauth_response))
 
         # チーム情報を取得してドメインを取得
         access_token = oauth_response['access_token']
@@ -47,21 +46,24 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         team_domain = team_info_response['team']['domain']
         logger.info("チームドメインを取得: %s", team_domain)
 
-        # 認証情報をDynamoDBに保存
+        # 認証情報を保存
         team_id = oauth_response['team']['id']
         workspace_id = oauth_response['team']['enterprise_id'] if 'enterprise_id' in oauth_response['team'] else team_id
         current_time = int(time.time())
         
-        logger.info("DynamoDBに認証情報を保存中: team_id=%s, workspace_id=%s", team_id, workspace_id)
-        auth_table.put_item(
-            Item={
-                'team_id': team_id,
-                'workspace_id': workspace_id,
-                'access_token': oauth_response['access_token'],
-                'team_name': oauth_response['team']['name'],
-                'created_at': current_time
-            }
-        )
+        logger.info("認証情報を保存中: team_id=%s, workspace_id=%s", team_id, workspace_id)
+        workspace_data: Dict[str, Any] = {
+            'team_id': team_id,
+            'workspace_id': workspace_id,
+            'access_token': oauth_response['access_token'],
+            'team_name': oauth_response['team']['name'],
+            'created_at': current_time
+        }
+        # トークンローテーションが有効なアプリでは、期限付きのトークンと更新用トークンが返る
+        if oauth_response.get('refresh_token'):
+            workspace_data['refresh_token'] = oauth_response['refresh_token']
+            workspace_data['token_expires_at'] = current_time + int(oauth_response['expires_in'])
+        storage.save_workspace_data(workspace_data)
 
         # ワークスペースドメイン取得
         app_id = os.environ.get('SLACK_APP_ID')
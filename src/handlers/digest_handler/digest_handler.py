@@ -0,0 +1,87 @@
+import json
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from lib.storage import Storage, create_storage
+from lib.slack import SlackManager
+from lib.tokens import TokenProvider
+from lib.digest import WeeklyDigest, digest_period, RESULT_SUSPENDED
+from lib.metrics import flush_after
+from lib.structured_log import configure_logging
+
+logger = configure_logging()
+
+db_manager: Storage = create_storage()
+token_provider = TokenProvider(db_manager)
+# 引き継ぎのときだけ使うので、最初の呼び出しで作る（コールドスタートで作らない）
+lambda_client: Optional[Any] = None
+digest = WeeklyDigest(db_manager)
+
+# 残り時間がこれを切ったら途中経過を保存して、続きを新しい呼び出しに引き継ぐ（ミリ秒）
+TIME_MARGIN_MS = 60 * 1000
+
+
+def _lambda_client() -> Any:
+    global lambda_client
+    if lambda_client is None:
+        import boto3
+        lambda_client = boto3.client('lambda')
+    return lambda_client
+
+
+def _continue_later(context: Any, payload: Dict[str, Any]) -> None:
+    """自分自身を非同期で呼び出し、残りのワークスペースを引き継ぐ"""
+    _lambda_client().invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(payload).encode('utf-8')
+    )
+
+
+@flush_after
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    try:
+        # 引き継ぎの呼び出しでは、最初の呼び出しと同じ期間・残りのワークスペースを処理する
+        period: Dict[str, str] = event.get('period') or digest_period(datetime.now())
+        team_ids: List[str] = event.get('team_ids') or db_manager.get_workspace_ids()
+
+        def has_time() -> bool:
+            return context is None or context.get_remaining_time_in_millis() > TIME_MARGIN_MS
+
+        results: Dict[str, str] = {}
+        for position, team_id in enumerate(team_ids):
+            workspace_data: Dict[str, Any] = db_manager.get_workspace_data(team_id)
+            channels: List[str] = workspace_data.get('digest_channels') or []
+            slack_token: Optional[str] = channels and token_provider.token_for(team_id, workspace_data)
+            if not slack_token:
+                results[team_id] = 'skipped'
+                continue
+
+            slack_manager: SlackManager = SlackManager.for_token(slack_token)
+
+            def post(channel_id: str, text: str, blocks: List[Dict[str, Any]]) -> bool:
+                return slack_manager.post_message(channel_id, text, blocks=blocks) is not None
+
+            results[team_id] = digest.run(team_id, period, channels, post, has_time)
+            if results[team_id] == RESULT_SUSPENDED:
+                logger.info("ダイジェストを次の呼び出しに引き継ぎ: team_id=%s, remaining=%d",
+                            team_id, len(team_ids) - position)
+                _continue_later(context, {'period': period, 'team_ids': team_ids[position:]})
+                break
+
+        return {
+            'statusCode': 200,
+            'body': {
+                'message': 'Weekly digest processed',
+                'week_id': period['week_id'],
+                'results': results
+            }
+        }
+
+    except Exception as e:
+        logger.error(f"Error processing weekly digest: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': {
+                'error': str(e)
+            }
+        }
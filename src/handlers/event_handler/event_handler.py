@@ -1,27 +1,48 @@
 import json
 import os
-import boto3
 import logging
-from typing import Dict, Any, List
-from lib.db import DynamoDBManager
+from typing import Dict, Any, List, Optional
+from lib.storage import Storage, create_storage
 from lib.slack import SlackManager
-from boto3.resources.base import ServiceResource
+from lib.tokens import TokenProvider
+from lib.gratitude import matcher_for_workspace
+from lib.reactions import ReactionBuffer, is_thanks_reaction
+from lib.event_filter import EventPrefilter
+from lib.metrics import metrics, flush_after
+from lib.metering import install_usage_meter
+from lib.ratelimit import GrantRateLimiter, GRANT_RATE_NOTIFY
+from lib.publisher import SNSPublisher, EVENTS
+from lib.structured_log import configure_logging, set_log_context, log_invocation, LazyPayload
 
-# ロガーの設定
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# ロガーの設定（JSON形式・トークン伏せ字・サンプリング）
+logger = configure_logging()
 
-dynamodb: ServiceResource = boto3.resource('dynamodb')
-sns = boto3.client('sns')
-db_manager: DynamoDBManager = DynamoDBManager(dynamodb)
+# STORAGE_BACKEND=sqlite（Socket Mode サーバー）では AWS のクライアントを作らない
+db_manager: Storage = create_storage()
+token_provider = TokenProvider(db_manager)
+reaction_buffer: ReactionBuffer = ReactionBuffer(db_manager)
+publisher: SNSPublisher = SNSPublisher()
+# 処理不要なイベントを DynamoDB・Slack を呼ぶ前に破棄する（EVENT_CHANNEL_ALLOWLIST でチャンネルを限定できる）
+prefilter: EventPrefilter = EventPrefilter(channel_allowlist=os.environ.get('EVENT_CHANNEL_ALLOWLIST'))
+# ワークスペースごとの利用量（-metering テーブル）
+install_usage_meter(db_manager)
+# ユーザーごと・ワークスペースごとの付与の試行回数の上限（超えた分は SNS に渡さない）
+grant_limiter: GrantRateLimiter = GrantRateLimiter(db_manager)
 
+RATE_LIMITED_MESSAGES = {
+    'user': "⚠️ 短時間に多くのポイント付与が行われたため、しばらくの間あなたからの付与を受け付けていません",
+    'workspace': "⚠️ ワークスペース全体で短時間に多くのポイント付与が行われたため、しばらくの間付与を受け付けていません",
+}
+
+@flush_after
+@log_invocation
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     try:
-        logger.info("イベントを受信しました: %s", event)
+        logger.debug("イベントを受信しました: %s", LazyPayload(event))
         
         # Slackイベントの検証
         body: Dict[str, Any] = json.loads(event['body'])
-        logger.info("リクエストボディ: %s", body)
+        logger.debug("リクエストボディ: %s", LazyPayload(body))
         
         # challengeリクエストの処理
         if 'challenge' in body:
@@ -34,111 +55,158 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         # 重複リクエストのチェック
         if 'X-Slack-Retry-Num' in event['headers']:
             logger.info("重複リクエストを検出しました")
+            _meter_event(body, dropped=True)
             return {
                 'statusCode': 200,
                 'body': json.dumps({'message': 'Duplicate request'})
             }
 
-        # イベント処理
-        event_data: Dict[str, Any] = body['event']
-        event_type: str = event_data['type']
-        team_id: str = body['team_id']
-
-        # SlackManagerのインスタンス化
-        workspace_data: Dict[str, Any] = db_manager.get_workspace_data(team_id)
-        slack_token: str = workspace_data.get('access_token')
-        if not slack_token:
-            logger.error("ワークスペースのBotトークンが見つかりません: team_id=%s", team_id)
-            return {'statusCode': 500}
-        
-        slack_manager: SlackManager = SlackManager(slack_token)
-
-        if event_type == 'app_home_opened':
-            logger.info("ホームタブが開かれました: user_id=%s", event_data['user'])
-            message_data = {
-                'event_id': 'home_opened',
-                'user_id': event_data['user'],
-                'team_id': team_id
-            }
-            logger.info("SNSメッセージを送信: %s", message_data)
-            sns.publish(
-                TopicArn=os.environ['SNS_POINTS_TOPIC_ARN'],
-                Message=json.dumps(message_data)
-            )
-            return {'statusCode': 200}
+        return handle_event(body, publisher)
 
-        elif event_type == 'message':
-            # メンションとポイント付与の処理
-            mentions_and_text = slack_manager.extract_mentions(event_data['text'])
-            mentions: List[str] = mentions_and_text[0]
-            extracted_text: str = mentions_and_text[1]
-            if not mentions:
-                logger.info("メンションが見つかりませんでした")
-                return {'statusCode': 200}
-            
-            # "ありがとう"のチェック
-            if "ありがとう" not in extracted_text:
-                logger.info("メッセージに「ありがとう」が含まれていません")
-                return {'statusCode': 200}
-            
-            logger.info("検出されたメンション: %s", mentions)
-            
-            # ワークスペース情報の取得
-            workspace_info: Dict[str, Any] = slack_manager.get_workspace_info()
-            logger.info("ワークスペース情報を取得: %s", workspace_info)
-            
-            # SNSにポイント付与リクエストを送信
-            user_id: str = event_data['user']
-            message_data = {
-                'event_id': 'point_give',
-                'user_id': user_id,
-                'mentions': mentions,
-                'team_id': team_id,
-                'workspace_name': workspace_info.get('name', ''),
-                'workspace_domain': workspace_info.get('domain', ''),
-                'message': extracted_text  # メッセージを追加
-            }
-            logger.info("SNSメッセージを送信: %s", message_data)
-            
-            sns.publish(
-                TopicArn=os.environ['SNS_POINTS_TOPIC_ARN'],
-                Message=json.dumps(message_data)
-            )
-            return {'statusCode': 200}
+    except Exception as e:
+        logger.error("エラーが発生しました: %s", str(e), exc_info=True)
+        return {'statusCode': 500}
 
-        elif event_type == 'app_installed':
-            logger.info("アプリがインストールされました: team_id=%s", team_id)
-            message_data = {
-                'event_id': 'app_installed',
-                'user_id': None,
-                'team_id': team_id
-            }
-            logger.info("SNSメッセージを送信: %s", message_data)
-            sns.publish(
-                TopicArn=os.environ['SNS_POINTS_TOPIC_ARN'],
-                Message=json.dumps(message_data)
-            )
+
+def _meter_event(body: Dict[str, Any], dropped: bool) -> None:
+    """受け付けたイベント（と破棄したイベント）をワークスペースの利用量に数える"""
+    metrics.set_dimensions(team_id=body.get('team_id'))
+    metrics.record('event', 'received')
+    if dropped:
+        metrics.record('event', 'dropped')
+
+
+def _shed(scope: str) -> Dict[str, Any]:
+    """付与の試行回数の上限を超えた要求を破棄する"""
+    logger.info("付与の上限を超えたため破棄しました: scope=%s", scope)
+    metrics.record('event', 'shed')
+    return {'statusCode': 200}
+
+
+def handle_event(body: Dict[str, Any], publisher: Any) -> Dict[str, Any]:
+    """Events API のイベント処理（Lambda / Socket Mode サーバー共通）
+
+    後続の処理は publisher 経由で通知側に渡す。
+    """
+    # ペイロードだけで判定できる不要なイベント（ボット・編集・メンションなしなど）は I/O の前に破棄
+    dropped = prefilter.check(body)
+    _meter_event(body, dropped=bool(dropped))
+    if dropped:
+        logger.debug("前段フィルターで破棄しました: stage=%s", dropped)
+        return {'statusCode': 200}
+
+    # イベント処理
+    event_data: Dict[str, Any] = body['event']
+    event_type: str = event_data['type']
+    team_id: str = body['team_id']
+    metrics.set_dimensions(event_type=event_type)
+    set_log_context(event_type=event_type, team_id=team_id)
+
+    # 上限を超えていると分かっている送信者・ワークスペースの付与は I/O の前に破棄
+    if event_type == 'message':
+        scope = grant_limiter.blocked(team_id, event_data.get('user'))
+        if scope:
+            return _shed(scope)
+
+    # SlackManagerのインスタンス化
+    workspace_data: Dict[str, Any] = db_manager.get_workspace_data(team_id)
+    prefilter.remember_workspace(team_id, workspace_data)
+    slack_token: Optional[str] = token_provider.token_for(team_id, workspace_data)
+    if not slack_token:
+        logger.error("ワークスペースのBotトークンが見つかりません: team_id=%s", team_id)
+        return {'statusCode': 500}
+
+    slack_manager: SlackManager = SlackManager.for_token(slack_token)
+
+    if event_type == 'app_home_opened':
+        logger.info("ホームタブが開かれました: user_id=%s", event_data['user'])
+        message_data = {
+            'event_id': 'home_opened',
+            'user_id': event_data['user'],
+            'team_id': team_id
+        }
+        logger.debug("SNSメッセージを送信: %s", LazyPayload(message_data))
+        publisher.publish(EVENTS, message_data)
+        return {'statusCode': 200}
+
+    elif event_type == 'message':
+        # メンション抽出・感謝フレーズ検出（マークアップの除去は感謝のメッセージだけ）
+        scan = matcher_for_workspace(workspace_data).scan(event_data['text'])
+        mentions: List[str] = scan.mentions
+        if not mentions:
+            logger.info("メンションが見つかりませんでした")
             return {'statusCode': 200}
 
-        elif event_type == 'team_join' or event_type == 'user_profile_change':
-            user_info = event_data['user']
-            message_data = {
-                'event_id': event_type,
-                'user_id': user_info['id'],
-                'team_id': user_info['team_id'],
-                'user_profile': user_info
-            }
-            logger.info("SNSメッセージを送信: %s", message_data)
-            sns.publish(
-                TopicArn=os.environ['SNS_POINTS_TOPIC_ARN'],
-                Message=json.dumps(message_data)
-            )
+        # 感謝フレーズ（ワークスペースごとに設定可能）のチェック
+        if scan.phrase is None:
+            logger.info("メッセージに感謝フレーズが含まれていません")
             return {'statusCode': 200}
+        extracted_text: str = scan.text
+
+        logger.info("検出されたメンション: %s", mentions)
+
+        user_id: str = event_data['user']
+        scope, first_rejection = grant_limiter.acquire(team_id, user_id)
+        if scope:
+            if first_rejection and GRANT_RATE_NOTIFY:
+                slack_manager.send_dm(user_id, RATE_LIMITED_MESSAGES[scope])
+            return _shed(scope)
 
-        else:
-            logger.info("未対応のイベントタイプを受信: %s", event_type)
+        # ワークスペース情報の取得
+        workspace_info: Dict[str, Any] = slack_manager.get_workspace_info()
+        logger.debug("ワークスペース情報を取得: %s", LazyPayload(workspace_info))
+
+        # SNSにポイント付与リクエストを送信
+        message_data = {
+            'event_id': 'point_give',
+            'user_id': user_id,
+            'mentions': mentions,
+            'team_id': team_id,
+            'channel': event_data.get('channel'),
+            'workspace_name': workspace_info.get('name', ''),
+            'workspace_domain': workspace_info.get('domain', ''),
+            'message': extracted_text,  # メッセージを追加
+            # 元のメッセージの識別子。再配信・再試行されても付与は1回になる
+            'request_id': event_data.get('client_msg_id') or f"{event_data.get('channel')}:{event_data.get('ts')}"
+        }
+        logger.debug("SNSメッセージを送信: %s", LazyPayload(message_data))
+
+        # 送信者ごとに順序付けて処理される（FIFO）。Slack のイベントIDで重複送信を除く
+        publisher.publish(EVENTS, message_data, dedup_id=body.get('event_id'))
+        return {'statusCode': 200}
+
+    elif event_type in ('reaction_added', 'reaction_removed'):
+        # リアクションはバッファに溜め、reaction_flush がウィンドウ単位でまとめて付与する
+        if not is_thanks_reaction(event_data['reaction'], workspace_data):
+            logger.info("感謝リアクションではありません: %s", event_data['reaction'])
             return {'statusCode': 200}
+        reaction_buffer.record(event_data, team_id)
+        return {'statusCode': 200}
+
+    elif event_type == 'app_installed':
+        logger.info("アプリがインストールされました: team_id=%s", team_id)
+        message_data = {
+            'event_id': 'app_installed',
+            'user_id': None,
+            'team_id': team_id
+        }
+        logger.debug("SNSメッセージを送信: %s", LazyPayload(message_data))
+        publisher.publish(EVENTS, message_data)
+        return {'statusCode': 200}
+
+    elif event_type == 'team_join' or event_type == 'user_profile_change':
+        user_info = event_data['user']
+        message_data = {
+            'event_id': event_type,
+            'user_id': user_info['id'],
+            'team_id': user_info['team_id'],
+            'user_profile': user_info
+        }
+        logger.debug("SNSメッセージを送信: %s", LazyPayload(message_data))
+        publisher.publish(EVENTS, message_data)
+        return {'statusCode': 200}
+
+    else:
+        logger.info("未対応のイベントタイプを受信: %s", event_type)
+        return {'statusCode': 200}
 
-    except Exception as e:
-        logger.error("エラーが発生しました: %s", str(e), exc_info=True)
-        return {'statusCode': 500}
\ No newline at end of file
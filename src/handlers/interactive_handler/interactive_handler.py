@@ -1,20 +1,38 @@
 import os
 import json
-import boto3
 import logging
 import urllib.parse
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from lib import search
+from lib.storage import Storage, create_storage
+from lib.slack import SlackManager, SEARCH_ACTION_ID
+from lib.tokens import TokenProvider
+from lib.metrics import metrics, flush_after
+from lib.metering import install_usage_meter
+from lib.publisher import SNSPublisher, INTERACTIVE
+from lib.structured_log import configure_logging, set_log_context, log_invocation, LazyPayload
 
-# ロガーの設定
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# ロガーの設定（JSON形式・トークン伏せ字・サンプリング）
+logger = configure_logging()
 
-# SNSクライアントの初期化
-sns = boto3.client('sns')
+# SNSクライアントは最初の送信時に作る（Socket Mode サーバーでは使わない）
+publisher: SNSPublisher = SNSPublisher()
+db_manager: Storage = create_storage()
+token_provider = TokenProvider(db_manager)
+# ワークスペースごとの利用量（-metering テーブル）
+install_usage_meter(db_manager)
 
+# 結果を通知側で表示するまで開いておくモーダル
+HISTORY_MODAL_TITLE = 'ポイント履歴'
+LOADING_TEXT = '⏳ ポイント履歴を読み込んでいます…'
+# 検索結果としてモーダルに載せる件数
+SEARCH_RESULT_LIMIT: int = int(os.environ.get('SEARCH_RESULT_LIMIT', '20'))
+
+@flush_after
+@log_invocation
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     try:
-        logger.info("イベントを受信しました: %s", event)
+        logger.debug("イベントを受信しました: %s", LazyPayload(event))
         
         # リクエストボディの解析
         decoded_body = urllib.parse.unquote(event['body'])
@@ -24,34 +42,9 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         # JSONとしてデコード
         body = json.loads(payload_str)
-        logger.info("リクエストボディ: %s", body)
-        
-        # JSONデコード
-        body = json.loads(payload_str)
-        logger.info("リクエストボディ: %s", body)
-        
-        # 必要なフィールドを抽出
-        user_id = body['user']['id']
-        team_id = body['team']['id']
-        action_id = body['actions'][0]['action_id']
-
-        if not all([user_id, team_id, action_id]):
-            logger.error("必須フィールドが不足しています: user_id=%s, team_id=%s, action_id=%s", 
-                        user_id, team_id, action_id)
-            raise ValueError("Required fields missing: user_id, team_id, action_id")
-
-        # SNSトピックにメッセージを送信
-        message = {
-            'user_id': user_id,
-            'team_id': team_id,
-            'action_id': action_id
-        }
-        logger.info("SNSメッセージを送信: %s", message)
+        logger.debug("リクエストボディ: %s", LazyPayload(body))
         
-        sns.publish(
-            TopicArn=os.environ['SNS_INTERACTIVE_TOPIC_ARN'],
-            Message=json.dumps(message)
-        )
+        handle_interactive(body, publisher)
 
         logger.info("メッセージを正常に処理しました")
         return {
@@ -71,3 +64,74 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 500,
             'body': json.dumps({'error': 'Internal server error'})
         }
+
+
+def _open_loading_modal(team_id: str, trigger_id: str) -> Optional[str]:
+    """読み込み中のモーダルを開く（開けなければ None。通知側は従来どおりDMで送る）"""
+    slack_token: Optional[str] = token_provider.token_for(team_id)
+    if not slack_token:
+        logger.error("ワークスペースのBotトークンが見つかりません: team_id=%s", team_id)
+        return None
+    return SlackManager.for_token(slack_token).open_modal(
+        trigger_id, SlackManager.text_modal(HISTORY_MODAL_TITLE, LOADING_TEXT))
+
+
+def _search_history(user_id: str, team_id: str, query: str, view_id: str) -> None:
+    """履歴モーダルの検索欄から感謝メッセージを検索し、同じモーダルに結果を表示する
+
+    索引を引くだけで済むため、SNS を経由せず応答の期限内にここで views.update まで行う。
+    """
+    slack_token: Optional[str] = token_provider.token_for(team_id)
+    if not slack_token:
+        logger.error("ワークスペースのBotトークンが見つかりません: team_id=%s", team_id)
+        return
+    query = query.strip()
+    if query:
+        results: List[Dict[str, Any]] = db_manager.search_messages(team_id, user_id, query, limit=SEARCH_RESULT_LIMIT)
+        user_ids = {user_id}
+        for record in results:
+            user_ids.add(record['from_user'])
+            user_ids.update(record['to_users'])
+        users_data = db_manager.get_users_data(list(user_ids))
+        user_names = {user.user_id: user.user_name for user in users_data if user}
+        text = search.render_results(query, results, user_id, user_names)
+    else:
+        text = "検索する言葉を入力してください"
+    logger.info("検索結果をモーダルに表示中: user_id=%s, view_id=%s", user_id, view_id)
+    SlackManager.for_token(slack_token).update_modal(
+        view_id, SlackManager.text_modal(HISTORY_MODAL_TITLE, text, search=query))
+
+
+def handle_interactive(body: Dict[str, Any], publisher: Any) -> None:
+    """インタラクティブペイロードの処理（Lambda / Socket Mode サーバー共通）"""
+    # 必要なフィールドを抽出
+    user_id = body['user']['id']
+    team_id = body['team']['id']
+    action_id = body['actions'][0]['action_id']
+    metrics.set_dimensions(event_type=action_id, team_id=team_id)
+    metrics.record('event', 'received')
+    set_log_context(event_type=action_id, team_id=team_id)
+
+    if not all([user_id, team_id, action_id]):
+        logger.error("必須フィールドが不足しています: user_id=%s, team_id=%s, action_id=%s", 
+                    user_id, team_id, action_id)
+        raise ValueError("Required fields missing: user_id, team_id, action_id")
+
+    if action_id == SEARCH_ACTION_ID:
+        _search_history(user_id, team_id, body['actions'][0].get('value') or '', body['view']['id'])
+        return
+
+    # SNSトピックにメッセージを送信
+    message = {
+        'user_id': user_id,
+        'team_id': team_id,
+        'action_id': action_id
+    }
+    if action_id == 'view_history' and body.get('trigger_id'):
+        # 応答の期限（3秒）内に読み込み中のモーダルを開き、結果は通知側が views.update で表示する
+        view_id = _open_loading_modal(team_id, body['trigger_id'])
+        if view_id:
+            message['view_id'] = view_id
+    logger.debug("SNSメッセージを送信: %s", LazyPayload(message))
+
+    publisher.publish(INTERACTIVE, message)
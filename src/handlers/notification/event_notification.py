@@ -1,38 +1,40 @@
 import json
 import os
-import boto3
+import uuid
 import logging
 from typing import Dict, Any, List,Optional
+from lib import outbox
 from lib.slack import SlackManager
-from lib.db import DynamoDBManager
-from lib.db import UserInfo
+from lib.tokens import TokenProvider
+from lib.storage import Storage, create_storage
+from lib.user_info import UserInfo
+from lib.structured_log import LazyPayload
 from interactive_notification import handle_home_opened
 
 # ロガーの設定
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb: boto3.resources.base.ServiceResource = boto3.resource('dynamodb')
-db_manager: DynamoDBManager = DynamoDBManager(dynamodb)
+db_manager: Storage = create_storage()
+token_provider = TokenProvider(db_manager)
 
 
 
 def handle_event_notification(message: Dict[str, Any]) -> None:
     """イベントトピックからの通知を処理"""
-    logger.info("イベント通知を受信: %s", message)
+    logger.debug("イベント通知を受信: %s", LazyPayload(message))
     
     event_id: str = message.get('event_id')
     user_id: Optional[str] = message.get('user_id')
     team_id: str = message.get('team_id')
     logger.info("ワークスペース情報を取得中: team_id=%s", team_id)
     workspace_data: Dict[str, Any] = db_manager.get_workspace_data(team_id)
-    slack_token: str = workspace_data.get('access_token') 
+    slack_token: Optional[str] = token_provider.token_for(team_id, workspace_data) 
     if not slack_token:
         logger.error("ワークスペースのBotトークンが見つかりません: team_id=%s", team_id)
         return
     
-    logger.info("slack_token:" f"{slack_token}")
-    slack_manager: SlackManager = SlackManager(slack_token)
+    slack_manager: SlackManager = SlackManager.for_token(slack_token)
 
     def check_and_save_user_profile(user_id: str) -> None:
             user_data: Optional[UserInfo] = db_manager.get_user_data(user_id)
@@ -73,30 +75,44 @@ def handle_event_notification(message: Dict[str, Any]) -> None:
         for mention in mentions:
             check_and_save_user_profile(mention)
 
-        result: Dict[str, Any] = db_manager.add_points(user_id, mentions, message=message_text)
+        result: Dict[str, Any] = db_manager.add_points(user_id, mentions, message=message_text, team_id=team_id,
+                                                       channel_id=message.get('channel'),
+                                                       request_id=message.get('request_id'))
 
+        # DM は送信待ち（lib.outbox）に積み、Slack への送信はワーカーに任せる
+        # 通知は付与のトランザクションが確定した後に別の書き込みで積む（本文に付与後の合計ポイントを使うため）。
+        # 積む前に失敗した場合は、例外を SQS の batchItemFailures として返して再配信させ、
+        # 下の duplicate の経路で積み直す。再配信のない Socket Mode サーバーでは、その通知は失われる。
         if result['success']:
-            logger.info("ポイント付与成功: user_id=%s", user_id)
+            if result.get('duplicate'):
+                # 再配信された要求。付与は済んでいるが、通知を積む前に止まった場合に備えて積み直す
+                # （同じ outbox_id の通知が既にあれば何もしない）
+                logger.info("処理済みのポイント付与要求: transaction_id=%s", result.get('transaction_id'))
+            else:
+                logger.info("ポイント付与成功: user_id=%s", user_id)
+            transaction_id: str = result['transaction_id']
             from_user_data: UserInfo = db_manager.get_user_data(user_id)
             from_user_name = from_user_data.user_name
 
+            notifications: List[Dict[str, Any]] = []
             for mention in mentions:
                 user_data: UserInfo = db_manager.get_user_data(mention)
-                message: str = (
+                received_message: str = (
                     f"🎉 ポイントを受け取りました！\n"
                     f"*From:* {from_user_name}\n"
                     f"*現在の合計ポイント:* {user_data.total_points}ポイント"
                 )
-                logger.info("受信者へDM送信: mention=%s", mention)
-                slack_manager.send_dm(mention, message)
+                notifications.append(outbox.dm(f"{transaction_id}#received#{mention}", team_id, mention,
+                                                received_message))
 
             # 送信者への通知
             sender_message: str = (
                 f"✅ {len(mentions)}人にポイントを付与しました\n"
                 f"*残りの付与可能ポイント:* {5 - result['daily_points_given']}ポイント"
             )
-            logger.info("送信者へDM送信: user_id=%s", user_id)
-            slack_manager.send_dm(user_id, sender_message)
+            notifications.append(outbox.dm(f"{transaction_id}#sent", team_id, user_id, sender_message))
+            added = db_manager.enqueue_outbox(notifications)
+            logger.info("DMを送信待ちに追加: transaction_id=%s, added=%d", transaction_id, added)
         
         else:
             logger.error("ポイント付与失敗: user_id=%s, error=%s", user_id, result['error_message'])
@@ -106,4 +122,29 @@ def handle_event_notification(message: Dict[str, Any]) -> None:
                 f"*理由:* {result['error_message']}\n"
                 f"*残りの付与可能ポイント:* {5 - result['daily_points_given']}ポイント"
             )
-            slack_manager.send_dm(user_id, error_message)
+            request_id: str = message.get('request_id') or str(uuid.uuid4())
+            db_manager.enqueue_outbox([outbox.dm(f"{team_id}#{request_id}#failed", team_id, user_id, error_message)])
+
+
+    if event_id == 'reaction_points_given':
+        mentions: List[str] = message.get('mentions', [])
+        logger.info("リアクションによるポイント付与を通知: user_id=%s, mentions=%s", user_id, mentions)
+        for mention in mentions:
+            check_and_save_user_profile(mention)
+
+        # 同じウィンドウの通知の再配信は同じ outbox_id になる
+        notification_id: str = message.get('transaction_id') or f"reaction#{team_id}#{message.get('window_id')}#{user_id}"
+        from_user_data: UserInfo = db_manager.get_user_data(user_id)
+        notifications: List[Dict[str, Any]] = []
+        for mention in mentions:
+            user_data: UserInfo = db_manager.get_user_data(mention)
+            notifications.append(outbox.dm(f"{notification_id}#received#{mention}", team_id, mention, (
+                f"🙏 リアクションでポイントを受け取りました！\n"
+                f"*From:* {from_user_data.user_name}\n"
+                f"*現在の合計ポイント:* {user_data.total_points}ポイント"
+            )))
+        notifications.append(outbox.dm(f"{notification_id}#sent", team_id, user_id, (
+            f"✅ リアクションで{len(mentions)}人にポイントを付与しました\n"
+            f"*残りの付与可能ポイント:* {5 - message['daily_points_given']}ポイント"
+        )))
+        db_manager.enqueue_outbox(notifications)
@@ -1,17 +1,25 @@
 import json
 import os
-import boto3
+import time
 import logging
 from typing import Dict, Any, List, Optional
 from lib.slack import SlackManager
-from lib.db import DynamoDBManager
+from lib.tokens import TokenProvider
+from lib.storage import Storage, create_storage
 from lib.user_info import UserInfo
+from lib.structured_log import LazyPayload
 # ロガーの設定
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb: boto3.resources.base.ServiceResource = boto3.resource('dynamodb')
-db_manager: DynamoDBManager = DynamoDBManager(dynamodb)
+db_manager: Storage = create_storage()
+token_provider = TokenProvider(db_manager)
+
+# 履歴DMに載せる件数と、スナップショットを作り直すまでの秒数（相手の表示名の変更を反映するため）
+HISTORY_PAGE_SIZE: int = int(os.environ.get('HISTORY_PAGE_SIZE', '20'))
+HISTORY_SNAPSHOT_TTL: int = int(os.environ.get('HISTORY_SNAPSHOT_TTL', '86400'))
+# 読み込み中のモーダル（interactive_handler が開く）と同じタイトル
+HISTORY_MODAL_TITLE = 'ポイント履歴'
 
 def handle_home_opened(user_id: str, slack_manager: SlackManager) -> None:
 
@@ -31,29 +39,70 @@ def handle_home_opened(user_id: str, slack_manager: SlackManager) -> None:
         remaining_points=remaining_points
     )
 
-def handle_view_history(user_id: str, team_id: str) -> None:
-    """ポイント履歴の表示処理"""
+def render_history(transactions: List[Dict[str, Any]], user_names: Dict[str, str],
+                   page_size: int = HISTORY_PAGE_SIZE) -> str:
+    """履歴DMの本文（新しい順に page_size 件）"""
+    history_message: str = "📊 *ポイント履歴*\n"
+    for tx in transactions[:page_size]:
+        timestamp: str = tx.get('timestamp', '')
+        message: str = tx.get('message', 'メッセージなし')
+        
+        if tx['type'] == 'received':
+            from_user_name = user_names.get(tx['from_user'], tx['from_user'])
+            history_message += (
+                f"• {timestamp}\n"
+                f"  {from_user_name}から{tx['points']}ポイントを受け取りました\n"
+                f"  > {message}\n"
+            )
+        else:
+            to_user_name = user_names.get(tx['to_user'], tx['to_user'])
+            history_message += (
+                f"• {timestamp}\n"
+                f"  {to_user_name}に{tx['points']}ポイントを送りました\n"
+                f"  > {message}\n"
+            )
+    if len(transactions) > page_size:
+        history_message += f"…ほか{len(transactions) - page_size}件\n"
+    return history_message
+
+def deliver_history(slack_manager: SlackManager, user_id: str, text: str, view_id: Optional[str] = None) -> None:
+    """interactive_handler が開いた読み込み中のモーダルに表示する。モーダルがない・閉じられた場合はDMで送る"""
+    if view_id:
+        logger.info("履歴をモーダルに表示中: user_id=%s, view_id=%s", user_id, view_id)
+        if slack_manager.update_modal(view_id, SlackManager.text_modal(HISTORY_MODAL_TITLE, text, search='')):
+            return
+    logger.info("履歴メッセージをDMで送信中: user_id=%s", user_id)
+    slack_manager.send_dm(user_id, text)
+
+def handle_view_history(user_id: str, team_id: str, view_id: Optional[str] = None) -> None:
+    """ポイント履歴の表示処理
+
+    表示した内容はユーザーごとのスナップショットとして保存し、次に付与が行われるまでは
+    1回の読み取りで同じ内容を返す（付与のたびに参加者全員のスナップショットが無効化される）。
+    """
     # ワークスペースごとのトークンを取得
     logger.info("ワークスペース情報を取得中: team_id=%s", team_id)
     workspace_data: Dict[str, Any] = db_manager.get_workspace_data(team_id)
-    slack_token: str = workspace_data.get('access_token')
+    slack_token: Optional[str] = token_provider.token_for(team_id, workspace_data)
     
     if not slack_token:
         logger.error("ワークスペースのBotトークンが見つかりません: team_id=%s", team_id)
         return
         
-    slack_manager: SlackManager = SlackManager(slack_token)
-    
-    # ユーザー情報を取得
-    
+    slack_manager: SlackManager = SlackManager.for_token(slack_token)
+
+    snapshot: Dict[str, Any] = db_manager.get_history_snapshot(user_id)
+    if snapshot['text'] is not None and time.time() - snapshot['cached_at'] < HISTORY_SNAPSHOT_TTL:
+        logger.info("履歴スナップショットを表示中: user_id=%s, version=%d", user_id, snapshot['version'])
+        deliver_history(slack_manager, user_id, snapshot['text'], view_id)
+        return
     
     logger.info("ユーザーの取引履歴を取得中: user_id=%s", user_id)
-    transactions: List[Dict[str, Any]] = db_manager.get_user_transactions(user_id)
-    history_message: str = "📊 *ポイント履歴*\n"
+    transactions: List[Dict[str, Any]] = db_manager.get_user_transactions(user_id, team_id=team_id)
     
-    # トランザクションに含まれる全てのユーザーIDを収集
+    # 表示するトランザクションに含まれるユーザーIDを収集
     user_ids = set()
-    for tx in transactions:
+    for tx in transactions[:HISTORY_PAGE_SIZE]:
         if tx['type'] == 'received':
             user_ids.add(tx['from_user'])
         else:
@@ -63,32 +112,16 @@ def handle_view_history(user_id: str, team_id: str) -> None:
     users_data: List[UserInfo] = db_manager.get_users_data(list(user_ids))
     user_names = {user.user_id: user.user_name for user in users_data}
 
-    for tx in transactions:
-        timestamp: str = tx.get('timestamp', '')
-        message: str = tx.get('message', 'メッセージなし')
-        
-        if tx['type'] == 'received':
-            from_user_name = user_names[tx['from_user']]
-            history_message += (
-                f"• {timestamp}\n"
-                f"  {from_user_name}から{tx['points']}ポイントを受け取りました\n"
-                f"  > {message}\n"
-            )
-        else:
-            to_user_name = user_names[tx['to_user']]
-            history_message += (
-                f"• {timestamp}\n"
-                f"  {to_user_name}に{tx['points']}ポイントを送りました\n"
-                f"  > {message}\n"
-            )
+    history_message = render_history(transactions, user_names)
+    # 読み取り後に付与があった場合は保存されない（次回作り直す）
+    db_manager.save_history_snapshot(user_id, snapshot['version'], history_message)
     
-    logger.info("履歴メッセージをDMで送信中: user_id=%s", user_id)
-    slack_manager.send_dm(user_id, history_message)
+    deliver_history(slack_manager, user_id, history_message, view_id)
 
 def handle_interactive_notification(message: Dict[str, Any]) -> None:
     """インタラクティブトピックからの通知を処理"""
     try:
-        logger.info("インタラクティブ通知を受信: %s", message)
+        logger.debug("インタラクティブ通知を受信: %s", LazyPayload(message))
         
         # メッセージの解析
         user_id: str = message.get('user_id')
@@ -96,12 +129,12 @@ def handle_interactive_notification(message: Dict[str, Any]) -> None:
         action_id: str = message.get('action_id')
         
         if not action_id or not user_id or not team_id:
-            logger.error("必須フィールドが不足しています: %s", message)
+            logger.error("必須フィールドが不足しています: %s", LazyPayload(message))
             raise ValueError("Required fields missing in message")
 
         if action_id == 'view_history':
             logger.info("履歴表示がリクエストされました: user_id=%s", user_id)
-            handle_view_history(user_id, team_id)
+            handle_view_history(user_id, team_id, message.get('view_id'))
         else:
             logger.warning("不明なaction_idを受信: %s", action_id)
             
@@ -111,9 +144,9 @@ def handle_interactive_notification(message: Dict[str, Any]) -> None:
         logger.error("インタラクティブ通知の処理中にエラーが発生: %s", str(e), exc_info=True)
         # エラーが発生した場合はユーザーに通知
         workspace_data: Dict[str, Any] = db_manager.get_workspace_data(team_id)
-        if slack_token := workspace_data.get('bot_token'):
-            slack_manager: SlackManager = SlackManager(slack_token)
+        if slack_token := token_provider.token_for(team_id, workspace_data):
+            slack_manager: SlackManager = SlackManager.for_token(slack_token)
             error_message = "⚠️ 処理中にエラーが発生しました。しばらく時間をおいて再度お試しください。"
-            slack_manager.send_dm(user_id, error_message)
+            deliver_history(slack_manager, user_id, error_message, message.get('view_id'))
 
 
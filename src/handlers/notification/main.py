@@ -1,48 +1,34 @@
 import json
 import os
-import boto3
+import contextvars
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from lib.metrics import metrics, flush_after
+from lib.metering import install_usage_meter
+from lib.structured_log import configure_logging, set_log_context, log_invocation, LazyPayload
+from lib.publisher import topic_for_arn, EVENTS, INTERACTIVE
 
-from event_notification import handle_event_notification
+from event_notification import handle_event_notification, db_manager
 from interactive_notification import handle_interactive_notification
 
-# ロガーの設定
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# ロガーの設定（JSON形式・トークン伏せ字・サンプリング）
+logger = configure_logging()
+# ワークスペースごとの利用量（-metering テーブル）
+install_usage_meter(db_manager)
 
+# メッセージの内容（必須項目の欠落や想定外の形）による失敗。再試行しても同じ結果になる
+NON_RETRYABLE_ERRORS = (ValueError, KeyError, TypeError)
+
+@flush_after
+@log_invocation
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    records: List[Dict[str, Any]] = event.get('Records', [])
+    if records and records[0].get('eventSource') == 'aws:sqs':
+        # イベントトピック（FIFO）は SQS FIFO キュー経由で届く
+        return handle_sqs_batch(records)
     try:
         # SNSメッセージの解析
-        sns_message = event['Records'][0]['Sns']
-        topic_arn: str = sns_message['TopicArn']
-        message: Dict[str, Any] = json.loads(sns_message['Message'])
-        logger.info("SNSメッセージを受信: topic_arn=%s, message=%s", topic_arn, message)
-
-        # スタック名の取得
-        stack_name = os.environ['STACK_NAME']
-        event_topic = f"{stack_name}-events" # EventTopicと一致
-        interactive_topic = f"{stack_name}-interactive" # InteractiveTopicと一致
-        logger.info("トピック名を設定: event_topic=%s, interactive_topic=%s", event_topic, interactive_topic)
-
-        # トピックに応じて処理を分岐
-        if topic_arn.endswith(event_topic):
-            # イベントトピックの場合
-            logger.info("イベントトピックの処理を開始")
-            required_fields = {'event_id', 'user_id', 'team_id'}
-            if not required_fields.issubset(message.keys()):
-                missing_fields = required_fields - set(message.keys())
-                logger.error("必須フィールドが不足しています: %s", missing_fields)
-                raise ValueError(f"Required fields missing in event message: {missing_fields}")
-            handle_event_notification(message)
-
-        elif topic_arn.endswith(interactive_topic):
-            # インタラクティブトピックの場合
-            logger.info("インタラクティブトピックの処理を開始")
-            handle_interactive_notification(message)
-        else:
-            logger.error("不明なトピックARN: %s", topic_arn)
-            raise ValueError(f"Unknown topic ARN: {topic_arn}. Expected either {event_topic} or {interactive_topic}")
+        process_sns_message(records[0]['Sns'])
 
         logger.info("通知の処理が正常に完了しました")
         return {
@@ -61,4 +47,74 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return {
             'statusCode': 500,
             'body': json.dumps({'error': 'Internal server error'})
-        }
\ No newline at end of file
+        }
+
+
+def process_sns_message(sns_message: Dict[str, Any]) -> None:
+    """SNSメッセージ（SNS イベント、または SQS に配信された SNS エンベロープ）を処理"""
+    topic_arn: str = sns_message['TopicArn']
+    message: Dict[str, Any] = json.loads(sns_message['Message'])
+    event_type = message.get('event_id') or message.get('action_id')
+    metrics.set_dimensions(event_type=event_type)
+    set_log_context(event_type=event_type, team_id=message.get('team_id'))
+    logger.debug("SNSメッセージを受信: topic_arn=%s, message=%s", topic_arn, LazyPayload(message))
+
+    # トピックARNを論理トピック名に変換して処理を分岐
+    dispatch_notification(topic_for_arn(topic_arn), message, topic_arn)
+
+
+def handle_sqs_batch(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """SQS FIFO キューのバッチを処理し、失敗したメッセージだけを再配信させる
+
+    同じメッセージグループ（team_id:user_id）で失敗したメッセージより後ろは処理せずに
+    失敗として返し、送信者ごとの順序を保つ。メッセージの内容による失敗（NON_RETRYABLE_ERRORS）は
+    再試行しても成功せず、そのグループを DLQ に移るまで止めてしまうため破棄する。
+    """
+    failures: List[Dict[str, str]] = []
+    failed_groups = set()
+    for record in records:
+        group_id: Optional[str] = record.get('attributes', {}).get('MessageGroupId')
+        if group_id is not None and group_id in failed_groups:
+            failures.append({'itemIdentifier': record['messageId']})
+            continue
+        try:
+            # メッセージごとに別のコンテキストで処理し、ワークスペース（team_id）ごとに処理時間を記録する
+            contextvars.copy_context().run(_process_sqs_record, record)
+        except NON_RETRYABLE_ERRORS as e:
+            logger.error("再試行しても処理できないメッセージを破棄します: message_id=%s error=%s",
+                         record['messageId'], repr(e), exc_info=True)
+        except Exception as e:
+            logger.error("通知の処理中にエラーが発生しました: message_id=%s error=%s",
+                         record['messageId'], str(e), exc_info=True)
+            failures.append({'itemIdentifier': record['messageId']})
+            if group_id is not None:
+                failed_groups.add(group_id)
+    logger.info("SQSバッチを処理しました: records=%d failures=%d", len(records), len(failures))
+    return {'batchItemFailures': failures}
+
+
+def _process_sqs_record(record: Dict[str, Any]) -> None:
+    with metrics.timed('handler', 'notification.message'):
+        process_sns_message(json.loads(record['body']))
+
+
+def dispatch_notification(topic: Optional[str], message: Dict[str, Any], source: str = '') -> None:
+    """通知メッセージの処理（Lambda / Socket Mode サーバー共通）"""
+    metrics.set_dimensions(team_id=message.get('team_id'))
+    if topic == EVENTS:
+        # イベントトピックの場合
+        logger.info("イベントトピックの処理を開始")
+        required_fields = {'event_id', 'user_id', 'team_id'}
+        if not required_fields.issubset(message.keys()):
+            missing_fields = required_fields - set(message.keys())
+            logger.error("必須フィールドが不足しています: %s", missing_fields)
+            raise ValueError(f"Required fields missing in event message: {missing_fields}")
+        handle_event_notification(message)
+
+    elif topic == INTERACTIVE:
+        # インタラクティブトピックの場合
+        logger.info("インタラクティブトピックの処理を開始")
+        handle_interactive_notification(message)
+    else:
+        logger.error("不明なトピック: %s", source or topic)
+        raise ValueError(f"Unknown topic: {source or topic}. Expected either {EVENTS} or {INTERACTIVE}")
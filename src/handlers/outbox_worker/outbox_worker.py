@@ -0,0 +1,40 @@
+from typing import Dict, Any
+from lib.storage import Storage, create_storage
+from lib.tokens import TokenProvider
+from lib.outbox import OutboxWorker
+from lib.metrics import flush_after
+from lib.structured_log import configure_logging, log_invocation
+
+logger = configure_logging()
+
+db_manager: Storage = create_storage()
+token_provider = TokenProvider(db_manager)
+# サーキットブレーカーの状態はウォームコンテナの間で持ち越す
+worker: OutboxWorker = OutboxWorker(db_manager, token_provider.token_for)
+
+# 残り時間がこれを切ったら送信をやめる（送り残しは次の呼び出しが送る。ミリ秒）
+TIME_MARGIN_MS = 10 * 1000
+
+
+@flush_after
+@log_invocation
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """-outbox のストリーム（新しい通知）と1分ごとのスケジュール（再試行）から呼ばれ、期限の来た通知を送る"""
+    try:
+        def has_time() -> bool:
+            return context is None or context.get_remaining_time_in_millis() > TIME_MARGIN_MS
+
+        report: Dict[str, int] = worker.run(has_time)
+        return {
+            'statusCode': 200,
+            'body': report
+        }
+
+    except Exception as e:
+        logger.error(f"Error sending outbox: {str(e)}", exc_info=True)
+        return {
+            'statusCode': 500,
+            'body': {
+                'error': str(e)
+            }
+        }
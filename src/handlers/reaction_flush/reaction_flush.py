@@ -0,0 +1,56 @@
+from typing import Dict, Any, List
+from lib.storage import Storage, create_storage
+from lib.reactions import ReactionBuffer, ReactionCoalescer
+from lib.metrics import flush_after
+from lib.publisher import SNSPublisher, EVENTS
+from lib.structured_log import configure_logging, log_invocation
+
+logger = configure_logging()
+
+db_manager: Storage = create_storage()
+coalescer: ReactionCoalescer = ReactionCoalescer(ReactionBuffer(db_manager), db_manager)
+publisher: SNSPublisher = SNSPublisher()
+
+@flush_after
+@log_invocation
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    try:
+        # 閉じたウィンドウのリアクションをまとめて書き込む
+        outcomes: List[Dict[str, Any]] = coalescer.flush()
+
+        # 新たに付与できた送信者ごとに通知を依頼
+        notified = 0
+        for outcome in outcomes:
+            if not outcome['success'] or outcome.get('duplicate'):
+                continue
+            message_data = {
+                'event_id': 'reaction_points_given',
+                'user_id': outcome['user_id'],
+                'team_id': outcome['team_id'],
+                # 同じ相手の複数のメッセージへのリアクションは、通知では1人として数える
+                'mentions': list(dict.fromkeys(outcome['to_users'])),
+                'daily_points_given': outcome['daily_points_given'],
+                # 通知の送信待ち（lib.outbox）の ID に使う
+                'transaction_id': outcome.get('transaction_id'),
+                'window_id': outcome.get('window_id')
+            }
+            publisher.publish(EVENTS, message_data)
+            notified += 1
+
+        return {
+            'statusCode': 200,
+            'body': {
+                'message': 'Reactions flushed successfully',
+                'senders': len(outcomes),
+                'notified': notified
+            }
+        }
+
+    except Exception as e:
+        logger.error(f"Error flushing reactions: {str(e)}", exc_info=True)
+        return {
+            'statusCode': 500,
+            'body': {
+                'error': str(e)
+            }
+        }
@@ -1,31 +1,48 @@
-import boto3
 import datetime
 from typing import Dict, Any
-from lib.db import DynamoDBManager
+from lib.storage import Storage, create_storage
+from lib.metrics import flush_after
+from lib.structured_log import configure_logging
 
-from boto3.resources.base import ServiceResource
+logger = configure_logging()
 
-dynamodb: ServiceResource = boto3.resource('dynamodb')
-db_manager: DynamoDBManager = DynamoDBManager(dynamodb)
+db_manager: Storage = create_storage()
 
+@flush_after
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     try:
         # 日付の取得
         today: str = datetime.datetime.now().strftime('%Y-%m-%d')
         
-        # 全ユーザーの日次ポイントをリセット
-        result: Dict[str, int] = db_manager.reset_daily_points(today)
+        # ワークスペースごとに、そのワークスペースのユーザーだけをリセット
+        users_reset: int = 0
+        failed_teams = []
+        for team_id in db_manager.get_workspace_ids():
+            result: Dict[str, Any] = db_manager.reset_daily_points(today, team_id=team_id)
+            if result['success']:
+                users_reset += result['users_reset']
+            else:
+                failed_teams.append(team_id)
+        # team_id のないユーザー（移行前のアイテム・プロフィール保存前の受信者）はどのワークスペースにも含まれない
+        result = db_manager.reset_daily_points(today, unassigned=True)
+        if result['success']:
+            users_reset += result['users_reset']
+        else:
+            failed_teams.append(None)
+        if failed_teams:
+            logger.error("Daily points reset failed for teams: %s", failed_teams)
         
         return {
-            'statusCode': 200,
+            'statusCode': 200 if not failed_teams else 500,
             'body': {
                 'message': 'Daily points reset successfully',
-                'users_reset': result['users_reset']
+                'users_reset': users_reset,
+                'failed_teams': failed_teams
             }
         }
         
     except Exception as e:
-        print(f"Error resetting daily points: {str(e)}")
+        logger.error(f"Error resetting daily points: {str(e)}")
         return {
             'statusCode': 500,
             'body': {
@@ -0,0 +1,75 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+_registry: List['TTLCache'] = []
+
+
+class TTLCache:
+    """スレッドセーフな有効期限付きLRUキャッシュ
+
+    Lambda のウォームコンテナ間、Socket Mode サーバーのワーカー間で共有する。
+    ttl が 0 以下なら何も保持しない。
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        _registry.append(self)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """キャッシュになければ loader の結果を保存して返す（空の結果は保存しない）"""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+
+def clear_all() -> None:
+    """プロセス内の全キャッシュを破棄（テスト・負荷試験の環境切り替え用）"""
+    for cache in _registry:
+        cache.clear()
+
+
+def ttl_from_env(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
@@ -0,0 +1,82 @@
+import os
+import uuid
+import zlib
+import base64
+import hashlib
+from typing import Dict, Any, Optional
+
+# 書き込みに使う -transactions アイテムの形式（0: 従来の形式、1: コンパクトな形式）
+# 読み取りはどちらの形式にも対応するため、読み取り側を先にデプロイしてから切り替えられる
+TRANSACTION_CODEC_VERSION: int = int(os.environ.get('TRANSACTION_CODEC_VERSION', '1'))
+# このバイト数以上のメッセージは圧縮して保存する（圧縮で小さくならなければそのまま）
+MESSAGE_COMPRESS_THRESHOLD: int = int(os.environ.get('MESSAGE_COMPRESS_THRESHOLD', '200'))
+
+VERSION_ATTRIBUTE = 'v'
+COMPRESSED_MESSAGE = 'mz'
+
+# 形式 1 の短い属性名。キー・インデックスのキー（transaction_id / team_id / timestamp）と、
+# 条件式で参照する制御用の属性（status / grant_id）は従来の名前のまま
+SHORT_NAMES: Dict[str, str] = {
+    'from_user': 'f',
+    'to_users': 'r',
+    'points': 'p',
+    'message': 'm',
+    'channel_id': 'c',
+    'source': 's',
+}
+LONG_NAMES: Dict[str, str] = {short: name for name, short in SHORT_NAMES.items()}
+
+
+def new_transaction_id() -> str:
+    """UUID4 を URL セーフな Base64 にした22文字のトランザクションID（ハイフン区切りの36文字より短い）"""
+    return base64.urlsafe_b64encode(uuid.uuid4().bytes).rstrip(b'=').decode('ascii')
+
+
+def request_transaction_id(team_id: Optional[str], request_id: str) -> str:
+    """要求（Slack のメッセージ）ごとに決まる22文字のトランザクションID（再配信されても同じ値）"""
+    digest = hashlib.sha256(f'{team_id or ""}:{request_id}'.encode('utf-8')).digest()[:16]
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+def encode_transaction(record: Dict[str, Any], version: Optional[int] = None) -> Dict[str, Any]:
+    """トランザクション記録を保存用のアイテムにする
+
+    形式 1 では属性名を短くし、既定値（points=1・空のメッセージ）は書かず、長いメッセージは
+    zlib で圧縮したバイナリ（mz）にする。
+    """
+    version = TRANSACTION_CODEC_VERSION if version is None else version
+    if version == 0:
+        return dict(record)
+
+    item: Dict[str, Any] = {VERSION_ATTRIBUTE: 1}
+    for name, value in record.items():
+        if name == 'points' and value == 1:
+            continue
+        if name == 'message':
+            if not value:
+                continue
+            encoded = value.encode('utf-8')
+            if len(encoded) >= MESSAGE_COMPRESS_THRESHOLD:
+                compressed = zlib.compress(encoded, 9)
+                if len(compressed) < len(encoded):
+                    item[COMPRESSED_MESSAGE] = compressed
+                    continue
+        item[SHORT_NAMES.get(name, name)] = value
+    return item
+
+
+def decode_transaction(item: Dict[str, Any]) -> Dict[str, Any]:
+    """保存されたアイテム（どの形式でも）を従来の属性名の記録に戻す"""
+    if VERSION_ATTRIBUTE not in item:
+        return item
+
+    record: Dict[str, Any] = {'points': 1, 'message': ''}
+    for name, value in item.items():
+        if name == VERSION_ATTRIBUTE:
+            continue
+        if name == COMPRESSED_MESSAGE:
+            # boto3 は Binary 型で返す
+            record['message'] = zlib.decompress(bytes(getattr(value, 'value', value))).decode('utf-8')
+            continue
+        record[LONG_NAMES.get(name, name)] = value
+    return record
@@ -1,90 +1,262 @@
 import os 
 import boto3
-from typing import Dict, List, Any, Optional,Union
-import uuid
+from typing import Dict, List, Any, Optional, Union, Iterator, Tuple
+import json
+import time
 from datetime import datetime
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 from boto3.dynamodb.conditions import Key, Attr
 from boto3.resources.base import ServiceResource
 import logging
 
 from lib.user_info import UserInfo
+from lib.storage import Storage
+from lib.metrics import metrics, error_class, InstrumentedTable, InstrumentedDynamoDBClient
+from lib.structured_log import LazyPayload
+from lib.cache import TTLCache, ttl_from_env
+from lib import search
+from lib.codec import (SHORT_NAMES, encode_transaction, decode_transaction, new_transaction_id,
+                       request_transaction_id)
 # ロガーの設定
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# 1日に付与できるポイントの上限
+DAILY_POINT_LIMIT = 5
 
+# TransactWriteItems 1回あたりの最大アイテム数
+MAX_TRANSACT_ITEMS = 100
 
-class DynamoDBManager:
+# 1トランザクションに収まらない付与（ヘッダーの status）と、チャンクを並行に書き込む数
+GRANT_PENDING = 'pending'
+GRANT_COMPLETE = 'complete'
+GRANT_ROLLING_BACK = 'rolling_back'
+GRANT_ROLLED_BACK = 'rolled_back'
+GRANT_CHUNK_WORKERS = 4
+
+# 日次ポイントのリセットで並行に書き込む数
+RESET_WORKERS = int(os.environ.get('RESET_WORKERS', '8'))
+
+# ワークスペース単位で読むためのGSI（team_id をパーティションキーにする）
+USERS_TEAM_INDEX = 'team_id-user_id-index'
+TRANSACTIONS_TEAM_INDEX = 'team_id-timestamp-index'
+# 期間ごとに全ワークスペースの利用量を読むためのGSI
+METERING_PERIOD_INDEX = 'period-team_id-index'
+
+# 利用量のカウンターを残す期間（秒）
+USAGE_TTL_SECONDS = 400 * 24 * 60 * 60
+# チャンネルごとの感謝の件数（-channel-stats）。scope は '{team_id}#all' または '{team_id}#{日付}'
+CHANNEL_STATS_INDEX = 'scope-thanks-index'
+CHANNEL_STATS_TTL_SECONDS = 400 * 24 * 60 * 60
+# -outbox の期限の索引（state, due_at）。送信済みの通知は due_at を消して索引から外す
+OUTBOX_DUE_INDEX = 'state-due_at-index'
+_OUTBOX_NUMBERS = ('due_at', 'attempts', 'created_at', 'sent_at', 'expires_at')
+
+# 履歴スナップショット（-history テーブル）の無効化。付与の参加者ごとの更新に含め、
+# ユーザーアイテムの history_version を進めて、古い版のスナップショットを読まない・保存させない。
+# 本文はユーザーアイテム（と全属性を射影する team_id-user_id-index）に載せない。
+# REMOVE は以前ユーザーアイテムに保存していた本文を、次の付与で消すため
+INVALIDATE_HISTORY = 'REMOVE history_snapshot, history_cached_at ADD history_version :one'
+
+# get_user_data で読む属性（スナップショットは読まない）
+_PROFILE_ATTRIBUTES = {f'#{name}': name for name in UserInfo.__annotations__}
+# Slack のプロフィールから更新する属性
+_PROFILE_FIELDS = ('team_id', 'user_name', 'real_name', 'display_name', 'email')
+
+# プロセス内で共有するキャッシュ（Lambdaのウォームコンテナ / Socket Modeサーバーのワーカー間）
+# ワークスペース情報（Botトークン）と、履歴表示用のユーザープロフィール
+workspace_cache = TTLCache(maxsize=256, ttl=ttl_from_env('WORKSPACE_CACHE_TTL', 60))
+profile_cache = TTLCache(maxsize=10000, ttl=ttl_from_env('PROFILE_CACHE_TTL', 300))
+
+
+class DynamoDBManager(Storage):
     def __init__(self, dynamodb: ServiceResource, stack_name: Optional[str] = None) -> None:
         self.dynamodb: ServiceResource = dynamodb
         self.stack_name: str = stack_name or os.environ['STACK_NAME']
-        self.users_table = dynamodb.Table(f'{self.stack_name}-users')
-        self.transactions_table = dynamodb.Table(f'{self.stack_name}-transactions')
-        self.workspaces_table = dynamodb.Table(f'{self.stack_name}-auth')
+        self.users_table = InstrumentedTable(dynamodb.Table(f'{self.stack_name}-users'), metrics)
+        self.transactions_table = InstrumentedTable(dynamodb.Table(f'{self.stack_name}-transactions'), metrics)
+        self.workspaces_table = InstrumentedTable(dynamodb.Table(f'{self.stack_name}-auth'), metrics)
+        self.reactions_table = InstrumentedTable(dynamodb.Table(f'{self.stack_name}-reactions'), metrics)
+        self.jobs_table = InstrumentedTable(dynamodb.Table(f'{self.stack_name}-jobs'), metrics)
+        # 利用量の書き込み自体はワークスペースの利用量に数えないため計測しない
+        self.metering_table = dynamodb.Table(f'{self.stack_name}-metering')
+        self.rate_limits_table = InstrumentedTable(dynamodb.Table(f'{self.stack_name}-rate-limits'), metrics)
+        self.channel_stats_table = InstrumentedTable(dynamodb.Table(f'{self.stack_name}-channel-stats'), metrics)
+        self.search_table = InstrumentedTable(dynamodb.Table(f'{self.stack_name}-search'), metrics)
+        self.outbox_table = InstrumentedTable(dynamodb.Table(f'{self.stack_name}-outbox'), metrics)
+        self.history_table = InstrumentedTable(dynamodb.Table(f'{self.stack_name}-history'), metrics)
+        self.client = InstrumentedDynamoDBClient(dynamodb.meta.client, metrics)
         logger.info("DynamoDBManager initialized with stack name: %s", self.stack_name)
 
     def get_user_data(self, user_id: str) -> Optional[UserInfo]:
         """ユーザーデータの取得"""
         logger.info("Fetching user data for user_id: %s", user_id)
         response: Dict[str, Any] = self.users_table.get_item(
-            Key={'user_id': user_id}
+            Key={'user_id': user_id},
+            ProjectionExpression=', '.join(_PROFILE_ATTRIBUTES),
+            ExpressionAttributeNames=_PROFILE_ATTRIBUTES
         )
         user_data = response.get('Item')
         if not user_data:
             logger.info("User data not found for user_id: %s", user_id)
             return None
         user_info = UserInfo.from_dict(user_data)
-        logger.info("User data fetched: %s", user_info.to_dict())
+        logger.debug("User data fetched: %s", LazyPayload(user_data))
         return user_info
 
     def get_workspace_data(self, team_id: str) -> Dict[str, Any]:
-        """ワークスペースデータの取得"""
+        """ワークスペースデータの取得（WORKSPACE_CACHE_TTL 秒キャッシュする）"""
+        cache_key = (self.stack_name, team_id)
+        cached = workspace_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
         logger.info("Fetching workspace data for team_id: %s", team_id)
         response: Dict[str, Any] = self.workspaces_table.get_item(
             Key={'workspace_id':team_id}
         )
         workspace_data = response.get('Item', {})
-        logger.info("Workspace data fetched: %s", workspace_data)
+        if workspace_data:
+            workspace_cache.set(cache_key, dict(workspace_data))
+        logger.debug("Workspace data fetched: %s", LazyPayload(workspace_data))
         return workspace_data
 
-    def get_user_transactions(self, user_id: str) -> List[Dict[str, Any]]:
+    def save_workspace_data(self, workspace_data: Dict[str, Any]) -> None:
+        """ワークスペースデータの保存"""
+        self.workspaces_table.put_item(Item=workspace_data)
+        workspace_cache.invalidate((self.stack_name, workspace_data['workspace_id']))
+
+    def get_token_record(self, team_id: str) -> Dict[str, Any]:
+        """トークンの状態を強い整合性で読む（更新直後の別の呼び出しの書き込みを見るため）"""
+        item: Dict[str, Any] = self.workspaces_table.get_item(
+            Key={'workspace_id': team_id},
+            ProjectionExpression='access_token, refresh_token, token_expires_at, token_lease_until',
+            ConsistentRead=True
+        ).get('Item', {})
+        return item
+
+    def acquire_token_lease(self, team_id: str, owner: str, until: float, now: float) -> bool:
+        try:
+            self.workspaces_table.update_item(
+                Key={'workspace_id': team_id},
+                UpdateExpression='SET token_lease_owner = :owner, token_lease_until = :until',
+                ConditionExpression=(
+                    'attribute_exists(workspace_id) AND '
+                    '(attribute_not_exists(token_lease_until) OR token_lease_until < :now)'
+                ),
+                ExpressionAttributeValues={':owner': owner, ':until': int(until), ':now': int(now)}
+            )
+            return True
+        except self.workspaces_table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def save_rotated_token(self, team_id: str, owner: str, access_token: str,
+                           refresh_token: str, expires_at: float) -> bool:
+        try:
+            self.workspaces_table.update_item(
+                Key={'workspace_id': team_id},
+                UpdateExpression=(
+                    'SET access_token = :access_token, refresh_token = :refresh_token, '
+                    'token_expires_at = :expires_at REMOVE token_lease_owner, token_lease_until'
+                ),
+                ConditionExpression='token_lease_owner = :owner',
+                ExpressionAttributeValues={
+                    ':access_token': access_token,
+                    ':refresh_token': refresh_token,
+                    ':expires_at': int(expires_at),
+                    ':owner': owner,
+                }
+            )
+            return True
+        except self.workspaces_table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+        finally:
+            workspace_cache.invalidate((self.stack_name, team_id))
+
+    def _paginate(self, table: Any, operation: str, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+        """scan / query を LastEvaluatedKey がなくなるまで繰り返す"""
+        while True:
+            response: Dict[str, Any] = getattr(table, operation)(**kwargs)
+            yield from response.get('Items', [])
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _team_transactions(self, user_id: str, team_id: Optional[str]) -> List[Dict[str, Any]]:
+        """ユーザーが送受信したトランザクション
+
+        team_id があればそのワークスペースのパーティションだけを読む。ない場合は
+        移行前の互換動作として全件をスキャンする。
+        """
+        # 従来の形式と lib.codec のコンパクトな形式（短い属性名）のどちらのアイテムにも一致させる
+        involved = Attr('from_user').eq(user_id) | Attr('to_users').contains(user_id)
+        involved |= Attr(SHORT_NAMES['from_user']).eq(user_id) | Attr(SHORT_NAMES['to_users']).contains(user_id)
+        # 取り消した付与は履歴に出さない
+        involved &= Attr('status').not_exists() | Attr('status').ne(GRANT_ROLLED_BACK)
+        if team_id:
+            items = self._paginate(self.transactions_table, 'query',
+                                   IndexName=TRANSACTIONS_TEAM_INDEX,
+                                   KeyConditionExpression=Key('team_id').eq(team_id),
+                                   FilterExpression=involved)
+        else:
+            items = self._paginate(self.transactions_table, 'scan', FilterExpression=involved)
+        return [decode_transaction(item) for item in items]
+
+    def get_team_user_ids(self, team_id: str) -> List[str]:
+        """ワークスペースに所属するユーザーID（GSIのパーティションだけを読む）"""
+        return [item['user_id'] for item in self._paginate(
+            self.users_table, 'query',
+            IndexName=USERS_TEAM_INDEX,
+            KeyConditionExpression=Key('team_id').eq(team_id),
+            ProjectionExpression='user_id')]
+
+    def get_workspace_ids(self) -> List[str]:
+        """インストール済みワークスペースのID一覧"""
+        return [item['workspace_id'] for item in self._paginate(
+            self.workspaces_table, 'scan', ProjectionExpression='workspace_id')]
+
+    def get_user_transactions(self, user_id: str, team_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """ユーザーのトランザクション履歴を取得"""
-        logger.info("Fetching transactions for user_id: %s", user_id)
+        logger.info("Fetching transactions for user_id: %s team_id: %s", user_id, team_id)
         transactions = []
-        
-        # 受け取ったポイントの取得
-        received = self.transactions_table.scan(
-            FilterExpression=Attr('to_users').contains(user_id)
-        )
-        for tx in received.get('Items', []):
-            transactions.append({
-                'type': 'received',
-                'from_user': tx['from_user'],
-                'points': tx['points'],
-                'timestamp': tx['timestamp'],
-                'message': tx.get('message', '')
-            })
-
-        # 送信したポイントの取得
-        sent = self.transactions_table.scan(
-            FilterExpression=Attr('from_user').eq(user_id)
-        )
-        for tx in sent.get('Items', []):
-            for to_user in tx['to_users']:
+
+        for tx in self._team_transactions(user_id, team_id):
+            # 受け取ったポイント
+            if user_id in tx['to_users']:
                 transactions.append({
-                    'type': 'sent',
-                    'to_user': to_user,
+                    'type': 'received',
+                    'from_user': tx['from_user'],
                     'points': tx['points'],
                     'timestamp': tx['timestamp'],
                     'message': tx.get('message', '')
                 })
+            # 送信したポイント
+            if tx['from_user'] == user_id:
+                for to_user in tx['to_users']:
+                    transactions.append({
+                        'type': 'sent',
+                        'to_user': to_user,
+                        'points': tx['points'],
+                        'timestamp': tx['timestamp'],
+                        'message': tx.get('message', '')
+                    })
 
         # タイムスタンプでソート
         transactions.sort(key=lambda x: x['timestamp'], reverse=True)
-        logger.info("Transactions fetched and sorted: %s", transactions)
+        logger.info("Transactions fetched and sorted: %d items", len(transactions))
+        logger.debug("Transactions: %s", LazyPayload(transactions))
         return transactions
 
-    def add_points(self, from_user: str, to_users: List[str], message: str = '') -> Dict[str, Any]:
+    def add_points(self, from_user: str, to_users: List[str], message: str = '',
+                   team_id: Optional[str] = None, channel_id: Optional[str] = None,
+                   request_id: Optional[str] = None) -> Dict[str, Any]:
+        """ポイントの付与（リトライ回数・失敗理由を計測）"""
+        with metrics.timed('grant', 'add_points') as metric:
+            return self._add_points(from_user, to_users, message, team_id, metric, channel_id, request_id)
+
+    def _add_points(self, from_user: str, to_users: List[str], message: str, team_id: Optional[str],
+                    metric: Dict[str, Any], channel_id: Optional[str] = None,
+                    request_id: Optional[str] = None) -> Dict[str, Any]:
         # from_user が to_users に含まれていたら除外
         to_users = [user for user in to_users if user != from_user]
         
@@ -93,22 +265,35 @@ class DynamoDBManager:
             logger.info("No valid recipients after excluding the sender: %s", from_user)
             return {
                 'success': False,
-                'error_message': '送信者が受信者と同一でした'
+                'error_message': '送信者が受信者と同一でした',
+                'daily_points_given': self._get_daily_points([from_user]).get(from_user, 0)
             }
         
         """ポイントの付与"""
         logger.info("Adding points from user: %s to users: %s", from_user, to_users)
         max_retries = 3
         attempt = 0
+        # 要求（Slack のメッセージ）ごとに決まるID。再配信された要求は同じ記録に当たる
+        transaction_id: str = request_transaction_id(team_id, request_id) if request_id else new_transaction_id()
+        daily_points_given = 0
 
         while attempt < max_retries:
             try:
-                # 送信者の日次ポイント確認
-                sender_data: UserInfo = self.get_user_data(from_user)
-                daily_points_given: int = sender_data.daily_points_given
+                # 送信者の日次ポイント確認（同じ送信者の直前の付与を確実に読むため強い整合性で読む）
+                if request_id:
+                    sender_item, existing = self._read_sender_and_grant(from_user, transaction_id)
+                    if existing:
+                        return self._replayed_grant(existing, int(sender_item.get('daily_points_given', 0)), metric)
+                else:
+                    sender_item = self.users_table.get_item(
+                        Key={'user_id': from_user},
+                        ProjectionExpression='daily_points_given',
+                        ConsistentRead=True
+                    ).get('Item', {})
+                daily_points_given: int = int(sender_item.get('daily_points_given', 0))
                 logger.info("Sender's daily points: %d", daily_points_given)
                 
-                if daily_points_given + len(to_users) > 5:
+                if daily_points_given + len(to_users) > DAILY_POINT_LIMIT:
                     logger.warning("Daily points limit exceeded for user: %s", from_user)
                     return {
                         'success': False,
@@ -116,9 +301,10 @@ class DynamoDBManager:
                         'daily_points_given': daily_points_given
                     }
 
-                # トランザクションID生成
-                transaction_id: str = str(uuid.uuid4())
-                timestamp: str = datetime.now().isoformat()
+                # 受信者が多く1トランザクションに収まらない場合は、チャンクに分けて書き込む
+                chunked: bool = len(to_users) + 2 > MAX_TRANSACT_ITEMS
+
+                timestamp: str = datetime.now().isoformat(timespec='seconds')
                 logger.info("Generated transaction_id: %s at timestamp: %s", transaction_id, timestamp)
 
                 # トランザクションアイテムの準備
@@ -129,71 +315,83 @@ class DynamoDBManager:
                     'Update': {
                         'TableName': self.users_table.name,
                         'Key': {'user_id': from_user},
-                        'UpdateExpression': 'SET daily_points_given = if_not_exists(daily_points_given, :zero) + :points',
+                        'UpdateExpression': (
+                            'SET daily_points_given = if_not_exists(daily_points_given, :zero) + :points '
+                            f'{INVALIDATE_HISTORY}'
+                        ),
                         'ConditionExpression': 'attribute_not_exists(daily_points_given) OR daily_points_given = :current_daily_points',
                         'ExpressionAttributeValues': {
                             ':zero': 0,
                             ':points': len(to_users),
                             #':maxDaily': 5,
                             ':current_daily_points': daily_points_given,
+                            ':one': 1,
                         }
                     }
                 })
                 logger.info("Prepared transaction item for sender: %s with daily_points_given: %d", from_user, daily_points_given)
 
-                # 各受信者へのポイント付与アイテム
-                for to_user in to_users:
-                    receiver_data: UserInfo = self.get_user_data(to_user)
-                    current_points = receiver_data.total_points
-                    
-                    transact_items.append({
-                        'Update': {
-                            'TableName': self.users_table.name,
-                            'Key': {'user_id': to_user},
-                            'UpdateExpression': 'SET total_points = if_not_exists(total_points, :zero) + :points',
-                            'ConditionExpression': 'attribute_not_exists(total_points) OR total_points = :current_points',
-                            'ExpressionAttributeValues': {
-                                ':zero': 0,
-                                ':points': 1,
-                                ':current_points': current_points,
-                            }
-                        }
-                    })
-                    logger.info("Prepared transaction item for receiver: %s with total_points: %d", to_user, current_points)
+                # 各受信者へのポイント付与アイテム（チャンク分割時は後で書き込む）
+                if not chunked:
+                    transact_items.extend(self._receiver_item(to_user, 1) for to_user in to_users)
+                    logger.info("Prepared transaction items for receivers: %s", to_users)
 
-                # トランザクション記録アイテム
+                # トランザクション記録アイテム（lib.codec の形式で保存する）
+                record: Dict[str, Any] = {
+                    'transaction_id': transaction_id,
+                    'from_user': from_user,
+                    'to_users': to_users,
+                    'points': 1,
+                    'timestamp': timestamp,
+                    'message': message
+                }
+                if team_id:
+                    record['team_id'] = team_id
+                if channel_id:
+                    record['channel_id'] = channel_id
+                if chunked:
+                    # 送信者の上限の消費とヘッダーを同時に書き、受信者はチャンクごとに適用する
+                    record['status'] = GRANT_PENDING
+                # 記録は条件付きで書き込む（同じ要求の2回目は記録の条件で全体が取り消される）
                 transact_items.append({
                     'Put': {
                         'TableName': self.transactions_table.name,
-                        'Item': {
-                            'transaction_id': transaction_id,
-                            'from_user': from_user,
-                            'to_users': to_users,
-                            'points': 1,
-                            'timestamp': timestamp,
-                            'message': message
-                        }
+                        'Item': encode_transaction(record),
+                        'ConditionExpression': 'attribute_not_exists(transaction_id)'
                     }
                 })
                 logger.info("Prepared transaction record item")
 
                 # トランザクション実行
-                self.dynamodb.meta.client.transact_write_items(
+                self.client.transact_write_items(
                     TransactItems=transact_items
                 )
                 logger.info("Transaction executed successfully")
+                if chunked:
+                    return self._complete_grant(record, daily_points_given + len(to_users), metric)
 
+                self._on_grant_complete(record)
                 return {
                     'success': True,
                     'daily_points_given': daily_points_given + len(to_users),
                     'transaction_id': transaction_id
                 }
 
-            except self.dynamodb.meta.client.exceptions.TransactionCanceledException as e:
+            except self.client.exceptions.TransactionCanceledException as e:
+                reasons = e.response.get('CancellationReasons', [])
+                if request_id and len(reasons) == len(transact_items) \
+                        and reasons[-1].get('Code') == 'ConditionalCheckFailed':
+                    # 同じ要求が並行して先に書き込まれた
+                    existing = self._get_grant(transaction_id)
+                    if existing:
+                        return self._replayed_grant(existing, self._get_daily_points([from_user]).get(from_user, 0),
+                                                    metric)
                 attempt += 1
+                metric['retries'] = attempt
                 logger.warning(f"Transaction cancelled, retrying {attempt}/{max_retries}: {str(e)}")
                 if attempt >= max_retries:
                     logger.error("Max retries reached. Transaction failed.")
+                    metric['error'] = error_class(e)
                     return {
                         'success': False,
                         'error_message': 'トランザクションが競合により中断されました。再度お試しください。',
@@ -201,22 +399,545 @@ class DynamoDBManager:
                     }
             except Exception as e:
                 logger.error(f"Error adding points: {str(e)}")
+                metric['error'] = error_class(e)
                 return {
                     'success': False,
                     'error_message': 'データベース更新中にエラーが発生しました',
                     'daily_points_given': daily_points_given
                 }
 
-    def reset_daily_points(self, date: str) -> Dict[str, Any]:
-        """日次ポイントのリセット"""
+    def _on_grant_complete(self, record: Dict[str, Any]) -> None:
+        """付与の確定後の集計（チャンネルの件数と検索インデックス）。失敗しても付与は成功のまま"""
+        self._count_channel_thanks(record)
+        try:
+            self.index_message(record)
+        except Exception as e:
+            logger.error(f"Error indexing message: {str(e)}")
+
+    def _count_channel_thanks(self, record: Dict[str, Any]) -> None:
+        """付与の確定後に、チャンネルの通算と日ごとの件数に加算する
+
+        同じチャンネルへの付与が集中しても付与のトランザクションが競合しないよう、トランザクションの
+        外で ADD する。確定後・加算前に止まった場合はその1件が数えられない（集計用の値のため許容する）。
+        """
+        team_id, channel_id = record.get('team_id'), record.get('channel_id')
+        if not team_id or not channel_id:
+            return
+        points = len(record['to_users']) * int(record.get('points', 1))
+        day = record['timestamp'][:10]
+        try:
+            for scope, expires_at in ((f'{team_id}#all', None),
+                                      (f'{team_id}#{day}', int(time.time()) + CHANNEL_STATS_TTL_SECONDS)):
+                values: Dict[str, Any] = {':one': 1, ':points': points}
+                update = 'ADD thanks :one, points :points'
+                if expires_at:
+                    update = 'SET expires_at = :expires_at ' + update
+                    values[':expires_at'] = expires_at
+                self.channel_stats_table.update_item(
+                    Key={'scope': scope, 'channel_id': channel_id},
+                    UpdateExpression=update,
+                    ExpressionAttributeValues=values
+                )
+        except Exception as e:
+            logger.error(f"Error counting channel thanks: {str(e)}")
+
+    def top_channels(self, team_id: str, day: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """件数の多いチャンネル（scope-thanks-index の1回の Query）"""
+        scope = f'{team_id}#{day or "all"}'
+        items = self.channel_stats_table.query(
+            IndexName=CHANNEL_STATS_INDEX,
+            KeyConditionExpression=Key('scope').eq(scope),
+            ScanIndexForward=False,
+            Limit=limit
+        ).get('Items', [])
+        return [{'channel_id': item['channel_id'], 'thanks': int(item.get('thanks', 0)),
+                 'points': int(item.get('points', 0))} for item in items]
+
+    def index_message(self, record: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> None:
+        """検索インデックスの差分（previous にあって record にない索引語を消し、新しい索引語を書く）"""
+        current, stale = search.index_entries(record), search.index_entries(previous)
+        with self.search_table.batch_writer() as batch:
+            for term, posting in stale - current:
+                batch.delete_item(Key={'term': term, 'posting': posting})
+            for term, posting in current - stale:
+                batch.put_item(Item={'term': term, 'posting': posting, 'transaction_id': record['transaction_id']})
+
+    def unindex_message(self, record: Dict[str, Any]) -> None:
+        with self.search_table.batch_writer() as batch:
+            for term, posting in search.index_entries(record):
+                batch.delete_item(Key={'term': term, 'posting': posting})
+
+    def search_messages(self, team_id: str, user_id: str, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """索引語ごとの Query の積集合を新しい順に、BatchGetItem で本文を読んで照合する"""
+        candidates: Optional[set] = None
+        for term in search.query_terms(query):
+            postings = {item['posting'] for item in self._paginate(
+                self.search_table, 'query', KeyConditionExpression=Key('term').eq(f'{team_id}#{user_id}#{term}'),
+                ProjectionExpression='posting')}
+            candidates = postings if candidates is None else candidates & postings
+            if not candidates:
+                return []
+        results: List[Dict[str, Any]] = []
+        ordered = sorted(candidates or [], reverse=True)
+        for start in range(0, len(ordered), 100):
+            ids = [posting.split('#', 1)[1] for posting in ordered[start:start + 100]]
+            records = {record['transaction_id']: record for record in self._get_transactions(ids)}
+            for transaction_id in ids:
+                record = records.get(transaction_id)
+                if record and search.matches(record, query):
+                    results.append(search.search_result(record))
+                    if len(results) >= limit:
+                        return results
+        return results
+
+    def _get_transactions(self, transaction_ids: List[str]) -> List[Dict[str, Any]]:
+        request: Optional[Dict[str, Any]] = {self.transactions_table.name: {
+            'Keys': [{'transaction_id': transaction_id} for transaction_id in transaction_ids]}}
+        records: List[Dict[str, Any]] = []
+        while request:
+            response = self.client.batch_get_item(RequestItems=request)
+            records.extend(decode_transaction(item)
+                           for item in response.get('Responses', {}).get(self.transactions_table.name, []))
+            request = response.get('UnprocessedKeys') or None
+        return records
+
+    def _read_sender_and_grant(self, from_user: str,
+                               transaction_id: str) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """送信者の日次ポイントと同じ要求の記録（あれば）を、1回の BatchGetItem で強い整合性で読む"""
+        request: Optional[Dict[str, Any]] = {
+            self.users_table.name: {
+                'Keys': [{'user_id': from_user}],
+                'ProjectionExpression': 'daily_points_given',
+                'ConsistentRead': True
+            },
+            self.transactions_table.name: {
+                'Keys': [{'transaction_id': transaction_id}],
+                'ConsistentRead': True
+            }
+        }
+        responses: Dict[str, List[Dict[str, Any]]] = {}
+        while request:
+            response = self.client.batch_get_item(RequestItems=request)
+            for table_name, items in response.get('Responses', {}).items():
+                responses.setdefault(table_name, []).extend(items)
+            request = response.get('UnprocessedKeys') or None
+        sender_item = (responses.get(self.users_table.name) or [{}])[0]
+        grant = responses.get(self.transactions_table.name)
+        return sender_item, decode_transaction(grant[0]) if grant else None
+
+    def _replayed_grant(self, record: Dict[str, Any], daily_points_given: int,
+                        metric: Dict[str, Any]) -> Dict[str, Any]:
+        """書き込み済みの要求の結果（途中で止まったチャンク分割の付与は続きを適用する）"""
+        logger.info("Grant already recorded for this request: %s", record['transaction_id'])
+        status = record.get('status')
+        if status == GRANT_PENDING:
+            result = self._complete_grant(record, daily_points_given, metric)
+        elif status in (GRANT_ROLLING_BACK, GRANT_ROLLED_BACK):
+            result = {
+                'success': False,
+                'error_message': 'データベース更新中にエラーが発生しました',
+                'daily_points_given': daily_points_given
+            }
+        else:
+            result = {
+                'success': True,
+                'daily_points_given': daily_points_given,
+                'transaction_id': record['transaction_id']
+            }
+        result['duplicate'] = True
+        return result
+
+    def _receiver_item(self, to_user: str, points: int) -> Dict[str, Any]:
+        """受信者の加算アイテム
+
+        受信者は複数の送信者から同時に加算されうるため、読み取りと条件を使わずアトミックな ADD で更新する。
+        """
+        return {
+            'Update': {
+                'TableName': self.users_table.name,
+                'Key': {'user_id': to_user},
+                'UpdateExpression': f'{INVALIDATE_HISTORY}, total_points :points',
+                'ExpressionAttributeValues': {
+                    ':points': points,
+                    ':one': 1,
+                }
+            }
+        }
+
+    @staticmethod
+    def _grant_chunks(to_users: List[str]) -> List[List[str]]:
+        """ヘッダーの受信者をチャンクに分ける（ヘッダーの確認とマーカーの2アイテムを除いた数ずつ）"""
+        size = MAX_TRANSACT_ITEMS - 2
+        return [to_users[start:start + size] for start in range(0, len(to_users), size)]
+
+    def _get_grant(self, grant_id: str) -> Optional[Dict[str, Any]]:
+        item = self.transactions_table.get_item(Key={'transaction_id': grant_id}, ConsistentRead=True).get('Item')
+        return decode_transaction(item) if item else None
+
+    def _complete_grant(self, header: Dict[str, Any], daily_points_given: int,
+                        metric: Dict[str, Any]) -> Dict[str, Any]:
+        grant_id = header['transaction_id']
+        if self.resume_grant(grant_id, header):
+            self._on_grant_complete(header)
+            return {
+                'success': True,
+                'daily_points_given': daily_points_given,
+                'transaction_id': grant_id,
+                'chunks': len(self._grant_chunks(header['to_users']))
+            }
+        metric['error'] = 'GrantIncomplete'
+        if self.rollback_grant(grant_id):
+            return {
+                'success': False,
+                'error_message': 'データベース更新中にエラーが発生しました',
+                'daily_points_given': daily_points_given - len(header['to_users'])
+            }
+        # 取り消しも完了できなかった場合は grant_id から再開・取り消しできる
+        logger.error("Grant left pending: %s", grant_id)
+        return {
+            'success': False,
+            'error_message': 'データベース更新中にエラーが発生しました',
+            'daily_points_given': daily_points_given,
+            'transaction_id': grant_id
+        }
+
+    def _apply_grant_chunk(self, grant_id: str, index: int, recipients: List[str], points: int) -> bool:
+        """1チャンク分の受信者を加算（points=1）または取り消し（points=-1）する
+
+        マーカーアイテム {grant_id}#{index} の有無で適用済みかを判定するため、何度実行しても
+        1回分しか反映されない。ヘッダーの status も条件にし、取り消し開始後の適用を防ぐ。
+        """
+        applying = points > 0
+        marker_key = {'transaction_id': f'{grant_id}#{index}'}
+        items: List[Dict[str, Any]] = [{
+            'ConditionCheck': {
+                'TableName': self.transactions_table.name,
+                'Key': {'transaction_id': grant_id},
+                'ConditionExpression': '#status = :status',
+                'ExpressionAttributeNames': {'#status': 'status'},
+                'ExpressionAttributeValues': {':status': GRANT_PENDING if applying else GRANT_ROLLING_BACK}
+            }
+        }]
+        if applying:
+            items.append({'Put': {
+                'TableName': self.transactions_table.name,
+                'Item': dict(marker_key, grant_id=grant_id),
+                'ConditionExpression': 'attribute_not_exists(transaction_id)'
+            }})
+        else:
+            items.append({'Delete': {
+                'TableName': self.transactions_table.name,
+                'Key': marker_key,
+                'ConditionExpression': 'attribute_exists(transaction_id)'
+            }})
+        items.extend(self._receiver_item(to_user, points) for to_user in recipients)
+
+        for attempt in range(3):
+            try:
+                self.client.transact_write_items(TransactItems=items)
+                return True
+            except self.client.exceptions.TransactionCanceledException as e:
+                codes = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+                if len(codes) > 1 and codes[1] == 'ConditionalCheckFailed':
+                    # 適用済み（取り消し時は未適用）のチャンク
+                    return True
+                if codes and codes[0] == 'ConditionalCheckFailed':
+                    logger.warning("Grant %s is no longer %s", grant_id, 'pending' if applying else 'rolling back')
+                    return False
+                logger.warning("Grant chunk cancelled, retrying %d/3: %s#%d", attempt + 1, grant_id, index)
+            except Exception as e:
+                logger.error(f"Error applying grant chunk {grant_id}#{index}: {str(e)}")
+                return False
+        return False
+
+    def resume_grant(self, grant_id: str, header: Optional[Dict[str, Any]] = None) -> bool:
+        """チャンク分割した付与の未適用チャンクを並行に書き込み、完了にする（途中からの再開にも使う）"""
+        header = header or self._get_grant(grant_id)
+        if not header or header.get('status') not in (GRANT_PENDING, GRANT_COMPLETE):
+            return False
+        if header['status'] == GRANT_COMPLETE:
+            return True
+        chunks = self._grant_chunks(header['to_users'])
+        with ThreadPoolExecutor(max_workers=min(GRANT_CHUNK_WORKERS, len(chunks))) as executor:
+            applied = list(executor.map(lambda chunk: self._apply_grant_chunk(grant_id, chunk[0], chunk[1], 1),
+                                        enumerate(chunks)))
+        if not all(applied):
+            return False
         try:
-            # 全ユーザーのスキャン
-            response: Dict[str, Any] = self.users_table.scan()
-            users: List[Dict[str, Any]] = response['Items']
-            users_reset: int = 0
+            self.transactions_table.update_item(
+                Key={'transaction_id': grant_id},
+                UpdateExpression='SET #status = :complete',
+                ConditionExpression='#status = :pending',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':complete': GRANT_COMPLETE, ':pending': GRANT_PENDING}
+            )
+        except self.transactions_table.meta.client.exceptions.ConditionalCheckFailedException:
+            return self._get_grant(grant_id).get('status') == GRANT_COMPLETE
+        self._delete_grant_markers(grant_id, len(chunks))
+        logger.info("Grant completed: %s chunks=%d", grant_id, len(chunks))
+        return True
 
-            # バッチ更新用のアイテムリスト
-            for user in users:
+    def rollback_grant(self, grant_id: str) -> bool:
+        """チャンク分割した付与を取り消す（適用済みチャンクの減算と送信者の日次ポイントの返却）"""
+        header = self._get_grant(grant_id)
+        if not header or header.get('status') not in (GRANT_PENDING, GRANT_ROLLING_BACK, GRANT_ROLLED_BACK):
+            return False
+        if header['status'] == GRANT_ROLLED_BACK:
+            return True
+        names = {'#status': 'status'}
+        if header['status'] == GRANT_PENDING:
+            try:
+                self.transactions_table.update_item(
+                    Key={'transaction_id': grant_id},
+                    UpdateExpression='SET #status = :rolling_back',
+                    ConditionExpression='#status = :pending',
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues={':rolling_back': GRANT_ROLLING_BACK, ':pending': GRANT_PENDING}
+                )
+            except self.transactions_table.meta.client.exceptions.ConditionalCheckFailedException:
+                # 並行して完了した
+                return False
+        chunks = self._grant_chunks(header['to_users'])
+        if not all(self._apply_grant_chunk(grant_id, index, recipients, -1)
+                   for index, recipients in enumerate(chunks)):
+            return False
+        try:
+            self.client.transact_write_items(TransactItems=[
+                {'Update': {
+                    'TableName': self.users_table.name,
+                    'Key': {'user_id': header['from_user']},
+                    'UpdateExpression': f'{INVALIDATE_HISTORY}, daily_points_given :refund',
+                    'ExpressionAttributeValues': {':refund': -len(header['to_users']), ':one': 1}
+                }},
+                {'Update': {
+                    'TableName': self.transactions_table.name,
+                    'Key': {'transaction_id': grant_id},
+                    'UpdateExpression': 'SET #status = :rolled_back',
+                    'ConditionExpression': '#status = :rolling_back',
+                    'ExpressionAttributeNames': names,
+                    'ExpressionAttributeValues': {':rolled_back': GRANT_ROLLED_BACK,
+                                                  ':rolling_back': GRANT_ROLLING_BACK}
+                }},
+            ])
+        except self.client.exceptions.TransactionCanceledException as e:
+            logger.error(f"Error refunding grant {grant_id}: {str(e)}")
+            return self._get_grant(grant_id).get('status') == GRANT_ROLLED_BACK
+        logger.info("Grant rolled back: %s", grant_id)
+        return True
+
+    def _delete_grant_markers(self, grant_id: str, chunk_count: int) -> None:
+        with self.transactions_table.batch_writer() as batch:
+            for index in range(chunk_count):
+                batch.delete_item(Key={'transaction_id': f'{grant_id}#{index}'})
+
+    def pending_grants(self) -> List[Dict[str, Any]]:
+        """完了・取り消しのどちらも終わっていない付与（tools.grants で再開・取り消しする）"""
+        return [decode_transaction(item) for item in self._paginate(
+            self.transactions_table, 'scan',
+            FilterExpression=Attr('status').is_in([GRANT_PENDING, GRANT_ROLLING_BACK]),
+            ProjectionExpression=f"transaction_id, from_user, {SHORT_NAMES['from_user']}, v, #status, #ts",
+            ExpressionAttributeNames={'#status': 'status', '#ts': 'timestamp'})]
+
+    def add_reaction_points(self, window_id: str, grants: Dict[str, List[Tuple[str, str]]],
+                            message: str = '', team_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """リアクションによるポイント付与をウィンドウ単位でまとめて書き込む
+
+        grants は送信者ごとの (受信者, チャンネル:ts) のリストで、リアクションしたメッセージごとに
+        1ポイントの記録を書く。日次上限を超える分は切り捨てる。受信者ごとの加算は1アイテムに集約し、
+        アトミックな ADD で更新する。記録のIDはウィンドウ・送信者・メッセージから決まるため、再実行しても
+        二重付与にはならない。戻り値は送信者ごとの add_points 形式の結果（transaction_id は
+        送信者ごとの通知のIDに使う）。
+        """
+        with metrics.timed('grant', 'add_reaction_points') as metric:
+            return self._add_reaction_points(window_id, grants, message, team_id, metric)
+
+    def _add_reaction_points(self, window_id: str, grants: Dict[str, List[Tuple[str, str]]], message: str,
+                             team_id: Optional[str], metric: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        prefix = f"reaction#{window_id}#{team_id}" if team_id else f"reaction#{window_id}"
+        results: Dict[str, Dict[str, Any]] = {}
+        pending: Dict[str, List[Tuple[str, str]]] = {}
+        for from_user, reactions in grants.items():
+            recipients = [reaction for reaction in reactions if reaction[0] != from_user]
+            if recipients:
+                pending[from_user] = recipients
+            else:
+                results[from_user] = {'success': False, 'error_message': '送信者が受信者と同一でした'}
+
+        max_retries = 3
+        attempt = 0
+        while pending and attempt < max_retries:
+            daily_points = self._get_daily_points(list(pending))
+            chunk: List[Dict[str, Any]] = []
+            chunk_senders: Dict[str, List[Tuple[str, str]]] = {}
+            chunk_receivers: Dict[str, int] = {}
+            for from_user in sorted(pending):
+                daily_points_given = daily_points.get(from_user, 0)
+                allowed = pending[from_user][:max(DAILY_POINT_LIMIT - daily_points_given, 0)]
+                if not allowed:
+                    logger.warning("Daily points limit exceeded for user: %s", from_user)
+                    results[from_user] = {
+                        'success': False,
+                        'error_message': '本日の付与可能ポイントを超過しています',
+                        'daily_points_given': daily_points_given
+                    }
+                    del pending[from_user]
+                    continue
+                # メッセージごとの記録 + ユーザー更新が上限に収まらなければ次のトランザクションへ回す
+                touched = set(chunk_senders) | set(chunk_receivers) | {from_user} | {to for to, _ in allowed}
+                records = sum(len(reactions) for reactions in chunk_senders.values()) + len(allowed)
+                if chunk_senders and records + len(touched) > MAX_TRANSACT_ITEMS:
+                    continue
+                chunk_senders[from_user] = allowed
+                for to_user, _ in allowed:
+                    chunk_receivers[to_user] = chunk_receivers.get(to_user, 0) + 1
+
+            if not chunk_senders:
+                break
+
+            timestamp: str = datetime.now().isoformat(timespec='seconds')
+            record_index: Dict[str, int] = {}
+            for from_user, reactions in chunk_senders.items():
+                # 送信者の記録は同じトランザクションで書くので、最初の1件で書き込み済みかを判断する
+                record_index[from_user] = len(chunk)
+                for to_user, reacted in reactions:
+                    chunk.append({
+                        'Put': {
+                            'TableName': self.transactions_table.name,
+                            'Item': encode_transaction({
+                                'transaction_id': f"{prefix}#{from_user}#{to_user}#{reacted}",
+                                'from_user': from_user,
+                                'to_users': [to_user],
+                                'points': 1,
+                                'timestamp': timestamp,
+                                'message': message,
+                                'channel_id': reacted.split(':', 1)[0],
+                                'source': 'reaction',
+                                **({'team_id': team_id} if team_id else {})
+                            }),
+                            'ConditionExpression': 'attribute_not_exists(transaction_id)'
+                        }
+                    })
+            # 1トランザクションに同じキーは1回しか含められないため、ユーザーごとに1アイテムにまとめる
+            for user_id in dict.fromkeys(list(chunk_senders) + list(chunk_receivers)):
+                update: Dict[str, Any] = {
+                    'TableName': self.users_table.name,
+                    'Key': {'user_id': user_id},
+                    'ExpressionAttributeValues': {':one': 1}
+                }
+                set_clauses: List[str] = []
+                if user_id in chunk_senders:
+                    daily_points_given = daily_points.get(user_id, 0)
+                    set_clauses.append('daily_points_given = if_not_exists(daily_points_given, :zero) + :points')
+                    update['ConditionExpression'] = (
+                        'attribute_not_exists(daily_points_given) OR daily_points_given = :current_daily_points'
+                    )
+                    update['ExpressionAttributeValues'].update({
+                        ':zero': 0,
+                        ':points': len(chunk_senders[user_id]),
+                        ':current_daily_points': daily_points_given,
+                    })
+                if team_id:
+                    # 未登録の受信者もワークスペースのパーティションに入るようにする
+                    set_clauses.append('team_id = if_not_exists(team_id, :team_id)')
+                    update['ExpressionAttributeValues'][':team_id'] = team_id
+                expression = f"SET {', '.join(set_clauses)} " if set_clauses else ''
+                expression += INVALIDATE_HISTORY
+                if user_id in chunk_receivers:
+                    expression += ', total_points :received'
+                    update['ExpressionAttributeValues'][':received'] = chunk_receivers[user_id]
+                update['UpdateExpression'] = expression
+                chunk.append({'Update': update})
+
+            try:
+                self.client.transact_write_items(TransactItems=chunk)
+                logger.info("Reaction points committed: window=%s senders=%d receivers=%d",
+                            window_id, len(chunk_senders), len(chunk_receivers))
+                for from_user, reactions in chunk_senders.items():
+                    results[from_user] = {
+                        'success': True,
+                        'daily_points_given': daily_points.get(from_user, 0) + len(reactions),
+                        'transaction_id': f"{prefix}#{from_user}",
+                        'to_users': [to_user for to_user, _ in reactions]
+                    }
+                    del pending[from_user]
+            except self.client.exceptions.TransactionCanceledException as e:
+                reasons = e.response.get('CancellationReasons', [])
+                committed = [
+                    from_user for from_user, index in record_index.items()
+                    if len(reasons) > index and reasons[index].get('Code') == 'ConditionalCheckFailed'
+                ]
+                # トランザクション記録が既にある送信者は前回の実行で書き込み済み
+                for from_user in committed:
+                    logger.info("Reaction points already committed: window=%s from_user=%s", window_id, from_user)
+                    results[from_user] = {
+                        'success': True,
+                        'duplicate': True,
+                        'daily_points_given': daily_points.get(from_user, 0),
+                        'transaction_id': f"{prefix}#{from_user}",
+                        'to_users': [to_user for to_user, _ in chunk_senders[from_user]]
+                    }
+                    del pending[from_user]
+                if not committed:
+                    attempt += 1
+                    metric['retries'] = attempt
+                    logger.warning(f"Transaction cancelled, retrying {attempt}/{max_retries}: {str(e)}")
+            except Exception as e:
+                logger.error(f"Error adding reaction points: {str(e)}")
+                metric['error'] = error_class(e)
+                break
+
+        for from_user in pending:
+            results[from_user] = {
+                'success': False,
+                'error_message': 'トランザクションが競合により中断されました。再度お試しください。',
+                'retryable': True
+            }
+        return results
+
+    def _get_daily_points(self, user_ids: List[str]) -> Dict[str, int]:
+        """複数ユーザーの daily_points_given を BatchGetItem でまとめて取得"""
+        daily_points: Dict[str, int] = {}
+        for start in range(0, len(user_ids), 100):
+            request = {
+                self.users_table.name: {
+                    'Keys': [{'user_id': user_id} for user_id in user_ids[start:start + 100]],
+                    'ProjectionExpression': 'user_id, daily_points_given',
+                    'ConsistentRead': True
+                }
+            }
+            while request:
+                response = self.client.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.users_table.name, []):
+                    daily_points[item['user_id']] = int(item.get('daily_points_given', 0))
+                request = response.get('UnprocessedKeys') or None
+        return daily_points
+
+    def reset_daily_points(self, date: str, team_id: Optional[str] = None,
+                           unassigned: bool = False) -> Dict[str, Any]:
+        """日次ポイントのリセット
+
+        team_id を指定するとそのワークスペースのユーザーだけを読む。unassigned=True なら
+        team_id のないユーザーだけを読む（索引に載らないため Scan になる）。いずれの場合も
+        既に0のユーザーには書き込まず、書き込みは RESET_WORKERS 並列で行う。
+        """
+        try:
+            needs_reset = Attr('daily_points_given').gt(0)
+            if unassigned:
+                users = self._paginate(self.users_table, 'scan',
+                                       FilterExpression=Attr('team_id').not_exists() & needs_reset,
+                                       ProjectionExpression='user_id')
+            elif team_id:
+                users = self._paginate(self.users_table, 'query',
+                                       IndexName=USERS_TEAM_INDEX,
+                                       KeyConditionExpression=Key('team_id').eq(team_id),
+                                       FilterExpression=needs_reset,
+                                       ProjectionExpression='user_id')
+            else:
+                users = self._paginate(self.users_table, 'scan',
+                                       FilterExpression=needs_reset,
+                                       ProjectionExpression='user_id')
+
+            def reset(user: Dict[str, Any]) -> None:
                 self.users_table.update_item(
                     Key={'user_id': user['user_id']},
                     UpdateExpression="SET daily_points_given = :zero, last_reset_date = :date",
@@ -225,7 +946,10 @@ class DynamoDBManager:
                         ':date': date
                     }
                 )
-                users_reset += 1
+
+            # 読みながら書き込みを並行に流す（1件ずつ待つと対象ユーザー数に比例して遅くなる）
+            with ThreadPoolExecutor(max_workers=RESET_WORKERS) as executor:
+                users_reset: int = sum(1 for _ in executor.map(reset, users))
 
             return {
                 'success': True,
@@ -239,22 +963,13 @@ class DynamoDBManager:
                 'error_message': str(e)
             }
 
-    def get_points_history(self, user_id: str) -> Dict[str, List[Dict[str, Any]]]:
+    def get_points_history(self, user_id: str, team_id: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
         """ポイント履歴の取得"""
         try:
-            # 受け取ったポイントの履歴
-            received: Dict[str, Any] = self.transactions_table.scan(
-                FilterExpression=Attr('to_users').contains(user_id)
-            )
-
-            # 送信したポイントの履歴
-            sent: Dict[str, Any] = self.transactions_table.scan(
-                FilterExpression=Attr('from_user').eq(user_id)
-            )
-
+            transactions = self._team_transactions(user_id, team_id)
             return {
-                'received': received['Items'],
-                'sent': sent['Items']
+                'received': [tx for tx in transactions if user_id in tx['to_users']],
+                'sent': [tx for tx in transactions if tx['from_user'] == user_id]
             }
 
         except Exception as e:
@@ -275,44 +990,248 @@ class DynamoDBManager:
             existing_user_data: Optional[UserInfo] = self.get_user_data(user_info.user_id)
             
 
-            # 既存のデータがある場合は更新、ない場合は新規登録
+            # 既存のデータがある場合は変わった属性だけを更新、ない場合は新規登録
+            # ポイントは付与と並行して ADD で更新されるため、プロフィールの更新では書き込まない
             if existing_user_data :
-                user_info.total_points = existing_user_data.total_points
-                user_info.daily_points_given = existing_user_data.daily_points_given
+                changed: Dict[str, Any] = {
+                    name: getattr(user_info, name) for name in _PROFILE_FIELDS
+                    if getattr(user_info, name) != getattr(existing_user_data, name)
+                }
+                if not changed:
+                    logger.info("User profile unchanged for user_id: %s", user_info.user_id)
+                    return
                 self.users_table.update_item(
                     Key={'user_id': user_info.user_id},
-                    UpdateExpression=(
-                        "SET team_id = :team_id, "
-                        "user_name = :user_name, "
-                        "real_name = :real_name, "
-                        "display_name = :display_name, "
-                        "email = :email, "
-                        "total_points = :total_points, "
-                        "daily_points_given = :daily_points_given"
-                    ),
-                    ExpressionAttributeValues={
-                        ':team_id': user_info.team_id,
-                        ':user_name': user_info.user_name,
-                        ':real_name': user_info.real_name,
-                        ':display_name': user_info.display_name,
-                        ':email': user_info.email,
-                        ':total_points': user_info.total_points,
-                        ':daily_points_given': user_info.daily_points_given
-                    }
+                    UpdateExpression='SET ' + ', '.join(f'#{name} = :{name}' for name in changed),
+                    ExpressionAttributeNames={f'#{name}': name for name in changed},
+                    ExpressionAttributeValues={f':{name}': value for name, value in changed.items()}
                 )
             else:
                 self.users_table.put_item(
                     Item=user_info.to_dict()
                 )
+            profile_cache.invalidate((self.stack_name, user_info.user_id))
             logger.info("User profile saved/updated for user_id: %s", user_info.user_id)
         except Exception as e:
             logger.error(f"Error saving/updating user profile: {str(e)}")
 
     def get_users_data(self, user_ids: List[str]) -> List[Optional[UserInfo]]:
-        """複数のユーザー情報を取得"""
+        """複数のユーザー情報を取得
+
+        名前の表示用。PROFILE_CACHE_TTL 秒キャッシュするためポイントは最新とは限らない。
+        """
         users_data = []
         for user_id in user_ids:
-            user_data: Optional[UserInfo] = self.get_user_data(user_id)
+            user_data: Optional[UserInfo] = profile_cache.get_or_load(
+                (self.stack_name, user_id), lambda: self.get_user_data(user_id))
             if user_data:
                 users_data.append(user_data)
-        return users_data
\ No newline at end of file
+        return users_data
+
+    def put_reaction(self, item: Dict[str, Any]) -> None:
+        """リアクションをバッファに保存"""
+        self.reactions_table.put_item(Item=item)
+
+    def delete_reaction(self, window_id: str, reaction_key: str) -> None:
+        self.reactions_table.delete_item(Key={'window_id': window_id, 'reaction_key': reaction_key})
+
+    def get_reactions(self, max_window_id: str) -> List[Dict[str, Any]]:
+        """閉じたウィンドウのリアクション（バッファは短命で小さいため Scan で拾う）"""
+        return list(self._paginate(self.reactions_table, 'scan',
+                                   FilterExpression=Attr('window_id').lte(max_window_id)))
+
+    def delete_reactions(self, items: List[Dict[str, Any]]) -> None:
+        with self.reactions_table.batch_writer() as batch:
+            for item in items:
+                batch.delete_item(Key={'window_id': item['window_id'], 'reaction_key': item['reaction_key']})
+
+    def get_history_snapshot(self, user_id: str) -> Dict[str, Any]:
+        """ユーザーの history_version と -history のスナップショットを1回の BatchGetItem で取得
+
+        付与直後でも古い内容を返さないよう強い整合性で読み、版の一致しないスナップショットは返さない。
+        """
+        request: Optional[Dict[str, Any]] = {
+            self.users_table.name: {
+                'Keys': [{'user_id': user_id}],
+                'ProjectionExpression': 'history_version',
+                'ConsistentRead': True
+            },
+            self.history_table.name: {
+                'Keys': [{'user_id': user_id}],
+                'ConsistentRead': True
+            }
+        }
+        responses: Dict[str, List[Dict[str, Any]]] = {}
+        while request:
+            response = self.client.batch_get_item(RequestItems=request)
+            for table_name, items in response.get('Responses', {}).items():
+                responses.setdefault(table_name, []).extend(items)
+            request = response.get('UnprocessedKeys') or None
+        user_item = (responses.get(self.users_table.name) or [{}])[0]
+        snapshot = (responses.get(self.history_table.name) or [{}])[0]
+        version = int(user_item.get('history_version', 0))
+        if int(snapshot.get('version', -1)) != version:
+            return {'version': version, 'text': None, 'cached_at': 0}
+        return {
+            'version': version,
+            'text': snapshot.get('text'),
+            'cached_at': int(snapshot.get('cached_at', 0))
+        }
+
+    def save_history_snapshot(self, user_id: str, version: int, text: str) -> bool:
+        """読み取った時点から付与がなかった場合だけスナップショットを -history に保存"""
+        condition = 'attribute_exists(user_id) AND '
+        condition += 'history_version = :version' if version else 'attribute_not_exists(history_version)'
+        check: Dict[str, Any] = {
+            'TableName': self.users_table.name,
+            'Key': {'user_id': user_id},
+            'ConditionExpression': condition,
+        }
+        if version:
+            check['ExpressionAttributeValues'] = {':version': version}
+        try:
+            self.client.transact_write_items(TransactItems=[
+                {'ConditionCheck': check},
+                {'Put': {
+                    'TableName': self.history_table.name,
+                    'Item': {'user_id': user_id, 'version': version, 'text': text, 'cached_at': int(time.time())}
+                }}
+            ])
+            return True
+        except self.client.exceptions.TransactionCanceledException:
+            logger.info("History snapshot is stale, not saved: user_id=%s", user_id)
+            return False
+
+    def iter_team_transactions(self, team_id: str, since: str, until: str,
+                               cursor: Optional[Dict[str, Any]] = None,
+                               page_size: int = 500) -> Iterator[Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """ワークスペースの期間内のトランザクションを GSI のページ単位で読む（カーソルは LastEvaluatedKey）"""
+        kwargs: Dict[str, Any] = {
+            'IndexName': TRANSACTIONS_TEAM_INDEX,
+            'KeyConditionExpression': Key('team_id').eq(team_id) & Key('timestamp').between(since, until),
+            'FilterExpression': Attr('status').not_exists() | Attr('status').eq(GRANT_COMPLETE),
+            'Limit': page_size,
+        }
+        if cursor:
+            kwargs['ExclusiveStartKey'] = cursor
+        while True:
+            response: Dict[str, Any] = self.transactions_table.query(**kwargs)
+            cursor = response.get('LastEvaluatedKey')
+            yield [decode_transaction(item) for item in response.get('Items', [])], cursor
+            if not cursor:
+                return
+            kwargs['ExclusiveStartKey'] = cursor
+
+    def get_job_state(self, job_id: str) -> Optional[Dict[str, Any]]:
+        item: Optional[Dict[str, Any]] = self.jobs_table.get_item(
+            Key={'job_id': job_id}, ConsistentRead=True).get('Item')
+        return json.loads(item['state']) if item else None
+
+    def save_job_state(self, job_id: str, state: Dict[str, Any], ttl_seconds: int = 14 * 24 * 60 * 60) -> None:
+        """途中経過は JSON 文字列で保存する（Decimal への変換や入れ子の型を気にしなくてよい）"""
+        now = int(time.time())
+        self.jobs_table.put_item(Item={
+            'job_id': job_id,
+            'state': json.dumps(state, ensure_ascii=False, default=str),
+            'updated_at': now,
+            'expires_at': now + ttl_seconds,
+        })
+
+    def add_usage(self, period: str, usage: Dict[str, Dict[str, float]]) -> None:
+        """ワークスペースごとに1回の ADD（カウンター名は Slack のメソッド名などを含むため名前を置き換える）"""
+        expires_at = int(time.time()) + USAGE_TTL_SECONDS
+        for team_id, counters in usage.items():
+            names = {f'#c{index}': name for index, name in enumerate(counters)}
+            values: Dict[str, Any] = {f':c{index}': Decimal(str(round(value, 3)))
+                                      for index, value in enumerate(counters.values())}
+            values[':expires_at'] = expires_at
+            self.metering_table.update_item(
+                Key={'team_id': team_id, 'period': period},
+                UpdateExpression='SET expires_at = :expires_at ADD ' + ', '.join(
+                    f'{name} :c{index}' for index, name in enumerate(names)),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+
+    @staticmethod
+    def _outbox_item(item: Dict[str, Any]) -> Dict[str, Any]:
+        return {name: int(value) if name in _OUTBOX_NUMBERS else value for name, value in item.items()}
+
+    def enqueue_outbox(self, items: List[Dict[str, Any]]) -> int:
+        """1件ずつ条件付きの PutItem（再配信で積み直しても既にある通知は上書きしない）"""
+        added = 0
+        for item in items:
+            try:
+                self.outbox_table.put_item(Item=item, ConditionExpression='attribute_not_exists(outbox_id)')
+                added += 1
+            except self.outbox_table.meta.client.exceptions.ConditionalCheckFailedException:
+                logger.info("Outbox item already exists: %s", item['outbox_id'])
+        return added
+
+    def due_outbox(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        """状態ごとに state-due_at-index を1回ずつ Query する"""
+        items: List[Dict[str, Any]] = []
+        for state in ('pending', 'sending'):
+            items.extend(self.outbox_table.query(
+                IndexName=OUTBOX_DUE_INDEX,
+                KeyConditionExpression=Key('state').eq(state) & Key('due_at').lte(int(now)),
+                Limit=limit
+            ).get('Items', []))
+        items.sort(key=lambda item: item['due_at'])
+        return [self._outbox_item(item) for item in items[:limit]]
+
+    def update_outbox(self, outbox_id: str, state: str, attempts: int, changes: Dict[str, Any]) -> bool:
+        names: Dict[str, str] = {'#state': 'state'}
+        values: Dict[str, Any] = {':expected_state': state, ':expected_attempts': attempts}
+        sets: List[str] = []
+        removes: List[str] = []
+        for index, (name, value) in enumerate(changes.items()):
+            names[f'#a{index}'] = name
+            if value is None:
+                removes.append(f'#a{index}')
+            else:
+                values[f':v{index}'] = value
+                sets.append(f'#a{index} = :v{index}')
+        expression = ' '.join(part for part in (
+            'SET ' + ', '.join(sets) if sets else '', 'REMOVE ' + ', '.join(removes) if removes else '') if part)
+        try:
+            self.outbox_table.update_item(
+                Key={'outbox_id': outbox_id},
+                UpdateExpression=expression,
+                ConditionExpression='#state = :expected_state AND attempts = :expected_attempts',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+            return True
+        except self.outbox_table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def list_outbox(self, state: str, limit: int = 100) -> List[Dict[str, Any]]:
+        items = self.outbox_table.query(
+            IndexName=OUTBOX_DUE_INDEX,
+            KeyConditionExpression=Key('state').eq(state),
+            Limit=limit
+        ).get('Items', [])
+        return [self._outbox_item(item) for item in items]
+
+    def count_requests(self, key: str, bucket: int, ttl_seconds: int) -> Tuple[int, int]:
+        """1回の UpdateItem で加算し、直前の区間の件数も読む（区間ごとの属性 b{区間番号} を持ち、2つ前は消す）"""
+        current, previous = f'b{bucket}', f'b{bucket - 1}'
+        attributes: Dict[str, Any] = self.rate_limits_table.update_item(
+            Key={'limit_key': key},
+            UpdateExpression='SET expires_at = :expires_at ADD #current :one REMOVE #stale',
+            ExpressionAttributeNames={'#current': current, '#stale': f'b{bucket - 2}'},
+            ExpressionAttributeValues={':expires_at': int(time.time()) + ttl_seconds, ':one': 1},
+            ReturnValues='ALL_NEW'
+        ).get('Attributes', {})
+        return int(attributes.get(current, 0)), int(attributes.get(previous, 0))
+
+    def get_usage(self, periods: List[str]) -> List[Dict[str, Any]]:
+        usage: List[Dict[str, Any]] = []
+        for period in periods:
+            for item in self._paginate(self.metering_table, 'query', IndexName=METERING_PERIOD_INDEX,
+                                       KeyConditionExpression=Key('period').eq(period)):
+                item.pop('expires_at', None)
+                usage.append({name: float(value) if isinstance(value, Decimal) else value
+                              for name, value in item.items()})
+        return usage
@@ -0,0 +1,234 @@
+import os
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Callable, Tuple
+
+from lib.storage import Storage
+from lib.metrics import metrics
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# 集計で保持する送信者・受信者・チャンネルの数（これを超えると回数の少ないものから置き換える）
+DIGEST_COUNTER_CAPACITY: int = int(os.environ.get('DIGEST_COUNTER_CAPACITY', '200'))
+# 投稿に載せる順位の数とハイライトの数
+DIGEST_TOP_N: int = int(os.environ.get('DIGEST_TOP_N', '5'))
+DIGEST_HIGHLIGHTS: int = int(os.environ.get('DIGEST_HIGHLIGHTS', '3'))
+# 1回の query で読む件数（ページごとに途中経過を保存する）
+DIGEST_PAGE_SIZE: int = int(os.environ.get('DIGEST_PAGE_SIZE', '500'))
+# ハイライトに保存するメッセージの最大文字数
+HIGHLIGHT_MAX_CHARS = 200
+
+# ジョブの状態
+DIGEST_SCANNING = 'scanning'
+DIGEST_POSTING = 'posting'
+DIGEST_DONE = 'done'
+
+# run() の結果
+RESULT_POSTED = 'posted'
+RESULT_ALREADY_POSTED = 'already_posted'
+RESULT_SUSPENDED = 'suspended'
+
+
+def digest_period(now: datetime) -> Dict[str, str]:
+    """now までの7日間と週のID（ISO 週番号。同じ週の再実行は同じジョブになる）"""
+    year, week, _ = now.isocalendar()
+    return {
+        'week_id': f'{year}-W{week:02d}',
+        'since': (now - timedelta(days=7)).isoformat(),
+        'until': now.isoformat(),
+    }
+
+
+class TopCounter:
+    """上位だけを数えるカウンター（Space-Saving）
+
+    キーの数が capacity を超えると、回数が最小のキーを新しいキーで置き換え、最小の回数を
+    引き継ぐ。メモリはワークスペースの規模によらず capacity 件分で、上位のキーの回数は
+    capacity が十分大きければ正確になる（置き換えが起きなければ常に正確）。
+    """
+
+    def __init__(self, capacity: int = DIGEST_COUNTER_CAPACITY,
+                 counts: Optional[Dict[str, int]] = None) -> None:
+        self.capacity = capacity
+        self.counts: Dict[str, int] = dict(counts or {})
+
+    def add(self, key: str, count: int = 1) -> None:
+        if key in self.counts or len(self.counts) < self.capacity:
+            self.counts[key] = self.counts.get(key, 0) + count
+            return
+        smallest = min(self.counts, key=self.counts.__getitem__)
+        self.counts[key] = self.counts.pop(smallest) + count
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        return heapq.nlargest(n, self.counts.items(), key=lambda kv: (kv[1], kv[0]))
+
+
+class DigestAggregator:
+    """1週間分のトランザクションを1件ずつ受け取り、ダイジェストの材料だけを保持する
+
+    to_state() / from_state() で JSON に変換でき、ページの途中で中断しても続きから集計できる。
+    """
+
+    def __init__(self, capacity: int = DIGEST_COUNTER_CAPACITY, highlights: int = DIGEST_HIGHLIGHTS,
+                 state: Optional[Dict[str, Any]] = None) -> None:
+        state = state or {}
+        self.receivers = TopCounter(capacity, state.get('receivers'))
+        self.senders = TopCounter(capacity, state.get('senders'))
+        self.channels = TopCounter(capacity, state.get('channels'))
+        self.max_highlights = highlights
+        self.highlights: List[Dict[str, Any]] = list(state.get('highlights', []))
+        self.transactions: int = state.get('transactions', 0)
+        self.points: int = state.get('points', 0)
+
+    def add(self, transaction: Dict[str, Any]) -> None:
+        to_users: List[str] = list(transaction.get('to_users', []))
+        points = int(transaction.get('points', 1))
+        self.transactions += 1
+        self.points += points * len(to_users)
+        for to_user in to_users:
+            self.receivers.add(to_user, points)
+        self.senders.add(transaction['from_user'], points * len(to_users))
+        if transaction.get('channel_id'):
+            self.channels.add(transaction['channel_id'])
+        if transaction.get('message'):
+            self._add_highlight(transaction, to_users)
+
+    @staticmethod
+    def _highlight_rank(highlight: Dict[str, Any]) -> Tuple[int, int, str]:
+        # 受信者の多いメッセージ、同数なら長いメッセージを優先
+        return len(highlight['to_users']), len(highlight['message']), highlight['timestamp']
+
+    def _add_highlight(self, transaction: Dict[str, Any], to_users: List[str]) -> None:
+        highlight = {
+            'from_user': transaction['from_user'],
+            'to_users': to_users[:DIGEST_TOP_N],
+            'message': transaction['message'][:HIGHLIGHT_MAX_CHARS],
+            'channel_id': transaction.get('channel_id'),
+            'timestamp': str(transaction.get('timestamp', '')),
+        }
+        self.highlights.append(highlight)
+        if len(self.highlights) > self.max_highlights:
+            self.highlights.remove(min(self.highlights, key=self._highlight_rank))
+
+    def to_state(self) -> Dict[str, Any]:
+        return {
+            'receivers': self.receivers.counts,
+            'senders': self.senders.counts,
+            'channels': self.channels.counts,
+            'highlights': self.highlights,
+            'transactions': self.transactions,
+            'points': self.points,
+        }
+
+    def summary(self, top_n: int = DIGEST_TOP_N) -> Dict[str, Any]:
+        return {
+            'transactions': self.transactions,
+            'points': self.points,
+            'top_receivers': self.receivers.top(top_n),
+            'top_senders': self.senders.top(top_n),
+            'top_channels': self.channels.top(top_n),
+            'highlights': sorted(self.highlights, key=self._highlight_rank, reverse=True),
+        }
+
+
+def _ranking(rows: List[Tuple[str, int]], mention: str, unit: str) -> str:
+    medals = ['🥇', '🥈', '🥉']
+    lines = [f"{medals[i] if i < len(medals) else f'{i + 1}.'} {mention.format(key)}  {count}{unit}"
+             for i, (key, count) in enumerate(rows)]
+    return '\n'.join(lines) or 'まだありません'
+
+
+def build_digest_blocks(summary: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+    """ダイジェストの Block Kit と通知用の代替テキスト（ユーザー名・チャンネル名は Slack 側で表示）"""
+    text = f"今週のありがとう: {summary['transactions']}件・{summary['points']}ポイント"
+    blocks: List[Dict[str, Any]] = [
+        {'type': 'header', 'text': {'type': 'plain_text', 'text': '🙏 今週のありがとう'}},
+        {'type': 'context', 'elements': [{'type': 'mrkdwn', 'text':
+            f"この1週間で *{summary['transactions']}件* の感謝、*{summary['points']}ポイント* が贈られました"}]},
+        {'type': 'section', 'fields': [
+            {'type': 'mrkdwn', 'text': '*受け取った人*\n' + _ranking(summary['top_receivers'], '<@{}>', 'pt')},
+            {'type': 'mrkdwn', 'text': '*贈った人*\n' + _ranking(summary['top_senders'], '<@{}>', 'pt')},
+        ]},
+    ]
+    if summary['top_channels']:
+        blocks.append({'type': 'section', 'text': {'type': 'mrkdwn', 'text':
+            '*感謝が多かったチャンネル*\n' + _ranking(summary['top_channels'], '<#{}>', '件')}})
+    if summary['highlights']:
+        blocks.append({'type': 'divider'})
+        for highlight in summary['highlights']:
+            to_users = ' '.join(f'<@{user}>' for user in highlight['to_users'])
+            where = f" in <#{highlight['channel_id']}>" if highlight.get('channel_id') else ''
+            blocks.append({'type': 'section', 'text': {'type': 'mrkdwn', 'text':
+                f"<@{highlight['from_user']}> → {to_users}{where}\n> {highlight['message']}"}})
+    return text, blocks
+
+
+class WeeklyDigest:
+    """ワークスペースごとの週次ダイジェストを、トランザクションを1回だけ読んで作成・投稿する
+
+    ジョブ {digest#チーム#週} の途中経過（読み取り位置・集計・投稿済みチャンネル）を
+    ページごとに保存する。時間切れで中断しても、次の実行が続きから集計・投稿するため、
+    読み直しも二重投稿も起きない。
+    """
+
+    def __init__(self, storage: Storage, page_size: int = DIGEST_PAGE_SIZE,
+                 capacity: int = DIGEST_COUNTER_CAPACITY, highlights: int = DIGEST_HIGHLIGHTS) -> None:
+        self.storage = storage
+        self.page_size = page_size
+        self.capacity = capacity
+        self.highlights = highlights
+
+    @staticmethod
+    def job_id(team_id: str, week_id: str) -> str:
+        return f'digest#{team_id}#{week_id}'
+
+    def run(self, team_id: str, period: Dict[str, str], channels: List[str],
+            post: Callable[[str, str, List[Dict[str, Any]]], bool],
+            has_time: Callable[[], bool] = lambda: True) -> str:
+        """集計して channels に投稿する。has_time() が False になったら保存して中断する"""
+        job_id = self.job_id(team_id, period['week_id'])
+        state: Dict[str, Any] = self.storage.get_job_state(job_id) or {
+            'status': DIGEST_SCANNING, 'since': period['since'], 'until': period['until'],
+            'cursor': None, 'aggregate': {}, 'posted': [], 'failed': [],
+        }
+        if state['status'] == DIGEST_DONE:
+            return RESULT_ALREADY_POSTED
+
+        aggregator = DigestAggregator(self.capacity, self.highlights, state['aggregate'])
+        if state['status'] == DIGEST_SCANNING:
+            if state['cursor']:
+                logger.info("ダイジェストの集計を再開: job_id=%s", job_id)
+            pages = self.storage.iter_team_transactions(team_id, state['since'], state['until'],
+                                                        cursor=state['cursor'], page_size=self.page_size)
+            for page, cursor in pages:
+                for transaction in page:
+                    aggregator.add(transaction)
+                state['cursor'] = cursor
+                state['aggregate'] = aggregator.to_state()
+                if cursor is None:
+                    break
+                self.storage.save_job_state(job_id, state)
+                metrics.record('digest', 'page')
+                if not has_time():
+                    logger.info("時間切れのためダイジェストの集計を中断: job_id=%s", job_id)
+                    return RESULT_SUSPENDED
+            state['status'] = DIGEST_POSTING
+            self.storage.save_job_state(job_id, state)
+
+        text, blocks = build_digest_blocks(aggregator.summary())
+        for channel_id in channels:
+            if channel_id in state['posted'] or channel_id in state['failed']:
+                continue
+            if not has_time():
+                return RESULT_SUSPENDED
+            # 投稿できなかったチャンネル（Bot 未参加など）は再試行しない
+            state['posted' if post(channel_id, text, blocks) else 'failed'].append(channel_id)
+            self.storage.save_job_state(job_id, state)
+
+        state['status'] = DIGEST_DONE
+        self.storage.save_job_state(job_id, state)
+        logger.info("ダイジェストを投稿: job_id=%s, posted=%s, failed=%s", job_id, state['posted'], state['failed'])
+        return RESULT_POSTED
@@ -0,0 +1,110 @@
+import threading
+import logging
+from collections import Counter
+from typing import Dict, Any, Optional, Iterable, Callable, List, Tuple
+
+from lib.cache import TTLCache, ttl_from_env
+from lib.gratitude import matcher_for_workspace
+from lib.metrics import metrics
+from lib.reactions import is_thanks_reaction
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# event_handler が処理するイベント
+SUPPORTED_EVENTS = frozenset({
+    'app_home_opened', 'message', 'reaction_added', 'reaction_removed',
+    'app_installed', 'team_join', 'user_profile_change',
+})
+REACTION_EVENTS = frozenset({'reaction_added', 'reaction_removed'})
+
+# 人が書いた通常のメッセージとして扱う subtype（None は subtype なし）
+MESSAGE_SUBTYPES = frozenset({None, 'thread_broadcast', 'file_share'})
+
+# 判定の順番（安いものから）
+STAGES = ('event_type', 'subtype', 'bot', 'channel', 'mention', 'phrase', 'reaction')
+
+
+class EventPrefilter:
+    """ペイロードだけで処理不要なイベントを破棄する前段フィルター
+
+    DynamoDB・Slack を呼ぶ前に、STAGES の順に判定して最初に不要と判定した段の名前を返す。
+    感謝フレーズ・感謝リアクションの判定はワークスペースの設定が必要なため、
+    event_handler が読み込んだ設定を覚えておき、覚えていないワークスペースでは判定せず通す
+    （後段の通常の判定に任せる）。段ごとの破棄数は drops と metrics（event_filter / 段名）に出す。
+    """
+
+    def __init__(self, stages: Iterable[str] = STAGES, channel_allowlist: Optional[Iterable[str]] = None,
+                 workspace_ttl: Optional[float] = None) -> None:
+        if isinstance(channel_allowlist, str):
+            channel_allowlist = [channel.strip() for channel in channel_allowlist.split(',')]
+        self.channel_allowlist = frozenset(filter(None, channel_allowlist or [])) or None
+        self.stages: List[Tuple[str, Callable[[Dict[str, Any], Optional[str]], bool]]] = [
+            (name, getattr(self, f'_keep_{name}')) for name in stages
+        ]
+        if workspace_ttl is None:
+            workspace_ttl = ttl_from_env('WORKSPACE_CACHE_TTL', 60)
+        self._workspaces = TTLCache(maxsize=256, ttl=workspace_ttl)
+        self._lock = threading.Lock()
+        self.drops: Counter = Counter()
+        self.passed = 0
+
+    def remember_workspace(self, team_id: str, workspace_data: Dict[str, Any]) -> None:
+        """後続のイベントのフレーズ・リアクション判定に使うワークスペース設定"""
+        if workspace_data:
+            self._workspaces.set(team_id, workspace_data)
+
+    def check(self, body: Dict[str, Any]) -> Optional[str]:
+        """破棄する場合は判定した段の名前、通す場合は None"""
+        event: Dict[str, Any] = body.get('event') or {}
+        team_id: Optional[str] = body.get('team_id')
+        for name, keep in self.stages:
+            if not keep(event, team_id):
+                with self._lock:
+                    self.drops[name] += 1
+                metrics.record('event_filter', name)
+                return name
+        with self._lock:
+            self.passed += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'passed': self.passed, 'dropped': dict(self.drops)}
+
+    def _keep_event_type(self, event: Dict[str, Any], team_id: Optional[str]) -> bool:
+        return event.get('type') in SUPPORTED_EVENTS
+
+    def _keep_subtype(self, event: Dict[str, Any], team_id: Optional[str]) -> bool:
+        # 編集・削除・入退室などのシステムメッセージ
+        return event.get('type') != 'message' or event.get('subtype') in MESSAGE_SUBTYPES
+
+    def _keep_bot(self, event: Dict[str, Any], team_id: Optional[str]) -> bool:
+        return event.get('type') != 'message' or (not event.get('bot_id') and bool(event.get('user')))
+
+    def _keep_channel(self, event: Dict[str, Any], team_id: Optional[str]) -> bool:
+        if self.channel_allowlist is None:
+            return True
+        if event.get('type') == 'message':
+            return event.get('channel') in self.channel_allowlist
+        if event.get('type') in REACTION_EVENTS:
+            return event.get('item', {}).get('channel') in self.channel_allowlist
+        return True
+
+    def _keep_mention(self, event: Dict[str, Any], team_id: Optional[str]) -> bool:
+        return event.get('type') != 'message' or '<@' in event.get('text', '')
+
+    def _keep_phrase(self, event: Dict[str, Any], team_id: Optional[str]) -> bool:
+        if event.get('type') != 'message':
+            return True
+        workspace_data = self._workspaces.get(team_id)
+        if workspace_data is None:
+            return True
+        return matcher_for_workspace(workspace_data).find_phrase(event.get('text', '')) is not None
+
+    def _keep_reaction(self, event: Dict[str, Any], team_id: Optional[str]) -> bool:
+        if event.get('type') not in REACTION_EVENTS:
+            return True
+        workspace_data = self._workspaces.get(team_id)
+        return workspace_data is None or is_thanks_reaction(event.get('reaction', ''), workspace_data)
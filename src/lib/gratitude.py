@@ -0,0 +1,152 @@
+import re
+import functools
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+
+# ワークスペースで設定がない場合に使う感謝フレーズ
+DEFAULT_PHRASES: Tuple[str, ...] = (
+    'ありがとう', '有難う', '有り難う', 'ありがと', 'あざす', 'あざっす',
+    '感謝', 'サンキュー', 'サンクス',
+    'thanks', 'thank you', 'thx',
+    'merci', 'gracias', 'danke', '谢谢', '감사',
+    ':pray:', ':thankyou:', ':thank_you:', ':arigatou:', ':bow:', '🙏',
+)
+
+# Slackのマークアップ: <@U123>, <@U123|name>, <#C123|general>, <https://...|label>, <!here>
+_MARKUP = re.compile(r'<(?:@([A-Z0-9]+)(?:\|[^<>]*)?|([^<>|]*)(?:\|([^<>]*))?)>')
+# メンションだけ（リテラルの '<@' で始まるので C の高速な検索で済む）
+_MENTION = re.compile(r'<@([A-Z0-9]+)(?:\|[^<>]*)?>')
+
+
+class ScanResult:
+    """メッセージ走査の結果
+
+    マークアップを除いた本文（text）は読まれたときに作る。感謝でないメッセージ（大半）では作らない。
+    """
+
+    __slots__ = ('mentions', 'phrase', '_raw', '_text')
+
+    def __init__(self, mentions: List[str], phrase: Optional[str], raw: str) -> None:
+        self.mentions = mentions
+        self.phrase = phrase
+        self._raw = raw
+        self._text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = strip_markup(self._raw)
+        return self._text
+
+    @property
+    def is_thanks(self) -> bool:
+        return bool(self.mentions) and self.phrase is not None
+
+
+def _needs_word_boundary(phrase: str) -> bool:
+    return any(ch.isascii() and ch.isalnum() for ch in (phrase[0], phrase[-1]))
+
+
+def _render_markup(target: str, label: Optional[str]) -> str:
+    if target.startswith('#'):
+        return f"#{label}" if label else target
+    if target.startswith('!'):
+        return f"@{label or target[1:]}"
+    return label or target
+
+
+def strip_markup(text: str) -> str:
+    """メンションを除き、チャンネル・リンク・特殊メンションを表示名にした本文"""
+    if '<' not in text:
+        return text
+    # split は [本文, user_id, target, label, 本文, ...] を1パスで返す
+    pieces = _MARKUP.split(text)
+    for index in range(1, len(pieces), 4):
+        user_id, target, label = pieces[index:index + 3]
+        rendered = '' if user_id else _render_markup(target, label)
+        pieces[index:index + 3] = (rendered, '', '')
+    return ''.join(pieces)
+
+
+class GratitudeMatcher:
+    """メンション抽出・感謝フレーズ検出・マークアップ除去
+
+    1メッセージあたりの走査は、メンションの findall（'<@' を含む場合のみ）と
+    フレーズの部分文字列検索だけにする（従来はメンションの findall と sub、本文全体の lower）。
+    大文字・小文字のないフレーズ（日本語・絵文字）は元の本文をそのまま C の部分文字列検索で探し、
+    見つからない場合は本文の ASCII 部分だけを小文字にして英字のフレーズの候補を探し、候補が
+    あるときだけ本文全体を小文字にして確かめる。英数字で始まる/終わる
+    フレーズは単語境界付きの正規表現で確かめる（"thanks" が "thanksgiving" に一致しないように）。
+    マークアップの除去は本文が読まれたときだけ行う（ScanResult.text）。
+
+    全フレーズをまとめた1つの正規表現や Python で書いた Aho-Corasick も試したが、この程度の
+    フレーズ数ではフレーズごとの C の部分文字列検索より数倍遅い（2万文字の本文で2〜8倍）。
+    """
+
+    def __init__(self, phrases: Iterable[str]) -> None:
+        normalized = sorted({' '.join(p.lower().split()) for p in phrases if p and p.strip()}, key=len)
+        self.phrases: Tuple[str, ...] = tuple(normalized)
+        plain = [p for p in normalized if not _needs_word_boundary(p)]
+        # 小文字にしなくても一致するフレーズと、小文字にした本文で探すフレーズ
+        self._uncased: Tuple[str, ...] = tuple(p for p in plain if p.upper() == p)
+        self._cased: Tuple[str, ...] = tuple(p for p in plain if p.upper() != p)
+        self._bounded: Tuple[str, ...] = tuple(p for p in normalized if _needs_word_boundary(p))
+        # 正規表現の前に部分文字列で確かめる語（"thank you" は "thank"）
+        self._bounded_heads: Tuple[str, ...] = tuple(dict.fromkeys(p.split(' ', 1)[0] for p in self._bounded))
+        # 英字のフレーズがすべて ASCII なら、本文の ASCII 部分だけを小文字にして候補の有無を確かめる
+        # （日本語の本文全体の lower を、フレーズが含まれない大半のメッセージで省く）
+        needles = self._cased + self._bounded_heads
+        self._ascii_needles: Optional[Tuple[bytes, ...]] = (
+            tuple(needle.encode('ascii') for needle in needles) if all(n.isascii() for n in needles) else None)
+        self._bounded_pattern = re.compile(
+            '|'.join(
+                r'(?<![A-Za-z0-9])' + re.escape(p).replace(r'\ ', r'\s+') + r'(?![A-Za-z0-9])'
+                for p in sorted(self._bounded, key=len, reverse=True)
+            )
+        ) if self._bounded else None
+
+    def scan(self, text: str) -> ScanResult:
+        # 重複を除いて出現順（ユーザーIDは大文字英数字なので、フレーズの判定は元の本文のままでよい）
+        mentions = list(dict.fromkeys(_MENTION.findall(text))) if '<@' in text else []
+        return ScanResult(mentions, self.find_phrase(text), text)
+
+    def find_phrase(self, text: str) -> Optional[str]:
+        """最初に見つかった感謝フレーズ（なければ None）"""
+        for phrase in self._uncased:
+            if phrase in text:
+                return phrase
+        if not self._cased and self._bounded_pattern is None:
+            return None
+        if self._ascii_needles is not None:
+            folded = text.encode('ascii', 'ignore').lower()
+            if not any(needle in folded for needle in self._ascii_needles):
+                return None
+        lowered = text.lower()
+        for phrase in self._cased:
+            if phrase in lowered:
+                return phrase
+        if self._bounded_pattern is not None:
+            # 正規表現の前に部分文字列で候補があるかだけ確認する
+            if any(head in lowered for head in self._bounded_heads):
+                match = self._bounded_pattern.search(lowered)
+                if match:
+                    return ' '.join(match.group(0).split())
+        return None
+
+    def is_thanks(self, text: str) -> bool:
+        return self.scan(text).is_thanks
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_matcher(phrases: Tuple[str, ...]) -> GratitudeMatcher:
+    return GratitudeMatcher(phrases)
+
+
+def get_matcher(phrases: Optional[Iterable[str]] = None) -> GratitudeMatcher:
+    """フレーズ集合ごとに構築済みのマッチャーを再利用する"""
+    key = tuple(sorted({' '.join(p.lower().split()) for p in (phrases or DEFAULT_PHRASES) if p and p.strip()}))
+    return _cached_matcher(key or DEFAULT_PHRASES)
+
+
+def matcher_for_workspace(workspace_data: Dict[str, Any]) -> GratitudeMatcher:
+    """ワークスペース設定（-auth テーブルの thanks_phrases）に応じたマッチャー"""
+    return get_matcher(workspace_data.get('thanks_phrases'))
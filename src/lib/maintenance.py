@@ -0,0 +1,367 @@
+"""テーブル全体を対象にするメンテナンス処理
+
+SegmentedScan はテーブルを TotalSegments 個のセグメントに分け、ワーカープールで並列に
+ページングしながら読む。読み込みは消費キャパシティ（ConsumedCapacity）で速度を抑え、
+セグメントごとの位置（LastEvaluatedKey）を -jobs テーブルに定期的に保存するので、中断しても保存した
+位置から再開できる。途中の集計はチェックポイントごとに大きさを区切った別のアイテムに書き、位置の
+アイテムには書いたアイテムの数だけを持つ（集計が大きくなっても 400KB の上限を超えない）。
+
+PointsRebuild は最初のジョブで、-transactions を読み直して各ユーザーの total_points を
+再計算し、-users の値とのずれを報告する（repair=True なら修正する）。
+SearchReindex は -transactions の完了した付与を読み直して、全文検索の索引（-search）を作り直す。
+"""
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Callable, Tuple
+
+from lib import search
+from lib.db import (DynamoDBManager, GRANT_PENDING, GRANT_ROLLING_BACK, GRANT_ROLLED_BACK)
+from lib.codec import decode_transaction
+from lib.metrics import _consumed_capacity
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# セグメント数と並列数の既定値
+MAINTENANCE_SEGMENTS: int = int(os.environ.get('MAINTENANCE_SEGMENTS', '16'))
+# 途中経過を保存する間隔（秒）。ページごとに保存すると集計が大きいときに書き込みが増える
+CHECKPOINT_SECONDS: float = float(os.environ.get('MAINTENANCE_CHECKPOINT_SECONDS', '10'))
+# 途中の集計を保存するアイテム1件あたりの大きさの目安（DynamoDB のアイテムは 400KB まで）
+PARTIAL_MAX_BYTES: int = int(os.environ.get('MAINTENANCE_PARTIAL_MAX_BYTES', '256000'))
+# 報告に含めるずれの件数の上限
+MAX_REPORTED_DRIFTS = 100
+
+
+def _json_size(value: Any) -> int:
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+def split_partial(partial: Dict[str, Any], max_bytes: int = PARTIAL_MAX_BYTES) -> List[Dict[str, Any]]:
+    """集計を max_bytes 程度ずつの dict に分ける
+
+    値が dict ならキーごとに、list なら要素ごとに分け、それ以外の値は1つの dict にだけ入れる。
+    集計はどれも足し合わせ・連結・update でまとめる形なので、分けたものを別々の集計として扱ってよい。
+    """
+    shards: List[Dict[str, Any]] = [{}]
+    size = 0
+
+    def shard_for(entry_size: int) -> Dict[str, Any]:
+        nonlocal size
+        if shards[-1] and size + entry_size > max_bytes:
+            shards.append({})
+            size = 0
+        size += entry_size
+        return shards[-1]
+
+    for key, value in partial.items():
+        if isinstance(value, dict):
+            for inner_key, inner in value.items():
+                shard_for(_json_size([inner_key, inner])).setdefault(key, {})[inner_key] = inner
+        elif isinstance(value, list):
+            for inner in value:
+                shard_for(_json_size(inner)).setdefault(key, []).append(inner)
+        else:
+            shard_for(_json_size([key, value]))[key] = value
+    return [shard for shard in shards if shard]
+
+
+class CapacityLimiter:
+    """消費キャパシティ単位のトークンバケット（スレッド間で共有）
+
+    実際の消費量は呼び出しの後にしか分からないため、残高が負の間だけ待ち、
+    呼び出しの後に消費量を差し引く（1秒分までためられる）。
+    """
+
+    def __init__(self, units_per_second: Optional[float]) -> None:
+        self.rate = units_per_second or 0.0
+        self._available = self.rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._available = min(self.rate, self._available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait(self) -> None:
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                self._refill()
+                if self._available > 0:
+                    return
+                delay = -self._available / self.rate
+            time.sleep(delay)
+
+    def charge(self, units: float) -> None:
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill()
+            self._available -= units
+
+
+class SegmentedScan:
+    """並列セグメントスキャン（セグメントごとにチェックポイントを保存して再開できる）
+
+    process(items, partial) はページごとに呼ばれ、集計 partial（JSON で保存できる dict）を更新する。
+    partial はチェックポイントごとに split_partial で分けて {job_id}#{segment}#partial#{n} に保存し、
+    新しい dict に取り替える。run は保存したすべての partial のリストを返すので、呼び出し側は
+    セグメントをまたいだ集計と同じ方法でまとめる。
+    """
+
+    def __init__(self, db_manager: DynamoDBManager, table: Any, job_id: str,
+                 segments: int = MAINTENANCE_SEGMENTS, workers: Optional[int] = None,
+                 limiter: Optional[CapacityLimiter] = None, checkpoint_seconds: float = CHECKPOINT_SECONDS,
+                 partial_max_bytes: int = PARTIAL_MAX_BYTES, **scan_kwargs: Any) -> None:
+        self.db_manager = db_manager
+        self.table = table
+        self.job_id = job_id
+        self.segments = segments
+        self.workers = workers or segments
+        self.limiter = limiter or CapacityLimiter(None)
+        self.checkpoint_seconds = checkpoint_seconds
+        self.partial_max_bytes = partial_max_bytes
+        self.scan_kwargs = scan_kwargs
+
+    def run(self, process: Callable[[List[Dict[str, Any]], Dict[str, Any]], None]) -> List[Dict[str, Any]]:
+        with ThreadPoolExecutor(max_workers=min(self.workers, self.segments)) as executor:
+            results = list(executor.map(lambda segment: self._run_segment(segment, process), range(self.segments)))
+        logger.info("Segmented scan finished: job=%s scanned=%d", self.job_id,
+                    sum(state['scanned'] for state, _ in results))
+        return [partial for _, partials in results for partial in partials]
+
+    def _run_segment(self, segment: int, process: Callable[[List[Dict[str, Any]], Dict[str, Any]], None]
+                     ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        state_id = f'{self.job_id}#{segment}'
+        state: Dict[str, Any] = self.db_manager.get_job_state(state_id) or {
+            'cursor': None, 'done': False, 'scanned': 0, 'partials': 0
+        }
+        kwargs: Dict[str, Any] = dict(self.scan_kwargs, Segment=segment, TotalSegments=self.segments,
+                                      ReturnConsumedCapacity='TOTAL')
+        partial: Dict[str, Any] = {}
+        saved_at = time.monotonic()
+        while not state['done']:
+            if state['cursor']:
+                kwargs['ExclusiveStartKey'] = state['cursor']
+            self.limiter.wait()
+            response: Dict[str, Any] = self.table.scan(**kwargs)
+            self.limiter.charge(_consumed_capacity(response))
+            items: List[Dict[str, Any]] = response.get('Items', [])
+            process(items, partial)
+            state['scanned'] += len(items)
+            state['cursor'] = response.get('LastEvaluatedKey')
+            state['done'] = not state['cursor']
+            if state['done'] or time.monotonic() - saved_at >= self.checkpoint_seconds:
+                # 集計を先に書き、その数を位置と一緒に保存する（間で止まっても、保存した位置から読み直して書き直す）
+                for shard in split_partial(partial, self.partial_max_bytes):
+                    self.db_manager.save_job_state(f"{state_id}#partial#{state['partials']}", shard)
+                    state['partials'] += 1
+                self.db_manager.save_job_state(state_id, state)
+                partial = {}
+                saved_at = time.monotonic()
+        return state, [self.db_manager.get_job_state(f'{state_id}#partial#{index}') or {}
+                       for index in range(state['partials'])]
+
+
+def _snapshot_users(items: List[Dict[str, Any]], partial: Dict[str, Any]) -> None:
+    """ユーザーごとの [total_points（属性がなければ None）, history_version]"""
+    users: Dict[str, List[Optional[int]]] = partial.setdefault('users', {})
+    for item in items:
+        total = item.get('total_points')
+        users[item['user_id']] = [None if total is None else int(total), int(item.get('history_version', 0))]
+
+
+def _count_receipts(items: List[Dict[str, Any]], partial: Dict[str, Any]) -> None:
+    """受信ポイントの集計
+
+    完了した記録（status なし / complete）は to_users 全員に points を数える。チャンク分割した
+    付与が途中（pending / rolling_back）の場合は、適用済みのチャンク（マーカー {grant_id}#{index}）
+    の受信者だけを数えるため、ヘッダーとマーカーを別に集めて最後に突き合わせる。
+    """
+    receipts: Dict[str, int] = partial.setdefault('receipts', {})
+    markers: List[List[Any]] = partial.setdefault('markers', [])
+    unfinished: Dict[str, Any] = partial.setdefault('unfinished', {})
+    for item in items:
+        record = decode_transaction(item)
+        if 'to_users' not in record:
+            if 'grant_id' in record:
+                markers.append([record['grant_id'], int(record['transaction_id'].rsplit('#', 1)[1])])
+            continue
+        status = record.get('status')
+        points = int(record.get('points', 1))
+        if status == GRANT_ROLLED_BACK:
+            continue
+        if status in (GRANT_PENDING, GRANT_ROLLING_BACK):
+            unfinished[record['transaction_id']] = [list(record['to_users']), points]
+            continue
+        for to_user in record['to_users']:
+            receipts[to_user] = receipts.get(to_user, 0) + points
+
+
+class PointsRebuild:
+    """-transactions から total_points を再計算し、-users の値と照合する
+
+    先に -users を読んで各ユーザーの (total_points, history_version) を控え、その後に
+    -transactions を強い整合性で読む。控えた時点より前の付与はすべて集計に含まれるため、
+    history_version が変わっていない（その後どの付与にも関わっていない）ユーザーは集計と
+    一致するはず。一致しないユーザーをずれとして報告し、repair では history_version と
+    total_points が控えた値のままであることを条件に書き換える（並行した付与は上書きしない）。
+    付与に関わって値が変わったユーザーは busy として数え、再実行で確認する。
+    """
+
+    def __init__(self, db_manager: DynamoDBManager, job_id: str, segments: int = MAINTENANCE_SEGMENTS,
+                 workers: Optional[int] = None, read_limiter: Optional[CapacityLimiter] = None,
+                 write_limiter: Optional[CapacityLimiter] = None, repair: bool = False,
+                 page_size: Optional[int] = None) -> None:
+        self.db_manager = db_manager
+        self.job_id = job_id
+        self.segments = segments
+        self.workers = workers or segments
+        self.read_limiter = read_limiter or CapacityLimiter(None)
+        self.write_limiter = write_limiter or CapacityLimiter(None)
+        self.repair = repair
+        self.scan_kwargs: Dict[str, Any] = {'ConsistentRead': True}
+        if page_size:
+            self.scan_kwargs['Limit'] = page_size
+
+    def _scan(self, table: Any, phase: str, **kwargs: Any) -> SegmentedScan:
+        return SegmentedScan(self.db_manager, table, f'{self.job_id}#{phase}', segments=self.segments,
+                             workers=self.workers, limiter=self.read_limiter, **self.scan_kwargs, **kwargs)
+
+    def expected_totals(self) -> Dict[str, int]:
+        """-transactions から再計算したユーザーごとの受信ポイント"""
+        partials = self._scan(self.db_manager.transactions_table, 'transactions').run(_count_receipts)
+        expected: Dict[str, int] = {}
+        unfinished: Dict[str, Any] = {}
+        for partial in partials:
+            for user_id, points in partial.get('receipts', {}).items():
+                expected[user_id] = expected.get(user_id, 0) + points
+            unfinished.update(partial.get('unfinished', {}))
+        for partial in partials:
+            for grant_id, index in partial.get('markers', []):
+                # 完了・取り消し済みの付与のマーカーは数えない（完了した付与はヘッダーで数えている）
+                if grant_id not in unfinished:
+                    continue
+                to_users, points = unfinished[grant_id]
+                for to_user in self.db_manager._grant_chunks(to_users)[index]:
+                    expected[to_user] = expected.get(to_user, 0) + points
+        return expected
+
+    def run(self) -> Dict[str, Any]:
+        snapshot: Dict[str, List[Optional[int]]] = {}
+        for partial in self._scan(self.db_manager.users_table, 'users',
+                                  ProjectionExpression='user_id, total_points, history_version').run(_snapshot_users):
+            snapshot.update(partial.get('users', {}))
+        expected = self.expected_totals()
+
+        drifts: List[Dict[str, Any]] = []
+        for user_id, (observed, version) in snapshot.items():
+            if (observed or 0) != expected.get(user_id, 0):
+                drifts.append({'user_id': user_id, 'observed': observed, 'expected': expected.get(user_id, 0),
+                               'history_version': version})
+        missing = sorted(set(expected) - set(snapshot))
+
+        results = {'repaired': 0, 'busy': 0}
+        if self.repair and drifts:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for outcome in executor.map(self._repair, drifts):
+                    results[outcome] += 1
+
+        report: Dict[str, Any] = {
+            'job_id': self.job_id,
+            'users': len(snapshot),
+            'drifted': len(drifts),
+            'repaired': results['repaired'],
+            'busy': results['busy'],
+            'missing_users': missing[:MAX_REPORTED_DRIFTS],
+            'drifts': sorted(drifts, key=lambda drift: drift['user_id'])[:MAX_REPORTED_DRIFTS],
+        }
+        self.db_manager.save_job_state(self.job_id, {key: value for key, value in report.items() if key != 'drifts'})
+        logger.info("Points rebuild finished: job=%s users=%d drifted=%d repaired=%d busy=%d",
+                    self.job_id, report['users'], report['drifted'], report['repaired'], report['busy'])
+        return report
+
+    def _repair(self, drift: Dict[str, Any]) -> str:
+        """控えた値のままなら total_points を再計算した値に書き換える（'repaired' / 'busy'）"""
+        conditions: List[str] = []
+        values: Dict[str, Any] = {':expected': drift['expected']}
+        if drift['observed'] is None:
+            conditions.append('attribute_not_exists(total_points)')
+        else:
+            conditions.append('total_points = :observed')
+            values[':observed'] = drift['observed']
+        if drift['history_version']:
+            conditions.append('history_version = :version')
+            values[':version'] = drift['history_version']
+        else:
+            conditions.append('attribute_not_exists(history_version)')
+        table = self.db_manager.users_table
+        self.write_limiter.wait()
+        try:
+            response = table.update_item(
+                Key={'user_id': drift['user_id']},
+                UpdateExpression='SET total_points = :expected',
+                ConditionExpression=' AND '.join(conditions),
+                ExpressionAttributeValues=values
+            )
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            self.write_limiter.charge(1)
+            return 'busy'
+        self.write_limiter.charge(_consumed_capacity(response) or 1)
+        logger.info("total_points repaired: user_id=%s %s -> %s",
+                    drift['user_id'], drift['observed'], drift['expected'])
+        return 'repaired'
+
+
+class SearchReindex:
+    """-transactions の完了した付与を読み直して検索インデックスに書く（既存の付与の取り込みと修復）
+
+    索引語の書き込みは冪等なので、途中で止まっても同じ job_id で続きから再実行すればよい。
+    """
+
+    def __init__(self, db_manager: DynamoDBManager, job_id: str, segments: int = MAINTENANCE_SEGMENTS,
+                 workers: Optional[int] = None, read_limiter: Optional[CapacityLimiter] = None,
+                 write_limiter: Optional[CapacityLimiter] = None) -> None:
+        self.db_manager = db_manager
+        self.job_id = job_id
+        self.segments = segments
+        self.workers = workers
+        self.read_limiter = read_limiter
+        self.write_limiter = write_limiter or CapacityLimiter(None)
+
+    def _index(self, items: List[Dict[str, Any]], partial: Dict[str, Any]) -> None:
+        for item in items:
+            record = decode_transaction(item)
+            # チャンクのマーカーと、途中・取り消された付与は索引しない
+            if 'to_users' not in record or record.get('status') in (GRANT_PENDING, GRANT_ROLLING_BACK,
+                                                                     GRANT_ROLLED_BACK):
+                continue
+            entries = len(search.index_entries(record))
+            if not entries:
+                continue
+            self.write_limiter.wait()
+            self.db_manager.index_message(record)
+            self.write_limiter.charge(entries)
+            partial['indexed'] = partial.get('indexed', 0) + 1
+            partial['terms'] = partial.get('terms', 0) + entries
+
+    def run(self) -> Dict[str, Any]:
+        partials = SegmentedScan(self.db_manager, self.db_manager.transactions_table, f'{self.job_id}#transactions',
+                                 segments=self.segments, workers=self.workers,
+                                 limiter=self.read_limiter).run(self._index)
+        report: Dict[str, Any] = {
+            'job_id': self.job_id,
+            'indexed': sum(partial.get('indexed', 0) for partial in partials),
+            'terms': sum(partial.get('terms', 0) for partial in partials),
+        }
+        self.db_manager.save_job_state(self.job_id, report)
+        logger.info("Search reindex finished: job=%s indexed=%d terms=%d",
+                    self.job_id, report['indexed'], report['terms'])
+        return report
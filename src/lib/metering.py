@@ -0,0 +1,143 @@
+"""ワークスペース（team_id）ごとの利用量の計測
+
+lib.metrics のレコードを team_id ディメンションごとに集計し、Storage.add_usage で UTC の
+1時間単位のカウンターとして保存する。書き込みは METERING_FLUSH_SECONDS ごとにまとめて行う
+（Socket Mode サーバー用。プロセスの終了時に MetricsRecorder.close で残りを書き込む）。
+Lambda は呼び出しの間に凍結され、そのまま破棄されると溜めた分が失われるため、template.yaml で
+METERING_FLUSH_SECONDS=0 とし、flush_after がハンドラーの終わりに毎回書き込む。
+
+カウンター:
+    events_received / events_dropped  受け付けたイベント・前段で破棄したイベント
+    events_shed                       付与の試行回数の上限（lib.ratelimit）で破棄したイベント
+    grants                            成功したポイント付与（リアクションの一括付与は1回）
+    rcu / wcu                         DynamoDB の消費キャパシティ
+    slack_calls / slack.<メソッド名>   Slack API の呼び出し回数
+    invocations / duration_ms         ハンドラーの呼び出し回数と処理時間の合計
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Any, Optional, Callable
+
+from lib.storage import Storage
+from lib.metrics import metrics, CallRecord
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# 利用量をまとめて書き込む間隔（秒）。0 なら flush のたびに書き込む
+METERING_FLUSH_SECONDS: float = float(os.environ.get('METERING_FLUSH_SECONDS', '60'))
+
+# 読み込みキャパシティとして数える DynamoDB の操作（それ以外は書き込み）
+READ_OPERATIONS = {'get_item', 'query', 'scan', 'batch_get_item', 'transact_get_items'}
+# 処理時間として数えるレコード（Lambda ハンドラー / Socket Mode サーバーの1件ごと）
+DURATION_SERVICES = {'handler', 'server'}
+
+
+def usage_period(moment: Optional[datetime] = None) -> str:
+    """利用量を集計する期間（UTC の1時間）"""
+    moment = moment or datetime.now(timezone.utc)
+    if moment.tzinfo:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H')
+
+
+def periods_between(since: datetime, until: datetime) -> List[str]:
+    """since から until まで（両端を含む）の期間"""
+    periods: List[str] = []
+    moment = since
+    while usage_period(moment) <= usage_period(until):
+        periods.append(usage_period(moment))
+        moment += timedelta(hours=1)
+    return periods
+
+
+def usage_counters(record: CallRecord) -> Dict[str, float]:
+    """1件の計測結果が加算するカウンター"""
+    if record.service == 'event':
+        return {f'events_{record.operation}': 1}
+    if record.service == 'grant':
+        return {} if record.error else {'grants': 1}
+    if record.service == 'dynamodb':
+        unit = 'rcu' if record.operation in READ_OPERATIONS else 'wcu'
+        return {unit: record.consumed_capacity} if record.consumed_capacity else {}
+    if record.service == 'slack':
+        return {'slack_calls': 1, f'slack.{record.operation}': 1}
+    if record.service in DURATION_SERVICES:
+        return {'invocations': 1, 'duration_ms': record.duration_ms}
+    return {}
+
+
+class UsageMeter:
+    """metrics のシンク。team_id ごとに集計し、一定間隔でまとめて保存する"""
+
+    def __init__(self, storage: Storage, flush_seconds: float = METERING_FLUSH_SECONDS,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.storage = storage
+        self.flush_seconds = flush_seconds
+        self.clock = clock
+        self._pending: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._flushed_at = clock()
+        self._lock = threading.Lock()
+
+    def export(self, records: List[CallRecord]) -> None:
+        period = usage_period()
+        with self._lock:
+            for record in records:
+                team_id = record.dimensions.get('team_id')
+                counters = team_id and usage_counters(record)
+                if not counters:
+                    continue
+                team_usage = self._pending.setdefault(period, {}).setdefault(team_id, {})
+                for name, value in counters.items():
+                    team_usage[name] = team_usage.get(name, 0) + value
+            due = self._pending and self.clock() - self._flushed_at >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = self.clock()
+        for period, usage in pending.items():
+            try:
+                self.storage.add_usage(period, usage)
+            except Exception as e:
+                # 次の書き込みで再試行する
+                logger.error(f"Error saving usage: {str(e)}")
+                with self._lock:
+                    for team_id, counters in usage.items():
+                        team_usage = self._pending.setdefault(period, {}).setdefault(team_id, {})
+                        for name, value in counters.items():
+                            team_usage[name] = team_usage.get(name, 0) + value
+
+
+_installed: Optional[UsageMeter] = None
+_install_lock = threading.Lock()
+
+
+def install_usage_meter(storage: Storage) -> UsageMeter:
+    """プロセスに1つの UsageMeter を metrics に登録する（Socket Mode サーバーでは各ハンドラーが共有）"""
+    global _installed
+    with _install_lock:
+        if _installed is None:
+            _installed = UsageMeter(storage)
+            metrics.add_sink(_installed)
+        return _installed
+
+
+def top_consumers(storage: Storage, since: datetime, until: datetime, metric: str = 'wcu',
+                  limit: int = 10) -> List[Dict[str, Any]]:
+    """期間内の利用量の合計を team_id ごとに求め、metric の多い順に limit 件"""
+    totals: Dict[str, Dict[str, Any]] = {}
+    for entry in storage.get_usage(periods_between(since, until)):
+        team_total = totals.setdefault(entry['team_id'], {'team_id': entry['team_id']})
+        for name, value in entry.items():
+            if name in ('team_id', 'period'):
+                continue
+            team_total[name] = team_total.get(name, 0) + value
+    ranked = sorted(totals.values(), key=lambda total: (-total.get(metric, 0), total['team_id']))
+    return ranked[:limit]
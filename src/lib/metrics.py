@@ -0,0 +1,298 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Iterator, Tuple, Callable
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'KansyaConnect')
+
+# ハンドラーが設定するディメンション（event_type など）
+_dimensions: contextvars.ContextVar = contextvars.ContextVar('metrics_dimensions', default={})
+
+# CloudWatch のディメンションにしない値（ワークスペースごとにメトリクスが増えないよう、EMF のプロパティとして出す）
+PROPERTY_ONLY_DIMENSIONS = ('team_id',)
+
+# EMF で1つのメトリクスに出せる値の最大数（超える分は別のログ行に分ける）
+EMF_MAX_VALUES = 100
+
+
+class CallRecord:
+    """外部API呼び出し1回分の計測結果"""
+
+    __slots__ = ('service', 'operation', 'duration_ms', 'error', 'consumed_capacity', 'retries', 'dimensions')
+
+    def __init__(self, service: str, operation: str, duration_ms: float, error: Optional[str] = None,
+                 consumed_capacity: float = 0.0, retries: int = 0,
+                 dimensions: Optional[Dict[str, str]] = None) -> None:
+        self.service = service
+        self.operation = operation
+        self.duration_ms = duration_ms
+        self.error = error
+        self.consumed_capacity = consumed_capacity
+        self.retries = retries
+        self.dimensions = dimensions or {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class InMemoryExporter:
+    """テスト用：出力されたレコードをそのまま保持"""
+
+    def __init__(self) -> None:
+        self.records: List[CallRecord] = []
+
+    def export(self, records: List[CallRecord]) -> None:
+        self.records.extend(records)
+
+    def calls(self, service: Optional[str] = None, operation: Optional[str] = None) -> List[CallRecord]:
+        return [
+            r for r in self.records
+            if (service is None or r.service == service) and (operation is None or r.operation == operation)
+        ]
+
+
+class EMFExporter:
+    """CloudWatch Embedded Metric Format のログ行として出力"""
+
+    def __init__(self, namespace: str = NAMESPACE, stream: Any = None) -> None:
+        self.namespace = namespace
+        self.stream = stream
+
+    def export(self, records: List[CallRecord]) -> None:
+        groups: Dict[Tuple[Any, ...], List[CallRecord]] = {}
+        for record in records:
+            key = (record.service, record.operation, tuple(sorted(record.dimensions.items())))
+            groups.setdefault(key, []).append(record)
+
+        stream = self.stream or sys.stdout
+        for (service, operation, dimensions), group in groups.items():
+            for start in range(0, len(group), EMF_MAX_VALUES):
+                chunk = group[start:start + EMF_MAX_VALUES]
+                stream.write(json.dumps(self._document(service, operation, dict(dimensions), chunk),
+                                        ensure_ascii=False) + '\n')
+        stream.flush()
+
+    def _document(self, service: str, operation: str, dimensions: Dict[str, str],
+                  group: List[CallRecord]) -> Dict[str, Any]:
+        dimension_sets = [['Service', 'Operation']]
+        metric_dimensions = sorted(name for name in dimensions if name not in PROPERTY_ONLY_DIMENSIONS)
+        if metric_dimensions:
+            dimension_sets.append(['Service', 'Operation'] + metric_dimensions)
+        errors: Dict[str, int] = {}
+        for record in group:
+            if record.error:
+                errors[record.error] = errors.get(record.error, 0) + 1
+        document: Dict[str, Any] = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': dimension_sets,
+                    'Metrics': [
+                        {'Name': 'Latency', 'Unit': 'Milliseconds'},
+                        {'Name': 'Calls', 'Unit': 'Count'},
+                        {'Name': 'Errors', 'Unit': 'Count'},
+                        {'Name': 'ConsumedCapacity', 'Unit': 'Count'},
+                        {'Name': 'Retries', 'Unit': 'Count'},
+                    ],
+                }],
+            },
+            'Service': service,
+            'Operation': operation,
+            'Latency': [round(r.duration_ms, 3) for r in group],
+            'Calls': len(group),
+            'Errors': sum(errors.values()),
+            'ConsumedCapacity': sum(r.consumed_capacity for r in group),
+            'Retries': sum(r.retries for r in group),
+            'ErrorClasses': errors,
+        }
+        document.update(dimensions)
+        return document
+
+
+class MetricsRecorder:
+    """呼び出し単位の計測結果を溜めて、flush時にエクスポーターへ渡す"""
+
+    def __init__(self, exporter: Any = None) -> None:
+        self.exporter = exporter
+        # エクスポーターとは別に同じレコードを受け取る集計（lib.metering の UsageMeter など）
+        self.sinks: List[Any] = []
+        self._records: List[CallRecord] = []
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink: Any) -> None:
+        if sink not in self.sinks:
+            self.sinks.append(sink)
+
+    def set_dimensions(self, **dimensions: Optional[str]) -> None:
+        """以降の計測に event_type などのディメンションを付与"""
+        merged = dict(_dimensions.get())
+        merged.update({k: v for k, v in dimensions.items() if v})
+        _dimensions.set(merged)
+
+    def record(self, service: str, operation: str, duration_ms: float = 0.0, error: Optional[str] = None,
+               consumed_capacity: float = 0.0, retries: int = 0) -> None:
+        record = CallRecord(service, operation, duration_ms, error, consumed_capacity, retries,
+                            dict(_dimensions.get()))
+        with self._lock:
+            self._records.append(record)
+
+    @contextmanager
+    def timed(self, service: str, operation: str) -> Iterator[Dict[str, Any]]:
+        """処理時間とエラークラスを記録。yieldした辞書で consumed_capacity / retries / error を上書きできる"""
+        call: Dict[str, Any] = {'consumed_capacity': 0.0, 'retries': 0, 'error': None}
+        started = time.perf_counter()
+        error: Optional[str] = None
+        try:
+            yield call
+        except Exception as e:
+            error = error_class(e)
+            raise
+        finally:
+            self.record(service, operation, (time.perf_counter() - started) * 1000.0, call['error'] or error,
+                        call['consumed_capacity'], call['retries'])
+
+    def flush(self) -> None:
+        with self._lock:
+            records, self._records = self._records, []
+        if not records:
+            return
+        for exporter in ([self.exporter] if self.exporter is not None else []) + self.sinks:
+            try:
+                exporter.export(records)
+            except Exception as e:
+                logger.error(f"Error exporting metrics: {str(e)}")
+
+    def close(self) -> None:
+        """プロセスの終了時：flush に加え、書き込みをまとめている集計（sink）に残った分も出力する"""
+        self.flush()
+        for sink in self.sinks:
+            try:
+                sink.flush()
+            except Exception as e:
+                logger.error(f"Error flushing metrics sink: {str(e)}")
+
+
+def error_class(e: Exception) -> str:
+    """boto3 / slack_sdk のエラーコードを含むエラークラス名"""
+    response = getattr(e, 'response', None)
+    code = None
+    if isinstance(response, dict):
+        code = response.get('Error', {}).get('Code')
+    elif response is not None:
+        # SlackResponse
+        try:
+            code = response.get('error')
+        except Exception:
+            code = None
+    return f"{type(e).__name__}:{code}" if code else type(e).__name__
+
+
+def _consumed_capacity(response: Any) -> float:
+    if not isinstance(response, dict):
+        return 0.0
+    consumed = response.get('ConsumedCapacity')
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return float(sum(c.get('CapacityUnits', 0) for c in consumed or []))
+
+
+class InstrumentedTable:
+    """boto3 Table の各操作を計測するプロキシ"""
+
+    _OPERATIONS = {'get_item', 'put_item', 'update_item', 'delete_item', 'scan', 'query'}
+
+    def __init__(self, table: Any, recorder: MetricsRecorder) -> None:
+        self._table = table
+        self._recorder = recorder
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._table, name)
+        if name not in self._OPERATIONS:
+            return attr
+
+        def call(**kwargs: Any) -> Any:
+            kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+            with self._recorder.timed('dynamodb', name) as metric:
+                response = attr(**kwargs)
+                metric['consumed_capacity'] = _consumed_capacity(response)
+            return response
+        return call
+
+
+class InstrumentedDynamoDBClient:
+    """resource.meta.client のトランザクション・バッチ操作を計測するプロキシ"""
+
+    _OPERATIONS = {'transact_write_items', 'transact_get_items', 'batch_get_item', 'batch_write_item'}
+
+    def __init__(self, client: Any, recorder: MetricsRecorder) -> None:
+        self._client = client
+        self._recorder = recorder
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name not in self._OPERATIONS:
+            return attr
+
+        def call(**kwargs: Any) -> Any:
+            kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+            with self._recorder.timed('dynamodb', name) as metric:
+                response = attr(**kwargs)
+                metric['consumed_capacity'] = _consumed_capacity(response)
+            return response
+        return call
+
+
+class InstrumentedSlackClient:
+    """slack_sdk WebClient の API呼び出しを計測するプロキシ"""
+
+    def __init__(self, client: Any, recorder: MetricsRecorder) -> None:
+        self._client = client
+        self._recorder = recorder
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            with self._recorder.timed('slack', name):
+                return attr(*args, **kwargs)
+        return call
+
+
+def _default_exporter() -> Any:
+    exporter = os.environ.get('METRICS_EXPORTER', 'emf').lower()
+    if exporter == 'memory':
+        return InMemoryExporter()
+    if exporter == 'none':
+        return None
+    return EMFExporter()
+
+
+# プロセス共通のレコーダー。ハンドラーの終わりに flush() する
+metrics: MetricsRecorder = MetricsRecorder(_default_exporter())
+
+
+def flush_after(handler: Callable[..., Any]) -> Callable[..., Any]:
+    """lambda_handler の処理時間を記録し、終了時に計測結果を出力するデコレーター"""
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Any:
+        token = _dimensions.set({'handler': handler.__module__})
+        try:
+            with metrics.timed('handler', handler.__module__):
+                return handler(event, context)
+        finally:
+            metrics.flush()
+            _dimensions.reset(token)
+    return wrapper
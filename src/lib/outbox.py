@@ -0,0 +1,293 @@
+"""Slack への通知の送信待ち（アウトボックス）と送信ワーカー
+
+付与の通知（DM）は Slack に直接送らず、付与の確定後に Storage.enqueue_outbox でアウトボックス
+（DynamoDB では -outbox テーブル）に書き、OutboxWorker がまとめて送る。通知処理は Slack の遅延や
+レート制限を待たずに次の付与へ進み、送れなかった通知も失われない。
+
+アウトボックスのIDは付与の transaction_id などから決めるので、同じ付与の要求が再配信されても
+同じ通知が二重に積まれることはない（積む処理の途中で止まっても、再配信で積み直せる）。
+アウトボックスへの書き込みは付与のトランザクションには含まれないため、付与の確定後から積み終わる
+までの失敗は、要求の再配信（Lambda では SQS FIFO キューの再配信）に頼って回復する。
+
+状態:
+    pending  送信待ち（due_at 以降に送る）
+    sending  ワーカーが送信中（due_at までに終わらなければ別のワーカーが送り直す）
+    sent     送信済み（OUTBOX_RETENTION_SECONDS 後に TTL で消える）
+    dead     再試行の上限に達したか、送っても届かない宛先（replay で pending に戻せる）
+
+ワーカーは期限の来た通知をまとめて読み、ワークスペースごとにトークンとクライアントを1回だけ
+用意して送る。失敗した通知は指数バックオフ（ジッター付き）で再試行し、ワークスペースごとの
+サーキットブレーカーが開いている間は、そのワークスペースへの送信を止めて回復後に回す
+（レート制限の応答では Retry-After の間止める）。
+"""
+import os
+import time
+import random
+import logging
+from typing import Dict, List, Any, Optional, Callable, Iterable
+
+from slack_sdk.errors import SlackApiError
+
+from lib.storage import Storage
+from lib.slack import SlackManager
+from lib.metrics import metrics
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+OUTBOX_PENDING = 'pending'
+OUTBOX_SENDING = 'sending'
+OUTBOX_SENT = 'sent'
+OUTBOX_DEAD = 'dead'
+
+# 1回に読む通知の数と、送信中とみなす秒数（これを過ぎると別のワーカーが送り直す）
+OUTBOX_BATCH_SIZE: int = int(os.environ.get('OUTBOX_BATCH_SIZE', '50'))
+OUTBOX_LEASE_SECONDS: int = int(os.environ.get('OUTBOX_LEASE_SECONDS', '60'))
+# 再試行の回数の上限と、バックオフの初期値・上限（秒）
+OUTBOX_MAX_ATTEMPTS: int = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_BACKOFF_BASE: float = float(os.environ.get('OUTBOX_BACKOFF_BASE', '2'))
+OUTBOX_BACKOFF_MAX: float = float(os.environ.get('OUTBOX_BACKOFF_MAX', '900'))
+# 送信済みの通知を残す秒数（再配信された要求で積み直されないように）
+OUTBOX_RETENTION_SECONDS: int = 14 * 24 * 60 * 60
+# サーキットブレーカー: 連続した失敗の回数と、開いている秒数
+BREAKER_FAILURES: int = int(os.environ.get('OUTBOX_BREAKER_FAILURES', '5'))
+BREAKER_COOLDOWN_SECONDS: float = float(os.environ.get('OUTBOX_BREAKER_COOLDOWN_SECONDS', '60'))
+
+# 再試行しても届かない宛先のエラー
+PERMANENT_ERRORS = frozenset({
+    'user_not_found', 'account_inactive', 'cannot_dm_bot', 'channel_not_found', 'user_disabled',
+})
+
+
+def dm(outbox_id: str, team_id: str, user_id: str, text: str, now: Optional[float] = None) -> Dict[str, Any]:
+    """DM の通知"""
+    now = time.time() if now is None else now
+    return {
+        'outbox_id': outbox_id,
+        'team_id': team_id,
+        'kind': 'dm',
+        'user_id': user_id,
+        'text': text,
+        'state': OUTBOX_PENDING,
+        'due_at': int(now),
+        'attempts': 0,
+        'created_at': int(now),
+    }
+
+
+def backoff_seconds(attempts: int, rng: Optional[random.Random] = None,
+                    base: float = OUTBOX_BACKOFF_BASE, cap: float = OUTBOX_BACKOFF_MAX) -> float:
+    """attempts 回目の失敗の後に待つ秒数（上限までの指数バックオフ、半分から全部の間のジッター）"""
+    delay = min(cap, base * (2 ** max(attempts - 1, 0)))
+    return delay * (0.5 + (rng or random).random() / 2)
+
+
+def _retry_after(error: SlackApiError) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    if response is None or getattr(response, 'status_code', None) != 429:
+        return None
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After') or headers.get('retry-after') or 1)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def _error_code(error: Exception) -> str:
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            return str(response.get('error') or type(error).__name__)
+        except AttributeError:
+            pass
+    return type(error).__name__
+
+
+class CircuitBreaker:
+    """キー（ワークスペース）ごとのサーキットブレーカー
+
+    連続して failures 回失敗すると cooldown 秒開き（送らない）、過ぎると1件だけ試す（半開き）。
+    試した1件が成功すれば閉じ、失敗すればまた開く。
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN_SECONDS,
+                 clock: Callable[[], float] = time.time) -> None:
+        self.failures = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        # key -> [連続した失敗の回数, 開いている期限]
+        self._state: Dict[str, List[float]] = {}
+
+    def open_until(self, key: str) -> Optional[float]:
+        """開いていればその期限（送らずに期限まで延ばす）。None なら送ってよい
+
+        開いていた期限を過ぎた後の最初の呼び出しだけ None を返し（半開きで試す1件）、
+        その結果が出るまでの間は再び cooldown 秒開いているものとして扱う。
+        """
+        state = self._state.get(key)
+        if state is None:
+            return None
+        now = self.clock()
+        if state[1] > now:
+            return state[1]
+        if state[0] >= self.failures:
+            state[1] = now + self.cooldown
+        return None
+
+    def success(self, key: str) -> None:
+        self._state.pop(key, None)
+
+    def failure(self, key: str, retry_after: Optional[float] = None) -> None:
+        state = self._state.setdefault(key, [0, 0.0])
+        state[0] += 1
+        if retry_after is not None:
+            state[1] = max(state[1], self.clock() + retry_after)
+        elif state[0] >= self.failures:
+            # 半開きで試した1件が失敗した場合も、ここでもう一度開く
+            state[1] = self.clock() + self.cooldown
+        if state[1] > self.clock():
+            logger.warning("通知の送信を一時停止: key=%s, failures=%d, until=%.0f", key, int(state[0]), state[1])
+
+
+class OutboxWorker:
+    """期限の来た通知をまとめて送る"""
+
+    def __init__(self, storage: Storage, token_for: Callable[[str], Optional[str]],
+                 slack_for: Callable[[str], SlackManager] = SlackManager.for_token,
+                 batch_size: int = OUTBOX_BATCH_SIZE, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 lease_seconds: int = OUTBOX_LEASE_SECONDS, breaker: Optional[CircuitBreaker] = None,
+                 clock: Callable[[], float] = time.time, rng: Optional[random.Random] = None) -> None:
+        self.storage = storage
+        self.token_for = token_for
+        self.slack_for = slack_for
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.rng = rng or random.Random()
+
+    def run(self, has_time: Callable[[], bool] = lambda: True) -> Dict[str, int]:
+        """期限の来た通知がなくなるか、has_time() が False になるまで送る"""
+        report = {'sent': 0, 'retried': 0, 'dead': 0, 'deferred': 0, 'skipped': 0}
+        while has_time():
+            items = self.storage.due_outbox(self.clock(), self.batch_size)
+            if not items:
+                break
+            progress = self._send_batch(items, report)
+            if not progress:
+                # すべて他のワーカーが処理中か、ブレーカーで延ばした
+                break
+        if any(report.values()):
+            logger.info("通知を送信: %s", report)
+        return report
+
+    def _send_batch(self, items: List[Dict[str, Any]], report: Dict[str, int]) -> int:
+        by_team: Dict[str, List[Dict[str, Any]]] = {}
+        for item in items:
+            by_team.setdefault(item['team_id'], []).append(item)
+        progress = 0
+        for team_id, team_items in by_team.items():
+            slack_manager: Optional[SlackManager] = None
+            channels: Dict[str, str] = {}
+            for item in team_items:
+                open_until = self.breaker.open_until(team_id)
+                if open_until is not None:
+                    if self.storage.update_outbox(item['outbox_id'], item['state'], item['attempts'],
+                                                  {'state': OUTBOX_PENDING, 'due_at': int(open_until) + 1}):
+                        report['deferred'] += 1
+                    continue
+                claimed = self._claim(item)
+                if claimed is None:
+                    report['skipped'] += 1
+                    continue
+                progress += 1
+                if slack_manager is None:
+                    token = self.token_for(team_id)
+                    if not token:
+                        self._fail(claimed, 'token_not_found', report)
+                        continue
+                    slack_manager = self.slack_for(token)
+                self._send(slack_manager, claimed, channels, report)
+        return progress
+
+    def _claim(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """送信中にする（他のワーカーが先に取った場合は None）"""
+        attempts = item['attempts'] + 1
+        lease_until = int(self.clock()) + self.lease_seconds
+        if not self.storage.update_outbox(item['outbox_id'], item['state'], item['attempts'],
+                                          {'state': OUTBOX_SENDING, 'due_at': lease_until, 'attempts': attempts}):
+            return None
+        return dict(item, state=OUTBOX_SENDING, due_at=lease_until, attempts=attempts)
+
+    def _send(self, slack_manager: SlackManager, item: Dict[str, Any], channels: Dict[str, str],
+              report: Dict[str, int]) -> None:
+        team_id = item['team_id']
+        try:
+            # 同じ相手への DM はバッチの中で conversations.open を1回にする
+            channels[item['user_id']] = slack_manager.deliver_dm(item['user_id'], item['text'],
+                                                                 channels.get(item['user_id']))
+        except SlackApiError as e:
+            code = _error_code(e)
+            if code in PERMANENT_ERRORS:
+                self._finish(item, OUTBOX_DEAD, report, error=code)
+                return
+            self.breaker.failure(team_id, _retry_after(e))
+            self._fail(item, code, report)
+            return
+        except Exception as e:
+            self.breaker.failure(team_id)
+            self._fail(item, type(e).__name__, report)
+            return
+        self.breaker.success(team_id)
+        self._finish(item, OUTBOX_SENT, report)
+
+    def _fail(self, item: Dict[str, Any], error: str, report: Dict[str, int]) -> None:
+        if item['attempts'] >= self.max_attempts:
+            self._finish(item, OUTBOX_DEAD, report, error=error)
+            return
+        due_at = self.clock() + backoff_seconds(item['attempts'], self.rng)
+        open_until = self.breaker.open_until(item['team_id'])
+        if open_until is not None:
+            due_at = max(due_at, open_until)
+        self._finish(item, OUTBOX_PENDING, report, error=error, due_at=int(due_at) + 1)
+
+    def _finish(self, item: Dict[str, Any], state: str, report: Dict[str, int],
+                error: Optional[str] = None, due_at: Optional[int] = None) -> None:
+        changes: Dict[str, Any] = {'state': state, 'last_error': error}
+        if state == OUTBOX_SENT:
+            # 送信済みは期限の索引から外し、保存期間の後に消す
+            changes.update({'due_at': None, 'sent_at': int(self.clock()),
+                            'expires_at': int(self.clock()) + OUTBOX_RETENTION_SECONDS})
+        elif due_at is not None:
+            changes['due_at'] = due_at
+        if not self.storage.update_outbox(item['outbox_id'], OUTBOX_SENDING, item['attempts'], changes):
+            # 期限切れで別のワーカーが取り直した
+            logger.warning("通知の状態を更新できません: outbox_id=%s", item['outbox_id'])
+            return
+        outcome = {OUTBOX_SENT: 'sent', OUTBOX_DEAD: 'dead'}.get(state, 'retried')
+        report[outcome] += 1
+        metrics.record('outbox', outcome, error=error)
+        if state == OUTBOX_DEAD:
+            logger.error("通知を送れませんでした: outbox_id=%s, attempts=%d, error=%s",
+                         item['outbox_id'], item['attempts'], error)
+
+
+def replay(storage: Storage, outbox_ids: Optional[Iterable[str]] = None, team_id: Optional[str] = None,
+           now: Optional[float] = None, limit: int = 1000) -> List[str]:
+    """送れなかった通知（dead）を送信待ちに戻す（outbox_ids / team_id で絞り込める）"""
+    wanted = set(outbox_ids) if outbox_ids is not None else None
+    now = time.time() if now is None else now
+    replayed: List[str] = []
+    for item in storage.list_outbox(OUTBOX_DEAD, limit=limit):
+        if wanted is not None and item['outbox_id'] not in wanted:
+            continue
+        if team_id and item['team_id'] != team_id:
+            continue
+        if storage.update_outbox(item['outbox_id'], OUTBOX_DEAD, item['attempts'],
+                                 {'state': OUTBOX_PENDING, 'due_at': int(now), 'attempts': 0, 'last_error': None}):
+            replayed.append(item['outbox_id'])
+    logger.info("送れなかった通知を送信待ちに戻しました: %d件", len(replayed))
+    return replayed
+
@@ -0,0 +1,84 @@
+import os
+import json
+import uuid
+import logging
+from typing import Dict, Any, Optional, Callable
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# 論理トピック名（SNSでは EventTopic / InteractiveTopic に対応）
+EVENTS = 'events'
+INTERACTIVE = 'interactive'
+
+
+def ordering_key(message: Dict[str, Any]) -> str:
+    """メッセージグループID（team_id:user_id）
+
+    同じ送信者の処理は順番に1件ずつ、異なる送信者の処理は並行に実行される。
+    ユーザーを伴わないイベント（app_installed など）はワークスペース単位で順序付ける。
+    """
+    return f"{message.get('team_id') or '-'}:{message.get('user_id') or '-'}"
+
+
+class SNSPublisher:
+    """通知メッセージを SNS トピックに送る（Lambda 構成）
+
+    FIFO トピック（ARN が .fifo で終わる）には ordering_key をメッセージグループIDとして付ける。
+    dedup_id を省略した場合は毎回異なるIDを付け、内容が同じ感謝も別々に処理する。
+    sns_client を省略すると最初の送信時に作る（import 時に AWS のリージョンを必要としない）。
+    """
+
+    def __init__(self, sns_client: Any = None, topic_arns: Optional[Dict[str, str]] = None) -> None:
+        self.sns_client = sns_client
+        self.topic_arns = topic_arns
+
+    def _client(self) -> Any:
+        if self.sns_client is None:
+            import boto3
+            self.sns_client = boto3.client('sns')
+        return self.sns_client
+
+    def _topic_arn(self, topic: str) -> str:
+        if self.topic_arns is not None:
+            return self.topic_arns[topic]
+        # 環境変数はテストなどで差し替えられるので呼び出し時に読む
+        return os.environ['SNS_POINTS_TOPIC_ARN' if topic == EVENTS else 'SNS_INTERACTIVE_TOPIC_ARN']
+
+    def publish(self, topic: str, message: Dict[str, Any], dedup_id: Optional[str] = None) -> None:
+        topic_arn = self._topic_arn(topic)
+        kwargs: Dict[str, Any] = {}
+        if topic_arn.endswith('.fifo'):
+            kwargs['MessageGroupId'] = ordering_key(message)
+            kwargs['MessageDeduplicationId'] = dedup_id or uuid.uuid4().hex
+        self._client().publish(
+            TopicArn=topic_arn,
+            Message=json.dumps(message),
+            **kwargs
+        )
+
+
+class CallbackPublisher:
+    """通知メッセージを同じプロセス内のコールバックに渡す（Socket Mode サーバー構成）
+
+    コールバックには (topic, message, group_id) を渡す。順序付けは受け取り側で行う。
+    """
+
+    def __init__(self, callback: Callable[[str, Dict[str, Any], str], None]) -> None:
+        self.callback = callback
+
+    def publish(self, topic: str, message: Dict[str, Any], dedup_id: Optional[str] = None) -> None:
+        # SNS を経由した場合と同じく JSON で往復させ、呼び出し側との共有を避ける
+        self.callback(topic, json.loads(json.dumps(message)), ordering_key(message))
+
+
+def topic_for_arn(topic_arn: str, stack_name: Optional[str] = None) -> Optional[str]:
+    """SNS トピックARNを論理トピック名に変換"""
+    stack_name = stack_name or os.environ['STACK_NAME']
+    name = topic_arn[:-len('.fifo')] if topic_arn.endswith('.fifo') else topic_arn
+    if name.endswith(f"{stack_name}-events"):
+        return EVENTS
+    if name.endswith(f"{stack_name}-interactive"):
+        return INTERACTIVE
+    return None
@@ -0,0 +1,150 @@
+"""入口（event_handler）でのポイント付与要求の流量制限
+
+ユーザーごと・ワークスペースごとにスライディングウィンドウで付与の試行回数を数え、上限を超えた
+要求は SNS に渡す前に破棄する。ウィンドウは GRANT_RATE_WINDOW_SECONDS 秒の区間2つ（現在と直前）の
+件数から「直前の区間の残り割合 × 直前の件数 + 現在の件数」で見積もる。
+
+件数は Storage.count_requests の共有カウンター（コンテナ間で共有）で数え、コンテナのメモリにも
+控える。共有カウンターで上限を超えたと分かった区間の残りは I/O なしで破棄する（ボットのループでも、
+1コンテナ・1区間あたり共有カウンターへの書き込みは上限+1回まで）。共有カウンターが使えない場合は通す。
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Callable, NamedTuple, Tuple
+
+from lib.storage import Storage
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# ウィンドウの長さ（秒）と、ウィンドウあたりの付与の試行回数の上限（0 なら制限しない）
+GRANT_RATE_WINDOW_SECONDS: float = float(os.environ.get('GRANT_RATE_WINDOW_SECONDS', '60'))
+GRANT_RATE_PER_USER: int = int(os.environ.get('GRANT_RATE_PER_USER', '10'))
+GRANT_RATE_PER_WORKSPACE: int = int(os.environ.get('GRANT_RATE_PER_WORKSPACE', '300'))
+# 破棄し始めたときに本人へ DM で知らせるか（ウィンドウごとに1回）
+GRANT_RATE_NOTIFY: bool = os.environ.get('GRANT_RATE_NOTIFY', 'false').lower() == 'true'
+
+# メモリに控えるキーの数の上限（古いものから捨てる）
+MAX_TRACKED_KEYS = 10000
+
+
+class RateDecision(NamedTuple):
+    allowed: bool
+    # このウィンドウで初めて上限を超えた要求（通知する場合に使う）
+    first_rejection: bool = False
+
+
+ALLOWED = RateDecision(True)
+
+
+class SlidingWindowLimiter:
+    """キーごとのスライディングウィンドウ（メモリの件数と共有カウンター）"""
+
+    def __init__(self, storage: Storage, limit: int, window_seconds: float = GRANT_RATE_WINDOW_SECONDS,
+                 clock: Callable[[], float] = time.time) -> None:
+        self.storage = storage
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.clock = clock
+        # key -> (区間番号, 現在の区間の件数, 直前の区間の件数, 破棄し続ける区間番号)
+        self._local: 'OrderedDict[str, Tuple[int, int, int, Optional[int]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _position(self) -> Tuple[int, float]:
+        """現在の区間番号と、区間内の経過割合"""
+        now = self.clock() / self.window_seconds
+        bucket = int(now)
+        return bucket, now - bucket
+
+    def _estimate(self, current: int, previous: int, elapsed: float) -> float:
+        return previous * (1 - elapsed) + current
+
+    def _local_state(self, key: str, bucket: int) -> Tuple[int, int, Optional[int]]:
+        state = self._local.get(key)
+        if state is None or state[0] < bucket - 1:
+            return 0, 0, None
+        if state[0] == bucket - 1:
+            return 0, state[1], None
+        return state[1], state[2], state[3]
+
+    def _remember(self, key: str, bucket: int, current: int, previous: int, blocked: Optional[int]) -> None:
+        self._local[key] = (bucket, current, previous, blocked)
+        self._local.move_to_end(key)
+        while len(self._local) > MAX_TRACKED_KEYS:
+            self._local.popitem(last=False)
+
+    def blocked(self, key: str) -> bool:
+        """I/O なしで破棄してよいか（この区間で上限を超えたと分かっている）"""
+        if self.limit <= 0:
+            return False
+        bucket, _ = self._position()
+        with self._lock:
+            return self._local_state(key, bucket)[2] == bucket
+
+    def hit(self, key: str) -> RateDecision:
+        """1回の試行を数え、通してよいかを返す"""
+        if self.limit <= 0:
+            return ALLOWED
+        bucket, elapsed = self._position()
+        with self._lock:
+            if self._local_state(key, bucket)[2] == bucket:
+                return RateDecision(False)
+        # メモリの件数だけで上限を超えている場合も、コンテナ全体で初めての破棄かを知るため1回は数える
+        try:
+            shared_current, shared_previous = self.storage.count_requests(
+                key, bucket, ttl_seconds=int(self.window_seconds * 3))
+        except Exception as e:
+            logger.error(f"Error counting requests: {str(e)}")
+            return ALLOWED
+        estimate = self._estimate(shared_current, shared_previous, elapsed)
+        allowed = estimate <= self.limit
+        with self._lock:
+            current, previous, _ = self._local_state(key, bucket)
+            self._remember(key, bucket, max(current + 1, shared_current), max(previous, shared_previous),
+                           None if allowed else bucket)
+        if allowed:
+            return ALLOWED
+        # 共有カウンターで上限をまたいだのはコンテナ全体で1回だけ
+        return RateDecision(False, first_rejection=estimate - 1 <= self.limit)
+
+
+class GrantRateLimiter:
+    """ポイント付与の試行をユーザーごと・ワークスペースごとに制限する"""
+
+    def __init__(self, storage: Storage, per_user: int = GRANT_RATE_PER_USER,
+                 per_workspace: int = GRANT_RATE_PER_WORKSPACE,
+                 window_seconds: float = GRANT_RATE_WINDOW_SECONDS,
+                 clock: Callable[[], float] = time.time) -> None:
+        self.users = SlidingWindowLimiter(storage, per_user, window_seconds, clock)
+        self.workspaces = SlidingWindowLimiter(storage, per_workspace, window_seconds, clock)
+
+    @staticmethod
+    def _keys(team_id: Optional[str], user_id: Optional[str]) -> Tuple[str, str]:
+        return f'user#{team_id}#{user_id}', f'workspace#{team_id}'
+
+    def blocked(self, team_id: Optional[str], user_id: Optional[str]) -> Optional[str]:
+        """I/O なしで破棄できる場合はその範囲（'user' / 'workspace'）"""
+        user_key, workspace_key = self._keys(team_id, user_id)
+        if self.users.blocked(user_key):
+            return 'user'
+        if self.workspaces.blocked(workspace_key):
+            return 'workspace'
+        return None
+
+    def acquire(self, team_id: Optional[str], user_id: Optional[str]) -> Tuple[Optional[str], bool]:
+        """(破棄する範囲 または None, このウィンドウで初めての破棄か)
+
+        ユーザーの上限で破棄した試行はワークスペースの件数に数えない（他のユーザーの付与を妨げない）。
+        """
+        user_key, workspace_key = self._keys(team_id, user_id)
+        decision = self.users.hit(user_key)
+        if not decision.allowed:
+            return 'user', decision.first_rejection
+        decision = self.workspaces.hit(workspace_key)
+        if not decision.allowed:
+            return 'workspace', decision.first_rejection
+        return None, False
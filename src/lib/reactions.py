@@ -0,0 +1,139 @@
+import os
+import time
+import logging
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+
+from lib.storage import Storage
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# ワークスペースで設定がない場合に感謝として扱う絵文字（:pray: は 🙏）
+DEFAULT_REACTIONS: Tuple[str, ...] = ('pray', 'thankyou', 'thank_you', 'arigatou')
+
+# まとめて書き込む単位（秒）
+WINDOW_SECONDS: int = int(os.environ.get('REACTION_WINDOW_SECONDS', '60'))
+
+# 書き込まれなかったバッファが残り続けないよう TTL を付ける（秒）
+BUFFER_TTL_SECONDS: int = 24 * 60 * 60
+
+REACTION_MESSAGE = 'リアクションで感謝'
+
+
+def window_id(event_ts: float, window_seconds: int = WINDOW_SECONDS) -> str:
+    """イベント時刻が属するウィンドウの開始時刻（エポック秒、10桁固定で辞書順=時刻順）"""
+    return f"{int(event_ts) // window_seconds * window_seconds:010d}"
+
+
+def is_thanks_reaction(reaction: str, workspace_data: Dict[str, Any]) -> bool:
+    """感謝リアクションかどうか（肌の色の違い :pray::skin-tone-2: も同じ絵文字として扱う）"""
+    name = reaction.split('::', 1)[0]
+    return name in (workspace_data.get('thanks_reactions') or DEFAULT_REACTIONS)
+
+
+class ReactionBuffer:
+    """reaction_added / reaction_removed をストレージ（DynamoDB では -reactions テーブル）に一時保存する
+
+    キーは (window_id, 送信者#受信者#チャンネル:ts#絵文字)。同じリアクションの重複
+    イベントは同じアイテムへの上書きになり、reaction_removed はアイテムを削除する
+    （追加と取り消しが同じウィンドウ内なら何も書き込まれない）。
+    """
+
+    def __init__(self, storage: Storage, window_seconds: int = WINDOW_SECONDS) -> None:
+        self.storage = storage
+        self.window_seconds = window_seconds
+
+    @staticmethod
+    def reaction_key(event: Dict[str, Any]) -> Optional[str]:
+        item = event.get('item', {})
+        from_user, to_user = event.get('user'), event.get('item_user')
+        if item.get('type') != 'message' or not from_user or not to_user or from_user == to_user:
+            return None
+        return f"{from_user}#{to_user}#{item['channel']}:{item['ts']}#{event['reaction']}"
+
+    def record(self, event: Dict[str, Any], team_id: str) -> bool:
+        """リアクションイベントをバッファに反映。対象外のイベントなら False"""
+        key = self.reaction_key(event)
+        if key is None:
+            return False
+        event_ts = float(event.get('event_ts') or time.time())
+        current = window_id(event_ts, self.window_seconds)
+
+        if event['type'] == 'reaction_removed':
+            # 直前のウィンドウはまだ書き込まれていないので、そちらの追加も取り消す
+            previous = window_id(event_ts - self.window_seconds, self.window_seconds)
+            for window in (current, previous):
+                self.storage.delete_reaction(window, key)
+            logger.info("リアクションを取り消しました: %s", key)
+            return True
+
+        self.storage.put_reaction({
+            'window_id': current,
+            'reaction_key': key,
+            'team_id': team_id,
+            'from_user': event['user'],
+            'to_user': event['item_user'],
+            'reaction': event['reaction'],
+            'expires_at': int(event_ts) + BUFFER_TTL_SECONDS,
+        })
+        logger.info("リアクションをバッファしました: window=%s key=%s", current, key)
+        return True
+
+    def closed_windows(self, now: Optional[float] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """書き込み可能になったウィンドウのアイテム
+
+        取り消しが届く猶予として、終了からさらに1ウィンドウ分経過したものだけを返す。
+        """
+        now = time.time() if now is None else now
+        cutoff = window_id(now - 2 * self.window_seconds, self.window_seconds)
+        windows: Dict[str, List[Dict[str, Any]]] = {}
+        for item in self.storage.get_reactions(cutoff):
+            windows.setdefault(item['window_id'], []).append(item)
+        return dict(sorted(windows.items()))
+
+    def discard(self, items: Iterable[Dict[str, Any]]) -> None:
+        self.storage.delete_reactions(list(items))
+
+
+class ReactionCoalescer:
+    """閉じたウィンドウのリアクションを、ウィンドウごとに1回のトランザクションで書き込む"""
+
+    def __init__(self, buffer: ReactionBuffer, db_manager: Storage) -> None:
+        self.buffer = buffer
+        self.db_manager = db_manager
+
+    @staticmethod
+    def group(items: Iterable[Dict[str, Any]]) -> Dict[str, List[Tuple[str, str]]]:
+        """送信者ごとの (受信者, チャンネル:ts)。同じメッセージへのリアクションは絵文字が違っても1ポイント
+
+        別のメッセージへのリアクションはそれぞれ1ポイントで、メッセージごとに1件の記録になる。
+        """
+        grants: Dict[str, Dict[Tuple[str, str], None]] = {}
+        for item in sorted(items, key=lambda i: i['reaction_key']):
+            # reaction_key は 送信者#受信者#チャンネル:ts#絵文字
+            message = item['reaction_key'].split('#')[2]
+            grants.setdefault(item['from_user'], {})[(item['to_user'], message)] = None
+        return {from_user: list(reactions) for from_user, reactions in grants.items()}
+
+    def flush(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """閉じたウィンドウを書き込み、送信者ごとの結果（通知用）を返す"""
+        outcomes: List[Dict[str, Any]] = []
+        for window, items in self.buffer.closed_windows(now).items():
+            # ワークスペースごとに1トランザクション（ユーザーは同じワークスペースのパーティションに入る）
+            by_team: Dict[str, List[Dict[str, Any]]] = {}
+            for item in items:
+                by_team.setdefault(item['team_id'], []).append(item)
+            for team_id, team_items in by_team.items():
+                grants = self.group(team_items)
+                results = self.db_manager.add_reaction_points(window, grants, message=REACTION_MESSAGE,
+                                                              team_id=team_id)
+                # 競合で書き込めなかった送信者の分はバッファに残して次回に持ち越す
+                retry = {from_user for from_user, result in results.items() if result.get('retryable')}
+                self.buffer.discard(item for item in team_items if item['from_user'] not in retry)
+                for from_user, result in results.items():
+                    if from_user not in retry:
+                        outcomes.append(dict(result, team_id=team_id, user_id=from_user, window_id=window))
+                logger.info("リアクションウィンドウを書き込みました: window=%s team_id=%s items=%d senders=%d",
+                            window, team_id, len(team_items), len(grants))
+        return outcomes
@@ -0,0 +1,94 @@
+"""感謝メッセージの全文検索（文字 n-gram の転置インデックス）
+
+日本語は単語の区切りがないため、NFKC 正規化・小文字化したテキストを記号と空白で区切り、
+各区間の文字 bigram と各文字（unigram）を索引語にする。問い合わせは bigram で引き、
+1文字だけの区間（「神」など）は unigram で引く。
+索引語はワークスペースと、付与の参加者（送信者・受信者）ごとに持つ:
+
+    term    = '{team_id}#{user_id}#{索引語}'
+    posting = '{timestamp}#{transaction_id}'  （新しい順に並べるため時刻を先頭に置く）
+
+検索は問い合わせの索引語すべてを含む付与（AND）を新しい順に取り出し、正規化した本文に
+問い合わせの各語がそのまま含まれるものだけを返す（bigram の偶然の一致を除く）。
+"""
+import re
+import unicodedata
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+# 1回の検索で引く索引語の上限（長い問い合わせは間引き、残りは本文の照合で確かめる）
+MAX_QUERY_TERMS = 8
+
+_SEGMENT = re.compile(r'\w+')
+
+
+def normalize(text: str) -> str:
+    """全角・半角と大文字・小文字を揃える"""
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def tokenize(text: str) -> Set[str]:
+    """問い合わせの索引語（文字 bigram。1文字だけの区間はその1文字）"""
+    tokens: Set[str] = set()
+    for segment in _SEGMENT.findall(normalize(text)):
+        if len(segment) == 1:
+            tokens.add(segment)
+            continue
+        tokens.update(segment[index:index + 2] for index in range(len(segment) - 1))
+    return tokens
+
+
+def index_tokens(text: str) -> Set[str]:
+    """本文の索引語（bigram に加えて、1文字の問い合わせで引けるよう各文字も索引する）"""
+    tokens = tokenize(text)
+    for segment in _SEGMENT.findall(normalize(text)):
+        tokens.update(segment)
+    return tokens
+
+
+def query_terms(query: str) -> List[str]:
+    """問い合わせの索引語（多い場合は均等に間引く）"""
+    terms = sorted(tokenize(query))
+    if len(terms) <= MAX_QUERY_TERMS:
+        return terms
+    step = len(terms) / MAX_QUERY_TERMS
+    return [terms[int(index * step)] for index in range(MAX_QUERY_TERMS)]
+
+
+def matches(record: Dict[str, Any], query: str) -> bool:
+    """問い合わせの各語（空白区切り）がすべて本文に含まれるか"""
+    message = normalize(record.get('message', ''))
+    return all(word in message for word in normalize(query).split())
+
+
+def posting(record: Dict[str, Any]) -> str:
+    return f"{record['timestamp']}#{record['transaction_id']}"
+
+
+def index_entries(record: Optional[Dict[str, Any]]) -> Set[Tuple[str, str]]:
+    """付与1件の (term, posting)。チーム不明・本文なし・取り消された付与は索引しない"""
+    if not record or not record.get('team_id') or record.get('status') in ('rolling_back', 'rolled_back'):
+        return set()
+    tokens = index_tokens(record.get('message', ''))
+    users = {record['from_user'], *record.get('to_users', [])}
+    return {(f"{record['team_id']}#{user_id}#{token}", posting(record)) for user_id in users for token in tokens}
+
+
+def render_results(query: str, results: List[Dict[str, Any]], user_id: str, user_names: Dict[str, str]) -> str:
+    """検索結果のモーダルの本文"""
+    if not results:
+        return f"「{query}」を含む感謝メッセージは見つかりませんでした"
+    lines = [f"🔍 *「{query}」の検索結果*（{len(results)}件）"]
+    for record in results:
+        if record['from_user'] == user_id:
+            names = '、'.join(user_names.get(to_user, to_user) for to_user in record['to_users'])
+            summary = f"{names}へ送りました"
+        else:
+            summary = f"{user_names.get(record['from_user'], record['from_user'])}から受け取りました"
+        lines.append(f"• {record['timestamp']}\n  {summary}\n  > {record.get('message', '')}")
+    return '\n'.join(lines) + '\n'
+
+
+def search_result(record: Dict[str, Any]) -> Dict[str, Any]:
+    """検索結果として返す項目"""
+    return {name: record[name] for name in
+            ('transaction_id', 'timestamp', 'from_user', 'to_users', 'message', 'channel_id') if name in record}
@@ -1,37 +1,62 @@
 from typing import List, Dict, Optional, Any,Tuple
-import re
 from slack_sdk.errors import SlackApiError
 from slack_sdk import WebClient
 import logging
+from lib.metrics import metrics, InstrumentedSlackClient
+from lib.structured_log import LazyPayload
+from lib.gratitude import get_matcher
+from lib.cache import TTLCache, ttl_from_env
+
+# トークンごとの SlackManager とワークスペース情報（team.info）をプロセス内で共有する
+_managers = TTLCache(maxsize=256, ttl=ttl_from_env('SLACK_CLIENT_CACHE_TTL', 300))
+_team_info = TTLCache(maxsize=256, ttl=ttl_from_env('SLACK_CLIENT_CACHE_TTL', 300))
+
+# モーダルの section ブロックの文字数と、モーダルのブロック数の上限
+MODAL_SECTION_LIMIT = 3000
+MODAL_MAX_BLOCKS = 100
+# 履歴モーダルの検索欄（Enter で block_actions が interactive_handler に届く）
+SEARCH_ACTION_ID = 'search_messages'
 
 class SlackManager:
     def __init__(self, token: str) -> None:
-        self.client = WebClient(token=token)
+        self.token = token
+        self.client = InstrumentedSlackClient(WebClient(token=token), metrics)
+        # ルートロガー（JSON形式）に伝播させる。インスタンスごとにハンドラーは追加しない
         self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(handler)
+
+    @classmethod
+    def for_token(cls, token: str) -> 'SlackManager':
+        """トークンごとに使い回すインスタンス（WebClientの生成を省く）"""
+        return _managers.get_or_load(token, lambda: cls(token))
 
     def send_dm(self, user_id: str, message: str) -> bool:
         """DMの送信"""
         try:
-            # DMチャンネルのオープン
-            response: Dict[str, Any] = self.client.conversations_open(users=[user_id])
-            channel_id: str = response['channel']['id']
-
-            # メッセージ送信
-            self.client.chat_postMessage(
-                channel=channel_id,
-                text=message,
-                parse='full'
-            )
+            self.deliver_dm(user_id, message)
             return True
 
         except SlackApiError as e:
             self.logger.error(f"Error sending DM: {str(e)}")
             return False
 
+    def deliver_dm(self, user_id: str, message: str, channel_id: Optional[str] = None) -> str:
+        """DMの送信（失敗は SlackApiError のまま送出する。lib.outbox が再試行を決める）
+
+        channel_id を渡すと conversations.open を省く。送った DM チャンネルのIDを返す。
+        """
+        if not channel_id:
+            # DMチャンネルのオープン
+            response: Dict[str, Any] = self.client.conversations_open(users=[user_id])
+            channel_id = response['channel']['id']
+
+        # メッセージ送信
+        self.client.chat_postMessage(
+            channel=channel_id,
+            text=message,
+            parse='full'
+        )
+        return channel_id
+
     def publish_home_tab(self, user_id: str, points: int = 0, remaining_points: int = 5) -> None:
         """ホームタブの表示"""
         try:
@@ -92,14 +117,71 @@ class SlackManager:
         except SlackApiError as e:
             self.logger.error(f"Error publishing home tab: {str(e)}")
 
+    @classmethod
+    def text_modal(cls, title: str, text: str, search: Optional[str] = None) -> Dict[str, Any]:
+        """本文だけのモーダル（section の text は3000文字までのため、行単位で分ける）
+
+        search に文字列（空文字を含む）を渡すと、その値を入れた検索欄を先頭に置く。
+        """
+        chunks: List[str] = []
+        for line in text.splitlines(keepends=True):
+            if chunks and len(chunks[-1]) + len(line) <= MODAL_SECTION_LIMIT:
+                chunks[-1] += line
+            else:
+                chunks.append(line[:MODAL_SECTION_LIMIT])
+        blocks: List[Dict[str, Any]] = [] if search is None else [cls.search_block(search)]
+        blocks.extend({"type": "section", "text": {"type": "mrkdwn", "text": chunk}}
+                      for chunk in chunks[:MODAL_MAX_BLOCKS - len(blocks)])
+        return {
+            "type": "modal",
+            "title": {"type": "plain_text", "text": title},
+            "close": {"type": "plain_text", "text": "閉じる"},
+            "blocks": blocks
+        }
+
+    @classmethod
+    def search_block(cls, query: str = '') -> Dict[str, Any]:
+        """感謝メッセージの検索欄"""
+        element: Dict[str, Any] = {
+            "type": "plain_text_input",
+            "action_id": SEARCH_ACTION_ID,
+            "placeholder": {"type": "plain_text", "text": "例: リリース"},
+            "dispatch_action_config": {"trigger_actions_on": ["on_enter_pressed"]}
+        }
+        if query:
+            element["initial_value"] = query
+        return {
+            "type": "input",
+            "block_id": "search",
+            "dispatch_action": True,
+            "optional": True,
+            "label": {"type": "plain_text", "text": "🔍 メッセージを検索"},
+            "element": element
+        }
+
+    def open_modal(self, trigger_id: str, view: Dict[str, Any]) -> Optional[str]:
+        """モーダルを開き、views.update で書き換えるための view_id を返す（trigger_id は3秒で失効する）"""
+        try:
+            response: Dict[str, Any] = self.client.views_open(trigger_id=trigger_id, view=view)
+            return response['view']['id']
+        except SlackApiError as e:
+            self.logger.error(f"Error opening modal: {str(e)}")
+            return None
+
+    def update_modal(self, view_id: str, view: Dict[str, Any]) -> bool:
+        """開いているモーダルの書き換え（閉じられている場合は False）"""
+        try:
+            self.client.views_update(view_id=view_id, view=view)
+            return True
+        except SlackApiError as e:
+            self.logger.error(f"Error updating modal: {str(e)}")
+            return False
+
     @classmethod
     def extract_mentions(cls, text: str) -> Tuple[List[str], str]:
-        """メンションの抽出"""
-        # メンションパターン: <@USER_ID>
-        mention_pattern: str = r'<@([A-Z0-9]+)>'
-        mentions: List[str] = re.findall(mention_pattern, text)
-        text_without_mentions: str = re.sub(mention_pattern, '', text)
-        return list(set(mentions)), text_without_mentions  # 重複を除去
+        """メンションの抽出（マークアップを除去したテキストも返す）"""
+        result = get_matcher().scan(text)
+        return result.mentions, result.text  # 重複は除去済み
 
     def get_user_info(self, user_id: str) -> Optional[Dict[str, Any]]:
         """ユーザー情報の取得"""
@@ -110,12 +192,14 @@ class SlackManager:
             self.logger.error(f"Error getting user info: {str(e)}")
             return None
 
-    def post_message(self, channel_id: str, message: str) -> Optional[Dict[str, Any]]:
-        """チャンネルへのメッセージ送信"""
+    def post_message(self, channel_id: str, message: str,
+                     blocks: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+        """チャンネルへのメッセージ送信（blocks がある場合 message は通知用の代替テキスト）"""
         try:
             response: Dict[str, Any] = self.client.chat_postMessage(
                 channel=channel_id,
                 text=message,
+                blocks=blocks,
                 parse='full'
             )
             return response
@@ -140,9 +224,13 @@ class SlackManager:
             return message_type  # カスタムメッセージをそのまま返す
 
     def get_workspace_info(self) -> Optional[Dict[str, Any]]:
-        """ワークスペース情報の取得"""
+        """ワークスペース情報の取得（名前・ドメインはほぼ変わらないのでキャッシュする）"""
+        cached = _team_info.get(self.token)
+        if cached is not None:
+            return cached
         try:
             response: Dict[str, Any] = self.client.team_info()
+            _team_info.set(self.token, response['team'])
             return response['team']
         except SlackApiError as e:
             self.logger.error(f"Error getting workspace info: {str(e)}")
@@ -163,7 +251,7 @@ class SlackManager:
         """ユーザーのプロファイル情報を取得"""
         try:
             response: Dict[str, Any] = self.client.users_info(user=user_id)
-            self.logger.info(f"response: {response}")
+            self.logger.debug("response: %s", LazyPayload(response))
             user_info = response['user']
             profile = user_info['profile']
             return {
@@ -0,0 +1,761 @@
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Union, Iterator, Tuple, Callable
+
+from lib.user_info import UserInfo
+from lib.storage import Storage
+from lib.metrics import metrics
+from lib.structured_log import LazyPayload
+from lib.codec import request_transaction_id
+from lib import search
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# 1日に付与できるポイントの上限（lib.db と同じ）
+DAILY_POINT_LIMIT = 5
+
+_USER_FIELDS = ('user_id', 'team_id', 'user_name', 'real_name', 'display_name', 'email',
+                'total_points', 'daily_points_given', 'last_reset_date')
+
+# 付与の参加者の履歴スナップショットを無効化（lib.db の INVALIDATE_HISTORY と同じ）
+_INVALIDATE_HISTORY = 'history_snapshot = NULL, history_version = history_version + 1'
+
+# 既存のデータベースファイルに後から追加した列（テーブルごと）
+_ADDED_COLUMNS = {
+    'users': {
+        'history_snapshot': 'TEXT',
+        'history_version': 'INTEGER NOT NULL DEFAULT 0',
+        'history_cached_at': 'INTEGER NOT NULL DEFAULT 0',
+    },
+    'transactions': {
+        'channel_id': 'TEXT',
+    },
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    team_id TEXT,
+    user_name TEXT,
+    real_name TEXT,
+    display_name TEXT,
+    email TEXT,
+    total_points INTEGER NOT NULL DEFAULT 0,
+    daily_points_given INTEGER NOT NULL DEFAULT 0,
+    last_reset_date TEXT,
+    history_snapshot TEXT,
+    history_version INTEGER NOT NULL DEFAULT 0,
+    history_cached_at INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS users_team ON users (team_id, user_id);
+
+CREATE TABLE IF NOT EXISTS workspaces (
+    workspace_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id TEXT PRIMARY KEY,
+    team_id TEXT,
+    from_user TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    message TEXT NOT NULL DEFAULT '',
+    source TEXT,
+    channel_id TEXT
+);
+CREATE INDEX IF NOT EXISTS transactions_sender ON transactions (from_user, timestamp);
+CREATE INDEX IF NOT EXISTS transactions_team_time ON transactions (team_id, timestamp);
+CREATE INDEX IF NOT EXISTS transactions_time ON transactions (timestamp);
+
+CREATE TABLE IF NOT EXISTS transaction_recipients (
+    transaction_id TEXT NOT NULL REFERENCES transactions (transaction_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    to_user TEXT NOT NULL,
+    PRIMARY KEY (transaction_id, position)
+);
+CREATE INDEX IF NOT EXISTS transaction_recipients_user ON transaction_recipients (to_user, transaction_id);
+
+CREATE TABLE IF NOT EXISTS reactions (
+    window_id TEXT NOT NULL,
+    reaction_key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (window_id, reaction_key)
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS usage (
+    team_id TEXT NOT NULL,
+    period TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (period, team_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS rate_limits (
+    limit_key TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (limit_key, bucket)
+);
+
+-- day は 'YYYY-MM-DD' または通算の 'all'
+CREATE TABLE IF NOT EXISTS channel_stats (
+    team_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    thanks INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (team_id, day, channel_id)
+);
+CREATE INDEX IF NOT EXISTS channel_stats_thanks ON channel_stats (team_id, day, thanks);
+
+-- 検索インデックス（lib.search）
+CREATE TABLE IF NOT EXISTS search_postings (
+    term TEXT NOT NULL,
+    posting TEXT NOT NULL,
+    transaction_id TEXT NOT NULL,
+    PRIMARY KEY (term, posting)
+) WITHOUT ROWID;
+
+-- Slack への通知の送信待ち（lib.outbox）
+CREATE TABLE IF NOT EXISTS outbox (
+    outbox_id TEXT PRIMARY KEY,
+    team_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    state TEXT NOT NULL,
+    due_at INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at INTEGER NOT NULL,
+    sent_at INTEGER,
+    expires_at INTEGER,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (state, due_at);
+"""
+
+_OUTBOX_COLUMNS = ('outbox_id', 'team_id', 'kind', 'user_id', 'text', 'state', 'due_at', 'attempts',
+                   'created_at', 'sent_at', 'expires_at', 'last_error')
+
+
+class SQLiteStorage(Storage):
+    """SQLite によるストレージ（AWS なしのセルフホスト構成・ローカル検証用）
+
+    WAL モードで、読み取りは書き込みを待たない。ポイント付与は BEGIN IMMEDIATE で
+    書き込みロックを先に取るため、DynamoDB 版のような競合リトライは起きない。
+    接続はスレッドごとに持つ（Socket Mode サーバーのワーカーから並行に使える）。
+    """
+
+    def __init__(self, path: str = 'kansya.db', timeout: float = 30.0) -> None:
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+            self._migrate(conn)
+        logger.info("SQLiteStorage initialized: %s", path)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection) -> None:
+        """既存のデータベースファイルに後から追加した列を足す"""
+        for table, added in _ADDED_COLUMNS.items():
+            columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            for name, definition in added.items():
+                if name not in columns:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        yield conn
+
+    @contextmanager
+    def _write(self, operation: str) -> Iterator[sqlite3.Connection]:
+        """書き込みロックを先に取るトランザクション"""
+        with self._connection() as conn, metrics.timed('sqlite', operation):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def _query(self, operation: str, sql: str, params: Tuple[Any, ...] = ()) -> List[sqlite3.Row]:
+        with self._connection() as conn, metrics.timed('sqlite', operation):
+            return conn.execute(sql, params).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    # ユーザー
+
+    @staticmethod
+    def _user_from_row(row: sqlite3.Row) -> UserInfo:
+        return UserInfo.from_dict({k: row[k] for k in _USER_FIELDS if row[k] is not None})
+
+    def get_user_data(self, user_id: str) -> Optional[UserInfo]:
+        """ユーザーデータの取得"""
+        rows = self._query('get_user', 'SELECT * FROM users WHERE user_id = ?', (user_id,))
+        if not rows:
+            logger.info("User data not found for user_id: %s", user_id)
+            return None
+        return self._user_from_row(rows[0])
+
+    def get_users_data(self, user_ids: List[str]) -> List[Optional[UserInfo]]:
+        """複数のユーザー情報を取得（1回のクエリ）"""
+        if not user_ids:
+            return []
+        placeholders = ','.join('?' * len(user_ids))
+        rows = self._query('get_users', f'SELECT * FROM users WHERE user_id IN ({placeholders})', tuple(user_ids))
+        by_id = {row['user_id']: self._user_from_row(row) for row in rows}
+        return [by_id[user_id] for user_id in user_ids if user_id in by_id]
+
+    def save_or_update_user_profile(self, user_profile: Union[Dict[str, Any], UserInfo]) -> None:
+        """ユーザープロファイルを保存または更新（既存のポイントは保持する）"""
+        try:
+            user_info = UserInfo.from_dict(user_profile) if isinstance(user_profile, dict) else user_profile
+            data = user_info.to_dict()
+            with self._write('save_user') as conn:
+                conn.execute(
+                    f"INSERT INTO users ({', '.join(_USER_FIELDS)}) VALUES ({', '.join('?' * len(_USER_FIELDS))}) "
+                    "ON CONFLICT (user_id) DO UPDATE SET team_id = excluded.team_id, user_name = excluded.user_name, "
+                    "real_name = excluded.real_name, display_name = excluded.display_name, email = excluded.email",
+                    tuple(data[field] for field in _USER_FIELDS))
+            logger.info("User profile saved/updated for user_id: %s", user_info.user_id)
+        except Exception as e:
+            logger.error(f"Error saving/updating user profile: {str(e)}")
+
+    def get_team_user_ids(self, team_id: str) -> List[str]:
+        rows = self._query('get_team_users', 'SELECT user_id FROM users WHERE team_id = ? ORDER BY user_id',
+                           (team_id,))
+        return [row['user_id'] for row in rows]
+
+    # ワークスペース
+
+    def get_workspace_data(self, team_id: str) -> Dict[str, Any]:
+        """ワークスペースデータの取得"""
+        rows = self._query('get_workspace', 'SELECT data FROM workspaces WHERE workspace_id = ?', (team_id,))
+        workspace_data = json.loads(rows[0]['data']) if rows else {}
+        logger.debug("Workspace data fetched: %s", LazyPayload(workspace_data))
+        return workspace_data
+
+    def save_workspace_data(self, workspace_data: Dict[str, Any]) -> None:
+        with self._write('save_workspace') as conn:
+            conn.execute('INSERT OR REPLACE INTO workspaces (workspace_id, data) VALUES (?, ?)',
+                         (workspace_data['workspace_id'], json.dumps(workspace_data, ensure_ascii=False, default=str)))
+
+    def get_workspace_ids(self) -> List[str]:
+        return [row['workspace_id'] for row in
+                self._query('get_workspaces', 'SELECT workspace_id FROM workspaces ORDER BY workspace_id')]
+
+    def get_token_record(self, team_id: str) -> Dict[str, Any]:
+        workspace_data = self.get_workspace_data(team_id)
+        return {key: workspace_data[key] for key in
+                ('access_token', 'refresh_token', 'token_expires_at', 'token_lease_until') if key in workspace_data}
+
+    def _update_workspace(self, operation: str, team_id: str,
+                          update: Callable[[Dict[str, Any]], bool]) -> bool:
+        """ワークスペースデータ（JSON）を書き込みロック内で読み、update が True を返したら保存"""
+        with self._write(operation) as conn:
+            row = conn.execute('SELECT data FROM workspaces WHERE workspace_id = ?', (team_id,)).fetchone()
+            if row is None:
+                return False
+            workspace_data = json.loads(row['data'])
+            if not update(workspace_data):
+                return False
+            conn.execute('UPDATE workspaces SET data = ? WHERE workspace_id = ?',
+                         (json.dumps(workspace_data, ensure_ascii=False, default=str), team_id))
+            return True
+
+    def acquire_token_lease(self, team_id: str, owner: str, until: float, now: float) -> bool:
+        def update(workspace_data: Dict[str, Any]) -> bool:
+            if workspace_data.get('token_lease_until', 0) >= int(now):
+                return False
+            workspace_data.update(token_lease_owner=owner, token_lease_until=int(until))
+            return True
+        return self._update_workspace('acquire_token_lease', team_id, update)
+
+    def save_rotated_token(self, team_id: str, owner: str, access_token: str,
+                           refresh_token: str, expires_at: float) -> bool:
+        def update(workspace_data: Dict[str, Any]) -> bool:
+            if workspace_data.get('token_lease_owner') != owner:
+                return False
+            workspace_data.pop('token_lease_owner')
+            workspace_data.pop('token_lease_until', None)
+            workspace_data.update(access_token=access_token, refresh_token=refresh_token,
+                                  token_expires_at=int(expires_at))
+            return True
+        return self._update_workspace('save_rotated_token', team_id, update)
+
+    # ポイント付与
+
+    @staticmethod
+    def _insert_transaction(conn: sqlite3.Connection, transaction_id: str, from_user: str, to_users: List[str],
+                            timestamp: str, message: str, team_id: Optional[str],
+                            source: Optional[str] = None, channel_id: Optional[str] = None) -> None:
+        conn.execute(
+            'INSERT INTO transactions (transaction_id, team_id, from_user, points, timestamp, message, source, '
+            'channel_id) VALUES (?, ?, ?, 1, ?, ?, ?, ?)',
+            (transaction_id, team_id, from_user, timestamp, message, source, channel_id))
+        conn.executemany(
+            'INSERT INTO transaction_recipients (transaction_id, position, to_user) VALUES (?, ?, ?)',
+            [(transaction_id, position, to_user) for position, to_user in enumerate(to_users)])
+
+    @staticmethod
+    def _credit(conn: sqlite3.Connection, from_user: str, to_users: List[str], team_id: Optional[str]) -> None:
+        """送信者の日次ポイントと受信者の合計ポイントを加算"""
+        conn.execute(
+            'INSERT INTO users (user_id, team_id, daily_points_given, history_version) VALUES (?, ?, ?, 1) '
+            'ON CONFLICT (user_id) DO UPDATE SET daily_points_given = daily_points_given + excluded.daily_points_given, '
+            f'team_id = COALESCE(team_id, excluded.team_id), {_INVALIDATE_HISTORY}',
+            (from_user, team_id, len(to_users)))
+        conn.executemany(
+            'INSERT INTO users (user_id, team_id, total_points, history_version) VALUES (?, ?, 1, 1) '
+            'ON CONFLICT (user_id) DO UPDATE SET total_points = total_points + 1, '
+            f'team_id = COALESCE(team_id, excluded.team_id), {_INVALIDATE_HISTORY}',
+            [(to_user, team_id) for to_user in to_users])
+
+    @staticmethod
+    def _daily_points(conn: sqlite3.Connection, user_id: str) -> int:
+        row = conn.execute('SELECT daily_points_given FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row['daily_points_given'] if row else 0
+
+    def add_points(self, from_user: str, to_users: List[str], message: str = '',
+                   team_id: Optional[str] = None, channel_id: Optional[str] = None,
+                   request_id: Optional[str] = None) -> Dict[str, Any]:
+        """ポイントの付与（日次上限の確認と書き込みを1トランザクションで行う）"""
+        to_users = [user for user in to_users if user != from_user]
+        if not to_users:
+            logger.info("No valid recipients after excluding the sender: %s", from_user)
+            rows = self._query('daily_points', 'SELECT daily_points_given FROM users WHERE user_id = ?', (from_user,))
+            return {
+                'success': False,
+                'error_message': '送信者が受信者と同一でした',
+                'daily_points_given': rows[0]['daily_points_given'] if rows else 0
+            }
+
+        daily_points_given = 0
+        with metrics.timed('grant', 'add_points') as metric:
+            try:
+                with self._write('add_points') as conn:
+                    daily_points_given = self._daily_points(conn, from_user)
+                    transaction_id = request_transaction_id(team_id, request_id) if request_id else str(uuid.uuid4())
+                    if request_id and conn.execute('SELECT 1 FROM transactions WHERE transaction_id = ?',
+                                                   (transaction_id,)).fetchone():
+                        # 同じ要求は書き込み済み（再配信）
+                        logger.info("Grant already recorded for this request: %s", transaction_id)
+                        return {
+                            'success': True,
+                            'duplicate': True,
+                            'daily_points_given': daily_points_given,
+                            'transaction_id': transaction_id
+                        }
+                    if daily_points_given + len(to_users) > DAILY_POINT_LIMIT:
+                        logger.warning("Daily points limit exceeded for user: %s", from_user)
+                        return {
+                            'success': False,
+                            'error_message': '本日の付与可能ポイントを超過しています',
+                            'daily_points_given': daily_points_given
+                        }
+                    timestamp = datetime.now().isoformat()
+                    self._insert_transaction(conn, transaction_id, from_user, to_users,
+                                             timestamp, message, team_id,
+                                             channel_id=channel_id)
+                    self._credit(conn, from_user, to_users, team_id)
+                    self._write_index(conn, search.index_entries({
+                        'transaction_id': transaction_id, 'team_id': team_id, 'from_user': from_user,
+                        'to_users': to_users, 'timestamp': timestamp, 'message': message}), transaction_id)
+                    if team_id and channel_id:
+                        conn.executemany(
+                            'INSERT INTO channel_stats (team_id, day, channel_id, thanks, points) '
+                            'VALUES (?, ?, ?, 1, ?) ON CONFLICT (team_id, day, channel_id) '
+                            'DO UPDATE SET thanks = thanks + 1, points = points + excluded.points',
+                            [(team_id, day, channel_id, len(to_users)) for day in ('all', timestamp[:10])])
+                logger.info("Transaction executed successfully")
+                return {
+                    'success': True,
+                    'daily_points_given': daily_points_given + len(to_users),
+                    'transaction_id': transaction_id
+                }
+            except sqlite3.Error as e:
+                logger.error(f"Error adding points: {str(e)}")
+                metric['error'] = type(e).__name__
+                return {
+                    'success': False,
+                    'error_message': 'データベース更新中にエラーが発生しました',
+                    'daily_points_given': daily_points_given
+                }
+
+    def add_reaction_points(self, window_id: str, grants: Dict[str, List[Tuple[str, str]]],
+                            message: str = '', team_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """リアクションによるポイント付与をウィンドウ単位で1トランザクションに書き込む（メッセージごとに1件の記録）"""
+        prefix = f"reaction#{window_id}#{team_id}" if team_id else f"reaction#{window_id}"
+        results: Dict[str, Dict[str, Any]] = {}
+        with metrics.timed('grant', 'add_reaction_points') as metric:
+            try:
+                with self._write('add_reaction_points') as conn:
+                    timestamp = datetime.now().isoformat()
+                    for from_user, reactions in grants.items():
+                        recipients = [reaction for reaction in reactions if reaction[0] != from_user]
+                        # 送信者ごとの通知のID（記録はメッセージごとに {transaction_id}#{受信者}#{チャンネル:ts}）
+                        transaction_id = f"{prefix}#{from_user}"
+                        if not recipients:
+                            results[from_user] = {'success': False, 'error_message': '送信者が受信者と同一でした'}
+                            continue
+                        existing = conn.execute('SELECT 1 FROM transactions WHERE transaction_id = ?',
+                                                ('#'.join((transaction_id,) + recipients[0]),)).fetchone()
+                        daily_points_given = self._daily_points(conn, from_user)
+                        if existing:
+                            # 前回の実行で書き込み済み
+                            results[from_user] = {
+                                'success': True, 'duplicate': True, 'daily_points_given': daily_points_given,
+                                'transaction_id': transaction_id, 'to_users': [to for to, _ in recipients]
+                            }
+                            continue
+                        allowed = recipients[:max(DAILY_POINT_LIMIT - daily_points_given, 0)]
+                        if not allowed:
+                            logger.warning("Daily points limit exceeded for user: %s", from_user)
+                            results[from_user] = {
+                                'success': False,
+                                'error_message': '本日の付与可能ポイントを超過しています',
+                                'daily_points_given': daily_points_given
+                            }
+                            continue
+                        for to_user, reacted in allowed:
+                            self._insert_transaction(conn, f"{transaction_id}#{to_user}#{reacted}", from_user,
+                                                     [to_user], timestamp, message, team_id, source='reaction',
+                                                     channel_id=reacted.split(':', 1)[0])
+                        to_users = [to_user for to_user, _ in allowed]
+                        self._credit(conn, from_user, to_users, team_id)
+                        results[from_user] = {
+                            'success': True, 'daily_points_given': daily_points_given + len(allowed),
+                            'transaction_id': transaction_id, 'to_users': to_users
+                        }
+            except sqlite3.Error as e:
+                logger.error(f"Error adding reaction points: {str(e)}")
+                metric['error'] = type(e).__name__
+                return {
+                    from_user: {
+                        'success': False,
+                        'error_message': 'データベース更新中にエラーが発生しました',
+                        'retryable': True
+                    }
+                    for from_user in grants
+                }
+        return results
+
+    def reset_daily_points(self, date: str, team_id: Optional[str] = None,
+                           unassigned: bool = False) -> Dict[str, Any]:
+        """日次ポイントのリセット（0のユーザーには書き込まない）"""
+        try:
+            sql = 'UPDATE users SET daily_points_given = 0, last_reset_date = ? WHERE daily_points_given > 0'
+            params: Tuple[Any, ...] = (date,)
+            if unassigned:
+                sql += ' AND team_id IS NULL'
+            elif team_id:
+                sql += ' AND team_id = ?'
+                params += (team_id,)
+            with self._write('reset_daily_points') as conn:
+                users_reset = conn.execute(sql, params).rowcount
+            return {
+                'success': True,
+                'users_reset': users_reset
+            }
+        except sqlite3.Error as e:
+            logger.error(f"Error resetting daily points: {str(e)}")
+            return {
+                'success': False,
+                'error_message': str(e)
+            }
+
+    # 履歴
+
+    # トランザクションと受信者（position 順の JSON 配列）
+    _TRANSACTION_COLUMNS = (
+        'SELECT t.*, '
+        '  (SELECT json_group_array(to_user) FROM '
+        '     (SELECT to_user FROM transaction_recipients r WHERE r.transaction_id = t.transaction_id '
+        '      ORDER BY position)) AS to_users '
+    )
+
+    @staticmethod
+    def _transaction_from_row(row: sqlite3.Row) -> Dict[str, Any]:
+        tx = {k: row[k] for k in row.keys() if row[k] is not None}
+        tx['to_users'] = json.loads(row['to_users'])
+        return tx
+
+    def _transactions_for(self, user_id: str, team_id: Optional[str]) -> List[Dict[str, Any]]:
+        """送信者インデックスと受信者インデックスで対象のトランザクションを引く"""
+        team_filter = ' AND t.team_id = ?' if team_id else ''
+        team_params: Tuple[Any, ...] = (team_id,) if team_id else ()
+        rows = self._query(
+            'get_transactions',
+            f'{self._TRANSACTION_COLUMNS}'
+            'FROM transactions t WHERE t.transaction_id IN ('
+            '  SELECT transaction_id FROM transactions WHERE from_user = ? '
+            '  UNION SELECT transaction_id FROM transaction_recipients WHERE to_user = ?)'
+            f'{team_filter} ORDER BY t.timestamp DESC',
+            (user_id, user_id) + team_params)
+        return [self._transaction_from_row(row) for row in rows]
+
+    def get_user_transactions(self, user_id: str, team_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """ユーザーのトランザクション履歴を取得"""
+        transactions = []
+        for tx in self._transactions_for(user_id, team_id):
+            if user_id in tx['to_users']:
+                transactions.append({
+                    'type': 'received',
+                    'from_user': tx['from_user'],
+                    'points': tx['points'],
+                    'timestamp': tx['timestamp'],
+                    'message': tx.get('message', '')
+                })
+            if tx['from_user'] == user_id:
+                for to_user in tx['to_users']:
+                    transactions.append({
+                        'type': 'sent',
+                        'to_user': to_user,
+                        'points': tx['points'],
+                        'timestamp': tx['timestamp'],
+                        'message': tx.get('message', '')
+                    })
+        transactions.sort(key=lambda x: x['timestamp'], reverse=True)
+        logger.info("Transactions fetched and sorted: %d items", len(transactions))
+        return transactions
+
+    def get_points_history(self, user_id: str, team_id: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """ポイント履歴の取得"""
+        try:
+            transactions = self._transactions_for(user_id, team_id)
+            return {
+                'received': [tx for tx in transactions if user_id in tx['to_users']],
+                'sent': [tx for tx in transactions if tx['from_user'] == user_id]
+            }
+        except sqlite3.Error as e:
+            logger.error(f"Error getting points history: {str(e)}")
+            return {
+                'received': [],
+                'sent': []
+            }
+
+    def get_history_snapshot(self, user_id: str) -> Dict[str, Any]:
+        rows = self._query('get_history_snapshot',
+                           'SELECT history_snapshot, history_version, history_cached_at FROM users WHERE user_id = ?',
+                           (user_id,))
+        if not rows:
+            return {'version': 0, 'text': None, 'cached_at': 0}
+        return {'version': rows[0]['history_version'], 'text': rows[0]['history_snapshot'],
+                'cached_at': rows[0]['history_cached_at']}
+
+    def save_history_snapshot(self, user_id: str, version: int, text: str) -> bool:
+        with self._write('save_history_snapshot') as conn:
+            saved = conn.execute(
+                'UPDATE users SET history_snapshot = ?, history_cached_at = ? WHERE user_id = ? AND history_version = ?',
+                (text, int(time.time()), user_id, version)).rowcount
+        return bool(saved)
+
+    def iter_team_transactions(self, team_id: str, since: str, until: str,
+                               cursor: Optional[Dict[str, Any]] = None,
+                               page_size: int = 500) -> Iterator[Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """transactions_team_time インデックスを (timestamp, transaction_id) のキーセットでページングする"""
+        while True:
+            after: Tuple[Any, ...] = (cursor['timestamp'], cursor['transaction_id']) if cursor else ('', '')
+            rows = self._query(
+                'iter_team_transactions',
+                f'{self._TRANSACTION_COLUMNS}'
+                'FROM transactions t WHERE t.team_id = ? AND t.timestamp BETWEEN ? AND ? '
+                '  AND (t.timestamp, t.transaction_id) > (?, ?) '
+                'ORDER BY t.timestamp, t.transaction_id LIMIT ?',
+                (team_id, since, until) + after + (page_size,))
+            page = [self._transaction_from_row(row) for row in rows]
+            cursor = ({'timestamp': page[-1]['timestamp'], 'transaction_id': page[-1]['transaction_id']}
+                      if len(page) == page_size else None)
+            yield page, cursor
+            if not cursor:
+                return
+
+    # ジョブの途中経過
+
+    def get_job_state(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query('get_job_state', 'SELECT state FROM jobs WHERE job_id = ? AND expires_at > ?',
+                           (job_id, int(time.time())))
+        return json.loads(rows[0]['state']) if rows else None
+
+    def save_job_state(self, job_id: str, state: Dict[str, Any], ttl_seconds: int = 14 * 24 * 60 * 60) -> None:
+        now = int(time.time())
+        with self._write('save_job_state') as conn:
+            conn.execute('INSERT OR REPLACE INTO jobs (job_id, state, updated_at, expires_at) VALUES (?, ?, ?, ?)',
+                         (job_id, json.dumps(state, ensure_ascii=False, default=str), now, now + ttl_seconds))
+
+    # ワークスペースごとの利用量
+
+    def add_usage(self, period: str, usage: Dict[str, Dict[str, float]]) -> None:
+        with self._write('add_usage') as conn:
+            conn.executemany(
+                'INSERT INTO usage (team_id, period, name, value) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (period, team_id, name) DO UPDATE SET value = value + excluded.value',
+                [(team_id, period, name, value)
+                 for team_id, counters in usage.items() for name, value in counters.items()])
+
+    def get_usage(self, periods: List[str]) -> List[Dict[str, Any]]:
+        if not periods:
+            return []
+        rows = self._query('get_usage',
+                           f"SELECT team_id, period, name, value FROM usage "
+                           f"WHERE period IN ({', '.join('?' * len(periods))})",
+                           tuple(periods))
+        usage: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for row in rows:
+            entry = usage.setdefault((row['team_id'], row['period']),
+                                     {'team_id': row['team_id'], 'period': row['period']})
+            entry[row['name']] = row['value']
+        return list(usage.values())
+
+    # 感謝メッセージの検索
+
+    @staticmethod
+    def _write_index(conn: sqlite3.Connection, entries: Any, transaction_id: str) -> None:
+        conn.executemany('INSERT OR IGNORE INTO search_postings (term, posting, transaction_id) VALUES (?, ?, ?)',
+                         [(term, posting, transaction_id) for term, posting in entries])
+
+    def index_message(self, record: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> None:
+        current, stale = search.index_entries(record), search.index_entries(previous)
+        with self._write('index_message') as conn:
+            conn.executemany('DELETE FROM search_postings WHERE term = ? AND posting = ?', list(stale - current))
+            self._write_index(conn, current - stale, record['transaction_id'])
+
+    def unindex_message(self, record: Dict[str, Any]) -> None:
+        with self._write('unindex_message') as conn:
+            conn.executemany('DELETE FROM search_postings WHERE term = ? AND posting = ?',
+                             list(search.index_entries(record)))
+
+    def search_messages(self, team_id: str, user_id: str, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        terms = [f'{team_id}#{user_id}#{term}' for term in search.query_terms(query)]
+        if not terms:
+            return []
+        rows = self._query(
+            'search_messages',
+            f'{self._TRANSACTION_COLUMNS}'
+            'FROM transactions t JOIN ('
+            '  SELECT transaction_id, posting FROM search_postings '
+            f"  WHERE term IN ({', '.join('?' * len(terms))}) "
+            '  GROUP BY posting HAVING COUNT(*) = ?) p ON p.transaction_id = t.transaction_id '
+            'ORDER BY p.posting DESC',
+            tuple(terms) + (len(terms),))
+        results: List[Dict[str, Any]] = []
+        for row in rows:
+            record = self._transaction_from_row(row)
+            if search.matches(record, query):
+                results.append(search.search_result(record))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def top_channels(self, team_id: str, day: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        rows = self._query('top_channels',
+                           'SELECT channel_id, thanks, points FROM channel_stats WHERE team_id = ? AND day = ? '
+                           'ORDER BY thanks DESC LIMIT ?', (team_id, day or 'all', limit))
+        return [{'channel_id': row['channel_id'], 'thanks': row['thanks'], 'points': row['points']}
+                for row in rows]
+
+    # Slack への通知の送信待ち
+
+    @staticmethod
+    def _outbox_row(row: sqlite3.Row) -> Dict[str, Any]:
+        return {name: row[name] for name in _OUTBOX_COLUMNS if row[name] is not None}
+
+    def enqueue_outbox(self, items: List[Dict[str, Any]]) -> int:
+        with self._write('enqueue_outbox') as conn:
+            before = conn.total_changes
+            conn.executemany(
+                f"INSERT OR IGNORE INTO outbox ({', '.join(_OUTBOX_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(_OUTBOX_COLUMNS))})",
+                [tuple(item.get(name) for name in _OUTBOX_COLUMNS) for item in items])
+            return conn.total_changes - before
+
+    def due_outbox(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        rows = self._query('due_outbox',
+                           "SELECT * FROM outbox WHERE state IN ('pending', 'sending') AND due_at <= ? "
+                           'ORDER BY due_at LIMIT ?', (int(now), limit))
+        return [self._outbox_row(row) for row in rows]
+
+    def update_outbox(self, outbox_id: str, state: str, attempts: int, changes: Dict[str, Any]) -> bool:
+        columns = [name for name in changes if name in _OUTBOX_COLUMNS]
+        with self._write('update_outbox') as conn:
+            cursor = conn.execute(
+                f"UPDATE outbox SET {', '.join(f'{name} = ?' for name in columns)} "
+                'WHERE outbox_id = ? AND state = ? AND attempts = ?',
+                tuple(changes[name] for name in columns) + (outbox_id, state, attempts))
+            return cursor.rowcount == 1
+
+    def list_outbox(self, state: str, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = self._query('list_outbox', 'SELECT * FROM outbox WHERE state = ? ORDER BY due_at LIMIT ?',
+                           (state, limit))
+        return [self._outbox_row(row) for row in rows]
+
+    # 付与の流量制限
+
+    def count_requests(self, key: str, bucket: int, ttl_seconds: int) -> Tuple[int, int]:
+        with self._write('count_requests') as conn:
+            conn.execute('DELETE FROM rate_limits WHERE limit_key = ? AND bucket < ?', (key, bucket - 1))
+            conn.execute('INSERT INTO rate_limits (limit_key, bucket, count) VALUES (?, ?, 1) '
+                         'ON CONFLICT (limit_key, bucket) DO UPDATE SET count = count + 1', (key, bucket))
+            counts = dict(conn.execute('SELECT bucket, count FROM rate_limits WHERE limit_key = ?',
+                                       (key,)).fetchall())
+        return counts.get(bucket, 0), counts.get(bucket - 1, 0)
+
+    # リアクションのバッファ
+
+    def put_reaction(self, item: Dict[str, Any]) -> None:
+        with self._write('put_reaction') as conn:
+            conn.execute('INSERT OR REPLACE INTO reactions (window_id, reaction_key, data) VALUES (?, ?, ?)',
+                         (item['window_id'], item['reaction_key'], json.dumps(item, ensure_ascii=False)))
+
+    def delete_reaction(self, window_id: str, reaction_key: str) -> None:
+        with self._write('delete_reaction') as conn:
+            conn.execute('DELETE FROM reactions WHERE window_id = ? AND reaction_key = ?', (window_id, reaction_key))
+
+    def get_reactions(self, max_window_id: str) -> List[Dict[str, Any]]:
+        rows = self._query('get_reactions', 'SELECT data FROM reactions WHERE window_id <= ? ORDER BY window_id',
+                           (max_window_id,))
+        return [json.loads(row['data']) for row in rows]
+
+    def delete_reactions(self, items: List[Dict[str, Any]]) -> None:
+        with self._write('delete_reactions') as conn:
+            conn.executemany('DELETE FROM reactions WHERE window_id = ? AND reaction_key = ?',
+                             [(item['window_id'], item['reaction_key']) for item in items])
@@ -0,0 +1,219 @@
+import os
+import abc
+from typing import Dict, List, Any, Optional, Union, Iterator, Tuple
+
+from lib.user_info import UserInfo
+
+
+class Storage(abc.ABC):
+    """ハンドラーが使う永続化操作のインターフェース
+
+    実装は DynamoDB（lib.db.DynamoDBManager）と SQLite（lib.sqlite_storage.SQLiteStorage）。
+    ポイント付与系の戻り値は {'success': bool, 'error_message': ..., 'daily_points_given': ...}
+    の形式で、どちらの実装でも同じ。
+    """
+
+    # ユーザー
+    @abc.abstractmethod
+    def get_user_data(self, user_id: str) -> Optional[UserInfo]:
+        """ユーザーデータの取得"""
+
+    @abc.abstractmethod
+    def get_users_data(self, user_ids: List[str]) -> List[Optional[UserInfo]]:
+        """複数のユーザー情報を取得"""
+
+    @abc.abstractmethod
+    def save_or_update_user_profile(self, user_profile: Union[Dict[str, Any], UserInfo]) -> None:
+        """ユーザープロファイルを保存または更新（ポイントは保持する）"""
+
+    @abc.abstractmethod
+    def get_team_user_ids(self, team_id: str) -> List[str]:
+        """ワークスペースに所属するユーザーID"""
+
+    # ワークスペース
+    @abc.abstractmethod
+    def get_workspace_data(self, team_id: str) -> Dict[str, Any]:
+        """ワークスペースデータ（Botトークンなど）の取得。なければ空の辞書"""
+
+    @abc.abstractmethod
+    def save_workspace_data(self, workspace_data: Dict[str, Any]) -> None:
+        """ワークスペースデータの保存（workspace_id がキー）"""
+
+    @abc.abstractmethod
+    def get_workspace_ids(self) -> List[str]:
+        """インストール済みワークスペースのID一覧"""
+
+    @abc.abstractmethod
+    def get_token_record(self, team_id: str) -> Dict[str, Any]:
+        """Bot トークンの最新の状態（キャッシュを通さない）
+
+        access_token / refresh_token / token_expires_at（エポック秒）/ token_lease_until。
+        ワークスペースがなければ空の辞書。
+        """
+
+    @abc.abstractmethod
+    def acquire_token_lease(self, team_id: str, owner: str, until: float, now: float) -> bool:
+        """トークン更新のリースを取得。他の呼び出しのリースが now 時点で有効なら False"""
+
+    @abc.abstractmethod
+    def save_rotated_token(self, team_id: str, owner: str, access_token: str,
+                           refresh_token: str, expires_at: float) -> bool:
+        """owner がリースを持っている場合だけ更新後のトークンを保存し、リースを解放する"""
+
+    # ポイント付与
+    @abc.abstractmethod
+    def add_points(self, from_user: str, to_users: List[str], message: str = '',
+                   team_id: Optional[str] = None, channel_id: Optional[str] = None,
+                   request_id: Optional[str] = None) -> Dict[str, Any]:
+        """ポイントの付与（channel_id は感謝が投稿されたチャンネル）
+
+        request_id（Slack のメッセージの client_msg_id など）を渡すと、同じ要求の2回目以降は
+        何も書き込まずに duplicate=True の結果を返す。結果には失敗した場合も含めて常に
+        daily_points_given（送信者の本日の付与済みポイント）を入れる。
+        """
+
+    @abc.abstractmethod
+    def add_reaction_points(self, window_id: str, grants: Dict[str, List[Tuple[str, str]]],
+                            message: str = '', team_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """リアクションによるポイント付与をウィンドウ単位でまとめて書き込む
+
+        grants は送信者ごとの (受信者, チャンネル:ts) のリスト。リアクションしたメッセージごとに
+        1ポイントの記録を1件書く（履歴では1件ずつ表示される）。
+        """
+
+    @abc.abstractmethod
+    def reset_daily_points(self, date: str, team_id: Optional[str] = None,
+                           unassigned: bool = False) -> Dict[str, Any]:
+        """日次ポイントのリセット
+
+        team_id を指定するとそのワークスペースのユーザーだけ、unassigned=True なら
+        team_id のないユーザー（移行前のアイテムや、プロフィール保存前に受け取った受信者）だけを対象にする。
+        """
+
+    # 履歴
+    @abc.abstractmethod
+    def get_user_transactions(self, user_id: str, team_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """ユーザーのトランザクション履歴（送受信を1件ずつ、新しい順）"""
+
+    @abc.abstractmethod
+    def get_points_history(self, user_id: str, team_id: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """ポイント履歴の取得（received / sent）"""
+
+    @abc.abstractmethod
+    def get_history_snapshot(self, user_id: str) -> Dict[str, Any]:
+        """履歴スナップショット {'version': int, 'text': Optional[str], 'cached_at': int}
+
+        付与のたびに参加者全員の version が進み、text は消える。
+        """
+
+    @abc.abstractmethod
+    def save_history_snapshot(self, user_id: str, version: int, text: str) -> bool:
+        """version が読み取り時点から変わっていなければ保存。保存できたら True"""
+
+    @abc.abstractmethod
+    def iter_team_transactions(self, team_id: str, since: str, until: str,
+                               cursor: Optional[Dict[str, Any]] = None,
+                               page_size: int = 500) -> Iterator[Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """ワークスペースの timestamp が since 以上 until 以下のトランザクションをページ単位で返す
+
+        (ページ, 続きを読むためのカーソル) の順に返し、最後のページのカーソルは None。
+        カーソルは JSON に変換できる辞書で、cursor に渡すとその続きから読む。
+        完了していない付与・取り消した付与は含まない。
+        """
+
+    # ジョブの途中経過
+    @abc.abstractmethod
+    def get_job_state(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """save_job_state で保存した途中経過。なければ None"""
+
+    @abc.abstractmethod
+    def save_job_state(self, job_id: str, state: Dict[str, Any], ttl_seconds: int = 14 * 24 * 60 * 60) -> None:
+        """定期ジョブの途中経過（JSON に変換できる辞書）を保存。ttl_seconds 後に消える"""
+
+    # ワークスペースごとの利用量（lib.metering）
+    @abc.abstractmethod
+    def add_usage(self, period: str, usage: Dict[str, Dict[str, float]]) -> None:
+        """期間（UTC の1時間 'YYYY-MM-DDTHH'）の team_id ごとのカウンターに加算"""
+
+    @abc.abstractmethod
+    def get_usage(self, periods: List[str]) -> List[Dict[str, Any]]:
+        """各期間の team_id ごとのカウンター（{'team_id', 'period', カウンター名: 値}）"""
+
+    # チャンネルごとの感謝の件数（ポイント付与の確定時に加算する）
+    @abc.abstractmethod
+    def top_channels(self, team_id: str, day: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """感謝の件数の多いチャンネル（day は 'YYYY-MM-DD'、省略時は通算）
+
+        [{'channel_id', 'thanks'（メッセージ数）, 'points'（付与したポイント）}] を件数の多い順に返す。
+        """
+
+    # 感謝メッセージの検索（lib.search）。ポイント付与の確定時に索引する
+    @abc.abstractmethod
+    def index_message(self, record: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> None:
+        """付与の記録を索引する（previous を渡すとその索引との差分だけ書き換える）"""
+
+    @abc.abstractmethod
+    def unindex_message(self, record: Dict[str, Any]) -> None:
+        """付与の記録を索引から消す"""
+
+    @abc.abstractmethod
+    def search_messages(self, team_id: str, user_id: str, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """user_id が送った・受け取った感謝のうち、query の語をすべて含むものを新しい順に limit 件"""
+
+    # Slack への通知の送信待ち（lib.outbox）
+    @abc.abstractmethod
+    def enqueue_outbox(self, items: List[Dict[str, Any]]) -> int:
+        """通知を積む（同じ outbox_id が既にあれば積まない）。新しく積んだ件数を返す"""
+
+    @abc.abstractmethod
+    def due_outbox(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        """due_at が now 以前の pending / sending の通知を due_at の早い順に最大 limit 件"""
+
+    @abc.abstractmethod
+    def update_outbox(self, outbox_id: str, state: str, attempts: int, changes: Dict[str, Any]) -> bool:
+        """state と attempts が読んだ時点のままなら changes を書く（値が None の項目は消す）。書けたら True"""
+
+    @abc.abstractmethod
+    def list_outbox(self, state: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """state の通知（送れなかった通知の確認・再送用）"""
+
+    # 付与の流量制限（lib.ratelimit）
+    @abc.abstractmethod
+    def count_requests(self, key: str, bucket: int, ttl_seconds: int) -> Tuple[int, int]:
+        """key の区間 bucket の件数に1を加え、(その区間の件数, 直前の区間の件数) を返す"""
+
+    # リアクションのバッファ
+    @abc.abstractmethod
+    def put_reaction(self, item: Dict[str, Any]) -> None:
+        """(window_id, reaction_key) をキーにリアクションを保存（同じキーは上書き）"""
+
+    @abc.abstractmethod
+    def delete_reaction(self, window_id: str, reaction_key: str) -> None:
+        """リアクションを削除（存在しなくてもよい）"""
+
+    @abc.abstractmethod
+    def get_reactions(self, max_window_id: str) -> List[Dict[str, Any]]:
+        """window_id が max_window_id 以下のリアクション"""
+
+    @abc.abstractmethod
+    def delete_reactions(self, items: List[Dict[str, Any]]) -> None:
+        """書き込み済みのリアクションをまとめて削除"""
+
+
+def create_storage(backend: Optional[str] = None, **kwargs: Any) -> Storage:
+    """STORAGE_BACKEND（dynamodb / sqlite）に応じたストレージを生成
+
+    sqlite の場合は SQLITE_PATH のファイルを使う。AWS を使わない構成では boto3 を
+    読み込まない。ハンドラーはどちらの場合も dynamodb=... を渡してよい（sqlite では無視）。
+    """
+    backend = (backend or os.environ.get('STORAGE_BACKEND') or 'dynamodb').lower()
+    if backend == 'sqlite':
+        from lib.sqlite_storage import SQLiteStorage
+        path = kwargs.get('path') or os.environ.get('SQLITE_PATH') or 'kansya.db'
+        return SQLiteStorage(path, **{k: v for k, v in kwargs.items() if k == 'timeout'})
+    if backend == 'dynamodb':
+        import boto3
+        from lib.db import DynamoDBManager
+        dynamodb = kwargs.pop('dynamodb', None) or boto3.resource('dynamodb')
+        return DynamoDBManager(dynamodb, **kwargs)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import random
+import logging
+import functools
+import contextvars
+from typing import Dict, Any, Optional, Callable
+
+# 1行あたりの最大バイト数（ペイロードはこの範囲に切り詰める）
+LOG_MAX_BYTES: int = int(os.environ.get('LOG_MAX_BYTES', '4096'))
+
+# イベントタイプごとのサンプリング率 例: {"message": 0.1, "app_home_opened": 0.5}
+LOG_SAMPLE_RATES: Dict[str, float] = json.loads(os.environ.get('LOG_SAMPLE_RATES', '{}'))
+
+REDACTED = '***'
+# 伏せ字にするキー名（error_code や status_code などを巻き込まないよう、キー名全体で判定する）
+_SENSITIVE_KEY = re.compile(
+    r'(?:\w+_)?(?:token|secret)|password|authorization|(?:x-slack-)?signature|(?:oauth_)?code',
+    re.IGNORECASE,
+)
+_SLACK_TOKEN = re.compile(r'xox[a-z]-[A-Za-z0-9-]+')
+
+# 呼び出し単位のログコンテキスト（event_type, team_id とサンプリング結果）
+_context: contextvars.ContextVar = contextvars.ContextVar('log_context', default={})
+
+
+def redact(value: Any) -> Any:
+    """トークン類を伏せ字にしたコピーを返す"""
+    if isinstance(value, dict):
+        return {
+            k: REDACTED if isinstance(k, str) and _SENSITIVE_KEY.fullmatch(k) and v else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple, set)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return _SLACK_TOKEN.sub(lambda m: m.group(0)[:5] + REDACTED, value)
+    return value
+
+
+def truncate(text: str, budget: int = LOG_MAX_BYTES) -> str:
+    """UTF-8でbudgetバイトに収まるよう切り詰める"""
+    encoded = text.encode('utf-8')
+    if len(encoded) <= budget:
+        return text
+    marker = f"...(truncated {len(encoded) - budget} bytes)"
+    return encoded[:max(budget - len(marker), 0)].decode('utf-8', errors='ignore') + marker
+
+
+class LazyPayload:
+    """ログ出力時にだけシリアライズされるペイロード
+
+    logger.debug("...: %s", LazyPayload(event)) のように渡すと、
+    DEBUGが無効なら変換コストはかからない。
+    """
+
+    __slots__ = ('value', 'budget')
+
+    def __init__(self, value: Any, budget: Optional[int] = None) -> None:
+        self.value = value
+        self.budget = budget
+
+    def __str__(self) -> str:
+        value = getattr(self.value, 'data', self.value)  # SlackResponse
+        try:
+            text = json.dumps(redact(value), ensure_ascii=False, default=str, separators=(',', ':'))
+        except (TypeError, ValueError):
+            text = redact(str(value))
+        return truncate(text, self.budget or LOG_MAX_BYTES // 2)
+
+    __repr__ = __str__
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコード1行のJSONとして出力"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact(record.getMessage()),
+        }
+        entry.update({k: v for k, v in _context.get().items() if not k.startswith('_')})
+        request_id = getattr(record, 'aws_request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        if record.exc_info:
+            entry['exception'] = redact(self.formatException(record.exc_info))
+        return _fit_line(entry, LOG_MAX_BYTES)
+
+
+def _fit_line(entry: Dict[str, Any], budget: int) -> str:
+    """budgetバイトに収まるよう exception, message の順に切り詰めてからJSONにする
+
+    シリアライズ後の行を切るとJSONとして読めなくなるため、項目の値を切り詰める。
+    エスケープで増える分があるので、収まるまで繰り返す。
+    """
+    line = json.dumps(entry, ensure_ascii=False, default=str)
+    for field in ('exception', 'message'):
+        while isinstance(entry.get(field), str) and entry[field]:
+            overflow = len(line.encode('utf-8')) - budget
+            if overflow <= 0:
+                return line
+            value: str = entry[field]
+            entry[field] = truncate(value, max(len(value.encode('utf-8')) - overflow, 0))
+            line = json.dumps(entry, ensure_ascii=False, default=str)
+            if entry[field] == value:
+                break
+    return line
+
+
+class SamplingFilter(logging.Filter):
+    """サンプリング対象外の呼び出しではINFO以下を落とす（WARNING以上は常に出力）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        return _context.get().get('_sampled', True)
+
+
+def set_log_context(**fields: Optional[str]) -> None:
+    """ログに付与する項目を設定し、event_type のサンプリング率で出力有無を決める"""
+    merged = dict(_context.get())
+    merged.update({k: v for k, v in fields.items() if v})
+    event_type = fields.get('event_type')
+    if event_type is not None:
+        rate = LOG_SAMPLE_RATES.get(event_type, LOG_SAMPLE_RATES.get('*', 1.0))
+        merged['_sampled'] = rate >= 1.0 or random.random() < rate
+    _context.set(merged)
+
+
+def log_invocation(handler: Callable[..., Any]) -> Callable[..., Any]:
+    """呼び出しごとにログコンテキストを初期化するデコレーター"""
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Any:
+        token = _context.set({})
+        try:
+            return handler(event, context)
+        finally:
+            _context.reset(token)
+    return wrapper
+
+
+def configure_logging(level: int = logging.INFO) -> logging.Logger:
+    """ルートロガーをJSON出力・サンプリング付きに設定"""
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, os.environ.get('LOG_LEVEL', ''), level))
+    if not root.handlers:
+        root.addHandler(logging.StreamHandler())
+    for handler in root.handlers:
+        handler.setFormatter(JsonFormatter())
+        if not any(isinstance(f, SamplingFilter) for f in handler.filters):
+            handler.addFilter(SamplingFilter())
+    return root
@@ -0,0 +1,147 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from typing import Dict, Any, Optional, Callable
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+from lib.storage import Storage
+from lib.metrics import metrics
+from lib.cache import TTLCache
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# 有効期限のこの秒数前から更新する（更新中も古いトークンはまだ使える）
+TOKEN_REFRESH_MARGIN: float = float(os.environ.get('TOKEN_REFRESH_MARGIN', '600'))
+# 更新を担当する呼び出しのリース（この間に更新が終わらなければ別の呼び出しが引き継ぐ）
+TOKEN_LEASE_SECONDS: float = float(os.environ.get('TOKEN_LEASE_SECONDS', '30'))
+# 他の呼び出しが更新中のとき、保存済みのトークンを読み直す間隔
+TOKEN_POLL_SECONDS: float = 0.5
+
+# ワークスペースごとの {'access_token', 'renew_at'}（プロセス内で共有）
+token_cache = TTLCache(maxsize=256, ttl=24 * 60 * 60)
+
+
+def refresh_with_slack(refresh_token: str) -> Dict[str, Any]:
+    """oauth.v2.access の refresh_token グラントで新しいトークンを発行"""
+    response = WebClient().oauth_v2_access(
+        client_id=os.environ.get('SLACK_CLIENT_ID'),
+        client_secret=os.environ.get('SLACK_CLIENT_SECRET'),
+        grant_type='refresh_token',
+        refresh_token=refresh_token
+    )
+    return {
+        'access_token': response['access_token'],
+        'refresh_token': response['refresh_token'],
+        'expires_in': int(response['expires_in']),
+    }
+
+
+class TokenProvider:
+    """ワークスペースの Bot トークンを返す（Slack のトークンローテーション対応）
+
+    -auth テーブルに refresh_token / token_expires_at がないワークスペースは、保存済みの
+    access_token をそのまま使う。ローテーションが有効なワークスペースでは、期限の
+    TOKEN_REFRESH_MARGIN 秒前から更新する。更新は条件付き書き込みのリースを取れた
+    1つの呼び出しだけが行い、他の呼び出し（他の Lambda・他のスレッド）は期限内なら
+    今のトークンを使い続け、失効済みなら更新後のトークンが保存されるのを待つ。
+    """
+
+    def __init__(self, storage: Storage, refresh: Callable[[str], Dict[str, Any]] = refresh_with_slack,
+                 margin: float = TOKEN_REFRESH_MARGIN, lease_seconds: float = TOKEN_LEASE_SECONDS,
+                 poll_seconds: float = TOKEN_POLL_SECONDS) -> None:
+        self.storage = storage
+        self.refresh = refresh
+        self.margin = margin
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, team_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(team_id, threading.Lock())
+
+    def _cached(self, team_id: str, now: float) -> Optional[str]:
+        entry: Optional[Dict[str, Any]] = token_cache.get(team_id)
+        if entry and now < entry['renew_at']:
+            return entry['access_token']
+        return None
+
+    def _remember(self, team_id: str, access_token: str, renew_at: float) -> str:
+        token_cache.set(team_id, {'access_token': access_token, 'renew_at': renew_at})
+        return access_token
+
+    def token_for(self, team_id: str, workspace_data: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Bot トークン。ワークスペースが未登録、または失効して更新できなかった場合は None"""
+        token = self._cached(team_id, time.time())
+        if token:
+            return token
+        # 同じプロセスのスレッドは1つだけが先へ進み、残りはその結果をキャッシュから使う
+        with self._lock_for(team_id):
+            now = time.time()
+            token = self._cached(team_id, now)
+            if token:
+                return token
+            record: Dict[str, Any] = workspace_data or {}
+            if not record.get('access_token') or self._needs_renewal(record, now):
+                # キャッシュ済みのワークスペース情報は古いことがあるため読み直す
+                record = self.storage.get_token_record(team_id)
+            if not record.get('access_token'):
+                return None
+            if not record.get('refresh_token') or not record.get('token_expires_at'):
+                # ローテーションが無効なトークン（期限なし）
+                return self._remember(team_id, record['access_token'], float('inf'))
+            if not self._needs_renewal(record, now):
+                return self._remember(team_id, record['access_token'],
+                                      float(record['token_expires_at']) - self.margin)
+            return self._renew(team_id, record, now)
+
+    def _needs_renewal(self, record: Dict[str, Any], now: float) -> bool:
+        expires_at = record.get('token_expires_at')
+        return expires_at is not None and float(expires_at) - now <= self.margin
+
+    def _renew(self, team_id: str, record: Dict[str, Any], now: float) -> Optional[str]:
+        owner = uuid.uuid4().hex
+        if not self.storage.acquire_token_lease(team_id, owner, now + self.lease_seconds, now):
+            return self._wait_for_renewal(team_id, record, now)
+
+        logger.info("Botトークンを更新中: team_id=%s", team_id)
+        try:
+            renewed = self.refresh(record['refresh_token'])
+        except (SlackApiError, KeyError) as e:
+            # リースが切れた後に別の呼び出しが再試行する。期限内なら今のトークンを使い続ける
+            logger.error("Botトークンの更新に失敗しました: team_id=%s, error=%s", team_id, str(e))
+            metrics.record('token', 'refresh_failed')
+            if float(record['token_expires_at']) > now:
+                return self._remember(team_id, record['access_token'], now + self.lease_seconds)
+            return None
+
+        expires_at = now + renewed['expires_in']
+        if not self.storage.save_rotated_token(team_id, owner, renewed['access_token'],
+                                               renewed['refresh_token'], expires_at):
+            # リースの期限切れ後に別の呼び出しが引き継いだ。発行済みのトークン自体は有効
+            logger.warning("Botトークン更新のリースを失いました: team_id=%s", team_id)
+        metrics.record('token', 'refreshed')
+        return self._remember(team_id, renewed['access_token'], expires_at - self.margin)
+
+    def _wait_for_renewal(self, team_id: str, record: Dict[str, Any], now: float) -> Optional[str]:
+        """他の呼び出しが更新中。期限内なら今のトークン、失効済みなら更新の完了を待つ"""
+        metrics.record('token', 'lease_busy')
+        if float(record['token_expires_at']) > now:
+            return self._remember(team_id, record['access_token'], now + self.poll_seconds)
+
+        deadline = now + self.lease_seconds
+        while time.time() < deadline:
+            time.sleep(self.poll_seconds)
+            latest: Dict[str, Any] = self.storage.get_token_record(team_id)
+            if float(latest.get('token_expires_at') or 0) > time.time():
+                return self._remember(team_id, latest['access_token'],
+                                      float(latest['token_expires_at']) - self.margin)
+        logger.error("Botトークンの更新を待ちきれませんでした: team_id=%s", team_id)
+        return None
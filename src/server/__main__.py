@@ -0,0 +1,40 @@
+"""Socket Mode サーバーの起動
+
+使い方 (src ディレクトリで実行。aiohttp が必要):
+    SLACK_APP_TOKEN=xapp-... STACK_NAME=KansyaConnect python -m server --workers 16
+
+DynamoDB は Lambda 構成と同じテーブルを使う。SNS は使わない。
+STORAGE_BACKEND=sqlite（SQLITE_PATH）を指定すると AWS なしで動作する。
+"""
+import argparse
+import asyncio
+import os
+import sys
+from typing import List, Optional
+
+from lib.structured_log import configure_logging
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='KansyaConnect Socket Mode server')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVER_WORKERS', '8')))
+    parser.add_argument('--max-pending', type=int, default=1000, help='処理待ちの上限（超えると取り込みを待たせる）')
+    parser.add_argument('--shutdown-timeout', type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    # aiohttp は Socket Mode 構成でのみ必要
+    from slack_sdk.socket_mode.aiohttp import SocketModeClient
+    from server.app import SocketModeServer
+
+    async def run() -> None:
+        client = SocketModeClient(app_token=os.environ['SLACK_APP_TOKEN'])
+        server = SocketModeServer(client, workers=args.workers, max_pending=args.max_pending)
+        await server.run_forever(args.shutdown_timeout)
+
+    asyncio.run(run())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
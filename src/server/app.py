@@ -0,0 +1,263 @@
+"""Socket Mode 単一プロセスサーバー
+
+API Gateway → Lambda → SNS → Lambda の代わりに、1つの asyncio プロセスで
+Socket Mode の接続を受け、イベント・インタラクティブ・通知の各処理を
+ワーカープールで実行する。処理本体は各 Lambda ハンドラーと同じ関数
+（handle_event / handle_interactive / dispatch_notification）を使い、
+SNS の代わりにプロセス内のキューで通知処理へ渡す。
+
+boto3 / slack_sdk の呼び出しは同期APIなので、ワーカーはスレッドプールで
+実行する。ワークスペース情報・Slackクライアント・ユーザープロフィールの
+キャッシュ（lib.cache）はワーカー間で共有される。
+
+通知ジョブは Lambda 構成の FIFO キューと同じくメッセージグループ（team_id:user_id）
+ごとに1件ずつ順番に処理し、異なるグループは並行に処理する。
+
+通知処理が積んだ DM（lib.outbox）は、Lambda 構成の OutboxWorkerFunction の代わりに
+outbox_interval 秒ごとにワーカープールで送る（停止時にも1回送る）。
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import threading
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Deque, Dict, Any, List, Optional, Callable
+
+from slack_sdk.socket_mode.request import SocketModeRequest
+from slack_sdk.socket_mode.response import SocketModeResponse
+
+from lib.metrics import metrics
+from lib.publisher import CallbackPublisher
+
+# ロガーの設定
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDLER_DIRS = [
+    os.path.join(SRC_DIR, 'handlers', 'event_handler'),
+    os.path.join(SRC_DIR, 'handlers', 'interactive_handler'),
+    os.path.join(SRC_DIR, 'handlers', 'notification'),
+    os.path.join(SRC_DIR, 'handlers', 'outbox_worker'),
+]
+
+# Socket Mode のエンベロープ種別と、プロセス内で使う通知ジョブ
+EVENTS_API = 'events_api'
+INTERACTIVE = 'interactive'
+NOTIFICATION = 'notification'
+
+
+class HandlerCore:
+    """Lambda ハンドラーと共通の処理関数"""
+
+    def __init__(self, handle_event: Callable[..., Any], handle_interactive: Callable[..., Any],
+                 dispatch_notification: Callable[..., Any],
+                 drain_outbox: Optional[Callable[[], Any]] = None) -> None:
+        self.handle_event = handle_event
+        self.handle_interactive = handle_interactive
+        self.dispatch_notification = dispatch_notification
+        self.drain_outbox = drain_outbox
+
+
+def load_core() -> HandlerCore:
+    """各ハンドラーのモジュールを Lambda イメージと同じ配置で読み込む"""
+    import importlib
+    for path in [SRC_DIR] + HANDLER_DIRS:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return HandlerCore(
+        importlib.import_module('event_handler').handle_event,
+        importlib.import_module('interactive_handler').handle_interactive,
+        importlib.import_module('main').dispatch_notification,
+        importlib.import_module('outbox_worker').worker.run,
+    )
+
+
+class Job:
+    __slots__ = ('kind', 'payload', 'topic', 'group_id', 'enqueued_at', 'inbound')
+
+    def __init__(self, kind: str, payload: Dict[str, Any], topic: Optional[str] = None,
+                 group_id: Optional[str] = None, inbound: bool = False) -> None:
+        self.kind = kind
+        self.payload = payload
+        self.topic = topic
+        self.group_id = group_id
+        self.enqueued_at = time.perf_counter()
+        self.inbound = inbound
+
+
+class SocketModeServer:
+    """Socket Mode クライアントからの要求をワーカープールで処理する
+
+    client は slack_sdk.socket_mode.aiohttp.SocketModeClient と同じく
+    socket_mode_request_listeners / connect / disconnect / close /
+    send_socket_mode_response を持つオブジェクト。
+    """
+
+    def __init__(self, client: Any, core: Optional[HandlerCore] = None, workers: int = 8,
+                 threads: Optional[int] = None, max_pending: int = 1000,
+                 metrics_interval: float = 10.0, outbox_interval: float = 1.0) -> None:
+        self.client = client
+        self.core = core or load_core()
+        self.workers = workers
+        self.threads = threads or workers
+        self.max_pending = max_pending
+        self.metrics_interval = metrics_interval
+        self.outbox_interval = outbox_interval
+        self.publisher = CallbackPublisher(self._publish_threadsafe)
+        self.processed: Dict[str, int] = {EVENTS_API: 0, INTERACTIVE: 0, NOTIFICATION: 0}
+        self.errors: Dict[str, int] = {EVENTS_API: 0, INTERACTIVE: 0, NOTIFICATION: 0}
+        self._counts_lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+        # 処理中のメッセージグループと、その後ろで待っている通知ジョブ
+        self._groups: Dict[str, Deque[Job]] = {}
+        self._accepting = False
+        self._stopped: Optional[asyncio.Event] = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._pending = asyncio.Semaphore(self.max_pending)
+        self._stopped = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='kansya-worker')
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.metrics_interval > 0:
+            self._tasks.append(asyncio.create_task(self._flush_metrics()))
+        if self.outbox_interval > 0 and self.core.drain_outbox:
+            self._tasks.append(asyncio.create_task(self._send_outbox()))
+        self.client.socket_mode_request_listeners.append(self._on_request)
+        self._accepting = True
+        await self.client.connect()
+        logger.info("Socket Mode サーバーを開始しました: workers=%d", self.workers)
+
+    async def _on_request(self, client: Any, request: SocketModeRequest) -> None:
+        # Slack には3秒以内に ack を返す（Lambda 構成の 200 応答に相当）
+        await client.send_socket_mode_response(SocketModeResponse(envelope_id=request.envelope_id))
+        if not self._accepting:
+            logger.warning("停止処理中のため要求を破棄しました: %s", request.envelope_id)
+            return
+        if request.retry_attempt:
+            # Lambda 構成の X-Slack-Retry-Num と同じく再送は処理しない
+            logger.info("重複リクエストを検出しました: retry=%s", request.retry_attempt)
+            return
+        if request.type not in (EVENTS_API, INTERACTIVE):
+            logger.info("未対応のエンベロープを受信: %s", request.type)
+            return
+        # 処理待ちが上限に達したら ack 後の取り込みを待たせる（背圧）
+        await self._pending.acquire()
+        self._queue.put_nowait(Job(request.type, request.payload, inbound=True))
+
+    def _publish_threadsafe(self, topic: str, message: Dict[str, Any], group_id: Optional[str] = None) -> None:
+        """ワーカースレッドからの通知を同じキューに積む（SNS の代わり）"""
+        job = Job(NOTIFICATION, message, topic, group_id)
+        self._loop.call_soon_threadsafe(self._enqueue_ordered, job)
+
+    def _enqueue_ordered(self, job: Job) -> None:
+        """同じグループのジョブが処理中なら、終わるまで後ろで待たせる（イベントループ上で実行）"""
+        if job.group_id is None:
+            self._queue.put_nowait(job)
+        elif job.group_id in self._groups:
+            self._groups[job.group_id].append(job)
+        else:
+            self._groups[job.group_id] = deque()
+            self._queue.put_nowait(job)
+
+    def _release_group(self, job: Job) -> None:
+        """グループの次のジョブをキューに積む（task_done より前に呼び、drain の対象に含める）"""
+        if job.group_id is None:
+            return
+        waiting = self._groups[job.group_id]
+        if waiting:
+            self._queue.put_nowait(waiting.popleft())
+        else:
+            del self._groups[job.group_id]
+
+    async def _worker(self) -> None:
+        while True:
+            job: Job = await self._queue.get()
+            try:
+                # 呼び出しごとに新しいコンテキストで実行し、ログ・メトリクスの項目を持ち越さない
+                await self._loop.run_in_executor(self._executor, contextvars.Context().run, self._process, job)
+            finally:
+                if job.inbound:
+                    self._pending.release()
+                self._release_group(job)
+                self._queue.task_done()
+
+    def _process(self, job: Job) -> None:
+        error: Optional[str] = None
+        try:
+            if job.kind == EVENTS_API:
+                self.core.handle_event(job.payload, self.publisher)
+            elif job.kind == INTERACTIVE:
+                self.core.handle_interactive(job.payload, self.publisher)
+            else:
+                self.core.dispatch_notification(job.topic, job.payload)
+        except Exception as e:
+            error = type(e).__name__
+            with self._counts_lock:
+                self.errors[job.kind] += 1
+            logger.error("処理中にエラーが発生しました: kind=%s error=%s", job.kind, str(e), exc_info=True)
+        finally:
+            with self._counts_lock:
+                self.processed[job.kind] += 1
+            # キュー待ちを含めた1件あたりの処理時間
+            metrics.record('server', job.kind, (time.perf_counter() - job.enqueued_at) * 1000.0, error)
+
+    async def _flush_metrics(self) -> None:
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            metrics.flush()
+
+    def _drain_outbox(self) -> None:
+        try:
+            self.core.drain_outbox()
+        except Exception as e:
+            logger.error("通知の送信中にエラーが発生しました: %s", str(e), exc_info=True)
+
+    async def _send_outbox(self) -> None:
+        while True:
+            await asyncio.sleep(self.outbox_interval)
+            await self._loop.run_in_executor(self._executor, contextvars.Context().run, self._drain_outbox)
+
+    async def drain(self) -> None:
+        """キューが空になり、処理中の要求と派生した通知がすべて終わるまで待つ"""
+        await self._queue.join()
+
+    async def shutdown(self, timeout: float = 30.0) -> None:
+        """新しい要求の取り込みを止め、処理中の要求を終えてから停止する"""
+        self._accepting = False
+        await self.client.disconnect()
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("停止までに処理しきれなかった要求があります: %d", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.core.drain_outbox:
+            # 停止までに積まれた通知を送る（送り残しは次の起動で送る）
+            await self._loop.run_in_executor(self._executor, self._drain_outbox)
+        self._executor.shutdown(wait=True)
+        metrics.close()
+        await self.client.close()
+        self._stopped.set()
+        logger.info("Socket Mode サーバーを停止しました: processed=%s errors=%s", self.processed, self.errors)
+
+    async def run_forever(self, shutdown_timeout: float = 30.0) -> None:
+        """SIGTERM / SIGINT を受けるまで動かし、正常に停止する"""
+        await self.start()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            self._loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+        await self.shutdown(shutdown_timeout)
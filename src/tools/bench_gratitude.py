@@ -0,0 +1,72 @@
+"""感謝フレーズ検出のベンチマーク
+
+従来の正規表現2パス（メンション抽出 + 除去）とフレーズごとの部分文字列検索を、
+lib.gratitude のマッチャーと比較する。感謝フレーズが末尾にあるメッセージ（hit）と、
+どこにもないメッセージ（miss。チャンネルの大半）の両方を測る。--phrases で追加フレーズ数を増やせる。
+
+使い方 (src ディレクトリで実行):
+    python -m tools.bench_gratitude --lengths 200 2000 20000
+"""
+import argparse
+import random
+import re
+import sys
+import timeit
+from typing import List, Optional, Tuple
+
+from lib.gratitude import DEFAULT_PHRASES, get_matcher
+
+MENTION_PATTERN = r'<@([A-Z0-9]+)>'
+
+
+def legacy_scan(text: str, phrases: Tuple[str, ...]) -> Tuple[List[str], str, bool]:
+    """変更前の SlackManager.extract_mentions + フレーズごとの in 判定"""
+    mentions = re.findall(MENTION_PATTERN, text)
+    stripped = re.sub(MENTION_PATTERN, '', text)
+    lowered = stripped.lower()
+    return list(set(mentions)), stripped, any(p in lowered for p in phrases)
+
+
+def build_message(length: int, rng: random.Random, thanks: bool = True) -> str:
+    words = ['今日は', 'リリース', 'お疲れさまでした', 'review', 'deploy', 'その件', '<https://example.com|link>',
+             '<#C0123ABCD|general>', 'LGTM', '資料']
+    parts: List[str] = []
+    size = 0
+    while size < length:
+        token = f'<@U{rng.randrange(10**8):08d}>' if rng.random() < 0.1 else rng.choice(words)
+        parts.append(token)
+        size += len(token) + 1
+    parts.append('ほんとうにありがとう！' if thanks else 'よろしくお願いします')
+    return ' '.join(parts)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='gratitude matcher benchmark')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[200, 2000, 20000])
+    parser.add_argument('--number', type=int, default=200)
+    parser.add_argument('--phrases', type=int, default=0, help='追加するランダムなフレーズ数')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    extra = tuple(''.join(rng.choice('abcdefghijklmnopqrstuvwxyzかきくけこ') for _ in range(6))
+                  for _ in range(args.phrases))
+    phrases = tuple(p.lower() for p in DEFAULT_PHRASES) + extra
+    matcher = get_matcher(phrases)
+    print(f"{'length':>8}{'case':>6}{'legacy us':>12}{'matcher us':>12}{'speedup':>10}")
+    for length in args.lengths:
+        for thanks in (True, False):
+            text = build_message(length, rng, thanks)
+            legacy_result, result = legacy_scan(text, phrases), matcher.scan(text)
+            assert set(legacy_result[0]) == set(result.mentions)
+            assert legacy_result[2] == (result.phrase is not None)
+            legacy = min(timeit.repeat(lambda: legacy_scan(text, phrases), number=args.number, repeat=5))
+            single = min(timeit.repeat(lambda: matcher.scan(text), number=args.number, repeat=5))
+            legacy_us = legacy / args.number * 1e6
+            single_us = single / args.number * 1e6
+            print(f"{len(text):>8}{'hit' if thanks else 'miss':>6}{legacy_us:>12.1f}{single_us:>12.1f}"
+                  f"{legacy_us / single_us:>10.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
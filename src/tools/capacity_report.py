@@ -0,0 +1,125 @@
+"""DynamoDB の消費キャパシティ（RCU/WCU）を操作ごとに計測する
+
+スタブの DynamoDB（tools.fakes、アイテムサイズから実物と同じ規則で RCU/WCU を計算）に
+決まった作業（付与・履歴の表示・プロフィールの再保存）を実行し、作業ごとの消費量を表示する。
+--codec で -transactions の書き込み形式（lib.codec）を切り替えて比較できる。
+
+使い方 (src ディレクトリで実行):
+    python -m tools.capacity_report
+    python -m tools.capacity_report --codec 0 --codec 1 --grants 500
+"""
+import argparse
+import json
+import random
+import sys
+from typing import Any, Callable, Dict, List, Optional
+
+from lib import codec
+from lib.db import DynamoDBManager
+from lib.metrics import metrics, InMemoryExporter
+from tools.fakes import FakeDynamoDBResource
+
+TEAM_ID = 'T0CAPACITY'
+
+MESSAGES = [
+    'ありがとう！',
+    '昨日は遅くまでリリース対応ありがとうございました。本当に助かりました🙏',
+    'レビューありがとうございます。指摘いただいた点を直しました！',
+    # 長めの振り返り（同じ言い回しが続くため圧縮が効く）
+    ('今期のプロジェクトでは本当にお世話になりました。' * 3
+     + '要件の整理から設計レビュー、リリース後の障害対応まで、いつも先回りして動いてくださって'
+       'チーム全体がとても助かりました。来期もよろしくお願いします！' * 2),
+]
+
+
+def _measure(phase: Callable[[], None]) -> Dict[str, Dict[str, Any]]:
+    """phase 中の DynamoDB 呼び出しを操作ごとに集計（{'calls', 'capacity', 'per_call'}）"""
+    metrics.flush()
+    phase()
+    exporter = InMemoryExporter()
+    metrics.exporter, previous = exporter, metrics.exporter
+    try:
+        metrics.flush()
+    finally:
+        metrics.exporter = previous
+    report: Dict[str, Dict[str, Any]] = {}
+    for record in exporter.calls('dynamodb'):
+        entry = report.setdefault(record.operation, {'calls': 0, 'capacity': 0.0})
+        entry['calls'] += 1
+        entry['capacity'] += record.consumed_capacity
+    for entry in report.values():
+        entry['capacity'] = round(entry['capacity'], 1)
+        entry['per_call'] = round(entry['capacity'] / entry['calls'], 2)
+    return report
+
+
+def run(codec_version: int, users: int = 40, grants: int = 200, seed: int = 1) -> Dict[str, Dict[str, Any]]:
+    """作業ごと・DynamoDB の操作ごとの {'calls', 'capacity', 'per_call'}"""
+    rng = random.Random(seed)
+    db_manager = DynamoDBManager(FakeDynamoDBResource(), stack_name='capacity')
+    user_ids = [f'U{index:08d}' for index in range(users)]
+    profiles = [{
+        'user_id': user_id, 'team_id': TEAM_ID, 'user_name': f'user{index}', 'real_name': f'利用者 {index}',
+        'display_name': f'user{index}', 'email': f'user{index}@example.com',
+    } for index, user_id in enumerate(user_ids)]
+
+    def seed_profiles() -> None:
+        for profile in profiles:
+            db_manager.save_or_update_user_profile(profile)
+
+    def give() -> None:
+        for _ in range(grants):
+            sender = rng.choice(user_ids)
+            receivers = rng.sample([user for user in user_ids if user != sender], rng.randint(1, 3))
+            db_manager.add_points(sender, receivers, message=rng.choice(MESSAGES), team_id=TEAM_ID,
+                                  channel_id='C0CAPACITY')
+            # 日次上限に当たらないようにする
+            db_manager.users_table.update_item(Key={'user_id': sender}, UpdateExpression='SET daily_points_given = :zero',
+                                               ExpressionAttributeValues={':zero': 0})
+
+    def history() -> None:
+        for user_id in user_ids:
+            db_manager.get_user_transactions(user_id, team_id=TEAM_ID)
+
+    def resave_profiles() -> None:
+        for profile in profiles:
+            db_manager.save_or_update_user_profile(profile)
+
+    def rename_profiles() -> None:
+        for profile in profiles[:users // 4]:
+            db_manager.save_or_update_user_profile(dict(profile, display_name=profile['display_name'] + '_new'))
+
+    phases = {
+        'seed_profiles': seed_profiles,
+        'add_points': give,
+        'get_user_transactions': history,
+        'profile_unchanged': resave_profiles,
+        'profile_renamed': rename_profiles,
+    }
+    written_version, codec.TRANSACTION_CODEC_VERSION = codec.TRANSACTION_CODEC_VERSION, codec_version
+    try:
+        report = {name: _measure(phase) for name, phase in phases.items()}
+    finally:
+        codec.TRANSACTION_CODEC_VERSION = written_version
+    # 日次上限のリセット（計測用の update_item）は add_points の消費に含めない
+    report['add_points'].pop('update_item', None)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Measure DynamoDB capacity units per operation')
+    parser.add_argument('--codec', type=int, action='append', choices=[0, 1],
+                        help='-transactions の書き込み形式（複数指定で比較）')
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--grants', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    reports = {f'codec_v{version}': run(version, args.users, args.grants, args.seed)
+               for version in (args.codec or [0, 1])}
+    print(json.dumps(reports, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
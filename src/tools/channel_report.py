@@ -0,0 +1,36 @@
+"""ワークスペースで感謝の多いチャンネル（Storage.top_channels）
+
+-channel-stats テーブルの件数を1回の Query で読み、感謝のメッセージ数の多い順に表示する。
+--day（YYYY-MM-DD）を省略すると通算。
+
+使い方 (src ディレクトリで実行):
+    python -m tools.channel_report --stack-name KansyaConnect --team-id T0123456
+    python -m tools.channel_report --stack-name KansyaConnect --team-id T0123456 --day 2026-10-19
+"""
+import argparse
+import json
+import os
+import sys
+from typing import List, Optional
+
+import boto3
+
+from lib.db import DynamoDBManager
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Show the channels with the most thank-you messages')
+    parser.add_argument('--stack-name', default=os.environ.get('STACK_NAME'), required='STACK_NAME' not in os.environ)
+    parser.add_argument('--team-id', required=True)
+    parser.add_argument('--day', help='YYYY-MM-DD（省略時は通算）')
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    db_manager = DynamoDBManager(boto3.resource('dynamodb'), stack_name=args.stack_name)
+    print(json.dumps(db_manager.top_channels(args.team_id, day=args.day, limit=args.limit),
+                     ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1018 @@
+"""ローカル検証用のAWS / Slackスタブ
+
+負荷試験やストレステストでハンドラーをネットワークなしで動かすための
+インメモリ実装。各呼び出しは APICallRecorder に記録され、LatencyModel
+で指定した遅延が注入される。
+"""
+import copy
+import itertools
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from botocore.exceptions import ClientError
+
+# テーブル名のサフィックスごとのキースキーマ (HASH, RANGE)
+DEFAULT_KEY_SCHEMAS: Dict[str, Tuple[str, ...]] = {
+    '-users': ('user_id',),
+    '-transactions': ('transaction_id',),
+    '-auth': ('workspace_id',),
+    '-reactions': ('window_id', 'reaction_key'),
+    '-jobs': ('job_id',),
+    '-metering': ('team_id', 'period'),
+    '-rate-limits': ('limit_key',),
+    '-channel-stats': ('scope', 'channel_id'),
+    '-search': ('term', 'posting'),
+    '-outbox': ('outbox_id',),
+    '-history': ('user_id',),
+}
+
+# (テーブル名のサフィックス, インデックス名) ごとのキースキーマ
+DEFAULT_INDEX_SCHEMAS: Dict[Tuple[str, str], Tuple[str, ...]] = {
+    ('-users', 'team_id-user_id-index'): ('team_id', 'user_id'),
+    ('-transactions', 'team_id-timestamp-index'): ('team_id', 'timestamp'),
+    ('-metering', 'period-team_id-index'): ('period', 'team_id'),
+    ('-channel-stats', 'scope-thanks-index'): ('scope', 'thanks'),
+    ('-outbox', 'state-due_at-index'): ('state', 'due_at'),
+}
+
+MAX_TRANSACT_ITEMS = 100
+
+
+class LatencyModel:
+    """一様分布のジッター付き固定遅延"""
+
+    def __init__(self, mean_ms: float = 0.0, jitter_ms: float = 0.0, seed: Optional[int] = None) -> None:
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sleep(self) -> None:
+        if self.mean_ms <= 0 and self.jitter_ms <= 0:
+            return
+        with self._lock:
+            delay_ms = self._random.uniform(self.mean_ms - self.jitter_ms, self.mean_ms + self.jitter_ms)
+        time.sleep(max(delay_ms, 0.0) / 1000.0)
+
+
+class APICallRecorder:
+    """外部API呼び出し回数の記録（全体とスレッドごとの現在イベント単位）"""
+
+    def __init__(self) -> None:
+        self.totals: Counter = Counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, api: str) -> None:
+        with self._lock:
+            self.totals[api] += 1
+        current: Optional[Counter] = getattr(self._local, 'current', None)
+        if current is not None:
+            current[api] += 1
+
+    @contextmanager
+    def track(self) -> Iterator[Counter]:
+        """このスレッドで発生した呼び出しを個別に集計する"""
+        previous = getattr(self._local, 'current', None)
+        counter: Counter = Counter()
+        self._local.current = counter
+        try:
+            yield counter
+        finally:
+            self._local.current = previous
+
+
+def _to_dynamo(value: Any) -> Any:
+    """boto3と同様に数値をDecimalへ変換"""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _to_dynamo(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_dynamo(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return {_to_dynamo(v) for v in value}
+    return value
+
+
+def item_size(value: Any) -> int:
+    """DynamoDBのアイテムサイズ計算規則に沿ったおおよそのバイト数"""
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode('utf-8')) + item_size(v) + 1 for k, v in value.items())
+    if isinstance(value, (list, set, frozenset)):
+        return 3 + sum(item_size(v) + 1 for v in value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        digits = len(str(value).lstrip('-').replace('.', '').lstrip('0')) or 1
+        return (digits + 1) // 2 + 1
+    return len(str(value).encode('utf-8'))
+
+
+def _read_units(size: int, consistent: bool = False) -> float:
+    units = float(max(1, -(-size // 4096)))
+    return units if consistent else units / 2
+
+
+def _write_units(size: int) -> float:
+    return float(max(1, -(-size // 1024)))
+
+
+def _capacity(kwargs: Dict[str, Any], table_name: str, units: float) -> Dict[str, Any]:
+    if kwargs.get('ReturnConsumedCapacity', 'NONE') == 'NONE':
+        return {}
+    return {'ConsumedCapacity': {'TableName': table_name, 'CapacityUnits': units}}
+
+
+def _client_error(code: str, message: str, operation: str, **extra: Any) -> Dict[str, Any]:
+    response: Dict[str, Any] = {'Error': {'Code': code, 'Message': message}}
+    response.update(extra)
+    return response
+
+
+class _FakeExceptions:
+    """client.exceptions 相当。実物と同じく ClientError のサブクラス"""
+
+    class ConditionalCheckFailedException(ClientError):
+        pass
+
+    class TransactionCanceledException(ClientError):
+        pass
+
+    class ValidationException(ClientError):
+        pass
+
+    class ProvisionedThroughputExceededException(ClientError):
+        pass
+
+    class ResourceNotFoundException(ClientError):
+        pass
+
+
+# ---------------------------------------------------------------------------
+# 式の評価
+# ---------------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(
+    r'\s*(?:(?P<op><>|<=|>=|=|<|>|\(|\)|,|\+|-|\.|\[|\])'
+    r'|(?P<value>:[A-Za-z0-9_]+)'
+    r'|(?P<name>#[A-Za-z0-9_]+)'
+    r'|(?P<num>\d+)'
+    r'|(?P<ident>[A-Za-z_][A-Za-z0-9_]*))'
+)
+_KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'ADD', 'REMOVE', 'DELETE'}
+_MISSING = object()
+
+
+class _Parser:
+    def __init__(self, expression: str, names: Dict[str, str], values: Dict[str, Any]) -> None:
+        self.tokens: List[Tuple[str, str]] = []
+        pos = 0
+        expression = expression.strip()
+        while pos < len(expression):
+            match = _TOKEN_RE.match(expression, pos)
+            if not match or match.end() == pos:
+                raise ValueError(f"Invalid expression near: {expression[pos:]}")
+            kind = match.lastgroup
+            text = match.group(kind)
+            if kind == 'ident' and text.upper() in _KEYWORDS:
+                kind, text = 'kw', text.upper()
+            self.tokens.append((kind, text))
+            pos = match.end()
+        self.pos = 0
+        self.names = names or {}
+        self.values = _to_dynamo(values or {})
+
+    def peek(self, offset: int = 0) -> Tuple[str, str]:
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else ('eof', '')
+
+    def take(self, text: Optional[str] = None) -> Tuple[str, str]:
+        token = self.peek()
+        if text is not None and token[1] != text:
+            raise ValueError(f"Expected {text!r} but got {token[1]!r}")
+        self.pos += 1
+        return token
+
+    def at_end(self) -> bool:
+        return self.pos >= len(self.tokens)
+
+    # --- パス・オペランド ---
+    def path(self) -> List[Any]:
+        kind, text = self.take()
+        if kind == 'name':
+            segments: List[Any] = [self.names[text]]
+        elif kind == 'ident':
+            segments = [text]
+        else:
+            raise ValueError(f"Expected attribute path but got {text!r}")
+        while self.peek()[1] in ('.', '['):
+            if self.take()[1] == '.':
+                kind, text = self.take()
+                segments.append(self.names[text] if kind == 'name' else text)
+            else:
+                segments.append(int(self.take()[1]))
+                self.take(']')
+        return segments
+
+    def operand(self) -> Callable[[Dict[str, Any]], Any]:
+        kind, text = self.peek()
+        if kind == 'value':
+            self.take()
+            value = self.values[text]
+            return lambda item: value
+        if kind == 'ident' and self.peek(1)[1] == '(':
+            func = text.lower()
+            self.take()
+            self.take('(')
+            if func == 'if_not_exists':
+                path = self.path()
+                self.take(',')
+                default = self.operand()
+                self.take(')')
+                return lambda item: _resolve(item, path, default(item))
+            if func == 'list_append':
+                left = self.operand()
+                self.take(',')
+                right = self.operand()
+                self.take(')')
+                return lambda item: list(left(item) or []) + list(right(item) or [])
+            if func == 'size':
+                path = self.path()
+                self.take(')')
+                return lambda item: _size(_resolve(item, path, _MISSING))
+            raise ValueError(f"Unsupported function: {func}")
+        path = self.path()
+        return lambda item: _resolve(item, path, _MISSING)
+
+    def value_expr(self) -> Callable[[Dict[str, Any]], Any]:
+        left = self.operand()
+        if self.peek()[1] in ('+', '-'):
+            op = self.take()[1]
+            right = self.operand()
+            if op == '+':
+                return lambda item: left(item) + right(item)
+            return lambda item: left(item) - right(item)
+        return left
+
+    # --- 条件式 ---
+    def condition(self) -> Callable[[Dict[str, Any]], bool]:
+        left = self.and_condition()
+        while self.peek() == ('kw', 'OR'):
+            self.take()
+            right = self.and_condition()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, right)
+        return left
+
+    def and_condition(self) -> Callable[[Dict[str, Any]], bool]:
+        left = self.not_condition()
+        while self.peek() == ('kw', 'AND'):
+            self.take()
+            right = self.not_condition()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, right)
+        return left
+
+    def not_condition(self) -> Callable[[Dict[str, Any]], bool]:
+        if self.peek() == ('kw', 'NOT'):
+            self.take()
+            inner = self.not_condition()
+            return lambda item: not inner(item)
+        return self.primary_condition()
+
+    def primary_condition(self) -> Callable[[Dict[str, Any]], bool]:
+        kind, text = self.peek()
+        if text == '(':
+            self.take()
+            inner = self.condition()
+            self.take(')')
+            return inner
+        if kind == 'ident' and self.peek(1)[1] == '(' and text.lower() != 'size':
+            func = text.lower()
+            self.take()
+            self.take('(')
+            path = self.path()
+            if func == 'attribute_exists':
+                self.take(')')
+                return lambda item: _resolve(item, path, _MISSING) is not _MISSING
+            if func == 'attribute_not_exists':
+                self.take(')')
+                return lambda item: _resolve(item, path, _MISSING) is _MISSING
+            self.take(',')
+            operand = self.operand()
+            self.take(')')
+            if func == 'begins_with':
+                return lambda item: _begins_with(_resolve(item, path, _MISSING), operand(item))
+            if func == 'contains':
+                return lambda item: _contains(_resolve(item, path, _MISSING), operand(item))
+            if func == 'attribute_type':
+                return lambda item: _resolve(item, path, _MISSING) is not _MISSING
+            raise ValueError(f"Unsupported function: {func}")
+
+        left = self.operand()
+        kind, text = self.peek()
+        if (kind, text) == ('kw', 'BETWEEN'):
+            self.take()
+            low = self.operand()
+            self.take('AND')
+            high = self.operand()
+            return lambda item: _compare(left(item), '>=', low(item)) and _compare(left(item), '<=', high(item))
+        if (kind, text) == ('kw', 'IN'):
+            self.take()
+            self.take('(')
+            options = [self.operand()]
+            while self.peek()[1] == ',':
+                self.take()
+                options.append(self.operand())
+            self.take(')')
+            return lambda item: any(_compare(left(item), '=', option(item)) for option in options)
+        op = self.take()[1]
+        right = self.operand()
+        return lambda item: _compare(left(item), op, right(item))
+
+    # --- 更新式 ---
+    def update(self) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+        actions: List[Tuple[str, List[Any], Optional[Callable[[Dict[str, Any]], Any]]]] = []
+        while not self.at_end():
+            clause = self.take()[1]
+            while True:
+                if clause == 'SET':
+                    path = self.path()
+                    self.take('=')
+                    actions.append(('SET', path, self.value_expr()))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', self.path(), None))
+                elif clause in ('ADD', 'DELETE'):
+                    path = self.path()
+                    actions.append((clause, path, self.operand()))
+                else:
+                    raise ValueError(f"Unsupported update clause: {clause}")
+                if self.peek()[1] != ',':
+                    break
+                self.take()
+
+        def apply(item: Dict[str, Any]) -> Dict[str, Any]:
+            # 右辺はすべて更新前のアイテムに対して評価する
+            evaluated = [(action, path, fn(item) if fn else None) for action, path, fn in actions]
+            updated = copy.deepcopy(item)
+            for action, path, value in evaluated:
+                current = _resolve(updated, path, _MISSING)
+                if action == 'SET':
+                    _assign(updated, path, value)
+                elif action == 'REMOVE':
+                    _remove(updated, path)
+                elif action == 'ADD':
+                    if isinstance(value, set):
+                        _assign(updated, path, (set() if current is _MISSING else set(current)) | value)
+                    else:
+                        _assign(updated, path, (Decimal(0) if current is _MISSING else current) + value)
+                elif action == 'DELETE' and current is not _MISSING:
+                    remaining = set(current) - value
+                    if remaining:
+                        _assign(updated, path, remaining)
+                    else:
+                        _remove(updated, path)
+            return updated
+        return apply
+
+
+def _resolve(item: Any, path: List[Any], default: Any) -> Any:
+    current = item
+    for segment in path:
+        try:
+            current = current[segment]
+        except (KeyError, IndexError, TypeError):
+            return default
+    return current
+
+
+def _assign(item: Dict[str, Any], path: List[Any], value: Any) -> None:
+    target = item
+    for segment in path[:-1]:
+        target = target[segment]
+    target[path[-1]] = value
+
+
+def _remove(item: Dict[str, Any], path: List[Any]) -> None:
+    target = _resolve(item, path[:-1], _MISSING) if len(path) > 1 else item
+    if target is not _MISSING:
+        try:
+            del target[path[-1]]
+        except (KeyError, IndexError, TypeError):
+            pass
+
+
+def _size(value: Any) -> Any:
+    return _MISSING if value is _MISSING else Decimal(len(value))
+
+
+def _begins_with(value: Any, prefix: Any) -> bool:
+    return isinstance(value, (str, bytes)) and value.startswith(prefix)
+
+
+def _contains(value: Any, operand: Any) -> bool:
+    if value is _MISSING:
+        return False
+    try:
+        return operand in value
+    except TypeError:
+        return False
+
+
+def _compare(left: Any, op: str, right: Any) -> bool:
+    if left is _MISSING or right is _MISSING:
+        return False
+    try:
+        if op == '=':
+            return left == right
+        if op == '<>':
+            return left != right
+        if op == '<':
+            return left < right
+        if op == '<=':
+            return left <= right
+        if op == '>':
+            return left > right
+        if op == '>=':
+            return left >= right
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+def _build_condition(
+    condition: Any,
+    names: Optional[Dict[str, str]],
+    values: Optional[Dict[str, Any]],
+    is_key_condition: bool = False,
+) -> Callable[[Dict[str, Any]], bool]:
+    if condition is None:
+        return lambda item: True
+    names = dict(names or {})
+    values = dict(values or {})
+    if isinstance(condition, ConditionBase):
+        built = ConditionExpressionBuilder().build_expression(condition, is_key_condition=is_key_condition)
+        condition = built.condition_expression
+        names.update(built.attribute_name_placeholders)
+        values.update(built.attribute_value_placeholders)
+    parser = _Parser(condition, names, values)
+    evaluate = parser.condition()
+    if not parser.at_end():
+        raise ValueError(f"Unexpected token in condition: {parser.peek()[1]!r}")
+    return evaluate
+
+
+# ---------------------------------------------------------------------------
+# DynamoDB
+# ---------------------------------------------------------------------------
+
+class FakeDynamoDBStore:
+    """全テーブルのデータを保持する共有ストア"""
+
+    def __init__(
+        self,
+        key_schemas: Optional[Dict[str, Tuple[str, ...]]] = None,
+        index_schemas: Optional[Dict[Tuple[str, str], Tuple[str, ...]]] = None,
+    ) -> None:
+        self.key_schemas = dict(DEFAULT_KEY_SCHEMAS, **(key_schemas or {}))
+        self.index_schemas = dict(DEFAULT_INDEX_SCHEMAS, **(index_schemas or {}))
+        self.tables: Dict[str, Dict[Tuple[Any, ...], Dict[str, Any]]] = {}
+        self.lock = threading.RLock()
+        # 実行中のトランザクションが書き込むアイテム（transaction_conflicts=True のときだけ使う）
+        self.in_flight: Set[Tuple[str, Tuple[Any, ...]]] = set()
+
+    def key_schema(self, table_name: str) -> Tuple[str, ...]:
+        for suffix, schema in sorted(self.key_schemas.items(), key=lambda kv: -len(kv[0])):
+            if table_name.endswith(suffix):
+                return schema
+        raise KeyError(f"No key schema configured for table: {table_name}")
+
+    def index_schema(self, table_name: str, index_name: str) -> Tuple[str, ...]:
+        for (suffix, name), schema in self.index_schemas.items():
+            if name == index_name and table_name.endswith(suffix):
+                return schema
+        raise KeyError(f"No index schema configured for {table_name}/{index_name}")
+
+    def table(self, table_name: str) -> Dict[Tuple[Any, ...], Dict[str, Any]]:
+        with self.lock:
+            return self.tables.setdefault(table_name, {})
+
+    def item_key(self, table_name: str, key: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(_to_dynamo(key[name]) for name in self.key_schema(table_name))
+
+
+class FakeDynamoDBClient:
+    """resource.meta.client 相当（Python型をそのまま受け付ける）"""
+
+    exceptions = _FakeExceptions
+
+    def __init__(self, store: FakeDynamoDBStore, recorder: APICallRecorder, latency: LatencyModel,
+                 transaction_conflicts: bool = False) -> None:
+        self.store = store
+        self.recorder = recorder
+        self.latency = latency
+        # 実物と同じく、実行中（遅延の間）の別のトランザクションと同じアイテムを書くと TransactionConflict で取り消す
+        self.transaction_conflicts = transaction_conflicts
+
+    def _call(self, api: str) -> None:
+        self.recorder.record(f'dynamodb.{api}')
+        self.latency.sleep()
+
+    def transact_write_items(self, TransactItems: List[Dict[str, Any]], **kwargs: Any) -> Dict[str, Any]:
+        if not self.transaction_conflicts:
+            self._call('transact_write_items')
+            return self._transact_write(TransactItems, **kwargs)
+        self.recorder.record('dynamodb.transact_write_items')
+        keys = self._claim(TransactItems)
+        try:
+            self.latency.sleep()
+            return self._transact_write(TransactItems, **kwargs)
+        finally:
+            with self.store.lock:
+                self.store.in_flight.difference_update(keys)
+
+    def _item_key(self, entry: Dict[str, Any]) -> Tuple[str, Tuple[Any, ...]]:
+        (op, params), = entry.items()
+        key = params['Item'] if op == 'Put' else params['Key']
+        return params['TableName'], self.store.item_key(params['TableName'], key)
+
+    def _claim(self, items: List[Dict[str, Any]]) -> Set[Tuple[str, Tuple[Any, ...]]]:
+        keys = [self._item_key(entry) for entry in items]
+        with self.store.lock:
+            conflicts = [key in self.store.in_flight for key in keys]
+            if any(conflicts):
+                raise _FakeExceptions.TransactionCanceledException(
+                    _client_error('TransactionCanceledException',
+                                  'Transaction cancelled, please refer cancellation reasons for specific reasons',
+                                  'TransactWriteItems',
+                                  CancellationReasons=[
+                                      {'Code': 'TransactionConflict', 'Message': 'Transaction is ongoing for the item'}
+                                      if conflict else {'Code': 'None'} for conflict in conflicts]),
+                    'TransactWriteItems')
+            self.store.in_flight.update(keys)
+        return set(keys)
+
+    def _transact_write(self, TransactItems: List[Dict[str, Any]], **kwargs: Any) -> Dict[str, Any]:
+        if len(TransactItems) > MAX_TRANSACT_ITEMS:
+            raise _FakeExceptions.ValidationException(
+                _client_error('ValidationException',
+                              f'Member must have length less than or equal to {MAX_TRANSACT_ITEMS}',
+                              'TransactWriteItems'),
+                'TransactWriteItems')
+
+        with self.store.lock:
+            planned: List[Tuple[str, str, Tuple[Any, ...], Optional[Dict[str, Any]]]] = []
+            reasons: List[Dict[str, str]] = []
+            failed = False
+            seen_keys = set()
+            for entry in TransactItems:
+                (op, params), = entry.items()
+                table_name = params['TableName']
+                table = self.store.table(table_name)
+                if op == 'Put':
+                    key = self.store.item_key(table_name, params['Item'])
+                else:
+                    key = self.store.item_key(table_name, params['Key'])
+                if (table_name, key) in seen_keys:
+                    raise _FakeExceptions.ValidationException(
+                        _client_error('ValidationException',
+                                      'Transaction request cannot include multiple operations on one item',
+                                      'TransactWriteItems'),
+                        'TransactWriteItems')
+                seen_keys.add((table_name, key))
+
+                existing = table.get(key, {})
+                check = _build_condition(params.get('ConditionExpression'),
+                                         params.get('ExpressionAttributeNames'),
+                                         params.get('ExpressionAttributeValues'))
+                if not check(existing):
+                    failed = True
+                    reasons.append({'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+                    continue
+                reasons.append({'Code': 'None'})
+
+                if op == 'Put':
+                    planned.append((op, table_name, key, _to_dynamo(params['Item'])))
+                elif op == 'Update':
+                    base = existing or dict(zip(self.store.key_schema(table_name),
+                                                (_to_dynamo(params['Key'][k]) for k in self.store.key_schema(table_name))))
+                    apply = _Parser(params['UpdateExpression'],
+                                    params.get('ExpressionAttributeNames', {}),
+                                    params.get('ExpressionAttributeValues', {})).update()
+                    planned.append((op, table_name, key, apply(base)))
+                elif op == 'Delete':
+                    planned.append((op, table_name, key, None))
+
+            if failed:
+                raise _FakeExceptions.TransactionCanceledException(
+                    _client_error('TransactionCanceledException',
+                                  'Transaction cancelled, please refer cancellation reasons for specific reasons',
+                                  'TransactWriteItems',
+                                  CancellationReasons=reasons),
+                    'TransactWriteItems')
+
+            consumed: Dict[str, float] = {}
+            for op, table_name, key, item in planned:
+                table = self.store.table(table_name)
+                size = item_size(item if item is not None else table.get(key, {}))
+                # トランザクション書き込みは通常の2倍のWCUを消費する
+                consumed[table_name] = consumed.get(table_name, 0.0) + 2 * _write_units(size)
+                if op == 'Delete':
+                    table.pop(key, None)
+                else:
+                    table[key] = item
+        if kwargs.get('ReturnConsumedCapacity', 'NONE') == 'NONE':
+            return {}
+        return {'ConsumedCapacity': [{'TableName': name, 'CapacityUnits': units} for name, units in consumed.items()]}
+
+    def batch_get_item(self, RequestItems: Dict[str, Dict[str, Any]], **kwargs: Any) -> Dict[str, Any]:
+        self._call('batch_get_item')
+        responses: Dict[str, List[Dict[str, Any]]] = {}
+        with self.store.lock:
+            for table_name, request in RequestItems.items():
+                table = self.store.table(table_name)
+                items = []
+                for key in request['Keys']:
+                    item = table.get(self.store.item_key(table_name, key))
+                    if item is not None:
+                        items.append(copy.deepcopy(item))
+                responses[table_name] = items
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+class _FakeBatchWriter:
+    def __init__(self, table: 'FakeTable') -> None:
+        self.table = table
+        self.pending = 0
+
+    def __enter__(self) -> '_FakeBatchWriter':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.flush()
+
+    def _count(self) -> None:
+        self.pending += 1
+        if self.pending >= 25:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            self.table.client._call('batch_write_item')
+            self.pending = 0
+
+    def put_item(self, Item: Dict[str, Any]) -> None:
+        self._count()
+        with self.table.store.lock:
+            self.table.data[self.table.store.item_key(self.table.name, Item)] = _to_dynamo(Item)
+
+    def delete_item(self, Key: Dict[str, Any]) -> None:
+        self._count()
+        with self.table.store.lock:
+            self.table.data.pop(self.table.store.item_key(self.table.name, Key), None)
+
+
+class _FakeMeta:
+    def __init__(self, client: FakeDynamoDBClient) -> None:
+        self.client = client
+
+
+class FakeTable:
+    """boto3 Table リソース相当"""
+
+    def __init__(self, name: str, client: FakeDynamoDBClient) -> None:
+        self.name = name
+        self.client = client
+        self.store = client.store
+        self.meta = _FakeMeta(client)
+
+    @property
+    def data(self) -> Dict[Tuple[Any, ...], Dict[str, Any]]:
+        return self.store.table(self.name)
+
+    def _key_dict(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        return {name: item[name] for name in self.store.key_schema(self.name)}
+
+    def _conditional_failed(self, operation: str) -> ClientError:
+        return _FakeExceptions.ConditionalCheckFailedException(
+            _client_error('ConditionalCheckFailedException', 'The conditional request failed', operation),
+            operation)
+
+    def get_item(self, Key: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        self.client._call('get_item')
+        with self.store.lock:
+            item = self.data.get(self.store.item_key(self.name, Key))
+        response = _capacity(kwargs, self.name, _read_units(item_size(item or {}), kwargs.get('ConsistentRead', False)))
+        if item is not None:
+            response['Item'] = copy.deepcopy(item)
+        return response
+
+    def put_item(self, Item: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        self.client._call('put_item')
+        with self.store.lock:
+            key = self.store.item_key(self.name, Item)
+            check = _build_condition(kwargs.get('ConditionExpression'),
+                                     kwargs.get('ExpressionAttributeNames'),
+                                     kwargs.get('ExpressionAttributeValues'))
+            if not check(self.data.get(key, {})):
+                raise self._conditional_failed('PutItem')
+            self.data[key] = _to_dynamo(Item)
+        return _capacity(kwargs, self.name, _write_units(item_size(Item)))
+
+    def update_item(self, Key: Dict[str, Any], UpdateExpression: str, **kwargs: Any) -> Dict[str, Any]:
+        self.client._call('update_item')
+        with self.store.lock:
+            key = self.store.item_key(self.name, Key)
+            existing = self.data.get(key)
+            check = _build_condition(kwargs.get('ConditionExpression'),
+                                     kwargs.get('ExpressionAttributeNames'),
+                                     kwargs.get('ExpressionAttributeValues'))
+            if not check(existing or {}):
+                raise self._conditional_failed('UpdateItem')
+            base = existing or _to_dynamo(dict(Key))
+            apply = _Parser(UpdateExpression,
+                            kwargs.get('ExpressionAttributeNames', {}),
+                            kwargs.get('ExpressionAttributeValues', {})).update()
+            updated = apply(base)
+            self.data[key] = updated
+        response = _capacity(kwargs, self.name, _write_units(max(item_size(updated), item_size(existing or {}))))
+        return_values = kwargs.get('ReturnValues', 'NONE')
+        if return_values in ('ALL_NEW', 'UPDATED_NEW'):
+            response['Attributes'] = copy.deepcopy(updated)
+        if return_values in ('ALL_OLD', 'UPDATED_OLD') and existing is not None:
+            response['Attributes'] = copy.deepcopy(existing)
+        return response
+
+    def delete_item(self, Key: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        self.client._call('delete_item')
+        with self.store.lock:
+            key = self.store.item_key(self.name, Key)
+            check = _build_condition(kwargs.get('ConditionExpression'),
+                                     kwargs.get('ExpressionAttributeNames'),
+                                     kwargs.get('ExpressionAttributeValues'))
+            existing = self.data.get(key)
+            if not check(existing or {}):
+                raise self._conditional_failed('DeleteItem')
+            self.data.pop(key, None)
+        response = _capacity(kwargs, self.name, _write_units(item_size(existing or {})))
+        if kwargs.get('ReturnValues') == 'ALL_OLD' and existing is not None:
+            response['Attributes'] = copy.deepcopy(existing)
+        return response
+
+    def _page(
+        self,
+        keyed_items: List[Tuple[Tuple[Any, ...], Dict[str, Any]]],
+        key_names: Tuple[str, ...],
+        kwargs: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        start_key = kwargs.get('ExclusiveStartKey')
+        if start_key:
+            start = tuple(_to_dynamo(start_key[name]) for name in key_names)
+            positions = [k for k, _ in keyed_items]
+            keyed_items = keyed_items[positions.index(start) + 1:] if start in positions else []
+
+        limit = kwargs.get('Limit')
+        last_key: Optional[Dict[str, Any]] = None
+        if limit is not None and len(keyed_items) > limit:
+            keyed_items = keyed_items[:limit]
+            last_item = keyed_items[-1][1]
+            last_key = {name: last_item[name] for name in key_names}
+
+        matches = _build_condition(kwargs.get('FilterExpression'),
+                                   kwargs.get('ExpressionAttributeNames'),
+                                   kwargs.get('ExpressionAttributeValues'))
+        items = [copy.deepcopy(item) for _, item in keyed_items if matches(item)]
+        scanned_size = sum(item_size(item) for _, item in keyed_items)
+        response: Dict[str, Any] = _capacity(kwargs, self.name,
+                                             _read_units(scanned_size, kwargs.get('ConsistentRead', False)))
+        response.update({'Count': len(items), 'ScannedCount': len(keyed_items)})
+        if kwargs.get('Select') != 'COUNT':
+            response['Items'] = items
+        if last_key is not None:
+            response['LastEvaluatedKey'] = copy.deepcopy(last_key)
+        return response
+
+    def scan(self, **kwargs: Any) -> Dict[str, Any]:
+        self.client._call('scan')
+        key_names = self.store.key_schema(self.name)
+        with self.store.lock:
+            keyed_items = list(self.data.items())
+        total_segments = kwargs.get('TotalSegments')
+        if total_segments:
+            segment = kwargs['Segment']
+            keyed_items = [(k, v) for k, v in keyed_items
+                           if zlib.crc32(repr(k).encode()) % total_segments == segment]
+        return self._page(keyed_items, key_names, kwargs)
+
+    def query(self, KeyConditionExpression: Any, **kwargs: Any) -> Dict[str, Any]:
+        self.client._call('query')
+        index_name = kwargs.get('IndexName')
+        table_keys = self.store.key_schema(self.name)
+        index_keys = self.store.index_schema(self.name, index_name) if index_name else table_keys
+        matches = _build_condition(KeyConditionExpression,
+                                   kwargs.get('ExpressionAttributeNames'),
+                                   kwargs.get('ExpressionAttributeValues'),
+                                   is_key_condition=True)
+        with self.store.lock:
+            candidates = [item for item in self.data.values()
+                          if all(name in item for name in index_keys) and matches(item)]
+        if len(index_keys) > 1:
+            candidates.sort(key=lambda item: item[index_keys[1]],
+                            reverse=not kwargs.get('ScanIndexForward', True))
+        # ページングキーはインデックスキー + テーブルキー
+        key_names = tuple(dict.fromkeys(index_keys + table_keys))
+        keyed_items = [(tuple(item[name] for name in key_names), item) for item in candidates]
+        return self._page(keyed_items, key_names, kwargs)
+
+    def batch_writer(self, **kwargs: Any) -> _FakeBatchWriter:
+        return _FakeBatchWriter(self)
+
+
+class FakeDynamoDBResource:
+    """boto3.resource('dynamodb') 相当"""
+
+    def __init__(
+        self,
+        recorder: Optional[APICallRecorder] = None,
+        latency: Optional[LatencyModel] = None,
+        store: Optional[FakeDynamoDBStore] = None,
+        transaction_conflicts: bool = False,
+    ) -> None:
+        self.store = store or FakeDynamoDBStore()
+        self.recorder = recorder or APICallRecorder()
+        self.meta = _FakeMeta(FakeDynamoDBClient(self.store, self.recorder, latency or LatencyModel(),
+                                                 transaction_conflicts))
+
+    def Table(self, name: str) -> FakeTable:
+        return FakeTable(name, self.meta.client)
+
+
+# ---------------------------------------------------------------------------
+# SNS
+# ---------------------------------------------------------------------------
+
+class FakeSNSClient:
+    """publishされたメッセージを保持するSNSクライアント"""
+
+    def __init__(self, recorder: APICallRecorder, latency: Optional[LatencyModel] = None) -> None:
+        self.recorder = recorder
+        self.latency = latency or LatencyModel()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.published: List[Dict[str, Any]] = []
+
+    def publish(self, TopicArn: str, Message: str, **kwargs: Any) -> Dict[str, Any]:
+        self.recorder.record('sns.publish')
+        self.latency.sleep()
+        record = dict(kwargs, TopicArn=TopicArn, Message=Message, MessageId=str(uuid.uuid4()))
+        outbox: Optional[List[Dict[str, Any]]] = getattr(self._local, 'outbox', None)
+        if outbox is not None:
+            outbox.append(record)
+        else:
+            with self._lock:
+                self.published.append(record)
+        return {'MessageId': record['MessageId']}
+
+    @contextmanager
+    def capture(self) -> Iterator[List[Dict[str, Any]]]:
+        """このスレッドでpublishされたメッセージを取り出す"""
+        previous = getattr(self._local, 'outbox', None)
+        outbox: List[Dict[str, Any]] = []
+        self._local.outbox = outbox
+        try:
+            yield outbox
+        finally:
+            self._local.outbox = previous
+
+
+# ---------------------------------------------------------------------------
+# Slack
+# ---------------------------------------------------------------------------
+
+class FakeSlackWorkspace:
+    """Slack側の状態（ユーザーディレクトリ・チーム情報）"""
+
+    def __init__(self, recorder: APICallRecorder, latency: Optional[LatencyModel] = None,
+                 oauth_response: Optional[Dict[str, Any]] = None) -> None:
+        self.recorder = recorder
+        self.latency = latency or LatencyModel()
+        self.oauth_response = oauth_response or {}
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.teams: Dict[str, Dict[str, Any]] = {}
+        self.tokens: Dict[str, str] = {}
+        self._view_ids = itertools.count(1)
+
+    def add_team(self, team_id: str, token: str, name: str = '', domain: str = '') -> None:
+        self.teams[team_id] = {'id': team_id, 'name': name or team_id, 'domain': domain or team_id.lower()}
+        self.tokens[token] = team_id
+
+    def add_user(self, user_id: str, team_id: str, name: str = '') -> None:
+        name = name or user_id.lower()
+        self.users[user_id] = {
+            'id': user_id,
+            'team_id': team_id,
+            'name': name,
+            'profile': {
+                'real_name': name.title(),
+                'display_name': name,
+                'email': f'{name}@example.com',
+            },
+        }
+
+    def client_factory(self) -> Callable[..., 'FakeWebClient']:
+        return lambda token=None, **kwargs: FakeWebClient(self, token)
+
+
+class FakeWebClient:
+    """slack_sdk.WebClient 相当。未知のメソッドは {'ok': True} を返す"""
+
+    def __init__(self, workspace: FakeSlackWorkspace, token: Optional[str] = None) -> None:
+        self.workspace = workspace
+        self.token = token
+
+    def _team(self) -> Dict[str, Any]:
+        team_id = self.workspace.tokens.get(self.token or '', 'T00000000')
+        return self.workspace.teams.get(team_id, {'id': team_id, 'name': team_id, 'domain': team_id.lower()})
+
+    def __getattr__(self, method: str) -> Callable[..., Dict[str, Any]]:
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def call(**kwargs: Any) -> Dict[str, Any]:
+            self.workspace.recorder.record(f'slack.{method}')
+            self.workspace.latency.sleep()
+            return self._respond(method, kwargs)
+        return call
+
+    def _respond(self, method: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        if method == 'conversations_open':
+            users = kwargs.get('users') or ['']
+            return {'ok': True, 'channel': {'id': f"D{users[0]}"}}
+        if method == 'users_info':
+            user = self.workspace.users.get(kwargs.get('user', ''))
+            if user is None:
+                user = {'id': kwargs.get('user', ''), 'team_id': self._team()['id'], 'name': '',
+                        'profile': {'real_name': '', 'display_name': '', 'email': ''}}
+            return {'ok': True, 'user': copy.deepcopy(user)}
+        if method == 'team_info':
+            return {'ok': True, 'team': dict(self._team())}
+        if method == 'conversations_list':
+            return {'ok': True, 'channels': [{'id': 'C0000GENERAL', 'name': 'general'}]}
+        if method in ('views_open', 'views_update', 'views_push'):
+            return {'ok': True, 'view': {'id': kwargs.get('view_id') or f"V{next(self.workspace._view_ids):010d}"}}
+        if method == 'chat_postMessage':
+            return {'ok': True, 'channel': kwargs.get('channel'), 'ts': f"{time.time():.6f}"}
+        if method == 'oauth_v2_access':
+            return copy.deepcopy(self.workspace.oauth_response)
+        return {'ok': True}
+
+
+# ---------------------------------------------------------------------------
+# Socket Mode
+# ---------------------------------------------------------------------------
+
+class FakeSocketModeClient:
+    """slack_sdk.socket_mode.aiohttp.SocketModeClient の代わりに、ローカルで要求を配信する"""
+
+    def __init__(self) -> None:
+        self.socket_mode_request_listeners: List[Callable[..., Any]] = []
+        self.acks: List[str] = []
+        self.connected = False
+        self.closed = False
+        self._sequence = itertools.count(1)
+
+    async def connect(self) -> None:
+        self.connected = True
+
+    async def disconnect(self) -> None:
+        self.connected = False
+
+    async def close(self) -> None:
+        self.closed = True
+
+    async def send_socket_mode_response(self, response: Any) -> None:
+        self.acks.append(response.envelope_id)
+
+    async def deliver(self, envelope_type: str, payload: Dict[str, Any], retry_attempt: int = 0) -> str:
+        """Slack から1件のエンベロープが届いたのと同じく、登録済みのリスナーを呼ぶ"""
+        from slack_sdk.socket_mode.request import SocketModeRequest
+        envelope_id = f'env-{next(self._sequence)}'
+        request = SocketModeRequest(type=envelope_type, envelope_id=envelope_id, payload=payload,
+                                    retry_attempt=retry_attempt or None)
+        for listener in list(self.socket_mode_request_listeners):
+            await listener(self, request)
+        return envelope_id
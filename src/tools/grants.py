@@ -0,0 +1,51 @@
+"""チャンク分割した付与の再開・取り消し
+
+受信者が多く1トランザクションに収まらない付与は、ヘッダー（status=pending）を書いてから
+受信者をチャンクごとに適用する。途中で Lambda が終了した場合などはヘッダーが pending の
+まま残るので、このツールで完了させるか取り消す。どちらも何度実行しても結果は同じ。
+
+使い方 (src ディレクトリで実行):
+    python -m tools.grants --stack-name KansyaConnect list
+    python -m tools.grants --stack-name KansyaConnect resume --all-pending
+    python -m tools.grants --stack-name KansyaConnect rollback <grant_id> ...
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+import boto3
+
+from lib.db import DynamoDBManager
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Resume or roll back chunked grants')
+    parser.add_argument('--stack-name', default=os.environ.get('STACK_NAME'), required='STACK_NAME' not in os.environ)
+    parser.add_argument('command', choices=['list', 'resume', 'rollback'])
+    parser.add_argument('grant_ids', nargs='*')
+    parser.add_argument('--all-pending', action='store_true', help='pending / rolling_back の付与をすべて対象にする')
+    args = parser.parse_args(argv)
+
+    db_manager = DynamoDBManager(boto3.resource('dynamodb'), stack_name=args.stack_name)
+    if args.command == 'list':
+        print(json.dumps(db_manager.pending_grants(), ensure_ascii=False, indent=2, default=str))
+        return 0
+
+    targets: Dict[str, str] = {grant_id: args.command for grant_id in args.grant_ids}
+    if args.all_pending:
+        for grant in db_manager.pending_grants():
+            # 取り消し途中の付与は再開できないため、取り消しを完了させる
+            command = 'rollback' if grant['status'] == 'rolling_back' else args.command
+            targets.setdefault(grant['transaction_id'], command)
+    results: Dict[str, Any] = {}
+    for grant_id, command in targets.items():
+        action = db_manager.resume_grant if command == 'resume' else db_manager.rollback_grant
+        results[grant_id] = action(grant_id)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0 if all(results.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
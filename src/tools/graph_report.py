@@ -0,0 +1,38 @@
+"""ワークスペースの感謝のグラフの分析（lib.graph.GraphAnalytics）
+
+期間中の -transactions を読み、感謝に関わっていないメンバー・受け取っていないメンバー・相互の感謝の割合・
+感謝が集まる人・まとまりをつなぐつながりを表示する。結果は -jobs に保存され、同じ期間の再実行は
+保存した結果を返す（--refresh で計算し直す）。
+
+使い方 (src ディレクトリで実行):
+    python -m tools.graph_report --stack-name KansyaConnect --team-id T0123456 --since 2026-10-01 --until 2026-10-31T23:59:59
+"""
+import argparse
+import json
+import os
+import sys
+from typing import List, Optional
+
+import boto3
+
+from lib.db import DynamoDBManager
+from lib.graph import GraphAnalytics
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Analyze who-thanks-whom for a workspace')
+    parser.add_argument('--stack-name', default=os.environ.get('STACK_NAME'), required='STACK_NAME' not in os.environ)
+    parser.add_argument('--team-id', required=True)
+    parser.add_argument('--since', required=True, help='ISO 8601（この時刻以降）')
+    parser.add_argument('--until', required=True, help='ISO 8601（この時刻まで）')
+    parser.add_argument('--refresh', action='store_true', help='保存した結果を使わずに計算し直す')
+    args = parser.parse_args(argv)
+
+    db_manager = DynamoDBManager(boto3.resource('dynamodb'), stack_name=args.stack_name)
+    report = GraphAnalytics(db_manager).analyze(args.team_id, args.since, args.until, refresh=args.refresh)
+    print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
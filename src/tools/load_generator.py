@@ -0,0 +1,472 @@
+"""イベントリプレイ負荷ジェネレーター
+
+events/ 配下のフィクスチャをもとにユーザー・メンション・チームを変化させた
+イベントを生成し、event_handler / interactive_handler / notification(main)
+の lambda_handler をスタブ化したAWS・Slack上で実行する。
+
+使い方 (src ディレクトリで実行):
+    python -m tools.load_generator --events 500 --concurrency 16 \
+        --dynamodb-latency-ms 8 --slack-latency-ms 120
+"""
+import argparse
+import copy
+import importlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import Counter, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from unittest import mock
+
+from tools.fakes import (
+    APICallRecorder,
+    FakeDynamoDBResource,
+    FakeSlackWorkspace,
+    FakeSNSClient,
+    LatencyModel,
+)
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(SRC_DIR)
+EVENTS_DIR = os.path.join(REPO_DIR, 'events')
+HANDLER_DIRS = [
+    os.path.join(SRC_DIR, 'handlers', 'event_handler'),
+    os.path.join(SRC_DIR, 'handlers', 'interactive_handler'),
+    os.path.join(SRC_DIR, 'handlers', 'notification'),
+    os.path.join(SRC_DIR, 'handlers', 'outbox_worker'),
+]
+# ハンドラーはimport時にboto3クライアントを生成するため、毎回読み込み直す
+HANDLER_MODULES = ['event_handler', 'interactive_handler', 'main', 'event_notification', 'interactive_notification',
+                   'outbox_worker']
+
+STACK_NAME = 'loadtest'
+EVENT_TOPIC_ARN = f'arn:aws:sns:local:000000000000:{STACK_NAME}-events'
+INTERACTIVE_TOPIC_ARN = f'arn:aws:sns:local:000000000000:{STACK_NAME}-interactive'
+
+DEFAULT_MIX = {'message': 0.8, 'home_opened': 0.1, 'view_history': 0.1}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """線形補間によるパーセンタイル（sorted_valuesは昇順）"""
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * q / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def load_fixture(name: str) -> Dict[str, Any]:
+    with open(os.path.join(EVENTS_DIR, name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+class EventFactory:
+    """フィクスチャからイベントのバリエーションを生成"""
+
+    def __init__(self, users: int, teams: int, max_mentions: int, seed: Optional[int] = None) -> None:
+        self.random = random.Random(seed)
+        self.max_mentions = max_mentions
+        self.message_event = load_fixture('message_event.json')
+        self.interactive_event = load_fixture('interactive_event.json')
+        self.oauth_response = load_fixture('oauth_event.json')
+        self.team_ids = [f'T{i:08d}' for i in range(teams)]
+        self.users_by_team: Dict[str, List[str]] = {
+            team_id: [f'U{t:03d}{i:06d}' for i in range(max(users // teams, 2))]
+            for t, team_id in enumerate(self.team_ids)
+        }
+
+    def token_for(self, team_id: str) -> str:
+        return f'xoxb-{team_id}-loadtest'
+
+    def _pick(self) -> Tuple[str, str]:
+        team_id = self.random.choice(self.team_ids)
+        return team_id, self.random.choice(self.users_by_team[team_id])
+
+    def _fixture_body(self) -> Dict[str, Any]:
+        body = self.message_event['body']
+        return copy.deepcopy(json.loads(body) if isinstance(body, str) else body)
+
+    def _event_body(self, team_id: str, event: Dict[str, Any]) -> Dict[str, Any]:
+        body = self._fixture_body()
+        body['team_id'] = team_id
+        body['context_team_id'] = team_id
+        body['event_id'] = f'Ev{self.random.getrandbits(40):010X}'
+        body['event_time'] = int(time.time())
+        body['event'] = event
+        return body
+
+    def _api_gateway_event(self, template: Dict[str, Any], body: str) -> Dict[str, Any]:
+        event = copy.deepcopy(template)
+        headers = dict(event.get('headers') or {})
+        headers.pop('X-Slack-Retry-Num', None)
+        headers.pop('X-Slack-Retry-Reason', None)
+        event['headers'] = headers
+        event['multiValueHeaders'] = {}
+        event['body'] = body
+        return event
+
+    def message(self) -> Dict[str, Any]:
+        team_id, sender = self._pick()
+        members = [user for user in self.users_by_team[team_id] if user != sender]
+        count = self.random.randint(1, min(self.max_mentions, len(members)))
+        mentions = self.random.sample(members, count)
+        text = ' '.join(f'<@{user}>' for user in mentions) + ' いつもありがとう！'
+        event = self._fixture_body()['event']
+        ts = f'{time.time():.6f}'
+        event.update({'user': sender, 'text': text, 'team': team_id, 'ts': ts, 'event_ts': ts,
+                      'client_msg_id': f'{self.random.getrandbits(128):032x}'})
+        event.pop('blocks', None)
+        return self._api_gateway_event(self.message_event, json.dumps(self._event_body(team_id, event)))
+
+    def home_opened(self) -> Dict[str, Any]:
+        team_id, user = self._pick()
+        event = {'type': 'app_home_opened', 'user': user, 'channel': f'D{user}', 'tab': 'home',
+                 'event_ts': f'{time.time():.6f}'}
+        return self._api_gateway_event(self.message_event, json.dumps(self._event_body(team_id, event)))
+
+    def view_history(self) -> Dict[str, Any]:
+        team_id, user = self._pick()
+        payload = {
+            'type': 'block_actions',
+            'user': {'id': user, 'team_id': team_id},
+            'team': {'id': team_id},
+            'trigger_id': f'{self.random.getrandbits(48)}.loadtest',
+            'actions': [{'action_id': 'view_history', 'type': 'button'}],
+        }
+        body = 'payload=' + urllib.parse.quote(json.dumps(payload))
+        return self._api_gateway_event(self.interactive_event, body)
+
+
+class StubEnvironment:
+    """boto3 / slack_sdk をスタブに差し替えてハンドラーを読み込む"""
+
+    def __init__(self, factory: EventFactory, dynamodb_latency: LatencyModel,
+                 slack_latency: LatencyModel, sns_latency: LatencyModel, seed_users: bool = True,
+                 storage: str = 'dynamodb', sqlite_path: Optional[str] = None) -> None:
+        self.factory = factory
+        self.recorder = APICallRecorder()
+        self.dynamodb = FakeDynamoDBResource(self.recorder, dynamodb_latency)
+        # storage='sqlite' の場合は DynamoDB スタブの代わりに実際の SQLite ファイルを使う
+        self.storage = storage
+        self._tempdir: Optional[tempfile.TemporaryDirectory] = None
+        if storage == 'sqlite' and not sqlite_path:
+            self._tempdir = tempfile.TemporaryDirectory()
+            sqlite_path = os.path.join(self._tempdir.name, 'kansya.db')
+        self.sqlite_path = sqlite_path
+        self.sns = FakeSNSClient(self.recorder, sns_latency)
+        self.slack = FakeSlackWorkspace(self.recorder, slack_latency, oauth_response=factory.oauth_response)
+        self.handlers: Dict[str, Callable[[Dict[str, Any], Any], Dict[str, Any]]] = {}
+        self._stack = ExitStack()
+        self._seed(seed_users)
+
+    def _seed(self, seed_users: bool) -> None:
+        auth_table = self.dynamodb.Table(f'{STACK_NAME}-auth')
+        users_table = self.dynamodb.Table(f'{STACK_NAME}-users')
+        sqlite_storage = None
+        if self.storage == 'sqlite':
+            from lib.sqlite_storage import SQLiteStorage
+            sqlite_storage = SQLiteStorage(self.sqlite_path)
+        for team_id in self.factory.team_ids:
+            token = self.factory.token_for(team_id)
+            self.slack.add_team(team_id, token)
+            # auth_handler が保存するのと同じ形でワークスペースを登録
+            workspace = {
+                'team_id': team_id,
+                'workspace_id': team_id,
+                'access_token': token,
+                'team_name': self.factory.oauth_response.get('team', {}).get('name', team_id),
+                'created_at': int(time.time()),
+            }
+            if sqlite_storage:
+                sqlite_storage.save_workspace_data(workspace)
+            else:
+                auth_table.data[(team_id,)] = workspace
+            for user_id in self.factory.users_by_team[team_id]:
+                self.slack.add_user(user_id, team_id)
+                if seed_users:
+                    profile = self.slack.users[user_id]
+                    user = {
+                        'user_id': user_id,
+                        'team_id': team_id,
+                        'user_name': profile['name'],
+                        'real_name': profile['profile']['real_name'],
+                        'display_name': profile['profile']['display_name'],
+                        'email': profile['profile']['email'],
+                        'total_points': 0,
+                        'daily_points_given': 0,
+                        'last_reset_date': time.strftime('%Y-%m-%d'),
+                    }
+                    if sqlite_storage:
+                        sqlite_storage.save_or_update_user_profile(user)
+                    else:
+                        users_table.data[(user_id,)] = user
+        if sqlite_storage:
+            sqlite_storage.close()
+        self.recorder.totals.clear()
+
+    def __enter__(self) -> 'StubEnvironment':
+        stack = self._stack
+        stack.enter_context(mock.patch.dict(os.environ, {
+            'STACK_NAME': STACK_NAME,
+            'SNS_POINTS_TOPIC_ARN': EVENT_TOPIC_ARN,
+            'SNS_INTERACTIVE_TOPIC_ARN': INTERACTIVE_TOPIC_ARN,
+            'STORAGE_BACKEND': self.storage,
+            'SQLITE_PATH': self.sqlite_path or '',
+        }))
+        stack.enter_context(mock.patch('boto3.resource', lambda *a, **kw: self.dynamodb))
+        stack.enter_context(mock.patch('boto3.client', lambda *a, **kw: self.sns))
+        stack.enter_context(mock.patch('slack_sdk.WebClient', self.slack.client_factory()))
+        for path in [SRC_DIR] + HANDLER_DIRS:
+            if path not in sys.path:
+                sys.path.insert(0, path)
+        for name in HANDLER_MODULES:
+            sys.modules.pop(name, None)
+        metrics_module = importlib.import_module('lib.metrics')
+        stack.enter_context(mock.patch.object(metrics_module.metrics, 'exporter', None))
+        # 利用量の集計はこの環境のストレージに書き込む（終了後に前の環境の集計を残さない）
+        stack.enter_context(mock.patch.object(metrics_module.metrics, 'sinks', []))
+        stack.enter_context(mock.patch.object(importlib.import_module('lib.metering'), '_installed', None))
+        slack_module = importlib.import_module('lib.slack')
+        stack.enter_context(mock.patch.object(slack_module, 'WebClient', self.slack.client_factory()))
+        # 前の環境のトークン・クライアントを引き継がない
+        importlib.import_module('lib.cache').clear_all()
+
+        self.handlers = {
+            'event_handler': importlib.import_module('event_handler').lambda_handler,
+            'interactive_handler': importlib.import_module('interactive_handler').lambda_handler,
+            'notification': importlib.import_module('main').lambda_handler,
+            'outbox_worker': importlib.import_module('outbox_worker').lambda_handler,
+        }
+        # ハンドラーやSlackManagerのログ出力が計測を歪めるため、エラー以外は抑制する
+        logging.disable(logging.WARNING)
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        logging.disable(logging.NOTSET)
+        importlib.import_module('lib.cache').clear_all()
+        for name in HANDLER_MODULES:
+            sys.modules.pop(name, None)
+        self._stack.close()
+        if self._tempdir:
+            self._tempdir.cleanup()
+
+
+class LoadReport:
+    """ハンドラーごとのレイテンシーと外部API呼び出し回数の集計"""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.calls_by_kind: Dict[str, Counter] = defaultdict(Counter)
+        self.events_by_kind: Counter = Counter()
+        # イベントに紐付かない定期実行（アウトボックスの送信など）の回数
+        self.runs_by_kind: Counter = Counter()
+        self.started = 0.0
+        self.finished = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, timings: List[Tuple[str, float, bool]], calls: Counter,
+            background: bool = False) -> None:
+        with self._lock:
+            (self.runs_by_kind if background else self.events_by_kind)[kind] += 1
+            self.calls_by_kind[kind].update(calls)
+            for handler, elapsed_ms, ok in timings:
+                self.latencies[handler].append(elapsed_ms)
+                if not ok:
+                    self.errors[handler] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = max(self.finished - self.started, 1e-9)
+        total_events = sum(self.events_by_kind.values())
+        handlers = {}
+        for handler, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            handlers[handler] = {
+                'invocations': len(ordered),
+                'errors': self.errors[handler],
+                'p50_ms': round(percentile(ordered, 50), 3),
+                'p95_ms': round(percentile(ordered, 95), 3),
+                'p99_ms': round(percentile(ordered, 99), 3),
+                'max_ms': round(ordered[-1], 3) if ordered else 0.0,
+            }
+        calls_per_event = {
+            kind: {api: round(count / self.events_by_kind[kind], 2) for api, count in sorted(calls.items())}
+            for kind, calls in sorted(self.calls_by_kind.items()) if kind in self.events_by_kind
+        }
+        calls_per_run = {
+            kind: {api: round(count / self.runs_by_kind[kind], 2) for api, count in sorted(calls.items())}
+            for kind, calls in sorted(self.calls_by_kind.items()) if kind in self.runs_by_kind
+        }
+        return {
+            'events': total_events,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_eps': round(total_events / elapsed, 2),
+            'handlers': handlers,
+            'calls_per_event': calls_per_event,
+            'calls_per_run': calls_per_run,
+        }
+
+
+def _invoke(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]], event: Dict[str, Any]) -> Tuple[float, bool]:
+    started = time.perf_counter()
+    try:
+        response = handler(event, None) or {}
+        ok = response.get('statusCode', 200) < 400
+    except Exception:
+        ok = False
+    return (time.perf_counter() - started) * 1000.0, ok
+
+
+def _sns_event(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {'Records': [{'EventSource': 'aws:sns', 'Sns': {
+        'TopicArn': record['TopicArn'],
+        'Message': record['Message'],
+        'MessageId': record['MessageId'],
+        'MessageAttributes': {},
+    }}]}
+
+
+def run_one(env: StubEnvironment, kind: str, event: Dict[str, Any], report: LoadReport) -> None:
+    """1イベントを入口ハンドラーからSNS経由の通知処理まで実行"""
+    entry = 'interactive_handler' if kind == 'view_history' else 'event_handler'
+    timings: List[Tuple[str, float, bool]] = []
+    with env.recorder.track() as calls:
+        with env.sns.capture() as published:
+            elapsed_ms, ok = _invoke(env.handlers[entry], event)
+        timings.append((entry, elapsed_ms, ok))
+        for record in published:
+            elapsed_ms, ok = _invoke(env.handlers['notification'], _sns_event(record))
+            timings.append(('notification', elapsed_ms, ok))
+    report.add(kind, timings, calls)
+
+
+def run_outbox_worker(env: StubEnvironment, report: LoadReport) -> None:
+    """-outbox のストリームの代わりにワーカーを1回実行し、イベントとは別に集計"""
+    with env.recorder.track() as calls:
+        elapsed_ms, ok = _invoke(env.handlers['outbox_worker'], {'Records': []})
+    report.add('outbox_worker', [('outbox_worker', elapsed_ms, ok)], calls, background=True)
+
+
+def run_load(env: StubEnvironment, factory: EventFactory, events: int, concurrency: int,
+             rate: Optional[float], mix: Dict[str, float], outbox_interval: float = 0.05) -> LoadReport:
+    """並列数固定、またはrate指定時は一定間隔でイベントを投入"""
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    builders = {'message': factory.message, 'home_opened': factory.home_opened, 'view_history': factory.view_history}
+    workload = []
+    for _ in range(events):
+        kind = factory.random.choices(kinds, weights)[0]
+        workload.append((kind, builders[kind]()))
+
+    report = LoadReport()
+    futures: List[Future] = []
+    stopped = threading.Event()
+
+    def drain_outbox() -> None:
+        # 本番のようにイベントとは独立した周期でアウトボックスを送る
+        while not stopped.wait(outbox_interval):
+            run_outbox_worker(env, report)
+
+    drainer = threading.Thread(target=drain_outbox, name='outbox-worker', daemon=True)
+    report.started = time.perf_counter()
+    drainer.start()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for index, (kind, event) in enumerate(workload):
+                if rate:
+                    delay = report.started + index / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                futures.append(executor.submit(run_one, env, kind, event, report))
+            for future in futures:
+                future.result()
+    finally:
+        stopped.set()
+        drainer.join()
+    # 最後に積まれた DM を送り切る
+    run_outbox_worker(env, report)
+    report.finished = time.perf_counter()
+    return report
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        if kind.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'unknown event kind: {kind}')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def format_report(summary: Dict[str, Any]) -> str:
+    lines = [
+        f"events={summary['events']} elapsed={summary['elapsed_s']}s throughput={summary['throughput_eps']} events/s",
+        '',
+        f"{'handler':<22}{'count':>8}{'errors':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}",
+    ]
+    for handler, stats in summary['handlers'].items():
+        lines.append(
+            f"{handler:<22}{stats['invocations']:>8}{stats['errors']:>8}"
+            f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}"
+        )
+    lines.append('')
+    lines.append('external API calls per event:')
+    for kind, calls in summary['calls_per_event'].items():
+        lines.append(f'  {kind}:')
+        for api, count in calls.items():
+            lines.append(f'    {api:<36}{count:>8.2f}')
+    if summary['calls_per_run']:
+        lines.append('')
+        lines.append('external API calls per background run:')
+        for kind, calls in summary['calls_per_run'].items():
+            lines.append(f'  {kind}:')
+            for api, count in calls.items():
+                lines.append(f'    {api:<36}{count:>8.2f}')
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='KansyaConnect event replay load generator')
+    parser.add_argument('--events', type=int, default=200, help='投入するイベント数')
+    parser.add_argument('--concurrency', type=int, default=8, help='同時実行数')
+    parser.add_argument('--rate', type=float, default=None, help='1秒あたりの投入数（省略時は並列数のみで制御）')
+    parser.add_argument('--users', type=int, default=1000, help='生成するユーザー数')
+    parser.add_argument('--teams', type=int, default=5, help='生成するワークスペース数')
+    parser.add_argument('--max-mentions', type=int, default=3, help='1メッセージあたりの最大メンション数')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help='例: message=0.8,home_opened=0.1,view_history=0.1')
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=5.0)
+    parser.add_argument('--slack-latency-ms', type=float, default=100.0)
+    parser.add_argument('--sns-latency-ms', type=float, default=20.0)
+    parser.add_argument('--jitter', type=float, default=0.5, help='遅延のジッター（平均に対する割合）')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--storage', choices=['dynamodb', 'sqlite'], default='dynamodb',
+                        help='sqlite の場合は DynamoDB スタブの代わりに SQLite ファイルを使う')
+    parser.add_argument('--sqlite-path', default=None, help='省略時は一時ファイル')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args(argv)
+
+    def latency(mean_ms: float) -> LatencyModel:
+        return LatencyModel(mean_ms, mean_ms * args.jitter, seed=args.seed)
+
+    factory = EventFactory(args.users, args.teams, args.max_mentions, seed=args.seed)
+    with StubEnvironment(factory, latency(args.dynamodb_latency_ms), latency(args.slack_latency_ms),
+                         latency(args.sns_latency_ms), storage=args.storage, sqlite_path=args.sqlite_path) as env:
+        report = run_load(env, factory, args.events, args.concurrency, args.rate, args.mix)
+
+    summary = report.summary()
+    print(json.dumps(summary, ensure_ascii=False, indent=2) if args.json else format_report(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
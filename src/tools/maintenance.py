@@ -0,0 +1,60 @@
+"""テーブル全体のメンテナンス（lib.maintenance）
+
+rebuild-points: -transactions から各ユーザーの total_points を再計算し、-users とのずれを報告する。
+--repair を付けると、照合後に値が変わっていないユーザーだけ条件付きで書き換える。稼働中に実行してよい。
+reindex-search: -transactions の完了した付与から全文検索の索引（-search）を書き直す（既存の付与の取り込み）。
+
+並列セグメントスキャンの途中経過は -jobs テーブルに保存されるので、同じ --job-id で
+再実行すると中断した位置から続ける（既定の job-id は開始時刻から作り、最初に表示する）。
+
+使い方 (src ディレクトリで実行):
+    python -m tools.maintenance --stack-name KansyaConnect rebuild-points
+    python -m tools.maintenance --stack-name KansyaConnect rebuild-points --repair --max-rcu 500 --max-wcu 50
+    python -m tools.maintenance --stack-name KansyaConnect reindex-search --max-wcu 200
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from typing import List, Optional
+
+import boto3
+
+from lib.db import DynamoDBManager
+from lib.maintenance import CapacityLimiter, PointsRebuild, SearchReindex, MAINTENANCE_SEGMENTS
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Run table-wide maintenance jobs')
+    parser.add_argument('--stack-name', default=os.environ.get('STACK_NAME'), required='STACK_NAME' not in os.environ)
+    parser.add_argument('command', choices=['rebuild-points', 'reindex-search'])
+    parser.add_argument('--repair', action='store_true', help='ずれを修正する（指定しなければ報告だけ）')
+    parser.add_argument('--job-id', help='途中経過の保存先（同じ値で再実行すると続きから）')
+    parser.add_argument('--segments', type=int, default=MAINTENANCE_SEGMENTS)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--max-rcu', type=float, help='1秒あたりの読み込みキャパシティの上限')
+    parser.add_argument('--max-wcu', type=float, help='1秒あたりの書き込みキャパシティの上限')
+    args = parser.parse_args(argv)
+
+    db_manager = DynamoDBManager(boto3.resource('dynamodb'), stack_name=args.stack_name)
+    if args.command == 'reindex-search':
+        job_id = args.job_id or f"maintenance#reindex-search#{datetime.now().strftime('%Y%m%dT%H%M%S')}"
+        print(f'job-id: {job_id}', file=sys.stderr)
+        report = SearchReindex(db_manager, job_id, segments=args.segments, workers=args.workers,
+                               read_limiter=CapacityLimiter(args.max_rcu),
+                               write_limiter=CapacityLimiter(args.max_wcu)).run()
+        print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+        return 0
+    mode = 'repair' if args.repair else 'audit'
+    job_id = args.job_id or f"maintenance#rebuild-points#{mode}#{datetime.now().strftime('%Y%m%dT%H%M%S')}"
+    print(f'job-id: {job_id}', file=sys.stderr)
+    report = PointsRebuild(db_manager, job_id, segments=args.segments, workers=args.workers,
+                           read_limiter=CapacityLimiter(args.max_rcu), write_limiter=CapacityLimiter(args.max_wcu),
+                           repair=args.repair).run()
+    print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+    return 0 if report['drifted'] == report['repaired'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""ワークスペース分割キーへのオンライン移行
+
+-users / -transactions の team_id-* インデックスは team_id を持つアイテムだけを
+含むため、team_id のない既存アイテムに値を埋める。稼働中に実行してよい:
+
+- 書き込みは attribute_not_exists(team_id) 条件付きなので、並行して新しいコードが
+  書いた値を上書きしない
+- 何度実行しても結果は同じ（埋め終わったアイテムは対象外）
+- セグメント並列スキャンで、--max-writes-per-second で書き込み速度を抑える
+
+ユーザーの team_id がない場合は --default-team-id（既定は INITIAL_TEAM_ID、
+マルチワークスペース対応前は全ユーザーがこのワークスペース）を使う。トランザク
+ションは送信者の team_id を引き継ぐ。
+
+使い方 (src ディレクトリで実行):
+    python -m tools.migrate_team_keys --stack-name KansyaConnect --dry-run
+    python -m tools.migrate_team_keys --stack-name KansyaConnect --segments 4
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+
+class RateLimiter:
+    """スレッド間で共有する単純なトークンバケット"""
+
+    def __init__(self, per_second: Optional[float]) -> None:
+        self.interval = 1.0 / per_second if per_second else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(self._next, now) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class TeamKeyMigration:
+    def __init__(self, dynamodb: Any, stack_name: str, default_team_id: Optional[str],
+                 segments: int = 4, max_writes_per_second: Optional[float] = None,
+                 dry_run: bool = False) -> None:
+        self.users_table = dynamodb.Table(f'{stack_name}-users')
+        self.transactions_table = dynamodb.Table(f'{stack_name}-transactions')
+        self.default_team_id = default_team_id
+        self.segments = segments
+        self.limiter = RateLimiter(max_writes_per_second)
+        self.dry_run = dry_run
+        self._user_teams: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+
+    def _scan_missing(self, table: Any, segment: int, projection: str) -> Any:
+        kwargs: Dict[str, Any] = {
+            'FilterExpression': Attr('team_id').not_exists(),
+            'ProjectionExpression': projection,
+            'Segment': segment,
+            'TotalSegments': self.segments,
+        }
+        while True:
+            response = table.scan(**kwargs)
+            yield from response.get('Items', [])
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _set_team(self, table: Any, key: Dict[str, Any], team_id: str) -> bool:
+        if self.dry_run:
+            return True
+        self.limiter.wait()
+        try:
+            table.update_item(
+                Key=key,
+                UpdateExpression='SET team_id = :team_id',
+                ConditionExpression='attribute_not_exists(team_id)',
+                ExpressionAttributeValues={':team_id': team_id},
+            )
+            return True
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            # 移行中に新しいコードが team_id を書き込んだ
+            return False
+
+    def user_team(self, user_id: str) -> Optional[str]:
+        with self._lock:
+            if user_id in self._user_teams:
+                return self._user_teams[user_id]
+        item = self.users_table.get_item(Key={'user_id': user_id}, ProjectionExpression='team_id').get('Item')
+        team_id = (item or {}).get('team_id') or self.default_team_id
+        with self._lock:
+            self._user_teams[user_id] = team_id
+        return team_id
+
+    def _migrate_users(self, segment: int) -> Dict[str, int]:
+        counts = {'scanned': 0, 'updated': 0, 'skipped': 0}
+        for item in self._scan_missing(self.users_table, segment, 'user_id'):
+            counts['scanned'] += 1
+            if not self.default_team_id:
+                counts['skipped'] += 1
+                continue
+            updated = self._set_team(self.users_table, {'user_id': item['user_id']}, self.default_team_id)
+            counts['updated' if updated else 'skipped'] += 1
+        return counts
+
+    def _migrate_transactions(self, segment: int) -> Dict[str, int]:
+        counts = {'scanned': 0, 'updated': 0, 'skipped': 0}
+        # 送信者は従来の形式では from_user、lib.codec の形式では f
+        for item in self._scan_missing(self.transactions_table, segment, 'transaction_id, from_user, f'):
+            counts['scanned'] += 1
+            team_id = self.user_team(item.get('from_user') or item['f'])
+            if not team_id:
+                counts['skipped'] += 1
+                continue
+            updated = self._set_team(self.transactions_table, {'transaction_id': item['transaction_id']}, team_id)
+            counts['updated' if updated else 'skipped'] += 1
+        return counts
+
+    def _run_segments(self, worker: Any) -> Dict[str, int]:
+        totals = {'scanned': 0, 'updated': 0, 'skipped': 0}
+        with ThreadPoolExecutor(max_workers=self.segments) as executor:
+            for counts in executor.map(worker, range(self.segments)):
+                for name, value in counts.items():
+                    totals[name] += value
+        return totals
+
+    def run(self) -> Dict[str, Dict[str, int]]:
+        # トランザクションは送信者の team_id を参照するので、ユーザーを先に移行する
+        return {
+            'users': self._run_segments(self._migrate_users),
+            'transactions': self._run_segments(self._migrate_transactions),
+        }
+
+    def remaining(self) -> Dict[str, int]:
+        """team_id が未設定のまま残っているアイテム数（移行の確認用）"""
+        result = {}
+        for name, table in (('users', self.users_table), ('transactions', self.transactions_table)):
+            count = 0
+            kwargs: Dict[str, Any] = {'FilterExpression': Attr('team_id').not_exists(), 'Select': 'COUNT'}
+            while True:
+                response = table.scan(**kwargs)
+                count += response['Count']
+                if 'LastEvaluatedKey' not in response:
+                    break
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+            result[name] = count
+        return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Backfill team_id for team-partitioned indexes')
+    parser.add_argument('--stack-name', default=os.environ.get('STACK_NAME'), required='STACK_NAME' not in os.environ)
+    parser.add_argument('--default-team-id', default=os.environ.get('INITIAL_TEAM_ID'),
+                        help='team_id のないユーザーに設定するワークスペース')
+    parser.add_argument('--segments', type=int, default=4, help='並列スキャンのセグメント数')
+    parser.add_argument('--max-writes-per-second', type=float, default=None)
+    parser.add_argument('--dry-run', action='store_true', help='書き込まずに件数だけ数える')
+    args = parser.parse_args(argv)
+
+    migration = TeamKeyMigration(boto3.resource('dynamodb'), args.stack_name, args.default_team_id,
+                                 args.segments, args.max_writes_per_second, args.dry_run)
+    result = migration.run()
+    if not args.dry_run:
+        result['remaining'] = migration.remaining()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if args.dry_run or not any(result['remaining'].values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
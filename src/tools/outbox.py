@@ -0,0 +1,47 @@
+"""送れなかった通知（アウトボックスの dead）の確認と再送
+
+list-dead は再試行の上限に達したか、届かない宛先だった通知を表示する。
+replay はそれらを送信待ちに戻し、次のワーカーの実行（1分ごと）で送り直す。
+--outbox-id / --team-id を省略すると、すべての送れなかった通知を戻す。
+
+使い方 (src ディレクトリで実行):
+    python -m tools.outbox --stack-name KansyaConnect list-dead
+    python -m tools.outbox --stack-name KansyaConnect replay --team-id T0123456
+    python -m tools.outbox --stack-name KansyaConnect replay --outbox-id 'tx-1#sent' --outbox-id 'tx-2#sent'
+"""
+import argparse
+import json
+import os
+import sys
+from typing import List, Optional
+
+import boto3
+
+from lib import outbox
+from lib.db import DynamoDBManager
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Inspect and replay notifications that could not be sent')
+    parser.add_argument('--stack-name', default=os.environ.get('STACK_NAME'), required='STACK_NAME' not in os.environ)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list-dead', help='送れなかった通知を表示する')
+    list_parser.add_argument('--limit', type=int, default=100)
+
+    replay_parser = subparsers.add_parser('replay', help='送れなかった通知を送信待ちに戻す')
+    replay_parser.add_argument('--outbox-id', action='append', dest='outbox_ids')
+    replay_parser.add_argument('--team-id')
+    args = parser.parse_args(argv)
+
+    db_manager = DynamoDBManager(boto3.resource('dynamodb'), stack_name=args.stack_name)
+    if args.command == 'list-dead':
+        result = db_manager.list_outbox(outbox.OUTBOX_DEAD, limit=args.limit)
+    else:
+        result = {'replayed': outbox.replay(db_manager, outbox_ids=args.outbox_ids, team_id=args.team_id)}
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
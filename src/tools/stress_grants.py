@@ -0,0 +1,243 @@
+"""ポイント付与（add_points）の競合ストレステスト
+
+DynamoDB スタブ（tools.fakes）に対して、多数の送信者・受信者の付与をスレッドで並行に実行し、
+楽観的な条件と再試行ループが競合下でどう振る舞うかを計測する。スタブは遅延の間に同じアイテムを
+書く別のトランザクションを TransactionConflict で取り消す（実物と同じ）。
+
+シナリオ:
+    hot_recipients  多数の送信者が少数の受信者に集中して付与する
+    repeat_senders  少数の送信者が同時に連続して付与する（送信者の日次ポイントの条件で競合する）
+    limit_edge      日次上限の手前から複数人への付与を同時に行う（上限の超過が起きないかを見る）
+
+結果はスループット、結果の内訳（付与・上限・失敗）、トランザクションの取り消し率、
+再試行回数の分布、レイテンシー、不変条件の違反（付与したポイントと記録の不一致・日次上限の超過）。
+違反があれば終了コード 1 を返すので、付与処理を変更したときの確認に使える。
+
+使い方 (src ディレクトリで実行):
+    python -m tools.stress_grants --scenario hot_recipients --grants 2000 --threads 32 --dynamodb-latency-ms 4
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from unittest import mock
+
+from lib import db
+from lib.codec import decode_transaction
+from lib.db import DynamoDBManager
+from lib.maintenance import PointsRebuild
+from lib.metrics import metrics, CallRecord
+from tools.fakes import FakeDynamoDBResource, LatencyModel
+from tools.load_generator import percentile
+
+STACK_NAME = 'stress'
+TEAM_ID = 'T0STRESS'
+
+# senders / recipients: 人数、mentions: 1回の付与の受信者数の範囲、
+# headroom: 開始時点の残りの付与可能ポイント（None なら日次上限まで）
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    'hot_recipients': {'senders': 64, 'recipients': 2, 'mentions': (1, 2), 'headroom': None},
+    'repeat_senders': {'senders': 4, 'recipients': 200, 'mentions': (1, 3), 'headroom': None},
+    'limit_edge': {'senders': 16, 'recipients': 50, 'mentions': (1, 3), 'headroom': 2},
+}
+
+LIMIT_EXCEEDED_MESSAGE = '本日の付与可能ポイントを超過しています'
+
+
+class _RecordCollector:
+    """metrics のシンク。付与とトランザクションの計測結果を受け取る"""
+
+    def __init__(self) -> None:
+        self.records: List[CallRecord] = []
+
+    def export(self, records: List[CallRecord]) -> None:
+        self.records.extend(record for record in records
+                            if record.service == 'grant' or record.operation == 'transact_write_items')
+
+
+class GrantStress:
+    """1つのシナリオの実行と集計"""
+
+    def __init__(self, scenario: str, grants: int, threads: int, daily_limit: int,
+                 latency: Optional[LatencyModel] = None, seed: Optional[int] = None) -> None:
+        self.scenario = scenario
+        self.config = SCENARIOS[scenario]
+        self.grants = grants
+        self.threads = threads
+        self.daily_limit = daily_limit
+        self.random = random.Random(seed)
+        self.dynamodb = FakeDynamoDBResource(latency=latency or LatencyModel(), transaction_conflicts=True)
+        self.db_manager = DynamoDBManager(self.dynamodb, stack_name=STACK_NAME)
+        self.senders = [f'S{index:04d}' for index in range(self.config['senders'])]
+        self.recipients = [f'R{index:04d}' for index in range(self.config['recipients'])]
+        headroom = self.config['headroom']
+        self.start_daily = 0 if headroom is None else max(daily_limit - headroom, 0)
+
+    def _seed(self) -> None:
+        users = self.dynamodb.Table(f'{STACK_NAME}-users')
+        for user_id in self.senders + self.recipients:
+            users.data[(user_id,)] = {
+                'user_id': user_id, 'team_id': TEAM_ID, 'total_points': 0,
+                'daily_points_given': self.start_daily if user_id in self.senders else 0,
+            }
+
+    def _plan(self) -> List[Tuple[str, List[str]]]:
+        low, high = self.config['mentions']
+        plan = []
+        for index in range(self.grants):
+            sender = self.senders[index % len(self.senders)]
+            count = min(self.random.randint(low, high), len(self.recipients))
+            plan.append((sender, self.random.sample(self.recipients, count)))
+        self.random.shuffle(plan)
+        return plan
+
+    def run(self) -> Dict[str, Any]:
+        self._seed()
+        plan = self._plan()
+        outcomes: Counter = Counter()
+        latencies: List[float] = []
+        granted: Counter = Counter()
+        lock = threading.Lock()
+
+        def grant(sender: str, to_users: List[str]) -> None:
+            started = time.perf_counter()
+            result = self.db_manager.add_points(sender, to_users, team_id=TEAM_ID)
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            if result['success']:
+                outcome = 'granted'
+            elif result.get('error_message') == LIMIT_EXCEEDED_MESSAGE:
+                outcome = 'limited'
+            else:
+                outcome = 'failed'
+            with lock:
+                outcomes[outcome] += 1
+                latencies.append(elapsed_ms)
+                if result['success']:
+                    granted[sender] += len(to_users)
+
+        collector = _RecordCollector()
+        with mock.patch.object(db, 'DAILY_POINT_LIMIT', self.daily_limit), \
+                mock.patch.object(metrics, 'exporter', None), mock.patch.object(metrics, 'sinks', [collector]):
+            metrics.flush()
+            collector.records.clear()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                for future in [pool.submit(grant, sender, to_users) for sender, to_users in plan]:
+                    future.result()
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            metrics.flush()
+
+        return self._report(outcomes, latencies, granted, collector.records, elapsed)
+
+    def _report(self, outcomes: Counter, latencies: List[float], granted: Counter,
+                records: List[CallRecord], elapsed: float) -> Dict[str, Any]:
+        transactions = [record for record in records if record.operation == 'transact_write_items']
+        cancelled = sum(1 for record in transactions if record.error)
+        retries = Counter(record.retries for record in records if record.service == 'grant')
+        ordered = sorted(latencies)
+        return {
+            'scenario': self.scenario,
+            'grants': self.grants,
+            'threads': self.threads,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_gps': round(self.grants / elapsed, 1),
+            'outcomes': {name: outcomes[name] for name in ('granted', 'limited', 'failed')},
+            'transactions': {
+                'attempts': len(transactions),
+                'cancelled': cancelled,
+                'cancellation_rate': round(cancelled / len(transactions), 4) if transactions else 0.0,
+            },
+            'retries': {str(count): retries[count] for count in sorted(retries)},
+            'latency_ms': {
+                'p50': round(percentile(ordered, 50), 3),
+                'p95': round(percentile(ordered, 95), 3),
+                'p99': round(percentile(ordered, 99), 3),
+                'max': round(ordered[-1], 3) if ordered else 0.0,
+            },
+            'violations': self.violations(granted, outcomes['granted']),
+        }
+
+    def violations(self, granted: Counter, granted_count: int) -> List[Dict[str, Any]]:
+        """不変条件の違反（付与の結果・-transactions・-users の食い違いと日次上限の超過）"""
+        store = self.dynamodb.store
+        users = store.table(f'{STACK_NAME}-users')
+        records = [decode_transaction(item) for item in store.table(f'{STACK_NAME}-transactions').values()
+                   if 'grant_id' not in item]
+        recorded: Counter = Counter()
+        for record in records:
+            recorded[record['from_user']] += len(record['to_users'])
+
+        found: List[Dict[str, Any]] = []
+        if len(records) != granted_count:
+            found.append({'invariant': 'records_match_grants', 'granted': granted_count, 'records': len(records)})
+        expected = PointsRebuild(self.db_manager, f'stress#{self.scenario}', segments=1).expected_totals()
+        for user_id in self.recipients:
+            observed = int(users[(user_id,)].get('total_points', 0))
+            if observed != expected.get(user_id, 0):
+                found.append({'invariant': 'total_points_match_records', 'user_id': user_id,
+                              'observed': observed, 'expected': expected.get(user_id, 0)})
+        for user_id in self.senders:
+            daily = int(users[(user_id,)].get('daily_points_given', 0))
+            if daily > self.daily_limit:
+                found.append({'invariant': 'daily_limit', 'user_id': user_id, 'daily_points_given': daily})
+            if daily - self.start_daily != recorded[user_id] or recorded[user_id] != granted[user_id]:
+                found.append({'invariant': 'daily_points_match_records', 'user_id': user_id,
+                              'daily_points_given': daily, 'recorded': recorded[user_id],
+                              'granted': granted[user_id]})
+        return found
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    transactions = report['transactions']
+    latency = report['latency_ms']
+    lines = [
+        f"scenario={report['scenario']} grants={report['grants']} threads={report['threads']} "
+        f"elapsed={report['elapsed_s']}s throughput={report['throughput_gps']} grants/s",
+        'outcomes: ' + ' '.join(f'{name}={count}' for name, count in report['outcomes'].items()),
+        f"transactions: attempts={transactions['attempts']} cancelled={transactions['cancelled']} "
+        f"rate={transactions['cancellation_rate']:.2%}",
+        'retries: ' + ' '.join(f'{count}={grants}' for count, grants in report['retries'].items()),
+        f"latency: p50={latency['p50']:.2f}ms p95={latency['p95']:.2f}ms p99={latency['p99']:.2f}ms "
+        f"max={latency['max']:.2f}ms",
+        f"violations: {len(report['violations'])}",
+    ]
+    lines.extend(f'  {json.dumps(violation, ensure_ascii=False)}' for violation in report['violations'][:20])
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Stress the add_points transaction path under contention')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS) + ['all'], default='all')
+    parser.add_argument('--grants', type=int, default=1000, help='シナリオごとの付与の試行回数')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--daily-limit', type=int, default=db.DAILY_POINT_LIMIT,
+                        help='日次上限（既定は本番と同じ。大きくすると競合そのものを測れる）')
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=4.0)
+    parser.add_argument('--jitter', type=float, default=0.5, help='遅延のジッター（平均に対する割合）')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args(argv)
+
+    scenarios = sorted(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+    reports = []
+    # 再試行・上限超過のログが計測を歪めるため、エラー以外は抑制する（内訳は結果に出る）
+    logging.disable(logging.WARNING)
+    for scenario in scenarios:
+        latency = LatencyModel(args.dynamodb_latency_ms, args.dynamodb_latency_ms * args.jitter, seed=args.seed)
+        reports.append(GrantStress(scenario, args.grants, args.threads, args.daily_limit,
+                                   latency=latency, seed=args.seed).run())
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+    else:
+        print('\n\n'.join(format_report(report) for report in reports))
+    return 1 if any(report['violations'] for report in reports) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
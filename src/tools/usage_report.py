@@ -0,0 +1,42 @@
+"""ワークスペースごとの利用量の上位（lib.metering）
+
+-metering テーブルの1時間ごとのカウンターを期間内で合計し、指定したカウンターの多い順に表示する。
+期間は UTC で、--since / --until は ISO 形式（省略時は直近24時間）。
+
+使い方 (src ディレクトリで実行):
+    python -m tools.usage_report --stack-name KansyaConnect --metric wcu
+    python -m tools.usage_report --stack-name KansyaConnect --metric slack_calls --since 2026-10-01T00 --until 2026-10-07T23
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import boto3
+
+from lib.db import DynamoDBManager
+from lib.metering import top_consumers
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Show the workspaces with the highest usage')
+    parser.add_argument('--stack-name', default=os.environ.get('STACK_NAME'), required='STACK_NAME' not in os.environ)
+    parser.add_argument('--metric', default='wcu',
+                        help='並べ替えるカウンター（wcu / rcu / grants / events_received / slack_calls / duration_ms など）')
+    parser.add_argument('--since', type=datetime.fromisoformat)
+    parser.add_argument('--until', type=datetime.fromisoformat)
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    until = args.until or datetime.now(timezone.utc)
+    since = args.since or until - timedelta(hours=24)
+    db_manager = DynamoDBManager(boto3.resource('dynamodb'), stack_name=args.stack_name)
+    print(json.dumps(top_consumers(db_manager, since, until, metric=args.metric, limit=args.limit),
+                     ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+# Lambdaイメージと同じく src をルートとして lib / tools を読み込む
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    """プロセス内キャッシュ（ワークスペース・Slackクライアント）をテスト間で共有しない"""
+    from lib.cache import clear_all
+    clear_all()
+    yield
+    clear_all()
+
+
+@pytest.fixture(autouse=True)
+def _discard_metrics():
+    """前のテストが溜めた計測結果を次のテストに持ち越さない"""
+    from lib.metrics import metrics
+    yield
+    exporter, metrics.exporter = metrics.exporter, None
+    try:
+        metrics.flush()
+    finally:
+        metrics.exporter = exporter
+
+
+@pytest.fixture(params=['dynamodb', 'sqlite'])
+def storage(request, tmp_path):
+    """同じテストを DynamoDB（フェイク）と SQLite の両方の実装で走らせる"""
+    from lib.db import DynamoDBManager
+    from lib.sqlite_storage import SQLiteStorage
+    from tools.fakes import APICallRecorder, FakeDynamoDBResource
+    if request.param == 'sqlite':
+        storage = SQLiteStorage(str(tmp_path / 'kansya.db'))
+        yield storage
+        storage.close()
+        return
+    yield DynamoDBManager(FakeDynamoDBResource(recorder=APICallRecorder()), stack_name='test')
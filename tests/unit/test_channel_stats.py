@@ -0,0 +1,35 @@
+from datetime import datetime
+
+from lib.db import DynamoDBManager
+from tools.fakes import APICallRecorder, FakeDynamoDBResource
+
+
+def test_channels_are_ranked_by_thanks(storage):
+    storage.add_points('U1', ['U2', 'U3'], team_id='T1', channel_id='C_GENERAL')
+    storage.add_points('U2', ['U1'], team_id='T1', channel_id='C_RELEASE')
+    storage.add_points('U3', ['U1'], team_id='T1', channel_id='C_RELEASE')
+    storage.add_points('U4', ['U1'], team_id='T2', channel_id='C_OTHER')
+    storage.add_points('U4', ['U2'], team_id='T1')  # チャンネル不明（DM など）は数えない
+    # 上限で断られた付与・再配信は数えない
+    storage.add_points('U3', ['U1', 'U2', 'U4', 'U5', 'U6'], team_id='T1', channel_id='C_GENERAL')
+    storage.add_points('U2', ['U3'], team_id='T1', channel_id='C_RELEASE', request_id='m1')
+    storage.add_points('U2', ['U3'], team_id='T1', channel_id='C_RELEASE', request_id='m1')
+
+    expected = [{'channel_id': 'C_RELEASE', 'thanks': 3, 'points': 3},
+                {'channel_id': 'C_GENERAL', 'thanks': 1, 'points': 2}]
+    assert storage.top_channels('T1') == expected
+    assert storage.top_channels('T1', day=datetime.now().strftime('%Y-%m-%d')) == expected
+    assert storage.top_channels('T1', limit=1) == expected[:1]
+    assert storage.top_channels('T1', day='2000-01-01') == []
+
+
+def test_top_channels_is_one_read():
+    recorder = APICallRecorder()
+    db_manager = DynamoDBManager(FakeDynamoDBResource(recorder=recorder), stack_name='test')
+    for channel_id in ['C1', 'C2', 'C2', 'C3']:
+        assert db_manager.add_points('U1', ['U2'], team_id='T1', channel_id=channel_id)['success']
+
+    with recorder.track() as calls:
+        assert db_manager.top_channels('T1', limit=2)[0] == {'channel_id': 'C2', 'thanks': 2, 'points': 2}
+
+    assert calls == {'dynamodb.query': 1}
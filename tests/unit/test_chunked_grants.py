@@ -0,0 +1,84 @@
+from unittest import mock
+
+import pytest
+
+from lib import db
+from lib.db import DynamoDBManager
+from tools.fakes import FakeDynamoDBResource
+
+RECIPIENTS = [f'R{i}' for i in range(7)]
+
+
+@pytest.fixture
+def db_manager(monkeypatch):
+    # 1トランザクション4アイテム（1チャンク2人）、日次上限10として大きな付与を再現する
+    monkeypatch.setattr(db, 'MAX_TRANSACT_ITEMS', 4)
+    monkeypatch.setattr(db, 'DAILY_POINT_LIMIT', 10)
+    dynamodb = FakeDynamoDBResource()
+    users = dynamodb.Table('test-users')
+    for user_id in ['S1'] + RECIPIENTS:
+        users.put_item(Item={'user_id': user_id, 'team_id': 'T1', 'total_points': 0, 'daily_points_given': 0})
+    return DynamoDBManager(dynamodb, stack_name='test')
+
+
+def _totals(db_manager):
+    return {user_id: db_manager.get_user_data(user_id).total_points for user_id in RECIPIENTS}
+
+
+def _start_pending(db_manager):
+    """ヘッダーだけ書いた状態（チャンクの適用前に中断した付与）を作る"""
+    with mock.patch.object(DynamoDBManager, 'resume_grant', return_value=False), \
+            mock.patch.object(DynamoDBManager, 'rollback_grant', return_value=False):
+        result = db_manager.add_points('S1', RECIPIENTS, message='all hands', team_id='T1')
+    assert result['success'] is False
+    return result['transaction_id']
+
+
+def test_large_grant_is_split_into_chunks_and_charged_once(db_manager):
+    result = db_manager.add_points('S1', RECIPIENTS, message='all hands', team_id='T1')
+
+    assert result['success'] and result['chunks'] == 4
+    assert result['daily_points_given'] == 7
+    assert db_manager.get_user_data('S1').daily_points_given == 7
+    assert set(_totals(db_manager).values()) == {1}
+    header = db_manager.transactions_table.get_item(Key={'transaction_id': result['transaction_id']})['Item']
+    assert header['status'] == 'complete'
+    assert db_manager.get_user_transactions('R6', team_id='T1')[0]['message'] == 'all hands'
+    assert db_manager.transactions_table.get_item(Key={'transaction_id': f"{result['transaction_id']}#0"}).get('Item') is None
+
+
+def test_interrupted_grant_resumes_without_double_applying(db_manager):
+    grant_id = _start_pending(db_manager)
+    assert db_manager._apply_grant_chunk(grant_id, 0, RECIPIENTS[:2], 1)
+
+    assert db_manager.resume_grant(grant_id)
+    assert db_manager.resume_grant(grant_id)
+    assert set(_totals(db_manager).values()) == {1}
+    assert db_manager.get_user_data('S1').daily_points_given == 7
+
+
+def test_rollback_reverts_applied_chunks_and_refunds_the_sender(db_manager):
+    grant_id = _start_pending(db_manager)
+    assert db_manager._apply_grant_chunk(grant_id, 1, RECIPIENTS[2:4], 1)
+
+    assert db_manager.rollback_grant(grant_id)
+    assert db_manager.rollback_grant(grant_id)
+    assert set(_totals(db_manager).values()) == {0}
+    assert db_manager.get_user_data('S1').daily_points_given == 0
+    assert db_manager.get_user_transactions('S1', team_id='T1') == []
+    # 取り消し後は再開できない
+    assert not db_manager.resume_grant(grant_id)
+
+
+def test_failed_chunk_rolls_back_the_whole_grant(db_manager):
+    apply = DynamoDBManager._apply_grant_chunk
+
+    def flaky(self, grant_id, index, recipients, points):
+        return False if index == 2 and points > 0 else apply(self, grant_id, index, recipients, points)
+
+    with mock.patch.object(DynamoDBManager, '_apply_grant_chunk', flaky):
+        result = db_manager.add_points('S1', RECIPIENTS, team_id='T1')
+
+    assert result['success'] is False
+    assert result['daily_points_given'] == 0
+    assert set(_totals(db_manager).values()) == {0}
@@ -0,0 +1,60 @@
+from lib.codec import decode_transaction, encode_transaction, new_transaction_id
+from lib.db import DynamoDBManager
+from tools.capacity_report import run
+from tools.fakes import APICallRecorder, FakeDynamoDBResource
+
+LONG_MESSAGE = 'いつも丁寧なレビューをありがとうございます。' * 20
+
+
+def test_compact_items_round_trip_and_compress_long_messages():
+    record = {'transaction_id': new_transaction_id(), 'team_id': 'T1', 'timestamp': '2026-01-05T09:00:00',
+              'from_user': 'U1', 'to_users': ['U2', 'U3'], 'points': 1, 'message': LONG_MESSAGE, 'channel_id': 'C1'}
+
+    item = encode_transaction(record, version=1)
+
+    assert len(record['transaction_id']) == 22
+    assert item['v'] == 1 and item['f'] == 'U1' and item['r'] == ['U2', 'U3']
+    assert 'points' not in item and 'p' not in item
+    assert len(item['mz']) < len(LONG_MESSAGE.encode('utf-8')) // 4
+    assert decode_transaction(item) == record
+    assert decode_transaction(encode_transaction(dict(record, message=''), version=1))['message'] == ''
+    assert encode_transaction(record, version=0) == record
+
+
+def test_legacy_and_compact_items_are_read_together():
+    db_manager = DynamoDBManager(FakeDynamoDBResource(), stack_name='test')
+    db_manager.transactions_table.put_item(Item={
+        'transaction_id': '0b6f3f4e-legacy', 'team_id': 'T1', 'from_user': 'U2', 'to_users': ['U1'],
+        'points': 1, 'timestamp': '2025-12-01T10:00:00.123456', 'message': 'old format'})
+    assert db_manager.add_points('U1', ['U2'], message=LONG_MESSAGE, team_id='T1')['success']
+
+    history = db_manager.get_user_transactions('U1', team_id='T1')
+
+    assert [(tx['type'], tx['message']) for tx in history] == [('sent', LONG_MESSAGE), ('received', 'old format')]
+
+
+def test_unchanged_profile_is_not_rewritten():
+    recorder = APICallRecorder()
+    db_manager = DynamoDBManager(FakeDynamoDBResource(recorder=recorder), stack_name='test')
+    profile = {'user_id': 'U1', 'team_id': 'T1', 'user_name': 'taro', 'real_name': '太郎',
+               'display_name': 'taro', 'email': 'taro@example.com'}
+    db_manager.save_or_update_user_profile(profile)
+    db_manager.users_table.update_item(Key={'user_id': 'U1'}, UpdateExpression='ADD total_points :five',
+                                       ExpressionAttributeValues={':five': 5})
+
+    with recorder.track() as unchanged:
+        db_manager.save_or_update_user_profile(profile)
+    with recorder.track() as renamed:
+        db_manager.save_or_update_user_profile(dict(profile, display_name='たろう'))
+
+    assert unchanged == {'dynamodb.get_item': 1}
+    assert renamed == {'dynamodb.get_item': 1, 'dynamodb.update_item': 1}
+    user = db_manager.get_user_data('U1')
+    assert user.display_name == 'たろう' and user.total_points == 5
+
+
+def test_capacity_report_shows_fewer_units_with_the_compact_codec():
+    legacy, compact = run(0, users=10, grants=40), run(1, users=10, grants=40)
+
+    assert compact['get_user_transactions']['query']['capacity'] < legacy['get_user_transactions']['query']['capacity']
+    assert 'update_item' not in compact['profile_unchanged']
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+from lib.db import DynamoDBManager
+from lib.digest import TopCounter, WeeklyDigest, digest_period, RESULT_SUSPENDED, RESULT_POSTED, RESULT_ALREADY_POSTED
+from tools.fakes import APICallRecorder, FakeDynamoDBResource
+
+GRANTS = [
+    ('S1', ['R1', 'R2'], 'C1', 'リリース対応ありがとう'),
+    ('S2', ['R1'], 'C1', '助かりました'),
+    ('S3', ['R1', 'R3'], 'C2', 'レビューありがとうございます'),
+    ('S2', ['R2'], 'C1', ''),
+    ('S4', ['R1'], 'C2', 'ありがとう'),
+]
+
+
+def _grant_all(storage):
+    for sender, receivers, channel, message in GRANTS:
+        assert storage.add_points(sender, receivers, message=message, team_id='T1', channel_id=channel)['success']
+    # 別のワークスペースの付与は集計に入らない
+    assert storage.add_points('X1', ['X2'], message='other team', team_id='T2', channel_id='C1')['success']
+
+
+def test_top_counter_keeps_heavy_hitters_in_bounded_memory():
+    counter = TopCounter(capacity=3)
+    for key in ['a'] * 10 + ['b'] * 6 + list('cde') + ['a'] * 2:
+        counter.add(key)
+
+    assert len(counter.counts) == 3
+    assert counter.top(2) == [('a', 12), ('b', 6)]
+
+
+def test_interrupted_digest_resumes_without_rereading_or_reposting(storage):
+    _grant_all(storage)
+    period = digest_period(datetime.now() + timedelta(minutes=1))
+    posts = []
+
+    def post(channel_id, text, blocks):
+        posts.append((channel_id, text, blocks))
+        return True
+
+    digest = WeeklyDigest(storage, page_size=2)
+    # 最初のページを読んだところで時間切れ
+    assert digest.run('T1', period, ['C9', 'C8'], post, has_time=lambda: False) == RESULT_SUSPENDED
+    assert posts == []
+    state = storage.get_job_state(digest.job_id('T1', period['week_id']))
+    assert state['cursor'] and state['aggregate']['transactions'] == 2
+
+    assert digest.run('T1', period, ['C9', 'C8'], post) == RESULT_POSTED
+    assert digest.run('T1', period, ['C9', 'C8'], post) == RESULT_ALREADY_POSTED
+
+    assert [channel for channel, _, _ in posts] == ['C9', 'C8']
+    _, text, blocks = posts[0]
+    assert text == '今週のありがとう: 5件・7ポイント'
+    rendered = str(blocks)
+    assert '🥇 <@R1>  4pt' in rendered
+    assert '🥇 <#C1>  3件' in rendered
+    # ハイライトは受信者の多いメッセージから
+    highlights = [block['text']['text'] for block in blocks if '\n> ' in block.get('text', {}).get('text', '')]
+    assert highlights[0].endswith('レビューありがとうございます')
+    assert 'other team' not in rendered
+
+
+def test_digest_reads_each_transaction_page_once():
+    recorder = APICallRecorder()
+    storage = DynamoDBManager(FakeDynamoDBResource(recorder=recorder), stack_name='test')
+    _grant_all(storage)
+    period = digest_period(datetime.now() + timedelta(minutes=1))
+
+    with recorder.track() as calls:
+        WeeklyDigest(storage, page_size=2).run('T1', period, ['C9'], lambda *args: True)
+
+    # 5件を2件ずつ読む（再開のための読み直しはない）
+    assert calls['dynamodb.query'] == 3
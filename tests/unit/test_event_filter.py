@@ -0,0 +1,48 @@
+import json
+
+from lib.event_filter import EventPrefilter
+from tools.fakes import LatencyModel
+from tools.load_generator import EventFactory, StubEnvironment
+
+
+def _message(text='<@U2> ありがとう', **fields):
+    return {'team_id': 'T1', 'event': dict({'type': 'message', 'user': 'U1', 'channel': 'C1', 'text': text}, **fields)}
+
+
+def test_each_stage_drops_from_the_payload_alone():
+    prefilter = EventPrefilter(channel_allowlist='C1, C2')
+
+    assert prefilter.check({'team_id': 'T1', 'event': {'type': 'channel_created'}}) == 'event_type'
+    assert prefilter.check(_message(subtype='message_changed')) == 'subtype'
+    assert prefilter.check(_message(bot_id='B1')) == 'bot'
+    assert prefilter.check(_message(channel='C9')) == 'channel'
+    assert prefilter.check(_message(text='おはようございます')) == 'mention'
+    assert prefilter.check(_message(subtype='thread_broadcast')) is None
+    # ワークスペースの設定を知らない間はフレーズ・リアクションを判定しない
+    assert prefilter.check(_message(text='<@U2> 明日の件')) is None
+    reaction = {'team_id': 'T1', 'event': {'type': 'reaction_added', 'reaction': 'eyes', 'item': {'channel': 'C1'}}}
+    assert prefilter.check(reaction) is None
+
+    prefilter.remember_workspace('T1', {'workspace_id': 'T1', 'thanks_phrases': ['感謝']})
+    assert prefilter.check(_message(text='<@U2> 明日の件')) == 'phrase'
+    assert prefilter.check(_message(text='<@U2> 感謝です')) is None
+    assert prefilter.check(reaction) == 'reaction'
+
+    assert prefilter.stats() == {
+        'passed': 4,
+        'dropped': {'event_type': 1, 'subtype': 1, 'bot': 1, 'channel': 1, 'mention': 1, 'phrase': 1, 'reaction': 1},
+    }
+
+
+def test_dropped_events_make_no_network_calls():
+    factory = EventFactory(users=4, teams=1, max_mentions=1, seed=2)
+    team_id = factory.team_ids[0]
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env:
+        body = factory._event_body(team_id, {'type': 'message', 'user': factory.users_by_team[team_id][0],
+                                             'channel': 'C1', 'text': '今日の会議は15時からです', 'ts': '1.0'})
+        with env.recorder.track() as calls:
+            response = env.handlers['event_handler'](
+                factory._api_gateway_event(factory.message_event, json.dumps(body)), None)
+
+    assert response == {'statusCode': 200}
+    assert not calls
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+from lib.graph import GratitudeGraph, GraphAnalytics
+
+
+def _graph(edges, pending_edges=3):
+    graph = GratitudeGraph(pending_edges=pending_edges)
+    for from_user, to_user in edges:
+        graph.add({'from_user': from_user, 'to_users': [to_user]})
+    return graph
+
+
+def test_team_health_metrics():
+    # A-B-C と D-E-F の2つの輪を C→D だけがつなぎ、G は F から受け取るだけ
+    graph = _graph([('A', 'B'), ('B', 'C'), ('C', 'A'), ('B', 'A'), ('C', 'D'),
+                    ('D', 'E'), ('E', 'F'), ('F', 'D'), ('F', 'G'), ('H', 'A')])
+
+    report = graph.analyze(members=list('ABCDEFGHZ'))
+
+    assert report['users'] == 8 and report['edges'] == 10 and report['components'] == 1
+    assert report['isolated'] == ['Z']
+    assert report['unthanked'] == ['H']
+    assert report['reciprocity'] == 0.2
+    assert report['bridges'] == [{'users': ['C', 'D'], 'sides': [4, 4]}]
+    # 3人から受け取る A と、A の感謝をすべて受け取る B に集まる
+    assert {row['user_id'] for row in report['central'][:2]} == {'A', 'B'}
+
+
+def test_buffered_edges_merge_into_the_sorted_matrix():
+    edges = [(f'U{index % 17}', f'U{index % 13}') for index in range(1000)]
+    buffered, unbuffered = _graph(edges[:500], pending_edges=4), _graph(edges, pending_edges=10 ** 6)
+    for from_user, to_user in edges[500:]:
+        buffered.add({'from_user': from_user, 'to_users': [to_user]})
+        # 積んだランは前のランが後のランの2倍より大きく、全体を毎回マージし直さない
+        sizes = [run.nnz for run in buffered._runs]
+        assert all(larger > 2 * smaller for larger, smaller in zip(sizes, sizes[1:]))
+
+    assert list(buffered.edges()) == list(unbuffered.edges())
+    assert sum(weight for _, _, weight in buffered.edges()) == 1000
+    unbuffered.add({'from_user': 'U1', 'to_users': ['U2', 'U2'], 'points': 2})
+    assert unbuffered.weight(unbuffered.index['U1'], unbuffered.index['U2']) == 4 + edges.count(('U1', 'U2'))
+
+
+def test_reports_are_cached_and_extended_incrementally(storage):
+    storage.save_or_update_user_profile({'user_id': 'U9', 'team_id': 'T1'})
+    storage.add_points('U1', ['U2'], team_id='T1')
+    storage.add_points('U2', ['U1'], team_id='T1')
+    since = (datetime.now() - timedelta(days=1)).isoformat()
+    analytics = GraphAnalytics(storage)
+
+    first = analytics.analyze('T1', since, datetime.now().isoformat())
+    assert (first['grants'], first['reciprocity'], first['isolated']) == (2, 1.0, ['U9'])
+    assert analytics.analyze('T1', since, first['until']) == first
+
+    storage.add_points('U1', ['U3'], team_id='T1')
+    until = (datetime.now() + timedelta(seconds=1)).isoformat()
+    second = analytics.analyze('T1', since, until)
+
+    # 前回の終わりと同じ時刻の付与を数え直さない
+    assert second['grants'] == 3
+    assert second['edges'] == 3
+    assert second['unthanked'] == []
+    assert GraphAnalytics(storage).analyze('T1', since, until, refresh=True)['grants'] == 3
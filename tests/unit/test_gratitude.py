@@ -0,0 +1,36 @@
+from lib.gratitude import GratitudeMatcher, get_matcher, matcher_for_workspace
+from lib.slack import SlackManager
+
+
+def test_scan_extracts_mentions_and_strips_markup_in_one_pass():
+    result = get_matcher().scan('<@U1> <@U2|bob> <@U1> ありがとう <#C1|general> <https://x.com|link> <!here>')
+    assert result.mentions == ['U1', 'U2']
+    assert result.phrase == 'ありがと'
+    assert result.text == '   ありがとう #general link @here'
+    assert result.is_thanks
+
+
+def test_ascii_phrases_respect_word_boundaries():
+    matcher = get_matcher()
+    assert matcher.scan('<@U1> happy thanksgiving').phrase is None
+    assert matcher.scan('<@U1> Thank  You!').phrase == 'thank you'
+    assert matcher.scan('<@U1> 感謝:pray:').phrase == '感謝'
+    # 日本語の本文に混ざった大文字の英語
+    assert matcher.scan('<@U1> 本当にTHANKS！').phrase == 'thanks'
+    assert matcher.scan('<@U1> 本当にTHANKSGIVING').phrase is None
+
+
+def test_workspace_phrases_and_cache():
+    workspace = {'thanks_phrases': ['Kudos', 'おつかれ']}
+    matcher = matcher_for_workspace(workspace)
+    assert matcher is matcher_for_workspace({'thanks_phrases': ['おつかれ', 'kudos']})
+    assert matcher.scan('<@U1> kudos!').is_thanks
+    assert not matcher.scan('<@U1> ありがとう').is_thanks
+    assert matcher_for_workspace({}) is get_matcher()
+
+
+def test_extract_mentions_keeps_legacy_contract():
+    mentions, text = SlackManager.extract_mentions('<@U1> ありがとう <@U1>')
+    assert mentions == ['U1']
+    assert text == ' ありがとう '
+    assert GratitudeMatcher([]).find_phrase('ありがとう') is None
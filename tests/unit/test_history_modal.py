@@ -0,0 +1,51 @@
+import json
+from unittest import mock
+
+from lib.slack import SlackManager
+from tools.fakes import LatencyModel
+from tools.load_generator import EventFactory, StubEnvironment
+
+
+def _open_history(env, factory):
+    """履歴ボタンの押下から通知側の表示までを実行し、(入口の呼び出し, 通知の呼び出し, SNS メッセージ)"""
+    with env.recorder.track() as entry_calls, env.sns.capture() as published:
+        response = env.handlers['interactive_handler'](factory.view_history(), None)
+    assert response['statusCode'] == 200
+    [record] = published
+    with env.recorder.track() as notification_calls:
+        env.handlers['notification']({'Records': [{'EventSource': 'aws:sns', 'Sns': {
+            'TopicArn': record['TopicArn'], 'Message': record['Message'], 'MessageId': 'm1'}}]}, None)
+    return entry_calls, notification_calls, json.loads(record['Message'])
+
+
+def test_loading_modal_is_opened_before_history_is_read():
+    factory = EventFactory(users=4, teams=1, max_mentions=1, seed=3)
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env:
+        entry_calls, notification_calls, message = _open_history(env, factory)
+
+    # 入口は履歴を読まずにモーダルを開いてSNSに渡すだけ
+    assert entry_calls['slack.views_open'] == 1
+    assert not any(call.startswith('dynamodb.query') or call.startswith('dynamodb.scan') for call in entry_calls)
+    assert message['view_id'].startswith('V')
+    assert notification_calls['slack.views_update'] == 1
+    assert 'slack.chat_postMessage' not in notification_calls
+
+
+def test_closed_modal_falls_back_to_a_dm():
+    factory = EventFactory(users=4, teams=1, max_mentions=1, seed=3)
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env, \
+            mock.patch.object(SlackManager, 'update_modal', return_value=False):
+        _, notification_calls, _ = _open_history(env, factory)
+
+    assert notification_calls['slack.chat_postMessage'] == 1
+
+
+def test_long_history_is_split_into_sections():
+    text = ''.join(f'• 2026-01-05T09:00:00\n  U{i}から1ポイントを受け取りました\n  > {"ありがとう" * 40}\n'
+                   for i in range(40))
+
+    view = SlackManager.text_modal('ポイント履歴', text)
+
+    assert len(view['blocks']) > 1
+    assert all(len(block['text']['text']) <= 3000 for block in view['blocks'])
+    assert ''.join(block['text']['text'] for block in view['blocks']) == text
@@ -0,0 +1,42 @@
+import sys
+
+from tools.fakes import LatencyModel
+from tools.load_generator import EventFactory, StubEnvironment
+
+
+def _dynamodb_calls(calls):
+    return {api: count for api, count in calls.items() if api.startswith('dynamodb.')}
+
+
+def test_repeat_history_opens_use_the_snapshot_until_a_grant():
+    factory = EventFactory(users=4, teams=1, max_mentions=1, seed=5)
+    team_id = factory.team_ids[0]
+    sender, receiver = factory.users_by_team[team_id][:2]
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env:
+        notification = sys.modules['interactive_notification']
+        db_manager = notification.db_manager
+        db_manager.add_points(sender, [receiver], message='thanks', team_id=team_id)
+
+        with env.recorder.track() as first:
+            notification.handle_view_history(receiver, team_id)
+        with env.recorder.track() as repeat:
+            notification.handle_view_history(receiver, team_id)
+        snapshot = db_manager.get_history_snapshot(receiver)
+
+        # 読み取り後の付与で古くなったスナップショットは保存されない
+        stale_version = snapshot['version']
+        db_manager.add_points(receiver, [sender], message='back', team_id=team_id)
+        assert not db_manager.save_history_snapshot(receiver, stale_version, 'stale')
+        with env.recorder.track() as after_grant:
+            notification.handle_view_history(receiver, team_id)
+        rebuilt = db_manager.get_history_snapshot(receiver)
+
+    assert 'dynamodb.query' in first or 'dynamodb.scan' in first
+    assert _dynamodb_calls(repeat) == {'dynamodb.batch_get_item': 1}
+    assert repeat['slack.chat_postMessage'] == 1
+    assert 'thanks' in snapshot['text']
+    assert 'dynamodb.query' in after_grant or 'dynamodb.scan' in after_grant
+    assert rebuilt['version'] == stale_version + 1
+    assert 'back' in rebuilt['text'] and 'thanks' in rebuilt['text']
+    # 本文はユーザーアイテム（全属性を射影する GSI）に載せない
+    assert 'history_snapshot' not in env.dynamodb.Table('loadtest-users').get_item(Key={'user_id': receiver})['Item']
@@ -0,0 +1,71 @@
+import threading
+
+from lib import db
+from lib.db import DynamoDBManager
+from tools.fakes import APICallRecorder, FakeDynamoDBResource
+
+
+def _totals(storage, user_ids):
+    return {user_id: storage.get_user_data(user_id).total_points for user_id in user_ids}
+
+
+def test_redelivered_request_is_granted_once(storage):
+    first = storage.add_points('U1', ['U2', 'U3'], message='ありがとう', team_id='T1', request_id='msg-1')
+    replay = storage.add_points('U1', ['U2', 'U3'], message='ありがとう', team_id='T1', request_id='msg-1')
+
+    assert first['success'] and not first.get('duplicate')
+    assert replay['success'] and replay['duplicate']
+    assert replay['transaction_id'] == first['transaction_id']
+    assert replay['daily_points_given'] == 2
+    assert _totals(storage, ['U2', 'U3']) == {'U2': 1, 'U3': 1}
+    # 別のメッセージは別の付与
+    assert not storage.add_points('U1', ['U2'], team_id='T1', request_id='msg-2').get('duplicate')
+    assert storage.get_user_data('U2').total_points == 2
+
+
+def test_replay_does_not_write():
+    recorder = APICallRecorder()
+    db_manager = DynamoDBManager(FakeDynamoDBResource(recorder=recorder), stack_name='test')
+    assert db_manager.add_points('U1', ['U2'], team_id='T1', request_id='msg-1')['success']
+
+    with recorder.track() as calls:
+        assert db_manager.add_points('U1', ['U2'], team_id='T1', request_id='msg-1')['duplicate']
+
+    assert calls == {'dynamodb.batch_get_item': 1}
+
+
+def test_concurrent_deliveries_write_once(storage):
+    barrier = threading.Barrier(4)
+    results = []
+
+    def deliver():
+        barrier.wait()
+        results.append(storage.add_points('U1', ['U2'], team_id='T1', request_id='msg-1'))
+
+    threads = [threading.Thread(target=deliver) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(result['success'] for result in results)
+    assert sum(not result.get('duplicate') for result in results) == 1
+    assert storage.get_user_data('U2').total_points == 1
+
+
+def test_redelivered_chunked_grant_resumes(monkeypatch):
+    monkeypatch.setattr(db, 'MAX_TRANSACT_ITEMS', 4)
+    db_manager = DynamoDBManager(FakeDynamoDBResource(), stack_name='test')
+    recipients = ['R0', 'R1', 'R2', 'R3']
+    # 最初の配信はヘッダーの書き込み直後に止まった
+    monkeypatch.setattr(DynamoDBManager, 'resume_grant', lambda self, grant_id, header=None: False)
+    monkeypatch.setattr(DynamoDBManager, 'rollback_grant', lambda self, grant_id: False)
+    assert not db_manager.add_points('S1', recipients, team_id='T1', request_id='msg-1')['success']
+    monkeypatch.undo()
+    monkeypatch.setattr(db, 'MAX_TRANSACT_ITEMS', 4)
+
+    replay = db_manager.add_points('S1', recipients, team_id='T1', request_id='msg-1')
+
+    assert replay['success'] and replay['duplicate']
+    assert _totals(db_manager, recipients) == dict.fromkeys(recipients, 1)
+    assert db_manager.get_user_data('S1').daily_points_given == 4
@@ -0,0 +1,27 @@
+from tools.fakes import LatencyModel
+from tools.load_generator import STACK_NAME, EventFactory, StubEnvironment, percentile, run_load
+
+
+def test_percentile_interpolates():
+    values = [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert percentile(values, 50) == 3.0
+    assert percentile(values, 100) == 5.0
+    assert percentile([], 99) == 0.0
+
+
+def test_run_load_drives_handler_chain():
+    factory = EventFactory(users=20, teams=2, max_mentions=2, seed=7)
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env:
+        report = run_load(env, factory, events=30, concurrency=4, rate=None,
+                          mix={'message': 0.6, 'home_opened': 0.2, 'view_history': 0.2})
+
+    summary = report.summary()
+    assert summary['events'] == 30
+    assert summary['handlers']['notification']['errors'] == 0
+    assert summary['calls_per_event']['message']['sns.publish'] == 1.0
+    # DM はイベントとは別の定期実行で送り、そのイベントの呼び出しには数えない
+    assert 'slack.chat_postMessage' not in summary['calls_per_event']['message']
+    assert 'outbox_worker' not in summary['calls_per_event']
+    assert summary['handlers']['outbox_worker']['errors'] == 0
+    outbox = env.dynamodb.Table(f'{STACK_NAME}-outbox').data.values()
+    assert outbox and {item['state'] for item in outbox} == {'sent'}
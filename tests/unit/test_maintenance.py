@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+from lib import db
+from lib.db import DynamoDBManager
+from lib.maintenance import PointsRebuild, SegmentedScan
+from tools.fakes import FakeDynamoDBResource
+
+RECIPIENTS = [f'R{i}' for i in range(5)]
+
+
+@pytest.fixture
+def db_manager(monkeypatch):
+    # 1チャンク2人にして、途中で止まった大きな付与も作れるようにする
+    monkeypatch.setattr(db, 'MAX_TRANSACT_ITEMS', 4)
+    monkeypatch.setattr(db, 'DAILY_POINT_LIMIT', 20)
+    db_manager = DynamoDBManager(FakeDynamoDBResource(), stack_name='test')
+    for user_id in ['S1', 'S2'] + RECIPIENTS:
+        db_manager.users_table.put_item(Item={'user_id': user_id, 'team_id': 'T1', 'total_points': 0,
+                                              'daily_points_given': 0})
+    assert db_manager.add_points('S1', ['R0'], team_id='T1')['success']
+    assert db_manager.add_points('S2', ['R0', 'S1'], team_id='T1')['success']
+    assert db_manager.add_points('S2', RECIPIENTS, message='all hands', team_id='T1')['success']
+    return db_manager
+
+
+def _rebuild(db_manager, job_id, repair=False):
+    return PointsRebuild(db_manager, job_id, segments=3, page_size=2, repair=repair).run()
+
+
+def test_drift_is_reported_and_repaired(db_manager):
+    db_manager.users_table.update_item(Key={'user_id': 'R3'}, UpdateExpression='SET total_points = :wrong',
+                                       ExpressionAttributeValues={':wrong': 42})
+
+    audit = _rebuild(db_manager, 'audit')
+    assert audit['users'] == 7 and audit['drifted'] == 1 and audit['repaired'] == 0
+    assert audit['drifts'][0] == {'user_id': 'R3', 'observed': 42, 'expected': 1, 'history_version': 1}
+
+    repaired = _rebuild(db_manager, 'repair', repair=True)
+    assert repaired['repaired'] == 1
+    assert db_manager.get_user_data('R3').total_points == 1
+    assert _rebuild(db_manager, 'again')['drifted'] == 0
+
+
+def test_unfinished_grants_count_only_applied_chunks(db_manager):
+    header = {'transaction_id': 'G1', 'team_id': 'T1', 'from_user': 'S1', 'to_users': ['R0', 'R1', 'R2'],
+              'points': 1, 'timestamp': '2026-01-05T09:00:00', 'status': db.GRANT_PENDING}
+    db_manager.transactions_table.put_item(Item=header)
+    assert db_manager._apply_grant_chunk('G1', 0, ['R0', 'R1'], 1)
+
+    assert db_manager.get_user_data('R1').total_points == 2
+    assert _rebuild(db_manager, 'pending')['drifted'] == 0
+
+
+def test_users_touched_during_the_job_are_not_overwritten(db_manager):
+    db_manager.users_table.update_item(Key={'user_id': 'R4'}, UpdateExpression='SET total_points = :wrong',
+                                       ExpressionAttributeValues={':wrong': 9})
+    rebuild = PointsRebuild(db_manager, 'busy', segments=2, repair=True)
+    expected_totals = rebuild.expected_totals
+
+    def grant_then_count():
+        # -users を控えた後、集計前に並行した付与が入る
+        assert db_manager.add_points('S1', ['R4'], team_id='T1')['success']
+        return expected_totals()
+
+    rebuild.expected_totals = grant_then_count
+    report = rebuild.run()
+
+    assert report['drifted'] == 1 and report['busy'] == 1 and report['repaired'] == 0
+    assert db_manager.get_user_data('R4').total_points == 10
+
+
+def test_interrupted_scan_resumes_from_the_checkpoint(db_manager):
+    pages = []
+
+    def fail_on_third_page(items, partial):
+        if len(pages) == 2:
+            raise RuntimeError('interrupted')
+        pages.append(len(items))
+        partial['count'] = partial.get('count', 0) + len(items)
+
+    scan = SegmentedScan(db_manager, db_manager.users_table, 'resume', segments=1, checkpoint_seconds=0, Limit=2)
+    with pytest.raises(RuntimeError):
+        scan.run(fail_on_third_page)
+    pages.append(None)
+
+    partials = scan.run(fail_on_third_page)
+
+    assert sum(partial['count'] for partial in partials) == 7
+    assert db_manager.get_job_state('resume#0')['done']
+
+
+def test_checkpoints_keep_aggregates_out_of_the_cursor_item(db_manager):
+    for index in range(40):
+        db_manager.users_table.put_item(Item={'user_id': f'U{index:02d}', 'team_id': 'T1', 'total_points': index})
+
+    def totals(items, partial):
+        points = partial.setdefault('points', {})
+        for item in items:
+            points[item['user_id']] = int(item.get('total_points', 0))
+        partial['pages'] = partial.get('pages', 0) + 1
+
+    scan = SegmentedScan(db_manager, db_manager.users_table, 'large', segments=2, checkpoint_seconds=3600,
+                         partial_max_bytes=200, Limit=10)
+    partials = scan.run(totals)
+
+    merged = {}
+    for partial in partials:
+        merged.update(partial.get('points', {}))
+    assert len(merged) == 47 and merged['U39'] == 39
+    assert sum(partial.get('pages', 0) for partial in partials) == 6
+    # 位置のアイテムには集計を書かず、集計は大きさを区切った別のアイテムに書く
+    states = {item['job_id']: item['state'] for item in db_manager.jobs_table.data.values()}
+    assert set(json.loads(states['large#0'])) == {'cursor', 'done', 'scanned', 'partials'}
+    assert len(partials) > 2 and all(len(state) < 400 for state in states.values())
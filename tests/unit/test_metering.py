@@ -0,0 +1,114 @@
+import contextvars
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+from lib.db import DynamoDBManager
+from lib.metering import UsageMeter, top_consumers
+from lib.metrics import metrics, flush_after, CallRecord, EMFExporter
+from tools.fakes import APICallRecorder, FakeDynamoDBResource, LatencyModel
+from tools.load_generator import STACK_NAME, EventFactory, StubEnvironment, run_load
+
+
+def _in_workspace(team_id, work):
+    def run():
+        metrics.set_dimensions(team_id=team_id)
+        work()
+    contextvars.Context().run(run)
+
+
+def _window():
+    now = datetime.now(timezone.utc)
+    return now - timedelta(hours=1), now
+
+
+def test_usage_is_attributed_to_each_workspace(storage, monkeypatch):
+    monkeypatch.setattr(metrics, 'exporter', None)
+    monkeypatch.setattr(metrics, 'sinks', [UsageMeter(storage, flush_seconds=0)])
+    db_manager = DynamoDBManager(FakeDynamoDBResource(), stack_name='grants')
+
+    def busy():
+        metrics.record('event', 'received')
+        assert db_manager.add_points('U1', ['U2'], message='ありがとう', team_id='T1')['success']
+        metrics.record('slack', 'chat_postMessage')
+        metrics.record('handler', 'event_handler', duration_ms=120.0)
+
+    def quiet():
+        metrics.record('event', 'received')
+        metrics.record('event', 'dropped')
+
+    _in_workspace('T1', busy)
+    _in_workspace('T2', quiet)
+    metrics.flush()
+
+    ranked = top_consumers(storage, *_window(), metric='wcu')
+    assert [usage['team_id'] for usage in ranked] == ['T1', 'T2']
+    busiest = ranked[0]
+    assert busiest['grants'] == 1 and busiest['wcu'] > 0 and busiest['rcu'] > 0
+    assert busiest['slack.chat_postMessage'] == 1 and busiest['duration_ms'] == 120.0
+    assert ranked[1] == {'team_id': 'T2', 'events_received': 1, 'events_dropped': 1}
+    assert top_consumers(storage, *_window(), metric='events_dropped', limit=1)[0]['team_id'] == 'T2'
+
+
+def test_usage_is_written_in_batches():
+    recorder = APICallRecorder()
+    storage = DynamoDBManager(FakeDynamoDBResource(recorder=recorder), stack_name='test')
+    now = [0.0]
+    meter = UsageMeter(storage, flush_seconds=60, clock=lambda: now[0])
+    records = [_record('event', 'received'), _record('event', 'received')]
+
+    with recorder.track() as calls:
+        meter.export(records)
+        now[0] = 30
+        meter.export(records)
+    assert not calls
+    with recorder.track() as calls:
+        now[0] = 61
+        meter.export(records)
+    assert calls == {'dynamodb.update_item': 1}
+    assert top_consumers(storage, *_window(), metric='events_received')[0]['events_received'] == 6
+
+
+def test_lambda_invocations_write_usage_before_returning(monkeypatch):
+    recorder = APICallRecorder()
+    storage = DynamoDBManager(FakeDynamoDBResource(recorder=recorder), stack_name='test')
+    monkeypatch.setattr(metrics, 'exporter', None)
+    # template.yaml の METERING_FLUSH_SECONDS=0（凍結されたコンテナに利用量を残さない）
+    monkeypatch.setattr(metrics, 'sinks', [UsageMeter(storage, flush_seconds=0)])
+
+    @flush_after
+    def lambda_handler(event, context):
+        metrics.set_dimensions(team_id='T1')
+        metrics.record('event', 'received')
+
+    with recorder.track() as calls:
+        contextvars.Context().run(lambda_handler, {}, None)
+    assert calls == {'dynamodb.update_item': 1}
+    assert top_consumers(storage, *_window(), metric='invocations')[0]['invocations'] == 1
+
+
+def _record(service, operation, team_id='T1'):
+    return CallRecord(service, operation, 1.0, None, 0.0, 0, {'team_id': team_id})
+
+
+def test_team_id_is_a_property_not_a_cloudwatch_dimension():
+    stream = io.StringIO()
+    EMFExporter(stream=stream).export([_record('slack', 'chat_postMessage')])
+
+    document = json.loads(stream.getvalue())
+    assert document['team_id'] == 'T1'
+    assert all('team_id' not in dimensions for dimensions in document['_aws']['CloudWatchMetrics'][0]['Dimensions'])
+
+
+def test_handlers_meter_every_received_event():
+    factory = EventFactory(users=20, teams=2, max_mentions=2, seed=7)
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env:
+        run_load(env, factory, events=30, concurrency=4, rate=None,
+                 mix={'message': 0.6, 'home_opened': 0.2, 'view_history': 0.2})
+        metrics.close()
+
+    usage = top_consumers(DynamoDBManager(env.dynamodb, stack_name=STACK_NAME), *_window(), metric='grants')
+    assert {entry['team_id'] for entry in usage} == set(factory.team_ids)
+    assert sum(entry['events_received'] for entry in usage) == 30
+    assert sum(entry.get('grants', 0) for entry in usage) > 0
+    assert all(entry['slack_calls'] > 0 and entry['invocations'] > 0 for entry in usage)
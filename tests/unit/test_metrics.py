@@ -0,0 +1,55 @@
+import io
+import json
+
+from lib.db import DynamoDBManager
+from lib.metrics import EMFExporter, InMemoryExporter, metrics
+from tools.fakes import FakeDynamoDBResource
+
+
+def test_dynamodb_calls_are_timed_with_consumed_capacity(monkeypatch):
+    exporter = InMemoryExporter()
+    monkeypatch.setattr(metrics, 'exporter', exporter)
+    dynamodb = FakeDynamoDBResource()
+    for user_id in ('U1', 'U2'):
+        dynamodb.Table('test-users').put_item(Item={'user_id': user_id, 'total_points': 0, 'daily_points_given': 0})
+    db = DynamoDBManager(dynamodb, stack_name='test')
+
+    metrics.set_dimensions(event_type='point_give')
+    result = db.add_points('U1', ['U2'], message='ありがとう')
+    metrics.flush()
+
+    assert result['success']
+    transact = exporter.calls('dynamodb', 'transact_write_items')
+    assert len(transact) == 1
+    assert transact[0].consumed_capacity > 0
+    assert transact[0].dimensions['event_type'] == 'point_give'
+    grant = exporter.calls('grant', 'add_points')[0]
+    assert grant.retries == 0 and grant.error is None
+
+
+def test_emf_exporter_groups_calls_per_operation():
+    stream = io.StringIO()
+    recorder = type(metrics)(EMFExporter(namespace='Test', stream=stream))
+    recorder.record('slack', 'chat_postMessage', 12.5)
+    recorder.record('slack', 'chat_postMessage', 30.0, error='SlackApiError:ratelimited')
+    recorder.flush()
+
+    document = json.loads(stream.getvalue().splitlines()[0])
+    assert document['_aws']['CloudWatchMetrics'][0]['Namespace'] == 'Test'
+    assert document['Calls'] == 2
+    assert document['Latency'] == [12.5, 30.0]
+    assert document['ErrorClasses'] == {'SlackApiError:ratelimited': 1}
+
+
+def test_emf_exporter_splits_large_groups_without_dropping_values():
+    stream = io.StringIO()
+    recorder = type(metrics)(EMFExporter(namespace='Test', stream=stream))
+    for index in range(250):
+        recorder.record('dynamodb', 'get_item', float(index), error='Throttled' if index % 50 == 0 else None)
+    recorder.flush()
+
+    documents = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [len(document['Latency']) for document in documents] == [100, 100, 50]
+    assert [value for document in documents for value in document['Latency']] == [float(i) for i in range(250)]
+    assert sum(document['Calls'] for document in documents) == 250
+    assert sum(document['Errors'] for document in documents) == 5
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+from unittest import mock
+
+from lib.publisher import EVENTS, SNSPublisher
+from server.app import HandlerCore, SocketModeServer
+from tools.fakes import APICallRecorder, FakeSNSClient, FakeSocketModeClient, LatencyModel
+from tools.load_generator import EVENT_TOPIC_ARN, STACK_NAME, EventFactory, StubEnvironment
+
+
+def test_fifo_topic_gets_sender_message_group():
+    sns = FakeSNSClient(APICallRecorder())
+    fifo = SNSPublisher(sns, {EVENTS: 'arn:aws:sns:ap-northeast-1:1:test-events.fifo'})
+    fifo.publish(EVENTS, {'team_id': 'T1', 'user_id': 'U1'}, dedup_id='Ev1')
+    fifo.publish(EVENTS, {'team_id': 'T1', 'user_id': None})
+    SNSPublisher(sns, {EVENTS: 'arn:aws:sns:ap-northeast-1:1:test-events'}).publish(EVENTS, {'team_id': 'T1'})
+
+    first, second, standard = sns.published
+    assert (first['MessageGroupId'], first['MessageDeduplicationId']) == ('T1:U1', 'Ev1')
+    assert second['MessageGroupId'] == 'T1:-'
+    assert 'MessageGroupId' not in standard
+
+
+def _sqs_record(message_id, group_id, message):
+    envelope = {'TopicArn': EVENT_TOPIC_ARN, 'Message': json.dumps(message)}
+    return {'messageId': message_id, 'eventSource': 'aws:sqs', 'body': json.dumps(envelope),
+            'attributes': {'MessageGroupId': group_id}}
+
+
+def test_sqs_batch_stops_a_failed_group_and_continues_others():
+    factory = EventFactory(users=4, teams=1, max_mentions=1, seed=1)
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env:
+        main = sys.modules['main']
+        handled = []
+
+        def dispatch(topic, message, source=''):
+            if message['n'] == 1:
+                raise RuntimeError('throttled')
+            handled.append(message['n'])
+
+        records = [
+            _sqs_record('m1', 'T:A', {'n': 1}),
+            _sqs_record('m2', 'T:B', {'n': 2}),
+            _sqs_record('m3', 'T:A', {'n': 3}),
+            _sqs_record('m4', 'T:B', {'n': 4}),
+        ]
+        with mock.patch.object(main, 'dispatch_notification', dispatch):
+            result = env.handlers['notification']({'Records': records}, None)
+
+    assert handled == [2, 4]
+    assert result == {'batchItemFailures': [{'itemIdentifier': 'm1'}, {'itemIdentifier': 'm3'}]}
+
+
+def test_sqs_batch_drops_poison_messages_without_blocking_the_group():
+    factory = EventFactory(users=4, teams=1, max_mentions=1, seed=1)
+    team_id = factory.team_ids[0]
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env:
+        records = [
+            # 自分だけへのメンションは付与できず、失敗の DM を積む
+            _sqs_record('m1', f'{team_id}:U1', {'event_id': 'point_give', 'user_id': 'U1', 'team_id': team_id,
+                                                'mentions': ['U1'], 'message': 'ありがとう', 'request_id': 'r1'}),
+            # 形の壊れたメッセージ（mentions が文字列ではなくオブジェクト）は破棄する
+            _sqs_record('m2', f'{team_id}:U1', {'event_id': 'point_give', 'user_id': 'U1', 'team_id': team_id,
+                                                'mentions': 1, 'request_id': 'r2'}),
+            _sqs_record('m3', f'{team_id}:U1', {'event_id': 'point_give', 'user_id': 'U1', 'team_id': team_id,
+                                                'mentions': ['U2'], 'message': 'ありがとう', 'request_id': 'r3'}),
+        ]
+        result = env.handlers['notification']({'Records': records}, None)
+        outbox = sorted(env.dynamodb.Table(f'{STACK_NAME}-outbox').data.values(), key=lambda item: item['outbox_id'])
+
+    assert result == {'batchItemFailures': []}
+    assert any(item['outbox_id'].endswith('#failed') and '残りの付与可能ポイント:* 5' in item['text']
+               for item in outbox)
+    assert any(item['outbox_id'].endswith('#sent') for item in outbox)
+
+
+def test_server_runs_one_group_at_a_time_in_order():
+    lock = threading.Lock()
+    active = {}
+    seen = {'A': [], 'B': []}
+    overlap = {'groups': 0, 'same_group': 0}
+
+    def handle_event(body, publisher):
+        for n in range(4):
+            for user in ('A', 'B'):
+                publisher.publish(EVENTS, {'team_id': 'T', 'user_id': user, 'n': n})
+
+    def dispatch_notification(topic, message, source=''):
+        user = message['user_id']
+        with lock:
+            active[user] = active.get(user, 0) + 1
+            overlap['same_group'] = max(overlap['same_group'], active[user])
+            overlap['groups'] = max(overlap['groups'], sum(1 for count in active.values() if count))
+        time.sleep(0.01)
+        with lock:
+            active[user] -= 1
+            seen[user].append(message['n'])
+
+    client = FakeSocketModeClient()
+    server = SocketModeServer(client, core=HandlerCore(handle_event, None, dispatch_notification),
+                              workers=4, metrics_interval=0)
+
+    async def scenario():
+        await server.start()
+        await client.deliver('events_api', {})
+        await server.drain()
+        await server.shutdown(timeout=5)
+
+    asyncio.run(scenario())
+
+    assert seen == {'A': [0, 1, 2, 3], 'B': [0, 1, 2, 3]}
+    assert overlap == {'groups': 2, 'same_group': 1}
+    assert server.processed['notification'] == 8
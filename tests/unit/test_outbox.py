@@ -0,0 +1,134 @@
+import json
+import random
+
+from slack_sdk.errors import SlackApiError
+
+from lib import outbox
+from lib.outbox import CircuitBreaker, OutboxWorker
+from tools.fakes import LatencyModel
+from tools.load_generator import STACK_NAME, EventFactory, StubEnvironment
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSlack:
+    """deliver_dm の呼び出しを記録し、errors の順に失敗させる"""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+        self.opened = 0
+
+    def deliver_dm(self, user_id, message, channel_id=None):
+        if self.errors:
+            error = self.errors.pop(0)
+            if error:
+                raise SlackApiError(error, {'ok': False, 'error': error})
+        if channel_id is None:
+            self.opened += 1
+        self.sent.append((user_id, message))
+        return f'D{user_id}'
+
+
+def _worker(storage, slack, clock, **kwargs):
+    return OutboxWorker(storage, lambda team_id: 'xoxb-test', slack_for=lambda token: slack, clock=clock,
+                        rng=random.Random(0), breaker=CircuitBreaker(clock=clock), **kwargs)
+
+
+def test_enqueue_is_idempotent_and_worker_sends_once(storage):
+    clock = Clock()
+    items = [outbox.dm('tx1#received#U2', 'T1', 'U2', 'ありがとう', now=clock()),
+             outbox.dm('tx1#sent', 'T1', 'U1', '付与しました', now=clock())]
+    assert storage.enqueue_outbox(items) == 2
+    assert storage.enqueue_outbox(items) == 0
+    slack = FakeSlack()
+
+    report = _worker(storage, slack, clock).run()
+
+    assert report['sent'] == 2
+    assert sorted(slack.sent) == [('U1', '付与しました'), ('U2', 'ありがとう')]
+    assert storage.due_outbox(clock.now + 3600, 10) == []
+    # 送信済みの通知は積み直されない
+    assert storage.enqueue_outbox(items) == 0
+
+
+def test_transient_failures_back_off_then_go_dead_and_replay(storage):
+    clock = Clock()
+    storage.enqueue_outbox([outbox.dm('tx1#sent', 'T1', 'U1', '付与しました', now=clock())])
+    slack = FakeSlack(errors=['internal_error'] * 3)
+    worker = _worker(storage, slack, clock, max_attempts=3)
+
+    assert worker.run()['retried'] == 1
+    # バックオフの間は送らない
+    assert worker.run() == {'sent': 0, 'retried': 0, 'dead': 0, 'deferred': 0, 'skipped': 0}
+    [pending] = storage.list_outbox(outbox.OUTBOX_PENDING)
+    assert pending['attempts'] == 1 and pending['due_at'] > clock.now
+    for _ in range(2):
+        clock.now += outbox.OUTBOX_BACKOFF_MAX + 1
+        worker.run()
+
+    [dead] = storage.list_outbox(outbox.OUTBOX_DEAD)
+    assert (dead['attempts'], dead['last_error']) == (3, 'internal_error')
+    assert slack.sent == []
+
+    assert outbox.replay(storage, team_id='T1', now=clock.now) == ['tx1#sent']
+    assert worker.run()['sent'] == 1
+    assert storage.list_outbox(outbox.OUTBOX_DEAD) == []
+
+
+def test_permanent_errors_are_not_retried(storage):
+    clock = Clock()
+    storage.enqueue_outbox([outbox.dm('tx1#sent', 'T1', 'U1', '付与しました', now=clock())])
+
+    report = _worker(storage, FakeSlack(errors=['user_not_found']), clock).run()
+
+    assert report['dead'] == 1
+    assert storage.list_outbox(outbox.OUTBOX_DEAD)[0]['attempts'] == 1
+
+
+def test_breaker_stops_sending_to_a_failing_workspace(storage):
+    clock = Clock()
+    storage.enqueue_outbox([outbox.dm(f'tx{index}#sent', 'T1', f'U{index % 2}', 'T1宛て', now=clock())
+                            for index in range(8)])
+    slack = FakeSlack(errors=['service_unavailable'] * 5)
+    worker = _worker(storage, slack, clock)
+
+    report = worker.run()
+
+    # 5回続けて失敗した後の通知は送らずに延ばす
+    assert (report['retried'], report['deferred'], report['sent']) == (5, 3, 0)
+    assert slack.sent == []
+    clock.now += outbox.BREAKER_COOLDOWN_SECONDS + outbox.OUTBOX_BACKOFF_MAX + 2
+    assert worker.run()['sent'] == 8
+    # 同じ相手への DM チャンネルはバッチの中で1回だけ開く
+    assert slack.opened == 2
+
+
+def test_point_notifications_go_through_the_outbox():
+    factory = EventFactory(users=6, teams=1, max_mentions=2, seed=3)
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env:
+        event = factory.message()
+        with env.sns.capture() as published:
+            assert env.handlers['event_handler'](event, None)['statusCode'] == 200
+        [record] = published
+        sns_event = {'Records': [{'EventSource': 'aws:sns', 'Sns': {
+            'TopicArn': record['TopicArn'], 'Message': record['Message'], 'MessageId': 'm1'}}]}
+        with env.recorder.track() as notification_calls:
+            env.handlers['notification'](sns_event, None)
+            # 再配信されても同じ通知は積まれない
+            env.handlers['notification'](sns_event, None)
+        with env.recorder.track() as worker_calls:
+            response = env.handlers['outbox_worker']({'Records': []}, None)
+
+    mentions = json.loads(record['Message'])['mentions']
+    assert 'slack.chat_postMessage' not in notification_calls
+    assert response['body']['sent'] == len(mentions) + 1
+    assert worker_calls['slack.chat_postMessage'] == len(mentions) + 1
+    items = env.dynamodb.Table(f'{STACK_NAME}-outbox').data.values()
+    assert sorted(item['state'] for item in items) == ['sent'] * (len(mentions) + 1)
@@ -0,0 +1,76 @@
+import importlib
+from unittest import mock
+
+from lib.db import DynamoDBManager
+from lib.ratelimit import GrantRateLimiter, SlidingWindowLimiter
+from tools.fakes import APICallRecorder, FakeDynamoDBResource, LatencyModel
+from tools.load_generator import EventFactory, StubEnvironment
+
+
+class Clock:
+    def __init__(self, now=6000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_shared_counter_keeps_the_previous_window(storage):
+    assert storage.count_requests('user#T1#U1', 100, ttl_seconds=180) == (1, 0)
+    assert storage.count_requests('user#T1#U1', 100, ttl_seconds=180) == (2, 0)
+    assert storage.count_requests('user#T1#U1', 101, ttl_seconds=180) == (1, 2)
+    assert storage.count_requests('user#T1#U1', 103, ttl_seconds=180) == (1, 0)
+    assert storage.count_requests('user#T1#U2', 103, ttl_seconds=180) == (1, 0)
+
+
+def test_excess_attempts_are_shed_without_io():
+    recorder = APICallRecorder()
+    storage = DynamoDBManager(FakeDynamoDBResource(recorder=recorder), stack_name='test')
+    clock = Clock()
+    limiter = SlidingWindowLimiter(storage, limit=3, window_seconds=60, clock=clock)
+
+    assert [limiter.hit('user#T1#U1').allowed for _ in range(3)] == [True, True, True]
+    decision = limiter.hit('user#T1#U1')
+    assert not decision.allowed and decision.first_rejection
+    with recorder.track() as calls:
+        assert not limiter.hit('user#T1#U1').allowed
+        assert limiter.blocked('user#T1#U1')
+    assert not calls
+
+    # 次の区間でも直前の区間の件数が残っているうちは破棄し、その区間の終わりまで I/O なしで破棄する
+    clock.now += 60
+    assert not limiter.hit('user#T1#U1').allowed
+    clock.now += 45
+    with recorder.track() as calls:
+        assert not limiter.hit('user#T1#U1').allowed
+    assert not calls
+    clock.now += 60
+    assert limiter.hit('user#T1#U1').allowed
+
+
+def test_containers_share_the_limit(storage):
+    clock = Clock()
+    containers = [SlidingWindowLimiter(storage, limit=4, window_seconds=60, clock=clock) for _ in range(2)]
+
+    decisions = [containers[attempt % 2].hit('workspace#T1') for attempt in range(8)]
+
+    assert [decision.allowed for decision in decisions] == [True] * 4 + [False] * 4
+    assert sum(decision.first_rejection for decision in decisions) == 1
+
+
+def test_bot_loop_costs_nothing_downstream():
+    factory = EventFactory(users=4, teams=1, max_mentions=2, seed=5)
+    message = factory.message()
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env:
+        event_handler = importlib.import_module('event_handler')
+        limiter = GrantRateLimiter(event_handler.db_manager, per_user=3, per_workspace=100, clock=Clock())
+        with mock.patch.object(event_handler, 'grant_limiter', limiter), env.sns.capture() as published:
+            for _ in range(3):
+                env.handlers['event_handler'](message, None)
+            with env.recorder.track() as calls:
+                for _ in range(20):
+                    assert env.handlers['event_handler'](message, None)['statusCode'] == 200
+
+    assert len(published) == 3
+    # 4回目だけ共有カウンターを確認し、それ以降は I/O なしで破棄する
+    assert calls == {'dynamodb.update_item': 1}
@@ -0,0 +1,97 @@
+from lib.db import DynamoDBManager
+from lib.reactions import ReactionBuffer, ReactionCoalescer, is_thanks_reaction
+from tools.fakes import FakeDynamoDBResource
+
+WINDOW = 60
+NOW = 1_700_000_000
+
+
+def _reaction(event_type, user, item_user, ts='1.0', reaction='pray', at=NOW):
+    return {
+        'type': event_type, 'user': user, 'item_user': item_user, 'reaction': reaction,
+        'item': {'type': 'message', 'channel': 'C1', 'ts': ts}, 'event_ts': str(at),
+    }
+
+
+def _setup(daily_points=None):
+    dynamodb = FakeDynamoDBResource()
+    users = dynamodb.Table('test-users')
+    for user_id in ('U1', 'U2', 'U3', 'U4'):
+        users.put_item(Item={'user_id': user_id, 'total_points': 0,
+                             'daily_points_given': (daily_points or {}).get(user_id, 0)})
+    db_manager = DynamoDBManager(dynamodb, stack_name='test')
+    buffer = ReactionBuffer(db_manager, window_seconds=WINDOW)
+    return dynamodb, buffer, ReactionCoalescer(buffer, db_manager)
+
+
+def _points(dynamodb, user_id):
+    return dynamodb.Table('test-users').get_item(Key={'user_id': user_id})['Item']
+
+
+def test_is_thanks_reaction_uses_workspace_config():
+    assert is_thanks_reaction('pray::skin-tone-3', {})
+    assert not is_thanks_reaction('pray', {'thanks_reactions': ['kansya']})
+
+
+def test_window_is_coalesced_into_one_transaction():
+    dynamodb, buffer, coalescer = _setup()
+    buffer.record(_reaction('reaction_added', 'U1', 'U2', ts='1.0'), 'T1')
+    buffer.record(_reaction('reaction_added', 'U1', 'U2', ts='1.0'), 'T1')  # 再送
+    buffer.record(_reaction('reaction_added', 'U1', 'U2', ts='1.0', reaction='thankyou'), 'T1')
+    buffer.record(_reaction('reaction_added', 'U1', 'U3', ts='3.0'), 'T1')
+    buffer.record(_reaction('reaction_added', 'U2', 'U1', ts='4.0'), 'T1')
+    buffer.record(_reaction('reaction_added', 'U4', 'U3', ts='5.0'), 'T1')
+    buffer.record(_reaction('reaction_removed', 'U4', 'U3', ts='5.0', at=NOW + WINDOW), 'T1')
+
+    # 取り消しの猶予が過ぎるまでは書き込まない
+    assert coalescer.flush(now=NOW + WINDOW) == []
+
+    calls_before = dynamodb.recorder.totals['dynamodb.transact_write_items']
+    outcomes = {o['user_id']: o for o in coalescer.flush(now=NOW + 3 * WINDOW)}
+    assert dynamodb.recorder.totals['dynamodb.transact_write_items'] - calls_before == 1
+    assert outcomes['U1']['to_users'] == ['U2', 'U3']
+    assert set(outcomes) == {'U1', 'U2'}
+    assert _points(dynamodb, 'U1')['daily_points_given'] == 2
+    assert _points(dynamodb, 'U1')['total_points'] == 1
+    assert _points(dynamodb, 'U2')['total_points'] == 1
+    assert _points(dynamodb, 'U3')['total_points'] == 1
+    assert dynamodb.Table('test-reactions').data == {}
+
+
+def test_reactions_on_different_messages_each_count():
+    dynamodb, buffer, coalescer = _setup()
+    # 同じ相手の2つのメッセージ（片方には2種類の絵文字）
+    buffer.record(_reaction('reaction_added', 'U1', 'U2', ts='1.0'), 'T1')
+    buffer.record(_reaction('reaction_added', 'U1', 'U2', ts='1.0', reaction='thankyou'), 'T1')
+    buffer.record(_reaction('reaction_added', 'U1', 'U2', ts='2.0'), 'T1')
+
+    outcome, = coalescer.flush(now=NOW + 3 * WINDOW)
+
+    assert outcome['to_users'] == ['U2', 'U2']
+    assert _points(dynamodb, 'U1')['daily_points_given'] == 2
+    assert _points(dynamodb, 'U2')['total_points'] == 2
+    # メッセージごとに1件の記録になり、履歴のポイントの合計が total_points と一致する
+    received = coalescer.db_manager.get_user_transactions('U2', team_id='T1')
+    sent = coalescer.db_manager.get_user_transactions('U1', team_id='T1')
+    assert [(tx['type'], tx['points']) for tx in received] == [('received', 1), ('received', 1)]
+    assert [(tx['type'], tx['to_user'], tx['points']) for tx in sent] == [('sent', 'U2', 1)] * 2
+    assert len(dynamodb.Table('test-transactions').data) == 2
+
+
+def test_daily_limit_and_replay_are_enforced():
+    dynamodb, buffer, coalescer = _setup(daily_points={'U1': 4})
+    for recipient in ('U2', 'U3'):
+        buffer.record(_reaction('reaction_added', 'U1', recipient), 'T1')
+
+    outcome, = coalescer.flush(now=NOW + 3 * WINDOW)
+    assert outcome['to_users'] == ['U2']
+    assert _points(dynamodb, 'U1')['daily_points_given'] == 5
+    assert _points(dynamodb, 'U3')['total_points'] == 0
+
+    # 日次リセット後に同じウィンドウを再実行しても二重付与しない
+    dynamodb.Table('test-users').update_item(Key={'user_id': 'U1'}, UpdateExpression='SET daily_points_given = :zero',
+                                             ExpressionAttributeValues={':zero': 0})
+    replay = coalescer.db_manager.add_reaction_points(outcome['window_id'], {'U1': [('U2', 'C1:1.0')]},
+                                                         team_id='T1')
+    assert replay['U1']['duplicate']
+    assert _points(dynamodb, 'U2')['total_points'] == 1
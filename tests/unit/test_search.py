@@ -0,0 +1,116 @@
+import importlib
+import json
+import urllib.parse
+from unittest import mock
+
+from lib import search
+from lib.db import DynamoDBManager
+from lib.maintenance import SearchReindex
+from lib.slack import SlackManager, SEARCH_ACTION_ID
+from tools.fakes import APICallRecorder, FakeDynamoDBResource, LatencyModel
+from tools.load_generator import EventFactory, StubEnvironment
+
+
+def _ids(results):
+    return [result['transaction_id'] for result in results]
+
+
+def test_japanese_messages_are_found_by_substring(storage):
+    release = storage.add_points('U1', ['U2'], message='リリース対応ありがとうございました！', team_id='T1')
+    review = storage.add_points('U2', ['U1'], message='ＰＲのレビュー助かりました', team_id='T1')
+    storage.add_points('U1', ['U3'], message='資料の作成ありがとう', team_id='T1')
+
+    assert _ids(storage.search_messages('T1', 'U2', 'リリース')) == [release['transaction_id']]
+    # 全角・半角と大文字・小文字を区別しない
+    assert _ids(storage.search_messages('T1', 'U1', 'pr')) == [review['transaction_id']]
+    # 新しい順
+    thanked = storage.search_messages('T1', 'U1', 'ありがとう')
+    assert len(thanked) == 2
+    assert [result['timestamp'] for result in thanked] == sorted((result['timestamp'] for result in thanked),
+                                                                 reverse=True)
+    # bigram がすべて含まれても、語として含まれなければ返さない
+    assert storage.search_messages('T1', 'U2', 'リースリ') == []
+
+
+def test_one_character_queries_are_found(storage):
+    praised = storage.add_points('U1', ['U2'], message='神対応ありがとう', team_id='T1')
+    storage.add_points('U1', ['U3'], message='資料の作成ありがとう', team_id='T1')
+
+    assert search.query_terms('神') == ['神']
+    assert _ids(storage.search_messages('T1', 'U1', '神')) == [praised['transaction_id']]
+    assert _ids(storage.search_messages('T1', 'U1', '神 ありがとう')) == [praised['transaction_id']]
+
+
+def test_search_is_scoped_to_participants_and_workspace(storage):
+    storage.add_points('U1', ['U2'], message='デプロイありがとう', team_id='T1')
+
+    assert len(storage.search_messages('T1', 'U1', 'デプロイ')) == 1
+    assert len(storage.search_messages('T1', 'U2', 'デプロイ')) == 1
+    assert storage.search_messages('T1', 'U3', 'デプロイ') == []
+    assert storage.search_messages('T2', 'U1', 'デプロイ') == []
+
+
+def test_index_follows_edits_and_deletes(storage):
+    storage.add_points('U1', ['U2'], message='障害対応ありがとう', team_id='T1')
+    [record] = storage.search_messages('T1', 'U1', '障害')
+    record['team_id'] = 'T1'
+
+    # 受信者が変わった付与は、外れた人の索引から消える
+    storage.index_message(dict(record, to_users=['U3']), previous=record)
+    assert storage.search_messages('T1', 'U2', '障害') == []
+    assert len(storage.search_messages('T1', 'U1', '障害')) == 1
+
+    storage.unindex_message(dict(record, to_users=['U3']))
+    assert storage.search_messages('T1', 'U1', '障害') == []
+
+
+def test_search_costs_one_query_per_term():
+    recorder = APICallRecorder()
+    db_manager = DynamoDBManager(FakeDynamoDBResource(recorder=recorder), stack_name='test')
+    for index in range(5):
+        db_manager.add_points('U1', ['U2'], message=f'リリース{index}回目ありがとう', team_id='T1')
+
+    with recorder.track() as calls:
+        assert len(db_manager.search_messages('T1', 'U2', 'リリース')) == 5
+
+    assert calls == {'dynamodb.query': len(search.query_terms('リリース')), 'dynamodb.batch_get_item': 1}
+
+
+def test_reindex_picks_up_existing_grants():
+    db_manager = DynamoDBManager(FakeDynamoDBResource(), stack_name='test')
+    granted = db_manager.add_points('U1', ['U2'], message='オンボーディングありがとう', team_id='T1')
+    db_manager.search_table.data.clear()
+    assert db_manager.search_messages('T1', 'U2', 'オンボーディング') == []
+
+    report = SearchReindex(db_manager, 'reindex', segments=2).run()
+
+    assert report['indexed'] == 1
+    assert _ids(db_manager.search_messages('T1', 'U2', 'オンボーディング')) == [granted['transaction_id']]
+
+
+def test_search_box_updates_the_history_modal():
+    factory = EventFactory(users=4, teams=1, max_mentions=1, seed=3)
+    team_id = factory.team_ids[0]
+    sender, recipient = factory.users_by_team[team_id][:2]
+    payload = {
+        'type': 'block_actions',
+        'user': {'id': recipient, 'team_id': team_id},
+        'team': {'id': team_id},
+        'view': {'id': 'V0000000001'},
+        'actions': [{'action_id': SEARCH_ACTION_ID, 'type': 'plain_text_input', 'value': '勉強会'}],
+    }
+    event = factory._api_gateway_event(factory.interactive_event,
+                                       'payload=' + urllib.parse.quote(json.dumps(payload)))
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env:
+        interactive_handler = importlib.import_module('interactive_handler')
+        interactive_handler.db_manager.add_points(sender, [recipient], message='勉強会の講師ありがとう',
+                                                  team_id=team_id)
+        with mock.patch.object(SlackManager, 'update_modal', return_value=True) as update_modal, \
+                env.sns.capture() as published:
+            assert env.handlers['interactive_handler'](event, None)['statusCode'] == 200
+
+    assert not published
+    view_id, view = update_modal.call_args.args
+    assert view_id == 'V0000000001'
+    assert view['blocks'][0]['element']['initial_value'] == '勉強会'
+    assert '勉強会の講師ありがとう' in view['blocks'][1]['text']['text']
@@ -0,0 +1,54 @@
+import asyncio
+import json
+import sys
+import urllib.parse
+
+from server.app import SocketModeServer, load_core
+from tools.fakes import FakeSocketModeClient, LatencyModel
+from tools.load_generator import HANDLER_MODULES, STACK_NAME, EventFactory, StubEnvironment
+
+
+def test_socket_mode_server_runs_event_and_notification_in_process():
+    factory = EventFactory(users=10, teams=1, max_mentions=2, seed=3)
+    with StubEnvironment(factory, LatencyModel(), LatencyModel(), LatencyModel()) as env:
+        client = FakeSocketModeClient()
+        server = SocketModeServer(client, core=load_core(), workers=4, metrics_interval=0)
+        message = json.loads(factory.message()['body'])
+        interactive = json.loads(urllib.parse.unquote(factory.view_history()['body']).split('payload=', 1)[1])
+
+        async def scenario():
+            await server.start()
+            await client.deliver('events_api', message)
+            await client.deliver('events_api', message, retry_attempt=1)  # 再送は処理しない
+            await client.deliver('interactive', interactive)
+            await server.drain()
+            await server.shutdown(timeout=5)
+
+        asyncio.run(scenario())
+
+    assert len(client.acks) == 3
+    assert client.closed
+    assert server.processed == {'events_api': 1, 'interactive': 1, 'notification': 2}
+    assert server.errors == {'events_api': 0, 'interactive': 0, 'notification': 0}
+    # SNS を経由せずに通知処理まで実行される
+    assert env.recorder.totals['sns.publish'] == 0
+    sender = message['event']['user']
+    users = env.dynamodb.Table(f'{STACK_NAME}-users')
+    assert users.get_item(Key={'user_id': sender})['Item']['daily_points_given'] > 0
+
+
+def test_sqlite_server_loads_without_aws(monkeypatch, tmp_path):
+    for name in ('AWS_DEFAULT_REGION', 'AWS_REGION', 'AWS_PROFILE'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('AWS_CONFIG_FILE', str(tmp_path / 'missing-config'))
+    monkeypatch.setenv('STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setenv('SQLITE_PATH', str(tmp_path / 'kansya.db'))
+    monkeypatch.setenv('STACK_NAME', STACK_NAME)
+    for name in HANDLER_MODULES:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    try:
+        core = load_core()
+        assert core.drain_outbox() == {'sent': 0, 'retried': 0, 'dead': 0, 'deferred': 0, 'skipped': 0}
+    finally:
+        for name in HANDLER_MODULES:
+            sys.modules.pop(name, None)
@@ -0,0 +1,75 @@
+import pytest
+
+from lib.reactions import ReactionBuffer, ReactionCoalescer
+from lib.sqlite_storage import SQLiteStorage
+from lib.storage import create_storage
+
+WINDOW = 60
+NOW = 1_700_000_000
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'kansya.db'))
+    storage.save_workspace_data({'workspace_id': 'T1', 'team_id': 'T1', 'access_token': 'xoxb-1'})
+    for user_id, team_id in (('U1', 'T1'), ('U2', 'T1'), ('U3', 'T2')):
+        storage.save_or_update_user_profile({'user_id': user_id, 'team_id': team_id, 'user_name': user_id})
+    yield storage
+    storage.close()
+
+
+def test_wal_mode_and_indexed_history_lookups(storage):
+    with storage._connection() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        sender_plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT transaction_id FROM transactions WHERE from_user = ?', ('U1',)))
+        recipient_plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT transaction_id FROM transaction_recipients WHERE to_user = ?', ('U1',)))
+    assert 'transactions_sender' in sender_plan
+    assert 'transaction_recipients_user' in recipient_plan
+
+
+def test_add_points_enforces_daily_limit_and_records_history(storage):
+    assert storage.add_points('U1', ['U2', 'U1'], message='thanks', team_id='T1')['daily_points_given'] == 1
+    assert storage.add_points('U1', ['U2'] * 5, team_id='T1')['success'] is False
+    assert storage.get_user_data('U2').total_points == 1
+    assert storage.save_history_snapshot('U2', 1, 'snapshot')
+    assert not storage.save_history_snapshot('U2', 0, 'stale')
+    assert storage.get_history_snapshot('U2')['text'] == 'snapshot'
+
+    history = storage.get_points_history('U2', team_id='T1')
+    assert [tx['message'] for tx in history['received']] == ['thanks']
+    assert storage.get_user_transactions('U1', team_id='T2') == []
+
+    # プロファイル更新でポイントは消えない
+    storage.save_or_update_user_profile({'user_id': 'U2', 'team_id': 'T1', 'user_name': 'renamed'})
+    assert storage.get_user_data('U2').total_points == 1
+
+    assert storage.reset_daily_points('2024-01-02', team_id='T2')['users_reset'] == 0
+    assert storage.reset_daily_points('2024-01-02', team_id='T1')['users_reset'] == 1
+    assert storage.get_user_data('U1').daily_points_given == 0
+    assert storage.reset_daily_points('2024-01-02', unassigned=True)['users_reset'] == 0
+
+
+def test_reaction_flush_is_idempotent(storage):
+    buffer = ReactionBuffer(storage, window_seconds=WINDOW)
+    buffer.record({'type': 'reaction_added', 'user': 'U1', 'item_user': 'U2', 'reaction': 'pray',
+                   'item': {'type': 'message', 'channel': 'C1', 'ts': '1.0'}, 'event_ts': str(NOW)}, 'T1')
+    outcomes = ReactionCoalescer(buffer, storage).flush(now=NOW + 3 * WINDOW)
+
+    assert [outcome['success'] for outcome in outcomes] == [True]
+    assert storage.get_reactions('9999999999') == []
+    replay = storage.add_reaction_points(outcomes[0]['window_id'], {'U1': [('U2', 'C1:1.0')]}, team_id='T1')
+    assert replay['U1']['duplicate'] is True
+    assert storage.get_user_data('U2').total_points == 1
+
+
+def test_create_storage_selects_backend_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setenv('SQLITE_PATH', str(tmp_path / 'env.db'))
+    storage = create_storage(dynamodb=object())
+    assert isinstance(storage, SQLiteStorage)
+    assert storage.get_workspace_data('T1') == {}
+    storage.close()
+    with pytest.raises(ValueError):
+        create_storage('redis')
@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+from tools.fakes import FakeDynamoDBResource, LatencyModel
+from tools.stress_grants import SCENARIOS, GrantStress
+
+
+@pytest.mark.parametrize('scenario', sorted(SCENARIOS))
+def test_scenarios_keep_the_invariants(scenario):
+    report = GrantStress(scenario, grants=60, threads=8, daily_limit=20,
+                         latency=LatencyModel(1.0, 0.5, seed=1), seed=1).run()
+
+    assert sum(report['outcomes'].values()) == 60
+    assert report['transactions']['attempts'] >= report['outcomes']['granted']
+    assert sum(report['retries'].values()) == 60
+    assert report['violations'] == []
+
+
+def test_concurrent_transactions_on_one_item_conflict():
+    dynamodb = FakeDynamoDBResource(latency=LatencyModel(20.0), transaction_conflicts=True)
+    client = dynamodb.meta.client
+    item = {'Update': {'TableName': 'test-users', 'Key': {'user_id': 'U1'},
+                       'UpdateExpression': 'ADD total_points :one', 'ExpressionAttributeValues': {':one': 1}}}
+    reasons = []
+
+    def write():
+        try:
+            client.transact_write_items(TransactItems=[item])
+        except client.exceptions.TransactionCanceledException as e:
+            reasons.extend(reason['Code'] for reason in e.response['CancellationReasons'])
+
+    threads = [threading.Thread(target=write) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert reasons == ['TransactionConflict']
+    assert dynamodb.Table('test-users').data[('U1',)]['total_points'] == 1
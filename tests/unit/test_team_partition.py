@@ -0,0 +1,73 @@
+import importlib
+import os
+import sys
+
+from lib.db import DynamoDBManager
+from tools.fakes import FakeDynamoDBResource
+from tools.migrate_team_keys import TeamKeyMigration
+
+
+def _setup():
+    dynamodb = FakeDynamoDBResource()
+    users = dynamodb.Table('test-users')
+    users.put_item(Item={'user_id': 'U1', 'team_id': 'T1', 'total_points': 0, 'daily_points_given': 2})
+    users.put_item(Item={'user_id': 'U2', 'team_id': 'T1', 'total_points': 0, 'daily_points_given': 0})
+    users.put_item(Item={'user_id': 'U3', 'team_id': 'T2', 'total_points': 0, 'daily_points_given': 3})
+    # 移行前のアイテム（team_id なし）
+    users.put_item(Item={'user_id': 'U0', 'total_points': 4, 'daily_points_given': 1})
+    dynamodb.Table('test-transactions').put_item(Item={
+        'transaction_id': 'tx-old', 'from_user': 'U0', 'to_users': ['U1'], 'points': 1,
+        'timestamp': '2024-01-01T00:00:00', 'message': 'old'})
+    return dynamodb, DynamoDBManager(dynamodb, stack_name='test')
+
+
+def test_migration_backfills_team_ids_idempotently():
+    dynamodb, db_manager = _setup()
+    migration = TeamKeyMigration(dynamodb, 'test', default_team_id='T1', segments=2)
+
+    result = migration.run()
+    assert result['users']['updated'] == 1
+    assert result['transactions']['updated'] == 1
+    assert migration.remaining() == {'users': 0, 'transactions': 0}
+    assert migration.run()['users']['scanned'] == 0
+    assert sorted(db_manager.get_team_user_ids('T1')) == ['U0', 'U1', 'U2']
+    assert db_manager.get_user_transactions('U1', team_id='T1')[0]['message'] == 'old'
+
+
+def test_team_operations_read_only_their_partition():
+    dynamodb, db_manager = _setup()
+    TeamKeyMigration(dynamodb, 'test', default_team_id='T1').run()
+
+    result = db_manager.add_points('U1', ['U2'], message='thanks', team_id='T1')
+    assert result['success']
+    assert [tx['to_user'] for tx in db_manager.get_user_transactions('U1', team_id='T1')
+            if tx['type'] == 'sent'] == ['U2']
+    assert db_manager.get_user_transactions('U1', team_id='T2') == []
+
+    reset = db_manager.reset_daily_points('2024-01-02', team_id='T1')
+    users = dynamodb.Table('test-users')
+    assert reset['users_reset'] == 2  # U0, U1（0のユーザーには書き込まない）
+    assert users.get_item(Key={'user_id': 'U3'})['Item']['daily_points_given'] == 3
+    assert users.get_item(Key={'user_id': 'U1'})['Item']['daily_points_given'] == 0
+
+
+def test_daily_reset_also_covers_users_without_team(monkeypatch, tmp_path):
+    dynamodb, db_manager = _setup()
+    dynamodb.Table('test-auth').put_item(Item={'workspace_id': 'T1', 'access_token': 'xoxb-1'})
+    dynamodb.Table('test-auth').put_item(Item={'workspace_id': 'T2', 'access_token': 'xoxb-2'})
+    # 読み込み時のストレージは使わない
+    monkeypatch.setenv('STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setenv('SQLITE_PATH', str(tmp_path / 'unused.db'))
+    monkeypatch.syspath_prepend(os.path.join(os.path.dirname(importlib.import_module('lib').__path__[0]),
+                                             'handlers', 'reset_handler'))
+    monkeypatch.delitem(sys.modules, 'reset_handler', raising=False)
+    reset_handler = importlib.import_module('reset_handler')
+    monkeypatch.setattr(reset_handler, 'db_manager', db_manager)
+
+    response = reset_handler.lambda_handler({}, None)
+
+    users = dynamodb.Table('test-users')
+    assert response['statusCode'] == 200
+    assert response['body']['users_reset'] == 3  # U1・U3 と、team_id のない U0
+    assert users.get_item(Key={'user_id': 'U0'})['Item']['daily_points_given'] == 0
+    assert users.get_item(Key={'user_id': 'U3'})['Item']['daily_points_given'] == 0
@@ -0,0 +1,81 @@
+import threading
+import time
+
+from lib.db import DynamoDBManager
+from lib.tokens import TokenProvider
+from tools.fakes import APICallRecorder, FakeDynamoDBResource
+
+
+def _install(storage, expires_in):
+    storage.save_workspace_data({'workspace_id': 'T1', 'team_id': 'T1', 'access_token': 'xoxe-old',
+                                 'refresh_token': 'refresh-1', 'token_expires_at': int(time.time()) + expires_in})
+
+
+class CountingRefresh:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, refresh_token):
+        self.calls.append(refresh_token)
+        time.sleep(self.delay)
+        return {'access_token': f'xoxe-new-{len(self.calls)}', 'refresh_token': f'refresh-{len(self.calls) + 1}',
+                'expires_in': 43200}
+
+
+def test_concurrent_callers_refresh_once_ahead_of_expiry(storage):
+    _install(storage, expires_in=120)
+    refresh = CountingRefresh(delay=0.1)
+    tokens = []
+
+    def call():
+        # Lambda ごとに別のプロバイダー（リースだけで調停される）
+        tokens.append(TokenProvider(storage, refresh=refresh).token_for('T1'))
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert refresh.calls == ['refresh-1']
+    # 期限内の古いトークンか、更新後のトークン
+    assert set(tokens) <= {'xoxe-old', 'xoxe-new-1'}
+    record = storage.get_token_record('T1')
+    assert record['access_token'] == 'xoxe-new-1' and record['refresh_token'] == 'refresh-2'
+    assert 'token_lease_until' not in record
+    assert TokenProvider(storage, refresh=refresh).token_for('T1') == 'xoxe-new-1'
+
+
+def test_expired_token_waits_for_the_lease_holder(storage):
+    _install(storage, expires_in=-5)
+    now = time.time()
+    assert storage.acquire_token_lease('T1', 'other', now + 30, now)
+
+    def finish_renewal():
+        time.sleep(0.2)
+        assert storage.save_rotated_token('T1', 'other', 'xoxe-other', 'refresh-9', time.time() + 43200)
+
+    worker = threading.Thread(target=finish_renewal)
+    worker.start()
+    refresh = CountingRefresh()
+    token = TokenProvider(storage, refresh=refresh, poll_seconds=0.05).token_for('T1')
+    worker.join()
+
+    assert token == 'xoxe-other'
+    assert refresh.calls == []
+    # リースを持たない呼び出しは保存できない
+    assert not storage.save_rotated_token('T1', 'other', 'xoxe-stale', 'refresh-0', time.time())
+
+
+def test_non_rotating_token_needs_no_storage_reads():
+    recorder = APICallRecorder()
+    storage = DynamoDBManager(FakeDynamoDBResource(recorder=recorder), stack_name='test')
+    provider = TokenProvider(storage, refresh=CountingRefresh())
+
+    with recorder.track() as calls:
+        token = provider.token_for('T1', {'workspace_id': 'T1', 'access_token': 'xoxb-static'})
+        again = provider.token_for('T1')
+
+    assert token == again == 'xoxb-static'
+    assert not calls